@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def _make_stock_data(n_stocks=60, n_dates=140, seed=1):
+    """
+    生成测试用的价格/差值表（与上传文件解析后的格式一致）：价格表前两列为代码、名称，
+    日期列新日期在前；价格保留两位小数并有少量NaN，差值保留两位小数并有一部分为0。
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2024-01-01', periods=n_dates).strftime('%Y-%m-%d').tolist()[::-1]
+    steps = rng.normal(0, 0.02, size=(n_stocks, n_dates))
+    prices = np.round(10 * np.exp(np.cumsum(steps[:, ::-1], axis=1))[:, ::-1], 2)
+    prices[rng.random(prices.shape) < 0.01] = np.nan
+    diffs = np.round(rng.normal(0, 1, size=(n_stocks, n_dates)), 2)
+    diffs[rng.random(diffs.shape) < 0.05] = 0.0
+    price_data = pd.DataFrame(prices, columns=dates)
+    price_data.insert(0, '名称', [f'S{i}' for i in range(n_stocks)])
+    price_data.insert(0, '代码', [str(i + 1) for i in range(n_stocks)])
+    diff_data = pd.DataFrame(diffs, columns=dates)
+    return price_data, diff_data
+
+
+@pytest.fixture
+def make_stock_data():
+    return _make_stock_data
@@ -16,17 +16,7 @@ class BaseParamHandler:
         # 收集所有参数
         if params is None:
             params = {}
-            
-        params.update({
-            "start_option": self.main_window.start_option_combo.currentText(),
-            "shift_days": self.main_window.shift_spin.value(),
-            "is_forward": self.main_window.direction_checkbox.isChecked(),
-            "n_days": self.main_window.n_days_spin.value(),
-            "range_value": self.main_window.range_value_edit.text(),
-            "continuous_abs_threshold": self.main_window.continuous_abs_threshold_edit.text(),
-            "expr": getattr(self.main_window, 'last_expr', ''),
-            "ops_change": float(self.main_window.ops_change_edit.text() or 0),# 添加 only_show_selected 参数
-        })
+        self._update_params(params)
         # if params['only_show_selected']:
         #     print(f"only_show_selected params = {params}")
         # else:
@@ -60,14 +50,54 @@ class BaseParamHandler:
             # 返回空结果而不是崩溃
             result = {"dates": {}, "shift_days": 0, "is_forward": False, "start_date": "", "end_date": "", "base_idx": None}
         
+        self.store_result(result)
+        return result
+
+    def on_batch_calculate_clicked(self, params, scorings=None, range_sweep=None):
+        """
+        组合分析/三次分析的批量计算：同一组参数下的多个公式只做一次指标计算、一次结果构造。
+        scorings 为各公式的打分参数列表（格式见 CalculateThread.score_formula_batch）；
+        range_sweep 为 (基础公式, 变量, [(下限, 上限), ...])，见 CalculateThread.score_range_sweep。
+        返回与各公式一一对应的结果列表；基础公式不能追加区间条件（score_range_sweep 返回 None）时返回 None，
+        由调用方改为按公式批量打分。计算出错时异常照常抛出，由调用方的分析流程报告
+        """
+        if self.main_window.init.price_data is None:
+            return None
+        self._update_params(params)
+        calc = CalculateThread(
+            self.main_window.init.price_data,
+            self.main_window.init.diff_data,
+            self.main_window.init.workdays_str,
+            params
+        )
+        if range_sweep is not None:
+            formula_expr, variable, bound_pairs = range_sweep
+            results = calc.score_range_sweep(params, formula_expr, variable, bound_pairs)
+            if results is None:
+                calc._log_to_file(f"公式不能追加区间条件，改为按公式批量打分: {formula_expr}")
+            return results
+        return calc.score_formula_batch(params, scorings)
+
+    def store_result(self, result):
+        """记录最近一次计算结果（与单次计算后主窗口的状态一致）"""
         self.main_window.all_row_results = result  # 直接存储整个结果对象
         self.main_window.continuous_results = result.get('continuous_results', None)
         self.main_window.forward_max_date = result.get('forward_max_date')
         self.main_window.forward_max_result = result.get('forward_max_result')
         self.main_window.forward_min_date = result.get('forward_min_date')
         self.main_window.forward_min_result = result.get('forward_min_result')
-        
-        return result
+
+    def _update_params(self, params):
+        params.update({
+            "start_option": self.main_window.start_option_combo.currentText(),
+            "shift_days": self.main_window.shift_spin.value(),
+            "is_forward": self.main_window.direction_checkbox.isChecked(),
+            "n_days": self.main_window.n_days_spin.value(),
+            "range_value": self.main_window.range_value_edit.text(),
+            "continuous_abs_threshold": self.main_window.continuous_abs_threshold_edit.text(),
+            "expr": getattr(self.main_window, 'last_expr', ''),
+            "ops_change": float(self.main_window.ops_change_edit.text() or 0),# 添加 only_show_selected 参数
+        })
 
     def update_shift_spin_range(self):
         # 获取当前区间
@@ -2,6 +2,7 @@ from PyQt5.QtWidgets import QMessageBox, QFileDialog, QApplication
 from PyQt5.QtCore import QDate
 import pandas as pd
 from worker_threads import FileLoaderThread
+from function.stock_functions import TradingCalendar
 
 class StockAnalysisInit:
     def __init__(self, main_window):
@@ -30,8 +31,13 @@ class StockAnalysisInit:
                 QMessageBox.warning(self.main_window, "提示", "仅支持CSV或XLSX文件！")
                 return
             self.main_window.loader_thread.finished.connect(self.on_file_loaded)
+            self.main_window.loader_thread.progress.connect(self.on_file_progress)
             self.main_window.loader_thread.start()
 
+    def on_file_progress(self, rows, total_rows):
+        percent = min(100, rows * 100 // max(total_rows, 1))
+        self.main_window.result_text.setText(f"正在上传，请稍候...已读取 {rows} 行（约 {percent}%）")
+
     def on_file_loaded(self, df, price_data, diff_data, workdays_str, error_msg):
         if error_msg:
             QMessageBox.critical(self.main_window, "错误", f"文件读取失败：{error_msg}")
@@ -40,7 +46,8 @@ class StockAnalysisInit:
         self.df = df
         self.price_data = price_data
         self.diff_data = diff_data
-        self.workdays_str = workdays_str
+        # 交易日历：日期→下标 O(1)，非交易日按二分查找修正到前后交易日
+        self.workdays_str = TradingCalendar(workdays_str)
         
         # 设置日期选择器范围
         min_date = QDate.fromString(self.workdays_str[0], "yyyy-MM-dd")
@@ -15,6 +15,7 @@ from multiprocessing import cpu_count
 import re
 import gc
 import statistics
+import bisect
 
 def format_overall_stat_value(value):
     """
@@ -159,8 +160,16 @@ def show_continuous_sum_table(parent, all_results, price_data, as_widget=False):
         end_date = first_date_data.get("end_date")
         stocks_data = first_date_data.get("stocks", [])
 
-        # 按stock_idx排序
-        stocks_data = sorted(stocks_data, key=lambda row: row.get('stock_idx', 0))
+        # 列式结果（ResultRows）的累加值序列直接切片底层数组，不再复制成列表
+        sequence_source = stocks_data if hasattr(stocks_data, 'sequence') else None
+
+        def row_sequence(pos, row, key):
+            if sequence_source is not None:
+                return sequence_source.sequence(pos, key)
+            return row.get(key, [])
+
+        # 按stock_idx排序（保留原位置，用于取累加值序列）
+        stocks_data = sorted(enumerate(stocks_data), key=lambda item: item[1].get('stock_idx', 0))
 
         if not stocks_data:
             if not as_widget:
@@ -169,10 +178,10 @@ def show_continuous_sum_table(parent, all_results, price_data, as_widget=False):
 
         tab_widget = QTabWidget(parent)
         # 统计最大长度
-        max_len = max(int(row.get('continuous_len', 0)) for row in stocks_data)
-        max_valid_len = max(len(row.get('valid_sum_arr', [])) for row in stocks_data)
-        max_forward_len = max(len(row.get('forward_max_result', [])) for row in stocks_data)
-        max_forward_min_len = max(len(row.get('forward_min_result', [])) for row in stocks_data)
+        max_len = max(int(row.get('continuous_len', 0)) for pos, row in stocks_data)
+        max_valid_len = max(len(row_sequence(pos, row, 'valid_sum_arr')) for pos, row in stocks_data)
+        max_forward_len = max(len(row_sequence(pos, row, 'forward_max_result')) for pos, row in stocks_data)
+        max_forward_min_len = max(len(row_sequence(pos, row, 'forward_min_result')) for pos, row in stocks_data)
         n_val = max(max_len, max_valid_len, max_forward_len, max_forward_min_len)
 
         # 创建四个表格
@@ -197,9 +206,9 @@ def show_continuous_sum_table(parent, all_results, price_data, as_widget=False):
             setattr(tab_widget, f'search_filter_{idx+1}', f)
 
         def update_tables(stocks_data):
-            stocks_data = sorted(stocks_data, key=lambda row: row.get('stock_idx', 0))
+            stocks_data = sorted(stocks_data, key=lambda item: item[1].get('stock_idx', 0))
             table1.setRowCount(len(stocks_data))
-            for row_idx, row in enumerate(stocks_data):
+            for row_idx, (pos, row) in enumerate(stocks_data):
                 stock_idx = row.get('stock_idx', 0)
                 code = row.get('code', '')
                 name = row.get('name', '')
@@ -222,7 +231,7 @@ def show_continuous_sum_table(parent, all_results, price_data, as_widget=False):
                 table1.setItem(row_idx, 1, name_item)
                 table1.setItem(row_idx, 2, QTableWidgetItem(str(safe_val(actual_value_val))))
                 table1.setItem(row_idx, 3, QTableWidgetItem(str(safe_val(row.get('actual_value_date', '')))))
-                results = row.get('continuous_results', [])
+                results = row_sequence(pos, row, 'continuous_results')
                 for col_idx in range(max_len):
                     val = results[col_idx] if col_idx < len(results) else ""
                     table1.setItem(row_idx, 4 + col_idx, QTableWidgetItem(str(safe_val(val))))
@@ -252,7 +261,7 @@ def show_continuous_sum_table(parent, all_results, price_data, as_widget=False):
                 # 空一列
                 table1.setItem(row_idx, 4 + max_len + len(param_values), QTableWidgetItem(""))
                 # 有效累加值内容
-                valid_arr = row.get('valid_sum_arr', [])
+                valid_arr = row_sequence(pos, row, 'valid_sum_arr')
                 for col_idx in range(max_valid_len):
                     val = valid_arr[col_idx] if col_idx < len(valid_arr) else ""
                     table1.setItem(row_idx, 4 + max_len + len(param_values) + 1 + col_idx, QTableWidgetItem(str(safe_val(val))))
@@ -272,14 +281,14 @@ def show_continuous_sum_table(parent, all_results, price_data, as_widget=False):
 
             # table3
             table3.setRowCount(len(stocks_data))
-            for row_idx, row in enumerate(stocks_data):
+            for row_idx, (pos, row) in enumerate(stocks_data):
                 stock_idx = row.get('stock_idx', 0)
                 code = row.get('code', '')
                 name = row.get('name', '')
                 table3.setItem(row_idx, 0, QTableWidgetItem(str(code)))
                 table3.setItem(row_idx, 1, QTableWidgetItem(str(name)))
                 table3.setItem(row_idx, 2, QTableWidgetItem(str(row.get('forward_max_date', ''))))
-                forward_arr = row.get('forward_max_result', [])
+                forward_arr = row_sequence(pos, row, 'forward_max_result')
                 for col_idx in range(max_forward_len):
                     val = forward_arr[col_idx] if col_idx < len(forward_arr) else ""
                     table3.setItem(row_idx, 3 + col_idx, QTableWidgetItem(str(val)))
@@ -317,14 +326,14 @@ def show_continuous_sum_table(parent, all_results, price_data, as_widget=False):
 
             # table4
             table4.setRowCount(len(stocks_data))
-            for row_idx, row in enumerate(stocks_data):
+            for row_idx, (pos, row) in enumerate(stocks_data):
                 stock_idx = row.get('stock_idx', 0)
                 code = row.get('code', '')
                 name = row.get('name', '')
                 table4.setItem(row_idx, 0, QTableWidgetItem(str(code)))
                 table4.setItem(row_idx, 1, QTableWidgetItem(str(name)))
                 table4.setItem(row_idx, 2, QTableWidgetItem(str(row.get('forward_min_date', ''))))
-                forward_min_arr = row.get('forward_min_result', [])
+                forward_min_arr = row_sequence(pos, row, 'forward_min_result')
                 for col_idx in range(max_forward_min_len):
                     val = forward_min_arr[col_idx] if col_idx < len(forward_min_arr) else ""
                     table4.setItem(row_idx, 3 + col_idx, QTableWidgetItem(str(val)))
@@ -880,6 +889,56 @@ def perform_stock_selection_for_date(parent, target_date):
         QMessageBox.warning(parent, "错误", f"重新选股时出错: {str(e)}")
         print(f"重新选股时出错: {e}")
 
+class TradingCalendar(list):
+    """
+    交易日历：按日期升序排列的交易日（'YYYY-MM-DD'）列表，加载文件时构建一次。
+    仍是 list（可切片、遍历、取下标），in 和 index 用日期到下标的字典 O(1) 完成，
+    previous_or_same / next_or_same 用二分查找把非交易日修正到前后最近的交易日。
+    构建后不可修改：修改方法会使日期到下标的字典失效，调用时抛出 TypeError（需要修改时先 list(...) 复制）。
+    """
+    __slots__ = ('_positions',)
+
+    def __init__(self, dates=()):
+        super().__init__(dates)
+        self._positions = {}
+        for i, date in enumerate(self):
+            self._positions.setdefault(date, i)
+
+    def __reduce__(self):
+        return (type(self), (list(self),))
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("TradingCalendar 构建后不可修改")
+
+    append = extend = insert = remove = pop = clear = sort = reverse = _readonly
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+
+    def __contains__(self, date):
+        try:
+            return date in self._positions
+        except TypeError:
+            return super().__contains__(date)
+
+    def index(self, date, *args):
+        if not args:
+            try:
+                pos = self._positions.get(date)
+            except TypeError:
+                pos = None
+            if pos is not None:
+                return pos
+        return super().index(date, *args)
+
+    def previous_or_same(self, date):
+        """不晚于 date 的最后一个交易日，date 早于全部交易日时返回 None"""
+        i = bisect.bisect_right(self, date)
+        return self[i - 1] if i > 0 else None
+
+    def next_or_same(self, date):
+        """不早于 date 的第一个交易日，date 晚于全部交易日时返回 None"""
+        i = bisect.bisect_left(self, date)
+        return self[i] if i < len(self) else None
+
 def unify_date_columns(df):
     new_columns = []
     for col in df.columns:
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("worker_threads_cy")
+
+from worker_threads import read_csv_streaming
+
+
+def write_upload_csv(path, price_data, diff_data):
+    """按上传文件的格式写出 CSV：价格部分、一个空表头的分隔列、差值部分"""
+    separator = pd.DataFrame({'': np.nan}, index=price_data.index)
+    pd.concat([price_data, separator, diff_data], axis=1).to_csv(path, index=False)
+
+
+@pytest.fixture
+def upload_csv(tmp_path, make_stock_data):
+    price_data, diff_data = make_stock_data(n_stocks=45, n_dates=30, seed=2)
+    price_data['代码'] = [f'{i:06d}' for i in range(len(price_data))]
+    price_data.loc[3, '名称'] = np.nan
+    price_data.iloc[5, 4] = 0.0
+    diff_data.iloc[1, 2] = 1.23456
+    path = tmp_path / 'upload.csv'
+    write_upload_csv(path, price_data, diff_data)
+    return path
+
+
+@pytest.mark.parametrize("chunk_rows", [7, 2000])
+def test_streaming_matches_read_csv(upload_csv, chunk_rows):
+    progress = []
+    df, price_data, diff_data, df_layout = read_csv_streaming(
+        upload_csv, chunk_rows=chunk_rows, progress=lambda rows, total: progress.append(rows))
+    reference = pd.read_csv(upload_csv, dtype={'代码': str, '名称': str})
+    separator_idx = next(i for i, col in enumerate(reference.columns) if str(col).startswith('Unnamed'))
+    expected_price = reference.iloc[:, :separator_idx].copy()
+    values = expected_price.iloc[:, 2:].to_numpy(dtype=np.float64)
+    expected_price.iloc[:, 2:] = np.where(values == 0.0, np.nan, values)
+    expected_diff = reference.iloc[:, separator_idx + 1:].round(2)
+
+    pd.testing.assert_frame_equal(price_data, expected_price, check_dtype=False)
+    assert (price_data.dtypes.iloc[2:] == np.float64).all()
+    pd.testing.assert_frame_equal(diff_data, expected_diff)
+    assert list(df.columns) == df_layout['columns'] == list(reference.columns)
+    pd.testing.assert_frame_equal(df.iloc[:, :separator_idx], expected_price, check_dtype=False)
+    pd.testing.assert_frame_equal(df.iloc[:, separator_idx + 1:], expected_diff)
+    assert progress[-1] == len(reference)
+    assert price_data['代码'].iloc[0] == '000000'
+    assert pd.isna(price_data['名称'].iloc[3])
+
+
+def test_missing_separator_column_returns_none(tmp_path, make_stock_data):
+    price_data, _ = make_stock_data(n_stocks=5, n_dates=4)
+    path = tmp_path / 'no_separator.csv'
+    price_data.to_csv(path, index=False)
+    assert read_csv_streaming(path) is None
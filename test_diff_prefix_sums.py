@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("worker_threads_cy")
+
+from worker_threads import build_diff_prefix_sums
+
+
+def diff_matrix(make_stock_data, n_dates=80, seed=6):
+    _, diff_data = make_stock_data(n_stocks=15, n_dates=n_dates, seed=seed)
+    diffs = diff_data.values.astype(np.float64)
+    diffs[2, 10:15] = np.nan
+    return diffs
+
+
+def test_window_sums_match_rounded_loop(make_stock_data):
+    diffs = diff_matrix(make_stock_data)
+    pos_prefix, neg_prefix = build_diff_prefix_sums(diffs)
+    assert pos_prefix.dtype == neg_prefix.dtype == np.int64
+    assert pos_prefix.shape == neg_prefix.shape == (diffs.shape[0], diffs.shape[1] + 1)
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        s = int(rng.integers(diffs.shape[0]))
+        lo, hi = sorted(int(x) for x in rng.integers(0, diffs.shape[1] + 1, size=2))
+        pos_sum = neg_sum = 0.0
+        for v in diffs[s, lo:hi]:
+            if v > 0:
+                pos_sum += v
+            elif v < 0:
+                neg_sum += v
+        assert (pos_prefix[s, hi] - pos_prefix[s, lo]) / 100.0 == round(pos_sum, 2)
+        assert (neg_prefix[s, hi] - neg_prefix[s, lo]) / 100.0 == round(neg_sum, 2)
+
+
+def test_prefix_of_older_dates_unchanged_after_prepending(make_stock_data):
+    diffs = diff_matrix(make_stock_data)
+    pos_new, neg_new = build_diff_prefix_sums(diffs)
+    pos_old, neg_old = build_diff_prefix_sums(diffs[:, 3:])
+    np.testing.assert_array_equal(pos_new[:, 3:], pos_old)
+    np.testing.assert_array_equal(neg_new[:, 3:], neg_old)
+
+
+def test_values_not_in_whole_cents_return_empty(make_stock_data):
+    diffs = diff_matrix(make_stock_data) * 1.5
+    diffs[0, 0] = 0.005
+    pos_prefix, neg_prefix = build_diff_prefix_sums(diffs)
+    assert pos_prefix.shape == neg_prefix.shape == (0, 0)
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+worker_threads_cy = pytest.importorskip("worker_threads_cy")
+
+FORMULA_VAR_NAMES = worker_threads_cy.FORMULA_VAR_NAMES
+
+# 覆盖编译器支持的各类语法：算术、链式比较、and/or 返回操作数、not、abs/min/max、条件表达式、
+# 嵌套 if/else、除零、未赋值 result
+FORMULAS = [
+    "result = max_value - min_value * 2 + end_value / 4",
+    "result = -start_value + +continuous_len",
+    "if 0 < continuous_len <= 2 < max_value:\n    result = 1\nelse:\n    result = 0",
+    "result = continuous_len and max_value",
+    "result = continuous_len or min_value or 7",
+    "result = not continuous_len",
+    "result = abs(end_value - start_value) + min(max_value, min_value, end_value) - max(continuous_len, 1)",
+    "result = max_value if end_value > start_value else min_value",
+    "if max_value > 0:\n    if min_value < 0:\n        result = max_value - min_value\n    else:\n        result = 1\nelif end_value == 0:\n    result = 2\nelse:\n    pass",
+    "result = max_value / min_value",
+    "if max_value > 2:\n    result = end_value",
+    "result = True",
+    "if not (max_value != min_value) or end_value >= 1:\n    result = end_value * 0.5\nelse:\n    result = 0",
+]
+
+UNSUPPORTED = [
+    "result = 'abc'",
+    "result = max_value ** 2",
+    "result = max_value.real",
+    "x = max_value\nresult = x",
+    "result = (lambda v: v)(max_value)",
+    "result = unknown_name",
+    "for i in range(3):\n    result = i",
+    "result = max_value +",
+]
+
+
+def exec_formula(formula_expr, values):
+    """逐行 exec 的参考实现：返回 result，未赋值或运行出错时返回 None"""
+    env = dict(zip(FORMULA_VAR_NAMES, values))
+    try:
+        exec(formula_expr, {}, env)
+    except ZeroDivisionError:
+        return None
+    return env.get('result')
+
+
+def formula_rows(n_rows=400, seed=3):
+    """取值很少的变量行，比较、除零和 and/or 的各个分支都能覆盖到"""
+    rng = np.random.default_rng(seed)
+    return rng.integers(-3, 4, size=(n_rows, len(FORMULA_VAR_NAMES))).astype(np.float64)
+
+
+@pytest.mark.parametrize("formula_expr", FORMULAS)
+def test_compiled_program_matches_exec(formula_expr):
+    program = worker_threads_cy.compile_formula(formula_expr)
+    assert program is not None
+    for values in formula_rows():
+        expected = exec_formula(formula_expr, values.tolist())
+        got = worker_threads_cy.run_formula_program(program, values)
+        if expected is None:
+            assert got is None
+        else:
+            assert got == float(expected)
+
+
+@pytest.mark.parametrize("formula_expr", UNSUPPORTED)
+def test_unsupported_syntax_is_not_compiled(formula_expr):
+    assert worker_threads_cy.compile_formula(formula_expr) is None
+
+
+def test_empty_formula_has_no_result():
+    program = worker_threads_cy.compile_formula("")
+    assert program is not None
+    assert worker_threads_cy.run_formula_program(program, formula_rows(1)[0]) is None
+
+
+@pytest.mark.parametrize("formula_expr", FORMULAS)
+def test_columnar_evaluation_matches_exec(formula_expr):
+    rows = formula_rows()
+    columns = {name: rows[:, j].copy() for j, name in enumerate(FORMULA_VAR_NAMES)}
+    result, has_result = worker_threads_cy.evaluate_formula_columns(formula_expr, columns, len(rows))
+    for i, values in enumerate(rows):
+        expected = exec_formula(formula_expr, values.tolist())
+        assert has_result[i] == (expected is not None)
+        if expected is not None:
+            assert result[i] == float(expected)
+
+
+@pytest.mark.parametrize("descending", [True, False])
+@pytest.mark.parametrize("select_count", [0, 1, 4, 7, 50])
+def test_select_top_indices_breaks_ties_by_row(descending, select_count):
+    rng = np.random.default_rng(select_count)
+    scores = rng.integers(0, 4, size=40).astype(np.float64)
+    candidates = np.sort(rng.choice(40, size=25, replace=False))
+    # 逐行 append 后按 score 稳定排序再截断：分数相同时行号小的在前
+    expected = sorted(candidates.tolist(), key=lambda i: -scores[i] if descending else scores[i])[:select_count]
+    got = worker_threads_cy.select_top_indices(scores, candidates, select_count, descending)
+    assert got.tolist() == expected
+
+
+def test_select_top_indices_without_candidates():
+    assert worker_threads_cy.select_top_indices(np.ones(5), [], 3).tolist() == []
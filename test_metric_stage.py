@@ -0,0 +1,150 @@
+import math
+
+import numpy as np
+import pytest
+
+worker_threads_cy = pytest.importorskip("worker_threads_cy")
+
+from worker_threads import CalculateThread, metric_cache, split_indices
+
+FORMULAS = [
+    "if cont_sum_pos_sum >= 1 and valid_abs_sum_block1 <= 80 and not has_three_consecutive_zeros:\n"
+    "    result = increment_value + ops_change + continuous_len\nelse:\n    result = 0",
+    "if valid_pos_sum > 0 and end_value > start_value:\n    result = increment_value - continuous_len * 0.1\nelse:\n    result = 0",
+    "result = ops_change",
+]
+
+BASE_PARAMS = dict(
+    width=30, start_option='最大值', shift_days=0, is_forward=True, n_days=5, n_days_max=10,
+    range_value=1.5, continuous_abs_threshold=3.0, valid_abs_sum_threshold=3.0,
+    op_days='5', inc_rate='3', after_gt_end_ratio='2', after_gt_start_ratio='2',
+    stop_loss_inc_rate='-3', stop_loss_after_gt_end_ratio='-2', stop_loss_after_gt_start_ratio='-2',
+    trade_mode='T+1', expr='', select_count=5, sort_mode='最大值排序', ops_change=0.09,
+    formula_expr=FORMULAS[0], comparison_vars=[], profit_type='INC', loss_type='INC',
+    max_cores=2, only_show_selected=True)
+
+
+@pytest.fixture(autouse=True)
+def clear_metric_cache():
+    metric_cache.clear()
+    yield
+    metric_cache.clear()
+
+
+@pytest.fixture
+def dataset(make_stock_data):
+    price_data, diff_data = make_stock_data(n_stocks=80, n_dates=140, seed=5)
+    dates = list(price_data.columns[2:])
+    params = dict(BASE_PARAMS, end_date_start=dates[50], end_date_end=dates[38])
+    return price_data, diff_data, params
+
+
+def selected_rows(result):
+    """各结束日期入选的 (stock_idx, score)，按结果中的先后顺序"""
+    return {end_date: [(row['stock_idx'], row['score']) for row in rows]
+            for end_date, rows in result['dates'].items()}
+
+
+def assert_same_selection(result, expected):
+    assert selected_rows(result) == selected_rows(expected)
+    stats, expected_stats = result.get('overall_stats') or {}, expected.get('overall_stats') or {}
+    assert stats.keys() == expected_stats.keys()
+    for key, value in expected_stats.items():
+        if isinstance(value, float) and math.isnan(value):
+            assert math.isnan(stats[key])
+        else:
+            assert stats[key] == value
+
+
+def calculate_fresh(price_data, diff_data, params):
+    """清空指标缓存后按单个公式完整计算"""
+    metric_cache.clear()
+    return CalculateThread(price_data, diff_data, [], params).calculate_batch_16_cores(dict(params))
+
+
+def shard_bounds(params, num_stocks):
+    return [(start, end) for start, end in split_indices(num_stocks, params['max_cores']) if end > start]
+
+
+@pytest.mark.parametrize("sort_mode, select_count", [('最大值排序', 5), ('最小值排序', 3)])
+def test_select_rows_matches_calculate_batch(dataset, sort_mode, select_count):
+    price_data, diff_data, params = dataset
+    params = dict(params, sort_mode=sort_mode, select_count=select_count)
+    calc = CalculateThread(price_data, diff_data, [], params)
+    metrics = calc.calculate_metric_columns(dict(params, full_compute=True))
+    for formula_expr in FORMULAS:
+        p = dict(params, formula_expr=formula_expr)
+        expected = calculate_fresh(price_data, diff_data, p)
+        row_mask, scores = metrics.select_rows(formula_expr, sort_mode, select_count, [],
+                                               shard_bounds(p, len(price_data)), return_scores=True)
+        date_pos = {end_date: j for j, end_date in enumerate(metrics.end_dates)}
+        # 最终结果是各分片入选行合并后再取前 select_count 名，必然都在入选掩码内，
+        # 输出的 score（保留两位小数）与掩码对应的 score 一致；stock_idx 为负的是统计最大值/最小值/中值行
+        for end_date, rows in selected_rows(expected).items():
+            for stock_idx, score in rows:
+                if stock_idx < 0:
+                    continue
+                assert row_mask[stock_idx, date_pos[end_date]]
+                assert round(float(scores[stock_idx, date_pos[end_date]]), 2) == score
+        staged = calc.score_metric_columns(p, metrics, [{'formula_expr': formula_expr}])
+        assert_same_selection(staged[0], expected)
+
+
+@pytest.mark.parametrize("formula_expr, variable, bound_pairs", [
+    (FORMULAS[1], 'ops_change', [(-5, 5), (0, 3), (-1.5, 0.5), (2, 1), (-100, 100), (30, 1000)]),
+    ("if valid_pos_sum > 0:\n    result = increment_value\nelse:\n    result = ops_change", 'continuous_len', [(0, 3), (2, 2)]),
+])
+def test_sweep_range_matches_calculate_batch(dataset, formula_expr, variable, bound_pairs):
+    price_data, diff_data, params = dataset
+    calc = CalculateThread(price_data, diff_data, [], params)
+    metrics = calc.calculate_metric_columns(dict(params, full_compute=True))
+    swept = metrics.sweep_range(formula_expr, variable, bound_pairs, params['sort_mode'], params['select_count'], [],
+                                shard_bounds(params, len(price_data)))
+    assert len(swept) == len(bound_pairs)
+    for (lower, upper), (row_mask, scores) in zip(bound_pairs, swept):
+        p = dict(params, formula_expr=worker_threads_cy.range_condition_formula(formula_expr, variable, lower, upper))
+        # 追加区间条件后的公式直接对指标列选行，应与扫描得到的掩码相同
+        expected_mask = metrics.select_rows(p['formula_expr'], p['sort_mode'], p['select_count'], [],
+                                            shard_bounds(p, len(price_data)))
+        np.testing.assert_array_equal(row_mask, expected_mask)
+        expected = calculate_fresh(price_data, diff_data, p)
+        results = calc.score_range_sweep(params, formula_expr, variable, [(lower, upper)], metrics)
+        assert_same_selection(results[0], expected)
+
+
+def test_sweep_range_rejects_top_level_or(dataset):
+    price_data, diff_data, params = dataset
+    calc = CalculateThread(price_data, diff_data, [], params)
+    formula_expr = "if valid_pos_sum > 0 or end_value > start_value:\n    result = ops_change\nelse:\n    result = 0"
+    assert worker_threads_cy.range_condition_formula(formula_expr, 'ops_change', 0, 1) is None
+    assert calc.score_range_sweep(params, formula_expr, 'ops_change', [(0, 1)]) is None
+
+
+@pytest.mark.parametrize("n_new_dates", [1, 3])
+def test_extended_metrics_match_full_recompute(make_stock_data, monkeypatch, n_new_dates):
+    price_new, diff_new = make_stock_data(n_stocks=60, n_dates=143, seed=7)
+    dates = list(price_new.columns[2:])
+    # 旧数据集比新数据集少最新的 n_new_dates 个交易日
+    price_old = price_new.drop(columns=dates[:n_new_dates])
+    diff_old = diff_new.iloc[:, n_new_dates:]
+    extended = []
+    extend = CalculateThread._extend_cached_metrics
+
+    def record_extend(self, *args):
+        metrics = extend(self, *args)
+        extended.append(metrics is not None)
+        return metrics
+
+    monkeypatch.setattr(CalculateThread, '_extend_cached_metrics', record_extend)
+    old_params = dict(BASE_PARAMS, end_date_start=dates[n_new_dates + 30], end_date_end=dates[n_new_dates], full_compute=True)
+    CalculateThread(price_old, diff_old, [], old_params).calculate_metric_columns(dict(old_params))
+    for end_date_start in (dates[28], dates[40]):
+        params = dict(old_params, end_date_start=end_date_start, end_date_end=dates[0])
+        metrics = CalculateThread(price_new, diff_new, [], params).calculate_metric_columns(dict(params))
+        assert extended[-1]
+        metric_cache.clear()
+        fresh = CalculateThread(price_new, diff_new, [], params).calculate_metric_columns(dict(params))
+        assert metrics.end_dates == fresh.end_dates
+        np.testing.assert_array_equal(metrics.formula_cols, fresh.formula_cols)
+        np.testing.assert_array_equal(metrics.row_ok, fresh.row_ok)
+        metric_cache.put(metrics)
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("worker_threads_cy")
+
+from worker_threads import build_range_extreme_tables, range_table_levels
+
+
+def naive_extreme_index(prices, lo, hi, find_max):
+    """prices[lo:hi] 中非NaN、非0价格的最大/最小值下标（相等时取下标小的），没有有效值为-1"""
+    best = -1
+    for i in range(lo, min(hi, len(prices))):
+        v = prices[i]
+        if np.isnan(v) or v == 0:
+            continue
+        if best < 0 or (v > prices[best] if find_max else v < prices[best]):
+            best = i
+    return best
+
+
+def test_tables_match_window_scan(make_stock_data):
+    price_data, _ = make_stock_data(n_stocks=12, n_dates=70, seed=4)
+    prices = price_data.iloc[:, 2:].values.astype(np.float64)
+    # 一位小数的价格更容易出现相等的极值，另外放入0和整段无效的区间
+    prices = np.round(prices, 1)
+    prices[0, 5:9] = 0.0
+    prices[1, 10:20] = np.nan
+    levels = 6
+    max_idx, min_idx = build_range_extreme_tables(prices, levels)
+    assert max_idx.shape == min_idx.shape == (levels,) + prices.shape
+    for j in range(levels):
+        for s in range(prices.shape[0]):
+            for i in range(prices.shape[1]):
+                assert max_idx[j, s, i] == naive_extreme_index(prices[s], i, i + (1 << j), True)
+                assert min_idx[j, s, i] == naive_extreme_index(prices[s], i, i + (1 << j), False)
+
+
+def test_zero_levels_builds_empty_tables():
+    max_idx, min_idx = build_range_extreme_tables(np.ones((3, 5)), 0)
+    assert max_idx.shape == min_idx.shape == (0, 3, 5)
+
+
+def test_levels_cover_longest_enabled_range():
+    params = {'start_with_new_before_high_flag': True, 'new_before_high_range': 5,
+              'start_with_new_after_low_flag': True, 'new_after_low_range': 8,
+              'start_with_new_before_low_flag': False, 'new_before_low_range': 100}
+    levels = range_table_levels(params)
+    assert (1 << levels) - 1 >= 8
+    assert range_table_levels({}) == 0
@@ -0,0 +1,73 @@
+import math
+
+import numpy as np
+import pytest
+
+worker_threads_cy = pytest.importorskip("worker_threads_cy")
+
+
+def naive_continuous_sums(values):
+    """按时间顺序逐日累加：同号（0继承前一个数的符号）累加为一段，变号时开始新的一段；NaN跳过"""
+    sums = []
+    cur_sum = 0.0
+    last_sign = 0.0
+    consecutive_zeros = 0
+    has_three_consecutive_zeros = False
+    for i, v in enumerate(values):
+        if math.isnan(v):
+            continue
+        if v == 0:
+            consecutive_zeros += 1
+            if consecutive_zeros >= 3:
+                has_three_consecutive_zeros = True
+            sign = last_sign
+        else:
+            consecutive_zeros = 0
+            sign = 1.0 if v > 0 else -1.0
+        if i == 0 or sign == last_sign or last_sign == 0:
+            cur_sum += v
+        else:
+            sums.append(cur_sum)
+            cur_sum = v
+        last_sign = sign
+    if len(values) > 0:
+        sums.append(cur_sum)
+    return sums, has_three_consecutive_zeros
+
+
+def diff_row(n_dates=120, seed=8):
+    """带NaN、成段0和成段同号值的差值序列（新日期在前）"""
+    rng = np.random.default_rng(seed)
+    row = np.round(rng.normal(0, 1, n_dates), 2)
+    row[rng.random(n_dates) < 0.15] = 0.0
+    row[rng.random(n_dates) < 0.05] = np.nan
+    row[30:36] = 0.0
+    row[50:58] = np.abs(row[50:58]) + 0.01
+    row[0] = np.nan
+    return row
+
+
+@pytest.mark.parametrize("seed", [8, 9, 10])
+def test_run_table_matches_daily_loop(seed):
+    row = diff_row(seed=seed)
+    n = len(row)
+    rng = np.random.default_rng(seed)
+    lo, hi = 2, n - 3
+    for _ in range(400):
+        end_idx, start_idx = sorted(int(x) for x in rng.integers(lo, hi + 1, size=2))
+        expected = naive_continuous_sums(row[end_idx:start_idx + 1][::-1].tolist())
+        assert worker_threads_cy.continuous_sums(row, end_idx, start_idx) == expected
+        assert worker_threads_cy.continuous_sums(row, end_idx, start_idx, lo, hi) == expected
+
+
+def test_window_at_table_edges():
+    row = diff_row()
+    n = len(row)
+    for end_idx, start_idx in ((0, n - 1), (0, 0), (n - 1, n - 1), (0, 40), (40, n - 1)):
+        expected = naive_continuous_sums(row[end_idx:start_idx + 1][::-1].tolist())
+        assert worker_threads_cy.continuous_sums(row, end_idx, start_idx, 0, n - 1) == expected
+
+
+def test_table_must_cover_window():
+    with pytest.raises(ValueError):
+        worker_threads_cy.continuous_sums(diff_row(), 5, 20, 6, 30)
@@ -0,0 +1,34 @@
+import math
+import statistics
+
+import numpy as np
+import pytest
+
+worker_threads_cy = pytest.importorskip("worker_threads_cy")
+
+from worker_threads import median_value, stat_column_values
+
+
+@pytest.mark.parametrize("n", [1, 2, 3, 10, 11, 100, 101])
+def test_median_value_matches_statistics_median(n):
+    rng = np.random.default_rng(n)
+    # 两位小数且有重复值，偶数个时中间两个值的平均可能多出一位小数
+    values = np.round(rng.normal(0, 3, n), 2)
+    values[: n // 3] = values[0]
+    assert median_value(values) == round(statistics.median(values.tolist()), 2)
+
+
+def test_median_value_of_empty_is_none():
+    assert median_value(np.zeros(0)) is None
+
+
+def test_stat_column_values_skips_missing():
+    # 按字段顺序的行：score 为数值列（None 记在掩码中），hold_days 混有文本，逐个转换
+    rows = [(1.5, '3'), (None, ''), (math.nan, None), (-2.25, 'abc'), (4.0, 7)]
+    table = worker_threads_cy.ResultTable.from_rows(rows, ['score', 'hold_days'])
+    scores = stat_column_values(table, 'score')
+    expected_scores = [score for score, _ in rows if score is not None and not math.isnan(score)]
+    assert scores.tolist() == expected_scores
+    assert stat_column_values(table, 'hold_days').tolist() == [3.0, 7.0]
+    assert stat_column_values(table, 'missing_field').size == 0
+    assert median_value(scores) == round(statistics.median(expected_scores), 2)
@@ -0,0 +1,71 @@
+import pickle
+
+import pytest
+
+from function.stock_functions import TradingCalendar
+
+DATES = ['2024-01-02', '2024-01-03', '2024-01-05', '2024-01-08', '2024-01-09']
+
+
+@pytest.fixture
+def calendar():
+    return TradingCalendar(DATES)
+
+
+@pytest.mark.parametrize("date, expected", [
+    ('2023-12-29', None),
+    ('2024-01-02', '2024-01-02'),
+    ('2024-01-04', '2024-01-03'),
+    ('2024-01-06', '2024-01-05'),
+    ('2024-01-09', '2024-01-09'),
+    ('2024-02-01', '2024-01-09'),
+])
+def test_previous_or_same(calendar, date, expected):
+    assert calendar.previous_or_same(date) == expected
+
+
+@pytest.mark.parametrize("date, expected", [
+    ('2023-12-29', '2024-01-02'),
+    ('2024-01-02', '2024-01-02'),
+    ('2024-01-04', '2024-01-05'),
+    ('2024-01-07', '2024-01-08'),
+    ('2024-01-09', '2024-01-09'),
+    ('2024-01-10', None),
+])
+def test_next_or_same(calendar, date, expected):
+    assert calendar.next_or_same(date) == expected
+
+
+def test_empty_calendar_has_no_neighbours():
+    calendar = TradingCalendar()
+    assert calendar.previous_or_same('2024-01-02') is None
+    assert calendar.next_or_same('2024-01-02') is None
+
+
+def test_index_and_contains_match_list(calendar):
+    for i, date in enumerate(DATES):
+        assert date in calendar
+        assert calendar.index(date) == DATES.index(date) == i
+    assert '2024-01-04' not in calendar
+    assert ['2024-01-02'] not in calendar
+    with pytest.raises(ValueError):
+        calendar.index('2024-01-04')
+    assert calendar.index('2024-01-05', 1, 4) == 2
+
+
+def test_calendar_is_read_only(calendar):
+    for mutate in (lambda c: c.append('2024-01-10'), lambda c: c.sort(), lambda c: c.pop(),
+                   lambda c: c.__setitem__(0, '2024-01-01'), lambda c: c.__delitem__(0)):
+        with pytest.raises(TypeError):
+            mutate(calendar)
+    with pytest.raises(TypeError):
+        calendar += ['2024-01-10']
+    assert list(calendar) == DATES
+    assert calendar.index('2024-01-09') == 4
+
+
+def test_calendar_survives_pickle(calendar):
+    restored = pickle.loads(pickle.dumps(calendar))
+    assert type(restored) is TradingCalendar
+    assert list(restored) == DATES
+    assert restored.index('2024-01-08') == 3
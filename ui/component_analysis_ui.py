@@ -731,10 +731,7 @@ class ComponentAnalysisWidget(QWidget):
             if end_dt < workday_first:
                 end_date = workdays[0]
             else:
-                for d in reversed(workdays):
-                    if d <= end_date:
-                        end_date = d
-                        break
+                end_date = workdays.previous_or_same(end_date)
         
         # 获取结束日期在workdays中的索引
         end_date_idx = workdays.index(end_date)
@@ -977,10 +974,7 @@ class ComponentAnalysisWidget(QWidget):
                 if end_dt < workday_first:
                     end_date = workdays[0]
                 else:
-                    for d in reversed(workdays):
-                        if d <= end_date:
-                            end_date = d
-                            break
+                    end_date = workdays.previous_or_same(end_date)
             
             # 获取结束日期在workdays中的索引
             end_date_idx = workdays.index(end_date)
@@ -1149,10 +1143,7 @@ class ComponentAnalysisWidget(QWidget):
                 if end_dt < workday_first:
                     end_date = workdays[0]
                 else:
-                    for d in reversed(workdays):
-                        if d <= end_date:
-                            end_date = d
-                            break
+                    end_date = workdays.previous_or_same(end_date)
             
             # 获取结束日期在workdays中的索引
             end_date_idx = workdays.index(end_date)
@@ -2674,12 +2665,18 @@ class ComponentAnalysisWidget(QWidget):
         progress_msg += f"正值倍增系数={positive_multiplier}, 负值倍增系数={negative_multiplier}, 日期宽度={width}, 操作天数={op_days}, 递增值={increment_rate}, 后值大于结束值比例={after_gt_end_ratio}, 后值大于开始值比例={after_gt_start_ratio}, 止损递增值={stop_loss_inc_rate}, 止损后值大于结束值比例={stop_loss_after_gt_end_ratio}, 止损后值大于开始值比例={stop_loss_after_gt_start_ratio}, {new_high_low1_type}开始日期距结束日期天数={new_high_low1_start}, {new_high_low1_type}日期范围={new_high_low1_range}, {new_high_low1_type}展宽期天数={new_high_low1_span}, {new_high_low2_type}开始日期距结束日期天数={new_high_low2_start}, {new_high_low2_type}日期范围={new_high_low2_range}, {new_high_low2_type}展宽期天数={new_high_low2_span}"
         self.show_message(progress_msg)
         
+        batched = False
         try:
             # 设置当前公式
             self.main_window.last_formula_expr = formula
             
-            # 执行组合分析专用方法，直接传递参数
-            result = self._execute_component_analysis_single(formula, width, op_days, increment_rate, after_gt_end_ratio, after_gt_start_ratio, stop_loss_inc_rate, stop_loss_after_gt_end_ratio, stop_loss_after_gt_start_ratio, sort_mode, new_high_low1_start, new_high_low1_range, new_high_low1_span, new_high_low2_start, new_high_low2_range, new_high_low2_span, negative_multiplier, positive_multiplier)
+            analysis_args = (width, op_days, increment_rate, after_gt_end_ratio, after_gt_start_ratio, stop_loss_inc_rate, stop_loss_after_gt_end_ratio, stop_loss_after_gt_start_ratio, sort_mode, new_high_low1_start, new_high_low1_range, new_high_low1_span, new_high_low2_start, new_high_low2_range, new_high_low2_span, negative_multiplier, positive_multiplier)
+            # 同一参数组合下的全部公式已批量算好时直接取结果
+            result = self._get_batched_analysis_result(formula_idx, param_idx, analysis_args)
+            batched = result is not None
+            if not batched:
+                # 执行组合分析专用方法，直接传递参数
+                result = self._execute_component_analysis_single(formula, *analysis_args)
             
             # 再次检查是否被终止
             if self.analysis_terminated:
@@ -2818,13 +2815,52 @@ class ComponentAnalysisWidget(QWidget):
         # 增加索引，准备执行下一次分析
         self.current_analysis_index += 1
         
-        # 使用QTimer延迟执行下一次分析，确保当前分析完全完成
-        QTimer.singleShot(3000, self.execute_next_analysis)  # 3秒后执行下一次分析
+        # 使用QTimer延迟3秒执行下一次分析，确保当前分析完全完成；批量计算的结果已经算好，立即执行下一次
+        QTimer.singleShot(0 if batched else 3000, self.execute_next_analysis)
     
-    def _execute_component_analysis_single(self, formula, width, op_days, increment_rate, after_gt_end_ratio, after_gt_start_ratio, stop_loss_inc_rate, stop_loss_after_gt_end_ratio, stop_loss_after_gt_start_ratio, sort_mode, new_high_low1_start=0, new_high_low1_range=0, new_high_low1_span=0, new_high_low2_start=0, new_high_low2_range=0, new_high_low2_span=0, negative_multiplier=1.0, positive_multiplier=1.0):
+    def _get_batched_analysis_result(self, formula_idx, param_idx, analysis_args):
+        """
+        同一参数组合下的全部公式在第一次用到该参数组合时批量计算（一次指标计算、一次结果构造），之后直接取对应公式的结果。
+        三次分析同一轮的公式只是目标变量的上下限不同，用区间条件扫描（score_range_sweep）；
+        其他公式列表，以及基础条件顶层含 or 等不能扫描的公式，按公式批量打分（score_formula_batch）。
+        批量计算不可用时返回 None，由调用方单独计算该公式
+        """
+        formula_list = self.formula_list
+        if len(formula_list) < 2:
+            return None
+        batches = getattr(self, '_batched_analysis_results', None)
+        if batches is None or batches[0] is not formula_list:
+            batches = self._batched_analysis_results = (formula_list, {})
+        results = batches[1].get(param_idx)
+        if results is None:
+            first = formula_list[0]
+            if (first.get('sweep_base') and
+                    all(f.get('sweep_base') == first['sweep_base'] and f.get('variable') == first.get('variable') and
+                        f.get('sort_mode') == first.get('sort_mode') for f in formula_list)):
+                range_sweep = (first['sweep_base'], first['variable'], [(f['lower'], f['upper']) for f in formula_list])
+                results = self._execute_component_analysis_single(first['sweep_base'], *analysis_args, range_sweep=range_sweep)
+            if not isinstance(results, list) or len(results) != len(formula_list):
+                # 不是同一轮区间公式，或不能扫描（如基础条件顶层含 or，扫描与界面拼接出的公式含义不同）时按各公式原文批量打分
+                scorings = [{'formula_expr': f['formula'], 'sort_mode': f['sort_mode']} for f in formula_list]
+                results = self._execute_component_analysis_single(first['formula'], *analysis_args, scorings=scorings)
+            if not isinstance(results, list) or len(results) != len(formula_list):
+                print("批量计算不可用，改为逐个公式计算")
+                results = []
+            else:
+                print(f"参数组合 {param_idx + 1} 的 {len(results)} 个公式已批量计算完成")
+            batches[1][param_idx] = results
+        if formula_idx >= len(results) or not results[formula_idx]:
+            return None
+        result = results[formula_idx]
+        self.main_window.base_param.store_result(result)
+        self.main_window.last_calculate_result = result
+        return result
+
+    def _execute_component_analysis_single(self, formula, width, op_days, increment_rate, after_gt_end_ratio, after_gt_start_ratio, stop_loss_inc_rate, stop_loss_after_gt_end_ratio, stop_loss_after_gt_start_ratio, sort_mode, new_high_low1_start=0, new_high_low1_range=0, new_high_low1_span=0, new_high_low2_start=0, new_high_low2_range=0, new_high_low2_span=0, negative_multiplier=1.0, positive_multiplier=1.0, scorings=None, range_sweep=None):
         """
         执行单次组合分析
         专门为组合分析创建的方法，避免依赖自动分析子界面的控件
+        传入 scorings 或 range_sweep 时批量计算同一组参数下的多个公式，返回结果列表（见 _get_batched_analysis_result）
         """
         from PyQt5.QtWidgets import QMessageBox
         from datetime import datetime
@@ -2858,10 +2894,7 @@ class ComponentAnalysisWidget(QWidget):
             if start_dt > workday_last:
                 start_date = workdays[-1]
             else:
-                for d in workdays:
-                    if d >= start_date:
-                        start_date = d
-                        break
+                start_date = workdays.next_or_same(start_date)
             
         start_date_idx = workdays.index(start_date)
         if start_date_idx - width < 0 and width < len(workdays):
@@ -2874,10 +2907,7 @@ class ComponentAnalysisWidget(QWidget):
             if end_dt < workday_first:
                 end_date = start_date
             else:
-                for d in reversed(workdays):
-                    if d <= end_date:
-                        end_date = d
-                        break
+                end_date = workdays.previous_or_same(end_date)
         
         # 检查创新高新低日期宽度
         # 创新高参数
@@ -3085,9 +3115,13 @@ class ComponentAnalysisWidget(QWidget):
             profit_type=profit_type,
             loss_type=loss_type,
             negative_multiplier=negative_multiplier,
-            positive_multiplier=positive_multiplier
+            positive_multiplier=positive_multiplier,
+            scorings=scorings,
+            range_sweep=range_sweep
         )
         
+        if isinstance(result, list):
+            return result
         if result:
             merged_results = result.get('dates', {}) if result else {}
             valid_items = [(date_key, stocks) for date_key, stocks in merged_results.items()]
@@ -7088,6 +7122,9 @@ class ComponentAnalysisWidget(QWidget):
             equal_bound_value = round(min_value, 2)
             pairs.add((equal_bound_value, equal_bound_value))
 
+        # 去掉目标变量原有条件的基础公式：各公式即在其条件末尾追加 "变量 >= 下限 and 变量 <= 上限"，
+        # 执行时整轮公式用一次区间条件扫描算出（见 _get_batched_analysis_result）
+        sweep_base = self._modify_formula_for_variable(base_formula, variable_name, None, None)
         for lower, upper in sorted(pairs):
             modified_formula = self._modify_formula_for_variable(base_formula, variable_name, lower, upper)
             formulas.append({
@@ -7096,7 +7133,8 @@ class ComponentAnalysisWidget(QWidget):
                 'variable': variable_name,
                 'lower': lower,
                 'upper': upper,
-                'step': initial_step
+                'step': initial_step,
+                'sweep_base': sweep_base
             })
 
         print(f"生成了 {len(formulas)} 个公式组合")
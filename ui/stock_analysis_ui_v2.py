@@ -1336,7 +1336,7 @@ class StockAnalysisApp(QWidget):
                                 inc_rate=None, after_gt_end_ratio=None, after_gt_start_ratio=None,
                                 stop_loss_inc_rate=None, stop_loss_after_gt_end_ratio=None, stop_loss_after_gt_start_ratio=None,
                                 new_high_low_params=None, profit_type="INC", loss_type="INC", 
-                                negative_multiplier=1.0, positive_multiplier=1.0):
+                                negative_multiplier=1.0, positive_multiplier=1.0, scorings=None, range_sweep=None):
         # 直接在此处校验创新高/创新低日期范围
         workdays = getattr(self.init, 'workdays_str', None)
         # 如果没有传入end_date，则从控件获取
@@ -1357,10 +1357,7 @@ class StockAnalysisApp(QWidget):
                 if end_dt < workday_first:
                     end_date = workdays[0]
                 else:
-                    for d in reversed(workdays):
-                        if d <= end_date:
-                            end_date = d
-                            break
+                    end_date = workdays.previous_or_same(end_date)
                 print(f"自动修正后的end_date: {end_date}")
             
             # 更新控件显示（如果end_date是从控件获取的）
@@ -1613,6 +1610,10 @@ class StockAnalysisApp(QWidget):
         params['valid_abs_sum_threshold'] = self.valid_abs_sum_threshold_edit.text()
         params['new_before_high_logic'] = self.new_before_high_logic_combo.currentText()
         print(f"select_count={params['select_count']}, sort_mode={params['sort_mode']}, width={params['width']}, op_days={params['op_days']}, increment_rate={params['inc_rate']}, after_gt_end_ratio={params['after_gt_end_ratio']}, after_gt_start_ratio={params['after_gt_start_ratio']}, stop_loss_inc_rate={params['stop_loss_inc_rate']}, stop_loss_after_gt_end_ratio={params['stop_loss_after_gt_end_ratio']}, stop_loss_after_gt_start_ratio={params['stop_loss_after_gt_start_ratio']}")
+        # 组合分析/三次分析批量计算同一组参数下的多个公式，返回与各公式一一对应的结果列表（见 on_batch_calculate_clicked）
+        if scorings is not None or range_sweep is not None:
+            self.last_end_date = end_date
+            return self.base_param.on_batch_calculate_clicked(params, scorings=scorings, range_sweep=range_sweep)
         result = self.base_param.on_calculate_clicked(params)
         if result is None:
             if show_main_output:
@@ -1850,10 +1851,7 @@ class StockAnalysisApp(QWidget):
             if start_dt > workday_last:
                 start_date = workdays[-1]
             else:
-                for d in workdays:
-                    if d >= start_date:
-                        start_date = d
-                        break
+                start_date = workdays.next_or_same(start_date)
             
         width = self.width_spin.value()
         start_date_idx = workdays.index(start_date)
@@ -1866,10 +1864,7 @@ class StockAnalysisApp(QWidget):
             if end_dt < workday_first:
                 end_date = start_date
             else:
-                for d in reversed(workdays):
-                    if d <= end_date:
-                        end_date = d
-                        break
+                end_date = workdays.previous_or_same(end_date)
         # print(f"自动调整后的end_date: {end_date}")
         # 检查创新高新低日期宽度
         # 创新高参数
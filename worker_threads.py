@@ -1,78 +1,30 @@
 import pandas as pd
 from PyQt5.QtCore import QThread, pyqtSignal
-from function.stock_functions import unify_date_columns
+from function.stock_functions import unify_date_columns, TradingCalendar
 import numpy as np
 import time
 import math
 from multiprocessing import Pool, cpu_count
 import concurrent.futures
+from collections.abc import MutableSequence
 import worker_threads_cy  # 这是你用Cython编译出来的模块
 import re
 import threading
 import atexit
+import hashlib
+import json
+import shutil
+from collections import OrderedDict
 import psutil
 import os
 
-# Windows系统特定的进程调度优化 (Windows 11兼容)
-try:
-    import ctypes
-    from ctypes import wintypes
-    
-    # Windows API常量
-    THREAD_PRIORITY_HIGHEST = 2
-    THREAD_PRIORITY_ABOVE_NORMAL = 1
-    THREAD_PRIORITY_NORMAL = 0
-    THREAD_PRIORITY_BELOW_NORMAL = -1
-    THREAD_PRIORITY_LOWEST = -2
-    
-    # Windows 11特定的进程调度优化
-    # 使用更现代的调度策略，避免过度抢占CPU时间
-    
-    # 获取当前线程句柄
-    GetCurrentThread = ctypes.windll.kernel32.GetCurrentThread
-    GetCurrentThread.restype = wintypes.HANDLE
-    
-    # 设置线程优先级
-    SetThreadPriority = ctypes.windll.kernel32.SetThreadPriority
-    SetThreadPriority.argtypes = [wintypes.HANDLE, ctypes.c_int]
-    SetThreadPriority.restype = ctypes.c_bool
-    
-    # Windows 11中，尝试使用更平衡的调度策略
-    def set_current_thread_priority(priority):
-        """设置当前线程优先级 - Windows 11兼容版本"""
-        try:
-            thread_handle = GetCurrentThread()
-            if SetThreadPriority(thread_handle, priority):
-                return True
-            return False
-        except Exception:
-            return False
-    
-    # 检查Windows版本，为Windows 11提供特殊优化
-    def is_windows_11_or_later():
-        """检查是否为Windows 11或更高版本"""
-        try:
-            import platform
-            version = platform.version()
-            # Windows 11的版本号通常大于等于10.0.22000
-            if platform.system() == "Windows":
-                major, minor, build = map(int, version.split('.'))
-                return major >= 10 and build >= 22000
-            return False
-        except:
-            return False
-            
-    WINDOWS_OPTIMIZATION_AVAILABLE = True
-    IS_WINDOWS_11 = is_windows_11_or_later()
-    
-except ImportError:
-    WINDOWS_OPTIMIZATION_AVAILABLE = False
-    IS_WINDOWS_11 = False
-    def set_current_thread_priority(priority):
-        return False
-
 class ProcessPoolManager:
-    """全局进程池管理器，使用单例模式"""
+    """
+    全局进程池管理器，使用单例模式。
+    进程池常驻复用：每次计算前做健康检查，进程池损坏或有子进程退出时自动重建；
+    计算数据（价格/差值矩阵、日期列）发布到共享内存后常驻，数据不变时各次计算直接复用，
+    子进程只需挂载一次，每个任务只传递参数。
+    """
     _instance = None
     _lock = threading.Lock()
     
@@ -88,55 +40,137 @@ class ProcessPoolManager:
             self._process_pool = None
             self._max_workers = None
             self._pool_lock = threading.Lock()
+            # 常驻共享内存数据：来源对象、附加参数、描述信息和共享内存块
+            self._dataset_sources = None
+            self._dataset_key = None
+            self._dataset_descs = None
+            self._dataset_fingerprint = None
+            self._dataset_lineage = None
+            # 逐列摘要按数据来源对象缓存，每份加载的数据只计算一次
+            self._lineage_sources = None
+            self._shared_blocks = []
+            # 创新高/创新低稀疏表单独发布：来源对象、已构建层数、描述信息和共享内存块
+            self._range_sources = None
+            self._range_levels = 0
+            self._range_descs = (None, None)
+            self._range_blocks = []
             self._initialized = True
             # 注册程序退出时的清理函数
             atexit.register(self.shutdown)
     
     def get_process_pool(self, max_workers):
-        """获取或创建进程池，只有在进程数不同时才重新创建"""
+        """获取常驻进程池；进程数不足或进程池不健康时才重新创建"""
         with self._pool_lock:
-            if self._process_pool is None or self._max_workers != max_workers:
-                # 关闭旧的进程池
-                if self._process_pool is not None:
-                    try:
-                        self._process_pool.shutdown(wait=True)
-                        self._log_to_file(f"关闭旧的进程池，max_workers={self._max_workers}")
-                    except Exception as e:
-                        self._log_to_file(f"关闭旧进程池时出错: {e}", "ERROR")
-                
-                # 创建新的进程池
-                self._process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
-                self._max_workers = max_workers
-                self._log_to_file(f"【打开程序】创建新的进程池，max_workers={max_workers}")
+            if self._process_pool is None:
+                self._create_pool(max_workers, "【打开程序】创建新的进程池")
+            elif self._max_workers < max_workers:
+                self._create_pool(max_workers, f"进程数不足（{self._max_workers} < {max_workers}），重新创建进程池")
+            elif not self._is_pool_healthy():
+                self._create_pool(self._max_workers, "进程池健康检查失败，重新创建进程池", "WARNING")
             else:
-                # 检查当前进程池的活跃进程数量
-                self._ensure_sufficient_processes(max_workers)
-                self._log_to_file(f"复用现有进程池，max_workers={max_workers}")
-            
+                self._log_to_file(f"复用现有进程池，max_workers={self._max_workers}")
             return self._process_pool
-    
-    def _ensure_sufficient_processes(self, max_workers):
-        """确保进程池中有足够的活跃进程"""
-        if self._process_pool is None:
-            return
-        
+
+    def respawn(self, reason):
+        """计算过程中进程池损坏（子进程意外退出）时重建进程池"""
+        with self._pool_lock:
+            self._create_pool(self._max_workers or 1, f"进程池损坏（{reason}），重新创建进程池", "WARNING")
+            return self._process_pool
+
+    def _create_pool(self, max_workers, message, log_type="INFO"):
+        """关闭旧的进程池并创建新的进程池（调用方持有_pool_lock）"""
+        if self._process_pool is not None:
+            try:
+                self._process_pool.shutdown(wait=False, cancel_futures=True)
+                self._log_to_file(f"关闭旧的进程池，max_workers={self._max_workers}")
+            except Exception as e:
+                self._log_to_file(f"关闭旧进程池时出错: {e}", "ERROR")
+        self._process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+        self._max_workers = max_workers
+        self._log_to_file(f"{message}，max_workers={max_workers}", log_type)
+
+    def _is_pool_healthy(self):
+        """进程池未损坏且已启动的子进程都存活"""
+        pool = self._process_pool
+        if pool is None or getattr(pool, '_broken', False) or getattr(pool, '_shutdown_thread', False):
+            return False
         try:
-            # 检查当前活跃进程数量
-            active_processes = 0
-            if hasattr(self._process_pool, '_processes'):
-                active_processes = len(self._process_pool._processes)
-            
-            # 如果活跃进程数量不足，记录日志
-            if active_processes < max_workers:
-                self._log_to_file(f"检测到进程数量不足 - 当前: {active_processes}, 需要: {max_workers}", "WARNING")
-                # 注意：ProcessPoolExecutor会自动管理进程数量，这里只是记录状态
-                # 当提交新任务时，如果进程不足会自动创建新进程
-            else:
-                self._log_to_file(f"进程池状态正常 - 活跃进程: {active_processes}, 配置: {max_workers}")
-                
+            processes = getattr(pool, '_processes', None) or {}
+            for process in list(processes.values()):
+                if not process.is_alive():
+                    self._log_to_file(f"检测到子进程已退出 (PID: {process.pid}, exitcode: {process.exitcode})", "WARNING")
+                    return False
         except Exception as e:
-            self._log_to_file(f"检查进程数量时出错: {e}", "ERROR")
+            self._log_to_file(f"检查进程状态时出错: {e}", "ERROR")
+            return False
+        return True
+
+    def get_shared_dataset(self, sources, key, build, lineage):
+        """
+        获取常驻共享内存的计算数据描述信息。
+        sources 为数据来源对象（按对象身份比较），key 为影响数据内容的附加参数（倍增系数、存储类型）；
+        两者都与上次相同时直接复用，否则调用 build() 生成数组并重新发布到共享内存。
+        lineage() 返回数据来源的逐列摘要（见 dataset_column_digests），每份加载的数据只计算一次；
+        供指标缓存判断数据是否相同的数据指纹由逐列摘要和 key 得到，不再对发布的数组逐个计算摘要。
+        """
+        with self._pool_lock:
+            if (self._dataset_sources is not None and len(self._dataset_sources) == len(sources) and
+                    all(a is b for a, b in zip(self._dataset_sources, sources)) and self._dataset_key == key):
+                return self._dataset_descs
+            if (self._lineage_sources is None or len(self._lineage_sources) != len(sources) or
+                    not all(a is b for a, b in zip(self._lineage_sources, sources))):
+                self._lineage_sources = None
+                self._dataset_lineage = lineage()
+                self._lineage_sources = tuple(sources)
+            release_shared_arrays(self._shared_blocks)
+            self._dataset_sources = None
+            descs = []
+            for arr in build():
+                arr = np.asarray(arr)
+                # 非定长字符串的对象数组无法放入共享内存，直接随任务传递
+                if arr.dtype.kind == 'O':
+                    descs.append(arr.tolist())
+                else:
+                    descs.append(publish_shared_array(arr, self._shared_blocks))
+            self._dataset_sources = tuple(sources)
+            self._dataset_key = key
+            self._dataset_descs = tuple(descs)
+            self._dataset_fingerprint = hashlib.blake2b(repr((self._dataset_lineage, key)).encode(),
+                                                        digest_size=16).hexdigest()
+            self._log_to_file(f"计算数据已发布到共享内存，共{len(self._shared_blocks)}块")
+            return self._dataset_descs
     
+    def get_shared_range_tables(self, sources, levels, build):
+        """
+        获取常驻共享内存的创新高/创新低稀疏表描述信息 (最大值下标表, 最小值下标表)。
+        稀疏表与价格/差值数据分开发布，只随数据来源对象（按对象身份比较）和层数变化：
+        已发布的表层数不少于 levels 时直接复用（层数多的表同样能回答较短区间的查询），
+        否则调用 build(levels) 重新构建并发布；levels 为0且没有可复用的表时返回 (None, None)。
+        """
+        with self._pool_lock:
+            if (self._range_sources is not None and len(self._range_sources) == len(sources) and
+                    all(a is b for a, b in zip(self._range_sources, sources)) and self._range_levels >= levels):
+                return self._range_descs
+            release_shared_arrays(self._range_blocks)
+            self._range_sources = None
+            descs = (None, None)
+            if levels > 0:
+                descs = tuple(publish_shared_array(arr, self._range_blocks) for arr in build(levels))
+                self._log_to_file(f"创新高/创新低稀疏表已发布到共享内存，层数={levels}，"
+                                  f"占用{sum(shm.size for shm in self._range_blocks) / 1024 / 1024:.1f}MB")
+            self._range_sources = tuple(sources)
+            self._range_levels = levels
+            self._range_descs = descs
+            return descs
+
+    def dataset_fingerprint(self):
+        """当前共享内存数据的内容指纹（未发布数据时为None）"""
+        return self._dataset_fingerprint
+
+    def dataset_lineage(self):
+        """当前数据来源的逐列摘要（每份加载的数据只计算一次，未发布数据时为None）"""
+        return self._dataset_lineage
+
     def get_pool_status(self):
         """获取进程池状态信息"""
         if self._process_pool is None:
@@ -152,7 +186,7 @@ class ProcessPoolManager:
                 active_processes = len(self._process_pool._processes)
             
             return {
-                'status': 'running',
+                'status': 'running' if self._is_pool_healthy() else 'broken',
                 'max_workers': self._max_workers,
                 'active_processes': active_processes,
                 'processes_sufficient': active_processes >= self._max_workers if self._max_workers else False
@@ -166,7 +200,7 @@ class ProcessPoolManager:
             }
     
     def shutdown(self):
-        """关闭进程池"""
+        """关闭进程池并释放共享内存"""
         with self._pool_lock:
             if self._process_pool is not None:
                 try:
@@ -176,6 +210,14 @@ class ProcessPoolManager:
                     self._log_to_file("全局进程池已关闭")
                 except Exception as e:
                     self._log_to_file(f"关闭全局进程池时出错: {e}", "ERROR")
+            release_shared_arrays(self._shared_blocks)
+            self._dataset_sources = None
+            self._dataset_key = None
+            self._dataset_descs = None
+            release_shared_arrays(self._range_blocks)
+            self._range_sources = None
+            self._range_levels = 0
+            self._range_descs = (None, None)
     
     def _log_to_file(self, message, log_type="INFO"):
         """记录进程池相关日志到process_pool.log文件"""
@@ -192,58 +234,162 @@ class ProcessPoolManager:
             except:
                 pass
 
-    def _update_main_process_priority(self):
-        """更新主进程的调度优先级 - Windows 11兼容版本"""
-        try:
-            current_pid = os.getpid()
-            current_process = psutil.Process(current_pid)
-            
-            # 根据Windows版本预先选择最佳优先级
-            if IS_WINDOWS_11:
-                # Windows 11中，使用ABOVE_NORMAL_PRIORITY_CLASS更稳定
-                # 这样可以避免主进程过度抢占CPU时间，让子进程能够连贯运行
-                current_process.nice(psutil.ABOVE_NORMAL_PRIORITY_CLASS)
-                self._log_to_file(f"主进程优先级已更新为ABOVE_NORMAL_PRIORITY_CLASS (Windows 11兼容) (PID: {current_pid})")
-            else:
-                # Windows 10及以下版本，可以使用HIGH_PRIORITY_CLASS
-                current_process.nice(psutil.HIGH_PRIORITY_CLASS)
-                self._log_to_file(f"主进程优先级已更新为HIGH_PRIORITY_CLASS (PID: {current_pid})")
-                
-        except Exception as e:
-            self._log_to_file(f"更新主进程优先级时出错: {e}", "ERROR")
-
 # 全局进程池管理器实例
 process_pool_manager = ProcessPoolManager()
 
-# 全局时间戳管理器
-class GlobalTimeManager:
-    _instance = None
-    _lock = threading.Lock()
-    
-    def __new__(cls):
-        if cls._instance is None:
-            with cls._lock:
-                if cls._instance is None:
-                    cls._instance = super().__new__(cls)
-        return cls._instance
-    
-    def __init__(self):
-        if not hasattr(self, '_initialized'):
-            self._last_calculation_time = time.time()
-            self._initialized = True
-    
-    def get_last_calculation_time(self):
-        return self._last_calculation_time
-    
-    def update_calculation_time(self):
-        self._last_calculation_time = time.time()
-    
-    def get_time_elapsed(self):
-        current_time = time.time()
-        return current_time - self._last_calculation_time
 
-# 全局时间管理器实例
-global_time_manager = GlobalTimeManager()
+# 只影响打分/选股、不影响指标计算的参数，不参与指标缓存的键
+SCORING_ONLY_PARAMS = ('formula_expr', 'sort_mode', 'select_count', 'comparison_vars',
+                       'only_show_selected', 'max_cores', 'kernel_threads', 'metric_cache_mb', 'full_compute',
+                       'float32_validate')
+
+def metric_params_key(params):
+    """指标计算参数的缓存键：去掉只影响打分的参数和结束日期区间后按参数名排序"""
+    return repr(sorted((k, v) for k, v in params.items()
+                       if k not in SCORING_ONLY_PARAMS and k not in ('end_date_start', 'end_date_end')))
+
+def metric_forward_days(params):
+    """
+    一个结束日期的指标最多用到结束日之后几个交易日的数据：止盈止损模拟的 op_days 天（含前一日），
+    正的日期偏移，以及起点为负的创新高/创新低判断
+    """
+    starts = [int(params.get(f'new_{name}_start', 0) or 0) for name in (
+        'before_high', 'before_high2', 'after_high', 'after_high2',
+        'before_low', 'before_low2', 'after_low', 'after_low2')]
+    return (int(float(params.get('op_days', 0) or 0)) + 1 + max(int(params.get('shift_days', 0) or 0), 0) +
+            max([0] + [-start for start in starts]))
+
+def dataset_column_digests(price_data, diff_data):
+    """
+    数据集的逐列内容摘要 (股票摘要, ((日期, 列摘要), ...))，日期按数据列顺序（新日期在前）。
+    新文件只是在前面追加了交易日时，旧数据集的全部列摘要与新数据集最后若干列的摘要逐一相同。
+    """
+    stocks = hashlib.blake2b(repr(price_data.iloc[:, :2].values.tolist()).encode(), digest_size=16).hexdigest()
+    prices = np.ascontiguousarray(price_data.iloc[:, 2:].values.astype(np.float64).T)
+    diffs = np.ascontiguousarray(diff_data.values.astype(np.float64).T)
+    columns = tuple((date, hashlib.blake2b(prices[j].tobytes() + diffs[j].tobytes(), digest_size=16).hexdigest())
+                    for j, date in enumerate(price_data.columns[2:]))
+    return stocks, columns
+
+
+class MetricColumns:
+    """
+    第一阶段（指标计算）的结果：某个结束日期区间内全部股票的公式变量列。
+    formula_cols 为 (变量, 股票, 日期) 的 float64 矩阵，变量按 FORMULA_VAR_NAMES 顺序；
+    row_ok 为 (股票, 日期) 的行有效掩码（结束值有效且持有天数不为-1）；
+    key 为 (数据内容指纹, 指标参数, 开始结束日期, 最后结束日期)，第二阶段打分时用来确认列与参数匹配；
+    end_dates 为各日期列对应的结束日期，lineage 为计算所用数据集的逐列摘要（追加交易日后据此沿用旧的指标列）。
+    pending 为 (股票, 日期) 的待补算掩码：第一遍被公式前置条件跳过的行只有窗口指标，止盈止损变量为 NaN、row_ok 为0，
+    用其他公式打分前需先用 fill_rows 补算其中前置条件成立的行。
+    """
+    def __init__(self, key, formula_cols, row_ok, end_dates=None, lineage=None, pending=None):
+        self.key = key
+        self.formula_cols = formula_cols
+        self.row_ok = row_ok
+        self.end_dates = end_dates
+        self.lineage = lineage
+        self.pending = pending if pending is not None else np.zeros(row_ok.shape, dtype=np.uint8)
+
+    @property
+    def nbytes(self):
+        return self.formula_cols.nbytes + self.row_ok.nbytes + self.pending.nbytes
+
+    def pending_rows(self, formula_exprs):
+        """待补算的行中任一公式的前置条件成立、打分前需要补算完整指标的 (股票, 日期) 掩码，没有时返回 None"""
+        if not self.pending.any():
+            return None
+        need = np.zeros(self.pending.shape, dtype=bool)
+        for formula_expr in formula_exprs:
+            need |= worker_threads_cy.prefilter_pending_rows(formula_expr, self.formula_cols, self.pending)
+        return need if need.any() else None
+
+    def fill_rows(self, row_mask, part):
+        """用只计算了 row_mask 内各行的 part 补全这些行的指标列，并清除待补算标记"""
+        self.formula_cols[:, row_mask] = part.formula_cols[:, row_mask]
+        self.row_ok[row_mask] = part.row_ok[row_mask]
+        self.pending[row_mask] = 0
+
+    def select_rows(self, formula_expr, sort_mode, select_count, comparison_vars=None, shard_bounds=None, return_scores=False):
+        """
+        第二阶段：用指标列对公式打分，返回每个日期前 select_count 名的 (股票, 日期) 入选掩码；
+        shard_bounds 为各进程的股票区间，每个区间分别取前 select_count 名（与逐进程选股后合并一致），
+        return_scores 为真时同时返回 (股票, 日期) 的 score 矩阵
+        """
+        cmp_zero = worker_threads_cy.comparison_zero_columns(self.formula_cols, comparison_vars, self.row_ok.shape)
+        return worker_threads_cy.select_formula_rows(
+            formula_expr, self.formula_cols, worker_threads_cy.FORMULA_VAR_NAMES, self.row_ok, cmp_zero,
+            {"最大值排序": 1, "最小值排序": 2}.get(sort_mode, 0), int(select_count), return_scores, shard_bounds)
+
+    def sweep_range(self, formula_expr, variable, bound_pairs, sort_mode, select_count, comparison_vars=None, shard_bounds=None):
+        """
+        区间条件扫描：对每组 (下限, 上限) 返回 formula_expr 的 if 条件追加 `下限 <= variable <= 上限` 后的
+        (入选掩码, score 矩阵)，公式形式不支持时返回 None
+        """
+        cmp_zero = worker_threads_cy.comparison_zero_columns(self.formula_cols, comparison_vars, self.row_ok.shape)
+        return worker_threads_cy.sweep_range_rows(
+            formula_expr, self.formula_cols, worker_threads_cy.FORMULA_VAR_NAMES, self.row_ok, cmp_zero,
+            variable, bound_pairs, {"最大值排序": 1, "最小值排序": 2}.get(sort_mode, 0), int(select_count), shard_bounds)
+
+
+class MetricCache:
+    """
+    选股指标列缓存（LRU，按内存预算淘汰），值为 MetricColumns。
+    只改公式、排序方式或选股数量时直接用缓存的指标列重新打分，不再重算指标。
+    """
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def find_extension_base(self, params_key, lineage):
+        """
+        找出同一组指标参数（不含结束日期区间）在当前数据集或其旧版本上算好的条目：
+        股票相同，条目数据集的全部日期列与当前数据集最后若干列内容相同（当前数据集只是在前面追加了交易日）。
+        有多个时取覆盖结束日期最多的，没有返回 None
+        """
+        stocks, columns = lineage
+        with self._lock:
+            entries = list(self._entries.values())
+        best = None
+        for entry in entries:
+            if entry.key[1] != params_key or entry.lineage is None or entry.end_dates is None:
+                continue
+            old_stocks, old_columns = entry.lineage
+            if (old_stocks != stocks or len(old_columns) > len(columns) or
+                    columns[len(columns) - len(old_columns):] != old_columns):
+                continue
+            if best is None or len(entry.end_dates) > len(best.end_dates):
+                best = entry
+        return best
+
+    def put(self, metrics):
+        with self._lock:
+            old = self._entries.pop(metrics.key, None)
+            if old is not None:
+                self._nbytes -= old.nbytes
+            # 单个条目超过预算时不缓存
+            if metrics.nbytes > self.max_bytes:
+                return
+            while self._entries and self._nbytes + metrics.nbytes > self.max_bytes:
+                self._nbytes -= self._entries.popitem(last=False)[1].nbytes
+            self._entries[metrics.key] = metrics
+            self._nbytes += metrics.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+
+metric_cache = MetricCache()
 
 # 全局缩写映射表
 abbr_map = {
@@ -350,28 +496,402 @@ class RowResult:
     def to_dict(self):
         return {slot: getattr(self, slot) for slot in self.__slots__}
 
+class ResultRows(MutableSequence):
+    """
+    一个结束日期的结果行列表，底层是列式的 ResultTable。
+    行字典只在被访问（界面打开、遍历）时才创建，之后缓存并可像普通字典一样修改；
+    也可以像列表一样追加统计行等普通字典。
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self._items = list(range(len(table)))  # int 表示尚未创建字典的表格行号
+
+    def _materialize(self, pos):
+        item = self._items[pos]
+        if type(item) is int:
+            item = self.table.row(item)
+            self._items[pos] = item
+        return item
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._materialize(pos) for pos in range(*index.indices(len(self._items)))]
+        if index < 0:
+            index += len(self._items)
+        if not 0 <= index < len(self._items):
+            raise IndexError('ResultRows index out of range')
+        return self._materialize(index)
+
+    def __setitem__(self, index, value):
+        self._items[index] = value
+
+    def __delitem__(self, index):
+        del self._items[index]
+
+    def __len__(self):
+        return len(self._items)
+
+    def insert(self, index, value):
+        self._items.insert(index, value)
+
+    def sequence(self, index, name):
+        """第index行的累加值序列；尚未创建字典的行直接返回底层数组切片（不复制）"""
+        item = self._items[index]
+        if type(item) is int:
+            return self.table.sequence(name, item)
+        return item.get(name, [])
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, ResultRows)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return f"ResultRows({len(self._items)} rows)"
+
+FILE_CACHE_VERSION = 2
+
+
+def file_cache_root():
+    """上传文件二进制缓存的根目录：应用缓存目录（Windows 下为 %LOCALAPPDATA%，其他系统为 ~/.cache）下的 stock_analysis/file_cache"""
+    base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'stock_analysis', 'file_cache')
+
+
+def _file_path_key(file_path):
+    return hashlib.blake2b(os.path.abspath(file_path).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def file_cache_dir(file_path, stat=None):
+    """
+    上传文件的二进制缓存目录，位于应用缓存目录下，按文件绝对路径、大小和修改时间命名，
+    不在用户的数据目录里写任何东西；文件被修改后对应新的目录，不会读到旧文件的缓存。
+    """
+    stat = stat if stat is not None else os.stat(file_path)
+    return os.path.join(file_cache_root(), f"{_file_path_key(file_path)}_{stat.st_size}_{stat.st_mtime_ns}")
+
+
+def _pack_frame(frame):
+    """
+    把 DataFrame 拆成可以直接 np.save 的数组：文本列存为定长 unicode 矩阵加缺失掩码，
+    其余列合并为一个 (行, 列) 的 float64 矩阵；列顺序与非 float64 列的原始类型记在返回的 meta 里。
+    """
+    text_cols = [col for col in frame.columns if not pd.api.types.is_numeric_dtype(frame[col])]
+    value_cols = [col for col in frame.columns if col not in text_cols]
+    meta = {
+        'columns': [str(col) for col in frame.columns],
+        'text': {str(col): str(frame[col].dtype) for col in text_cols},
+        'dtypes': {str(col): str(frame[col].dtype) for col in value_cols if frame[col].dtype != np.float64},
+    }
+    text_na = np.array([frame[col].isna().to_numpy() for col in text_cols], dtype=bool).reshape(len(text_cols), len(frame))
+    text = np.array([frame[col].fillna('').astype(str).to_numpy() for col in text_cols], dtype=str).reshape(len(text_cols), len(frame))
+    # 数值列是连续的一段时按切片取，单一数据块时不复制，np.save 直接按内存布局写盘
+    value_idx = np.flatnonzero([col not in text_cols for col in frame.columns])
+    if len(value_idx) and value_idx[-1] - value_idx[0] + 1 == len(value_idx):
+        values = frame.iloc[:, value_idx[0]:value_idx[-1] + 1].to_numpy(dtype=np.float64)
+    else:
+        values = frame.iloc[:, value_idx].to_numpy(dtype=np.float64)
+    return meta, {'text': text, 'text_na': text_na, 'values': values}
+
+
+def _assemble_frame(columns, text, values):
+    """由文本列 {列名: Series}（按列顺序）和其余各列组成的数值矩阵拼出 DataFrame，数值矩阵直接作为数据块，不复制"""
+    frame = pd.DataFrame(values, columns=[col for col in columns if col not in text], copy=False)
+    for col, series in text.items():
+        frame.insert(columns.index(col), col, series)
+    return frame
+
+
+def join_price_diff(price_data, diff_data, columns, separator_values):
+    """把价格、差值两部分和中间的分隔列拼回与原文件列一致的完整表（各数据块共享，不复制）"""
+    separator = pd.DataFrame({'': np.asarray(separator_values, dtype=np.float64)}, index=price_data.index)
+    df = pd.concat([price_data, separator, diff_data], axis=1)
+    df.columns = columns
+    return df
+
+
+def _unpack_frame(meta, arrays):
+    """_pack_frame 的逆过程；数值矩阵直接作为 DataFrame 的数据块，不复制"""
+    text = {}
+    for i, col in enumerate(meta['text']):
+        column = arrays['text'][i].astype(object)
+        column[arrays['text_na'][i]] = np.nan
+        text[col] = pd.Series(column, dtype=meta['text'][col])
+    frame = _assemble_frame(meta['columns'], text, arrays['values'])
+    if meta['dtypes']:
+        frame = frame.astype(meta['dtypes'])
+    return frame
+
+
+def load_file_cache(file_path, file_type):
+    """
+    读取上传文件的二进制缓存，返回 (df, price_data, diff_data, all_dates)；缓存不存在或与文件不符时返回 None。
+    缓存目录由文件路径、大小和修改时间决定，三者都没变时才会命中；
+    数值矩阵以内存映射（写时复制）方式打开，只有实际用到的页才会读入内存。
+    """
+    try:
+        stat = os.stat(file_path)
+        cache_dir = file_cache_dir(file_path, stat)
+        with open(os.path.join(cache_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != FILE_CACHE_VERSION or meta['file_type'] != file_type:
+            return None
+        if meta['path'] != os.path.abspath(file_path) or meta['size'] != stat.st_size or meta['mtime_ns'] != stat.st_mtime_ns:
+            return None
+        frames = {}
+        for part in ('df', 'price', 'diff') if 'df' in meta else ('price', 'diff'):
+            arrays = {name: np.load(os.path.join(cache_dir, f"{part}_{name}_{meta['token']}.npy"),
+                                    mmap_mode='c' if name == 'values' else None)
+                      for name in ('text', 'text_na', 'values')}
+            frames[part] = _unpack_frame(meta[part], arrays)
+        if 'df' not in meta:
+            layout = meta['df_layout']
+            frames['df'] = join_price_diff(frames['price'], frames['diff'], layout['columns'], layout['separator'])
+        return frames['df'], frames['price'], frames['diff'], meta['all_dates']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_file_cache(file_path, file_type, df, price_data, diff_data, all_dates, df_layout=None):
+    """
+    把解析好的数据写成二进制缓存（目录见 file_cache_dir）。数组文件名带本次写入的标记，旧缓存的数组可能仍被映射着，
+    不覆盖只在写完后清理；meta.json 最后写入，写入中途失败时旧的 meta 已先删除，不会读到不完整的缓存。
+    同一文件旧版本（大小或修改时间不同）的缓存目录在写完后删除。写入失败时抛出异常，由调用方记录日志。
+    df 由 join_price_diff 拼成时传入 df_layout（原列名与分隔列的值），只记录拼接方式，不重复存储数据。
+    """
+    stat = os.stat(file_path)
+    cache_dir = file_cache_dir(file_path, stat)
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    token = f"{time.time_ns():x}"
+    os.makedirs(cache_dir, exist_ok=True)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    meta = {'version': FILE_CACHE_VERSION, 'file_type': file_type, 'path': os.path.abspath(file_path),
+            'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'token': token, 'all_dates': list(all_dates)}
+    written = set()
+    parts = [('price', price_data), ('diff', diff_data)]
+    if df_layout is not None:
+        meta['df_layout'] = df_layout
+    else:
+        parts.insert(0, ('df', df))
+    for part, frame in parts:
+        meta[part], arrays = _pack_frame(frame)
+        for name, array in arrays.items():
+            file_name = f"{part}_{name}_{token}.npy"
+            np.save(os.path.join(cache_dir, file_name), array, allow_pickle=False)
+            written.add(file_name)
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, meta_path)
+    for file_name in os.listdir(cache_dir):
+        if file_name.endswith('.npy') and file_name not in written:
+            try:
+                os.remove(os.path.join(cache_dir, file_name))
+            except OSError:
+                pass
+    # 同一文件的旧版本缓存已不可能再命中
+    root, current = os.path.split(cache_dir)
+    prefix = _file_path_key(file_path) + '_'
+    for entry in os.listdir(root):
+        if entry.startswith(prefix) and entry != current:
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+
+def apply_to_numeric_block(frame, func):
+    """
+    把 frame 的全部数值列取成一个 float64 矩阵，整体做一次 func(values)，返回列顺序不变的新 DataFrame；
+    文本列（代码、名称）原样保留，结果中的数值列合并为一个数据块。
+    """
+    is_numeric = np.array([pd.api.types.is_numeric_dtype(dtype) for dtype in frame.dtypes], dtype=bool)
+    if not is_numeric.any():
+        return frame
+    values = func(frame.iloc[:, is_numeric].to_numpy(dtype=np.float64))
+    block = pd.DataFrame(values, index=frame.index, columns=frame.columns[is_numeric], copy=False)
+    if is_numeric.all():
+        return block
+    result = pd.concat([frame.iloc[:, ~is_numeric], block], axis=1)
+    if not result.columns.equals(frame.columns):
+        order = np.argsort(np.concatenate([np.flatnonzero(~is_numeric), np.flatnonzero(is_numeric)]), kind='stable')
+        result = result.iloc[:, order]
+    return result
+
+def _chunk_values(frame):
+    """行块的各列转为 float64 矩阵；个别含非数字文本的列按 pd.to_numeric(errors='coerce') 转换，无法解析的值为NaN"""
+    if all(pd.api.types.is_numeric_dtype(dtype) for dtype in frame.dtypes):
+        return frame.to_numpy(dtype=np.float64)
+    return frame.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+
+
+def read_csv_streaming(file_path, chunk_rows=2000, progress=None):
+    """
+    分块读取价格/差值 CSV：先读表头找到分隔列，再按行块解析，数值直接写入预先分配的 float64 矩阵
+    （价格0.0转为NaN，差值保留两位小数），不生成整张文件的中间表，内存峰值接近最终矩阵大小。
+    返回 (df, price_data, diff_data, df_layout)，df 由两部分拼成、不另占内存；找不到分隔列时返回 None。
+    progress(已读取行数, 预计总行数) 每读完一块调用一次。
+    """
+    header = pd.read_csv(file_path, nrows=0).columns.tolist()
+    separator_idx = None
+    for i, col in enumerate(header):
+        if (pd.isna(col) or col == '' or str(col).startswith('Unnamed')):
+            separator_idx = i
+            break
+    if separator_idx is None:
+        return None
+    # 数据行数不超过换行符个数（表头行以换行结尾），按此预分配；未写入的部分不会占用物理内存
+    with open(file_path, 'rb') as f:
+        capacity = max(sum(block.count(b'\n') for block in iter(lambda: f.read(1 << 20), b'')), 1)
+    text_cols = [col for col in header[:separator_idx] if col in ('代码', '名称')]
+    price_idx = [i for i in range(separator_idx) if header[i] not in text_cols]
+    price_values = np.empty((capacity, len(price_idx)))
+    diff_values = np.empty((capacity, len(header) - separator_idx - 1))
+    separator_values = np.empty(capacity)
+    text_parts = {col: [] for col in text_cols}
+    rows = 0
+    for chunk in pd.read_csv(file_path, dtype={col: str for col in text_cols}, chunksize=chunk_rows):
+        n = len(chunk)
+        if rows + n > capacity:
+            capacity = max(capacity * 2, rows + n)
+            price_values = np.concatenate([price_values[:rows], np.empty((capacity - rows, price_values.shape[1]))])
+            diff_values = np.concatenate([diff_values[:rows], np.empty((capacity - rows, diff_values.shape[1]))])
+            separator_values = np.concatenate([separator_values[:rows], np.empty(capacity - rows)])
+        for col in text_cols:
+            text_parts[col].append(chunk[col])
+        price = _chunk_values(chunk.iloc[:, price_idx])
+        price_values[rows:rows + n] = np.where(price == 0.0, np.nan, price)
+        separator_values[rows:rows + n] = _chunk_values(chunk.iloc[:, [separator_idx]])[:, 0]
+        diff_values[rows:rows + n] = np.round(_chunk_values(chunk.iloc[:, separator_idx + 1:]), 2)
+        rows += n
+        if progress is not None:
+            progress(rows, capacity)
+    text = {col: pd.concat(parts, ignore_index=True) if parts else pd.Series([], dtype=str)
+            for col, parts in text_parts.items()}
+    price_data = _assemble_frame(header[:separator_idx], text, price_values[:rows])
+    diff_data = pd.DataFrame(diff_values[:rows], columns=header[separator_idx + 1:], copy=False)
+    df_layout = {'columns': [str(col) for col in header], 'separator': separator_values[:rows].tolist()}
+    df = join_price_diff(price_data, diff_data, df_layout['columns'], df_layout['separator'])
+    return df, price_data, diff_data, df_layout
+
+def format_stock_code(code):
+    """纯数字且不足6位的股票代码补零为6位，其他代码原样返回"""
+    if code is not None and code != '':
+        try:
+            code_str = str(code).strip()
+            if code_str.isdigit() and len(code_str) < 6:
+                return code_str.zfill(6)
+        except Exception:
+            pass
+    return code
+
+_stock_labels = (None, None, None)  # (price_data, 代码数组, 名称数组)
+_stock_labels_lock = threading.Lock()
+
+def stock_code_name_arrays(price_data):
+    """
+    与 price_data 行号对应的股票代码、名称数组（object数组，代码已补零为6位，名称为None时为空字符串）。
+    按数据对象缓存最近一次的结果：文件加载完成时即生成，计算结果收尾时按 stock_idx 直接取值。
+    """
+    global _stock_labels
+    with _stock_labels_lock:
+        source, codes, names = _stock_labels
+        if source is not price_data:
+            codes = np.empty(len(price_data), dtype=object)
+            codes[:] = [format_stock_code(code) for code in price_data.iloc[:, 0].tolist()]
+            names = np.empty(len(price_data), dtype=object)
+            names[:] = [name if name is not None else '' for name in price_data.iloc[:, 1].tolist()]
+            _stock_labels = (price_data, codes, names)
+        return codes, names
+
+
 class FileLoaderThread(QThread):
     finished = pyqtSignal(object, object, object, list, str)  # df, price_data, diff_data, workdays_str, error_msg
+    progress = pyqtSignal(int, int)  # 已读取行数, 预计总行数
 
     def __init__(self, file_path, file_type='csv'):
         super().__init__()
         self.file_path = file_path
         self.file_type = file_type
 
+    def _log_to_file(self, message, log_type="INFO"):
+        """记录文件加载相关日志到process_pool.log文件"""
+        try:
+            timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+            log_message = f"[{timestamp}] [{log_type}] [FileLoaderThread] {message}\n"
+
+            with open('process_pool.log', 'a', encoding='utf-8') as f:
+                f.write(log_message)
+        except Exception as e:
+            # 如果日志写入失败，至少尝试输出到控制台
+            try:
+                print(f"日志写入失败: {e}")
+            except:
+                pass
+
+    def _save_cache(self, df, price_data, diff_data, all_dates, df_layout=None):
+        # 写缓存失败不影响本次上传，只记录日志
+        try:
+            save_file_cache(self.file_path, self.file_type, df, price_data, diff_data, all_dates, df_layout=df_layout)
+        except Exception as e:
+            self._log_to_file(f"写入文件缓存失败 ({self.file_path}): {e}", "WARNING")
+
+    def _emit_loaded(self, df, price_data, diff_data, all_dates):
+        # 预先生成股票代码/名称数组，计算时不再逐行读取 DataFrame
+        stock_code_name_arrays(price_data)
+        self.finished.emit(df, price_data, diff_data, all_dates, "")
+
     def run(self):
         try:
-            if self.file_type == 'xlsx':
-                df = pd.read_excel(self.file_path, dtype=str)
-            else:
-                df = pd.read_csv(self.file_path, dtype=str)
+            timings = []
+            phase_start = time.time()
+            cached = load_file_cache(self.file_path, self.file_type)
+            if cached is not None:
+                df, price_data, diff_data, all_dates = cached
+                print(f"文件加载耗时（二进制缓存）: {time.time() - phase_start:.4f}秒")
+                self._emit_loaded(df, price_data, diff_data, all_dates)
+                return
+
+            def mark(phase):
+                nonlocal phase_start
+                now = time.time()
+                timings.append((phase, now - phase_start))
+                phase_start = now
+
+            def report():
+                print("文件加载耗时: " + ", ".join(f"{phase} {seconds:.4f}秒" for phase, seconds in timings) +
+                      f", 总计 {sum(seconds for _, seconds in timings):.4f}秒")
+
+            if self.file_type != 'xlsx':
+                # CSV 分块流式读取，数值直接写入价格/差值矩阵
+                loaded = read_csv_streaming(self.file_path, progress=self.progress.emit)
+                if loaded is None:
+                    self.finished.emit(None, None, None, [], "未找到分隔列")
+                    return
+                df, price_data, diff_data, df_layout = loaded
+                price_data = unify_date_columns(price_data)
+                diff_data = unify_date_columns(diff_data)
+                mark('流式读取')
+                all_dates = sorted(col for col in price_data.columns if col[:4].isdigit())
+                self._save_cache(df, price_data, diff_data, all_dates, df_layout=df_layout)
+                mark('写入缓存')
+                report()
+                self._emit_loaded(df, price_data, diff_data, all_dates)
+                return
+
+            # Excel 只有代码、名称按文本读取，其余列直接取单元格的数值
+            df = pd.read_excel(self.file_path, dtype={'代码': str, '名称': str})
+            mark('读取文件')
             
-            # 处理数据类型转换
+            # 处理数据类型转换：含非数字文本的列仍按原规则转换，无法解析的值为NaN
             for col in df.columns:
-                if col not in ['代码', '名称']:
+                if col not in ['代码', '名称'] and not pd.api.types.is_numeric_dtype(df[col]):
                     try:
                         df[col] = pd.to_numeric(df[col], errors='coerce')
                     except Exception:
                         continue
+            mark('类型转换')
             
             # 只对price_data部分做0.0转为NaN
             columns = df.columns.tolist()
@@ -385,20 +905,23 @@ class FileLoaderThread(QThread):
                 return
             price_data = df.iloc[:, 0:separator_idx]
             price_data = unify_date_columns(price_data)
-            # 只对price_data做0.0转为NaN，并对数值进行传统四舍五入保留两位小数
-            for col in price_data.columns:
-                price_data.loc[price_data[col] == 0.0, col] = np.nan
+            # 只对price_data做0.0转为NaN，全部数值列作为一个矩阵一次处理
+            price_data = apply_to_numeric_block(price_data, lambda values: np.where(values == 0.0, np.nan, values))
+            mark('零值处理')
             
             diff_data = df.iloc[:, separator_idx+1:]
             diff_data = unify_date_columns(diff_data)
             
-            # 对diff_data的数值列进行精度控制
-            for col in diff_data.columns:
-                diff_data[col] = diff_data[col].round(2)  # 保留两位小数
+            # 对diff_data的数值列进行精度控制（保留两位小数）
+            diff_data = apply_to_numeric_block(diff_data, lambda values: np.round(values, 2))
+            mark('保留两位小数')
             
             all_dates = [col for col in price_data.columns if col[:4].isdigit()]
             all_dates = sorted(all_dates)
-            self.finished.emit(df, price_data, diff_data, all_dates, "")
+            self._save_cache(df, price_data, diff_data, all_dates)
+            mark('写入缓存')
+            report()
+            self._emit_loaded(df, price_data, diff_data, all_dates)
         except Exception as e:
             self.finished.emit(None, None, None, [], str(e))
 
@@ -417,6 +940,8 @@ class CalculateThread(QThread):
         self.price_data = price_data
         self.diff_data = diff_data
         self.workdays_str = workdays_str
+        # 数据日期列（price_data 第3列起，新日期在前）的交易日历，结束日期→列下标 O(1) 查找
+        self.date_calendar = TradingCalendar(price_data.columns[2:] if price_data is not None else ())
         self.params = params
         self.prev_continuous_results = {}
         self.prev_start_idx = {}
@@ -457,7 +982,7 @@ class CalculateThread(QThread):
 
     def _round_numeric_values(self, stock_data):
         """
-        统一的数值四舍五入处理
+        统一的数值四舍五入处理（stock_data 可以是单行字典，也可以是整个日期的 ResultTable）
         对数值字段进行四舍五入保留两位小数
         对使用 round_to_2_nan 的字段进行特殊处理（如果为0则设为None）
         """
@@ -538,24 +1063,47 @@ class CalculateThread(QThread):
             'forward_min_valid_pos_sum', 'forward_min_valid_neg_sum'
         ]
         
+        def round_value(field, val):
+            if val is not None and val != '' and not (isinstance(val, float) and math.isnan(val)):
+                try:
+                    float_val = float(val)
+                    # 对使用 round_to_2_nan 的字段进行特殊处理
+                    if field in round_to_2_nan_fields:
+                        if abs(float_val) == 0.0:  # 如果四舍五入后为0，设为None
+                            return None
+                        return round(float_val, 2)
+                    # 普通字段直接四舍五入
+                    return round(float_val, 2)
+                except (ValueError, TypeError):
+                    pass
+            return val
+
+        # 列式结果按列处理，不创建行字典
+        if isinstance(stock_data, worker_threads_cy.ResultTable):
+            for field in dict.fromkeys(numeric_fields):
+                if field not in stock_data:
+                    continue
+                column = stock_data.columns[field]
+                if isinstance(column, np.ndarray):
+                    # 数值列整列四舍五入（结果与逐个 round 相同，整数/布尔列同样转为浮点数），None 仍记录在掩码中
+                    values = round_array(column.astype(np.float64))
+                    mask = stock_data.masks[field]
+                    if field in round_to_2_nan_fields:
+                        mask = (column == 0) if mask is None else (mask | (column == 0))
+                    if mask is not None and mask.any():
+                        values[mask] = np.nan
+                    else:
+                        mask = None
+                    stock_data.columns[field] = values
+                    stock_data.masks[field] = mask
+                elif not isinstance(column, worker_threads_cy.RaggedColumn):
+                    stock_data.set_values(field, [round_value(field, val) for val in stock_data.values(field)])
+            return
+
         # 处理所有数值字段
         for field in numeric_fields:
             if field in stock_data:
-                val = stock_data[field]
-                if val is not None and val != '' and not (isinstance(val, float) and math.isnan(val)):
-                    try:
-                        float_val = float(val)
-                        # 对使用 round_to_2_nan 的字段进行特殊处理
-                        if field in round_to_2_nan_fields:
-                            if abs(float_val) == 0.0:  # 如果四舍五入后为0，设为None
-                                stock_data[field] = None
-                            else:
-                                stock_data[field] = round(float_val, 2)
-                        else:
-                            # 普通字段直接四舍五入
-                            stock_data[field] = round(float_val, 2)
-                    except (ValueError, TypeError):
-                        continue
+                stock_data[field] = round_value(field, stock_data[field])
 
     def expr_to_tuple(self, expr, abbr_map):
         # 1. 缩写转全名
@@ -570,30 +1118,217 @@ class CalculateThread(QThread):
             )
         return expr
 
-    def calculate_batch_16_cores(self, params):
-        # 检查是否需要重新调度主进程
-        current_time = time.time()
-        time_elapsed = global_time_manager.get_time_elapsed()
-        one_minute = 30 * 60  # 1分钟 = 60秒
-        
-        # 记录时间信息到日志
-        self._log_to_file(f"时间检查 - 当前时间: {time.strftime('%H:%M:%S', time.localtime(current_time))}, 上次计算时间: {time.strftime('%H:%M:%S', time.localtime(global_time_manager.get_last_calculation_time()))}, 间隔: {time_elapsed/60:.1f}分钟")
-        
-        if time_elapsed > one_minute:
-            self._log_to_file(f"距离上次计算已超过{time_elapsed/60:.1f}分钟，触发主进程重新调度（30分钟阈值）")
-            try:
-                # 直接调用进程池管理器的维护方法
-                process_pool_manager._update_main_process_priority()
-                self._log_to_file("主进程优先级已更新")
-            except Exception as e:
-                self._log_to_file(f"更新主进程优先级时出错: {e}")
-            
-            # 更新时间戳
-            global_time_manager.update_calculation_time()
-            self._log_to_file(f"已更新时间戳，下次检查基准时间: {time.strftime('%H:%M:%S', time.localtime(global_time_manager.get_last_calculation_time()))}")
-        else:
-            self._log_to_file(f"距离上次计算仅{time_elapsed/60:.1f}分钟，未达到30分钟阈值，跳过重新调度")
-        
+    def calculate_metric_columns(self, params, metrics=None):
+        """
+        两阶段接口的第一阶段：只计算结束日期区间内的指标列（不打分、不构造结果行）并放入指标缓存。
+        返回 MetricColumns（传入的 metrics 与参数匹配时直接返回）；股票或日期区间为空时返回None。
+        """
+        return self.calculate_batch_16_cores(params, metrics=metrics, metrics_only=True)
+
+    def score_metric_columns(self, params, metrics, scorings):
+        """
+        两阶段接口的第二阶段：对同一批指标列依次应用多组打分参数。
+        scorings 为字典列表，每项可包含 formula_expr、sort_mode、select_count、comparison_vars，
+        未给出的沿用 params；返回与 scorings 一一对应的选股结果（格式同 calculate_batch_16_cores）。
+        各组在主进程用指标列选行，所有组的入选行只构造一次结果（见 score_formula_batch）；
+        公式无法列式计算时该组回退为完整计算。
+        """
+        return self.score_formula_batch(params, scorings, metrics)
+
+    def score_formula_batch(self, params, scorings, metrics=None):
+        """
+        批量打分：一次指标计算、一次结果行构造，返回与 scorings 一一对应的选股结果。
+        各组公式在主进程用指标列分别选出每日前 select_count 名，子进程只为所有入选行的并集构造结果，
+        再按组拆分、写入该组的 score 后收尾；公式无法列式计算的组回退为单独完整计算。
+        scorings 的格式同 score_metric_columns。
+        """
+        metrics = self.calculate_metric_columns(params, metrics)
+        num_stocks = len(self.price_data)
+        results = [None] * len(scorings)
+        batch = []
+        scoring_params_list = [dict(params, only_show_selected=True, **scoring) for scoring in scorings]
+        columnar = [worker_threads_cy.formula_supports_columnar(scoring_params.get('formula_expr', '') or '',
+                                                                scoring_params.get('comparison_vars', []))
+                    for scoring_params in scoring_params_list]
+        metrics = self._fill_pending_metrics(
+            params, metrics, [scoring_params.get('formula_expr', '') or ''
+                              for scoring_params, ok in zip(scoring_params_list, columnar) if ok])
+        for i, scoring_params in enumerate(scoring_params_list):
+            formula_expr = scoring_params.get('formula_expr', '') or ''
+            comparison_vars = scoring_params.get('comparison_vars', [])
+            if metrics is None or not columnar[i]:
+                results[i] = self.calculate_batch_16_cores(scoring_params)
+                continue
+            # 按该组的核心数划分股票区间，复现逐进程选股（每个进程各取前 select_count 名）的结果
+            shard_bounds = [(start, end) for start, end in
+                            split_indices(num_stocks, max(1, int(scoring_params.get('max_cores', 1) or 1))) if end > start]
+            row_mask, scores = metrics.select_rows(
+                formula_expr, scoring_params.get('sort_mode', '最大值排序'),
+                scoring_params.get('select_count', 10), comparison_vars, shard_bounds, return_scores=True)
+            batch.append((i, scoring_params, row_mask, scores, shard_bounds))
+        return self._build_selected_results(batch, results)
+
+    def score_range_sweep(self, params, formula_expr, variable, bound_pairs, metrics=None):
+        """
+        区间条件扫描：对每组 (下限, 上限) 计算在 formula_expr 的 if 条件末尾加上
+        `variable >= 下限 and variable <= 上限` 后的选股结果，返回与 bound_pairs 一一对应的结果。
+        指标列上每个日期只按变量值排序一次，每组上下限用二分查找取出区间内的候选行；
+        公式形式不支持时退回为逐个公式的 score_formula_batch；
+        公式不能追加区间条件（不是单个 if 语句，或条件顶层是 or 等，见 range_condition_formula）时返回 None。
+        """
+        formulas = [worker_threads_cy.range_condition_formula(formula_expr, variable, lower, upper)
+                    for lower, upper in bound_pairs]
+        if None in formulas:
+            return None
+        metrics = self.calculate_metric_columns(params, metrics)
+        scoring_params = dict(params, only_show_selected=True)
+        comparison_vars = scoring_params.get('comparison_vars', [])
+        swept = None
+        if worker_threads_cy.formula_supports_columnar(formula_expr, comparison_vars):
+            # 区间条件都追加在公式条件之后，原公式前置条件不成立的行在各组公式下都必然落选
+            metrics = self._fill_pending_metrics(params, metrics, [formula_expr])
+            if metrics is not None:
+                shard_bounds = [(start, end) for start, end in
+                                split_indices(len(self.price_data), max(1, int(scoring_params.get('max_cores', 1) or 1))) if end > start]
+                swept = metrics.sweep_range(
+                    formula_expr, variable, bound_pairs, scoring_params.get('sort_mode', '最大值排序'),
+                    scoring_params.get('select_count', 10), comparison_vars, shard_bounds)
+        if swept is None:
+            return self.score_formula_batch(params, [{'formula_expr': formula} for formula in formulas], metrics)
+        batch = [(i, dict(scoring_params, formula_expr=formulas[i]), row_mask, scores, shard_bounds)
+                 for i, (row_mask, scores) in enumerate(swept)]
+        return self._build_selected_results(batch, [None] * len(bound_pairs))
+
+    def _fill_pending_metrics(self, params, metrics, formula_exprs):
+        """
+        用 metrics 为 formula_exprs 打分前，为前置条件成立的待补算行补算完整指标并写回 metrics（缓存中的同一条目）。
+        没有需要补算的行时原样返回，补算失败时返回 None
+        """
+        if metrics is None:
+            return None
+        row_mask = metrics.pending_rows(formula_exprs)
+        if row_mask is None:
+            return metrics
+        part = self.calculate_batch_16_cores(params, metrics_only=True, row_mask=row_mask.astype(np.uint8))
+        if part is None:
+            return None
+        metrics.fill_rows(row_mask, part)
+        self._log_to_file(f"补算{int(row_mask.sum())}行待补算的指标")
+        return metrics
+
+    def _extend_cached_metrics(self, params, metric_key, date_columns, end_date_start_idx, end_date_end_idx):
+        """
+        增量指标计算：缓存中有同一组指标参数在当前数据集或其旧版本（当前数据只是在前面追加了交易日）上的指标列时，
+        旧数据集中结束日之后还有至少 metric_forward_days 个交易日的结束日期（数据相同时为全部共同的结束日期）
+        中最长的连续一段直接沿用旧的列，只计算其余结束日期，拼接后存入缓存。没有可沿用的结束日期时返回 None。
+        """
+        lineage = process_pool_manager.dataset_lineage()
+        if lineage is None:
+            return None
+        base = metric_cache.find_extension_base(metric_key[1], lineage)
+        if base is None:
+            return None
+        old_pos = {date: j for j, (date, _) in enumerate(base.lineage[1])}
+        base_pos = {date: j for j, date in enumerate(base.end_dates)}
+        horizon = 0 if len(base.lineage[1]) == len(lineage[1]) else metric_forward_days(params)
+        end_dates = [date_columns[idx] for idx in range(end_date_start_idx, end_date_end_idx - 1, -1)]
+        reusable = [end_date in base_pos and old_pos[end_date] >= horizon for end_date in end_dates]
+        # 沿用其中最长的一段连续结束日期，前后两段分别重新计算
+        best_start, best_len, run_start = 0, 0, None
+        for pos, ok in enumerate(reusable + [False]):
+            if ok and run_start is None:
+                run_start = pos
+            elif not ok and run_start is not None:
+                if pos - run_start > best_len:
+                    best_start, best_len = run_start, pos - run_start
+                run_start = None
+        if best_len == 0:
+            return None
+        formula_parts, row_ok_parts, pending_parts = [], [], []
+        for lo, hi in ((0, best_start), (best_start, best_start + best_len), (best_start + best_len, len(end_dates))):
+            if lo == hi:
+                continue
+            if lo == best_start:
+                reused = [base_pos[end_date] for end_date in end_dates[lo:hi]]
+                formula_parts.append(base.formula_cols[:, :, reused])
+                row_ok_parts.append(base.row_ok[:, reused])
+                pending_parts.append(base.pending[:, reused])
+                continue
+            part = self.calculate_batch_16_cores(
+                dict(params, end_date_start=end_dates[lo], end_date_end=end_dates[hi - 1]), metrics_only=True)
+            if part is None:
+                return None
+            formula_parts.append(part.formula_cols)
+            row_ok_parts.append(part.row_ok)
+            pending_parts.append(part.pending)
+        formula_cols = np.concatenate(formula_parts, axis=2)
+        row_ok = np.concatenate(row_ok_parts, axis=1)
+        metrics = MetricColumns(metric_key, formula_cols, row_ok, end_dates, lineage, np.concatenate(pending_parts, axis=1))
+        metric_cache.put(metrics)
+        self._log_to_file(f"增量指标计算：沿用{best_len}个结束日期的指标列，重新计算{len(end_dates) - best_len}个")
+        return metrics
+
+    def _build_selected_results(self, batch, results):
+        """
+        为各组已选出的 (股票, 日期) 掩码构造结果：子进程只为所有入选行的并集构造一次结果表，
+        再按组拆分、写入该组的 score 后收尾，填入 results 对应位置。
+        batch 为 [(结果位置, 参数, 入选掩码, score 矩阵, 分片区间), ...]
+        """
+        if not batch:
+            return results
+        union_mask = np.logical_or.reduce([row_mask for _, _, row_mask, _, _ in batch]).astype(np.uint8)
+        tables = self.calculate_batch_16_cores(dict(batch[0][1], only_show_selected=False),
+                                               row_mask=union_mask, return_tables=True)
+        date_columns = list(self.price_data.columns[2:])
+        for i, scoring_params, row_mask, scores, shard_bounds in batch:
+            # 逐进程计算时每个分片先按 score 排序截断再合并，这里按 (分片, score, 股票) 复现同样的先后顺序
+            shard_starts = [start for start, _ in shard_bounds]
+            descending = scoring_params.get('sort_mode', '最大值排序') == "最大值排序"
+            merged_results = {}
+            for date_pos, (end_date, table) in enumerate(tables.items()):
+                stock_idx = np.asarray(table.values('stock_idx'), dtype=np.int64)
+                keep = np.flatnonzero(row_mask[stock_idx, date_pos])
+                keep_scores = scores[stock_idx[keep], date_pos]
+                shard = np.searchsorted(shard_starts, stock_idx[keep], side='right')
+                keep = keep[np.lexsort((stock_idx[keep], -keep_scores if descending else keep_scores, shard))]
+                sub = table.take(keep)
+                sub.set_values('score', scores[stock_idx[keep], date_pos].tolist())
+                # 只显示选股结果时这几列的空值按0输出（与 calculate_batch_cy 一致）
+                for field in ('n_days_max_value', 'prev_day_change', 'end_day_change'):
+                    sub.set_values(field, [worker_threads_cy.safe_formula_val(val) for val in sub.values(field)])
+                merged_results[end_date] = sub
+            results[i] = self._finalize_batch_results(merged_results, scoring_params, date_columns)
+        return results
+
+    def _validate_float32(self, params):
+        """
+        float32 校验模式：同一组参数分别按 float64 与 float32 计算，用 compare_batch_results 比较两次结果，
+        差异汇总写入 process_pool.log 并放在结果的 float32_validation 中，返回 float32 的结果。
+        """
+        base = dict(params, float32_validate=False)
+        result64 = self.calculate_batch_16_cores(dict(base, float32_mode=False))
+        result32 = self.calculate_batch_16_cores(dict(base, float32_mode=True))
+        report = compare_batch_results(result64, result32)
+        self._log_to_file(
+            f"float32校验：{report['dates']}个日期中入选股票不同的{report['selection_diff_dates']}个，"
+            f"共同入选{report['rows']}行中{report['field_diffs']}个字段值不同，"
+            f"统计项不同{report['overall_diffs']}个，最大绝对差{report['max_abs_diff']}（{report['max_abs_diff_field']}）")
+        if result32 is not None:
+            result32['float32_validation'] = report
+        return result32
+
+    def calculate_batch_16_cores(self, params, metrics=None, metrics_only=False, row_mask=None, return_tables=False):
+        """
+        按股票分片在进程池中计算并合并结果。
+        metrics 为第一阶段得到的 MetricColumns，与本次指标参数一致时直接用它打分；
+        metrics_only 为真时只做第一阶段，返回 MetricColumns；
+        row_mask 为 (股票, 日期) 掩码时只为掩码内的行构造结果（不再打分选股），
+        return_tables 为真时直接返回各日期合并后的结果表，不做收尾处理。
+        params['float32_mode'] 为真时价格/差值矩阵按 float32 存储计算；params['float32_validate'] 为真时见 _validate_float32。
+        """
+        if (params.get('float32_validate', False) and metrics is None and not metrics_only and
+                row_mask is None and not return_tables):
+            return self._validate_float32(params)
         columns = list(self.diff_data.columns)
         date_columns = list(self.price_data.columns[2:])
         width = params.get("width")
@@ -607,29 +1342,56 @@ class CalculateThread(QThread):
         end_date_start = params.get('end_date_start', "2025-04-30")
         end_date_end = params.get('end_date_end', "2025-04-30")
         print(f"end_date_start: {end_date_start}, end_date_end: {end_date_end}")
-        end_date_start_idx = date_columns.index(end_date_start)
-        end_date_end_idx = date_columns.index(end_date_end)
-        price_data_np = self.price_data.iloc[:, 2:].values.astype(np.float64)
-        diff_data_np = self.diff_data.values.astype(np.float64)
-
+        end_date_start_idx = self.date_calendar.index(end_date_start)
+        end_date_end_idx = self.date_calendar.index(end_date_end)
         # 倍增系数参数
         negative_multiplier = float(params.get('negative_multiplier', 1.0))
         positive_multiplier = float(params.get('positive_multiplier', 1.0))
-        
-        # 应用倍增系数到diff_data
-        if negative_multiplier != 1.0 or positive_multiplier != 1.0:
-            # 创建掩码：负数位置为True，正数位置为False
-            negative_mask = diff_data_np < 0
-            positive_mask = diff_data_np > 0
-            
-            # 对负数应用负值倍增系数
-            if negative_multiplier != 1.0:
-                diff_data_np[negative_mask] *= negative_multiplier
+
+        # float32 模式：价格/差值矩阵按 float32 存入共享内存，内核读出后仍按 double 计算和累加
+        data_dtype = np.dtype(np.float32 if params.get('float32_mode', False) else np.float64)
+
+        def build_shared_arrays():
+            price_data_np = self.price_data.iloc[:, 2:].values.astype(np.float64)
+            diff_data_np = self.diff_data.values.astype(np.float64)
             
-            # 对正数应用正值倍增系数
-            if positive_multiplier != 1.0:
-                diff_data_np[positive_mask] *= positive_multiplier
-        num_stocks = price_data_np.shape[0]
+            # 应用倍增系数到diff_data
+            if negative_multiplier != 1.0 or positive_multiplier != 1.0:
+                # 创建掩码：负数位置为True，正数位置为False
+                negative_mask = diff_data_np < 0
+                positive_mask = diff_data_np > 0
+                
+                # 对负数应用负值倍增系数
+                if negative_multiplier != 1.0:
+                    diff_data_np[negative_mask] *= negative_multiplier
+                
+                # 对正数应用正值倍增系数
+                if positive_multiplier != 1.0:
+                    diff_data_np[positive_mask] *= positive_multiplier
+            # 差值前缀和只在没有倍增系数时使用，按整数分累加，与逐段累加保留两位小数的结果相同；
+            # 乘以倍增系数后常出现半分的值，不能按整数分表示，仍逐段累加（差值不是两位小数时同样返回空数组）
+            if negative_multiplier == 1.0 and positive_multiplier == 1.0:
+                diff_pos_prefix, diff_neg_prefix = build_diff_prefix_sums(diff_data_np)
+            else:
+                diff_pos_prefix = diff_neg_prefix = np.zeros((0, 0), dtype=np.int64)
+            if data_dtype != np.float64:
+                price_data_np = price_data_np.astype(data_dtype)
+                diff_data_np = diff_data_np.astype(data_dtype)
+            return (price_data_np, diff_data_np, np.array(date_columns), diff_pos_prefix, diff_neg_prefix)
+
+        # 价格/差值矩阵、日期列和差值前缀和常驻共享内存，
+        # 数据、倍增系数和存储类型不变时直接复用，每个任务只传递描述信息
+        (price_data_desc, diff_data_desc, date_columns_desc,
+         diff_pos_prefix_desc, diff_neg_prefix_desc) = process_pool_manager.get_shared_dataset(
+            (self.price_data, self.diff_data), (negative_multiplier, positive_multiplier, data_dtype.name),
+            build_shared_arrays,
+            lambda: dataset_column_digests(self.price_data, self.diff_data))
+        # 创新高/创新低稀疏表单独常驻，只依赖价格数据：区间参数变化时不重新发布价格/差值数据，
+        # 已构建的层数足够时直接复用
+        range_max_desc, range_min_desc = process_pool_manager.get_shared_range_tables(
+            (self.price_data,), range_table_levels(params),
+            lambda levels: build_range_extreme_tables(self.price_data.iloc[:, 2:].values.astype(np.float64), levels))
+        num_stocks = len(self.price_data)
         trade_t1_mode = params.get('trade_mode', 'T+1') == 'T+1'
 
         stock_idx_arr = np.arange(num_stocks, dtype=np.int32)
@@ -655,10 +1417,10 @@ class CalculateThread(QThread):
         only_show_selected = params.get('only_show_selected', False)
         max_cores = params.get('max_cores', 1)  # 从参数中获取最大核心数
         
-        if only_show_selected:
-            n_proc = max_cores  # 使用UI中设置的核心数
-        else:
-            n_proc = 1
+        # 选股和明细（查看参数）都按股票区间分片，使用UI中设置的核心数
+        n_proc = max(1, int(max_cores or 1))
+        # 每个进程内部计算指标的OpenMP线程数（默认1，即只按进程并行）
+        kernel_threads = max(1, int(params.get('kernel_threads', 1) or 1))
 
         # 新增：创新高/创新低相关参数
         new_before_high_start = int(params.get('new_before_high_start', 0))
@@ -722,17 +1484,52 @@ class CalculateThread(QThread):
         valid_abs_sum_threshold = self.safe_float(params.get('valid_abs_sum_threshold', None))
         new_before_high_logic = params.get('new_before_high_logic', '与')
         comparison_vars = params.get('comparison_vars', [])
+
+        # 指标缓存：只显示选股结果且公式可走列式计算时，按数据内容指纹+指标参数缓存全部公式变量列。
+        # 命中时在主进程用缓存列重新打分选出入选行，子进程跳过第一遍指标计算，只为入选行构造结果；
+        # 未命中时子进程顺带返回指标列，合并后存入缓存
+        if params.get('metric_cache_mb') is not None:
+            metric_cache.max_bytes = int(float(params['metric_cache_mb']) * 1024 * 1024)
+        metric_key = None
+        n_end_dates = end_date_start_idx - end_date_end_idx + 1
+        if metrics_only and (n_end_dates <= 0 or num_stocks <= 0):
+            return None
+        if n_end_dates <= 0:
+            # 起始、截止结束日期颠倒时区间为空，不派发任务，直接返回空结果（与原实现一致）
+            if return_tables:
+                return {}
+            return self._finalize_batch_results({}, params, date_columns)
+        if row_mask is None and (metrics_only or (only_show_selected and n_end_dates > 0 and num_stocks > 0 and
+                                                  worker_threads_cy.formula_supports_columnar(formula_expr, comparison_vars))):
+            metric_key = (process_pool_manager.dataset_fingerprint(), metric_params_key(params), end_date_start, end_date_end)
+            if metrics is None or metrics.key != metric_key:
+                metrics = metric_cache.get(metric_key)
+            if metrics is None:
+                metrics = self._extend_cached_metrics(params, metric_key, date_columns, end_date_start_idx, end_date_end_idx)
+            if metrics is not None and not metrics_only:
+                metrics = self._fill_pending_metrics(params, metrics, [formula_expr])
+            if metrics is not None:
+                if metrics_only:
+                    return metrics
+                row_mask = metrics.select_rows(formula_expr, sort_mode, select_count, comparison_vars,
+                                               [(start, end) for start, end in stock_idx_ranges if end > start])
+                self._log_to_file("指标缓存命中，跳过指标计算，只重新打分")
+        # 未命中时第一遍就收集指标列：被公式前置条件跳过的行记为待补算，换公式打分时再按需补算。
+        # metrics_only 且传入 row_mask 时只为掩码内的行计算完整指标（补算），结果不放入缓存。
+        # full_compute 为真时第一遍不做预筛选，为全部行计算完整指标
+        full_compute = bool(params.get('full_compute', False))
+        collect_metrics = metrics_only or (metric_key is not None and row_mask is None)
         
         args_list = [
             (
-                price_data_np,
-                date_columns,
+                price_data_desc,
+                date_columns_desc,
                 width,
                 start_option,
                 shift_days,
                 end_date_start_idx,
                 end_date_end_idx,
-                diff_data_np,
+                diff_data_desc,
                 np.ascontiguousarray(stock_idx_arr[start:end], dtype=np.int32),
                 is_forward,
                 n_days,
@@ -797,6 +1594,15 @@ class CalculateThread(QThread):
                 start_with_new_after_low_flag,
                 start_with_new_after_low2_flag,
                 comparison_vars,  # 添加比较变量列表
+                kernel_threads,
+                range_max_desc,
+                range_min_desc,
+                diff_pos_prefix_desc,
+                diff_neg_prefix_desc,
+                collect_metrics,
+                row_mask[start:end] if row_mask is not None else None,
+                metrics_only,
+                full_compute,
             )
             for (start, end) in stock_idx_ranges if end > start
         ]
@@ -820,130 +1626,99 @@ class CalculateThread(QThread):
         for idx in range(end_date_start_idx, end_date_end_idx-1, -1):
             end_date = date_columns[idx]
             merged_results[end_date] = []
-        # 每次计算都创建新的进程池，避免进程被系统清理的问题
-        with concurrent.futures.ProcessPoolExecutor(max_workers=n_proc) as executor:
-            self._log_to_file(f"创建新的进程池，max_workers={n_proc}")
-            
-            # 为子进程设置高优先级，确保立即获得CPU时间片
-            try:
-                if hasattr(executor, '_processes'):
-                    for process in executor._processes:
-                        if process and process.is_alive():
-                            try:
-                                # 使用已导入的psutil设置进程优先级
-                                child_process = psutil.Process(process.pid)
-                                
-                                # 方法1: 使用psutil设置进程优先级 (Windows 11兼容)
-                                try:
-                                    if IS_WINDOWS_11:
-                                        # Windows 11中，使用ABOVE_NORMAL_PRIORITY_CLASS更稳定
-                                        child_process.nice(psutil.ABOVE_NORMAL_PRIORITY_CLASS)
-                                        self._log_to_file(f"子进程优先级已设置为ABOVE_NORMAL_PRIORITY_CLASS (Windows 11兼容) (PID: {process.pid})")
-                                    else:
-                                        # Windows 10及以下版本，可以使用HIGH_PRIORITY_CLASS
-                                        child_process.nice(psutil.HIGH_PRIORITY_CLASS)
-                                        self._log_to_file(f"子进程优先级已设置为HIGH_PRIORITY_CLASS (PID: {process.pid})")
-                                except Exception:
-                                    # 如果高优先级失败，回退到NORMAL_PRIORITY_CLASS
-                                    try:
-                                        child_process.nice(psutil.NORMAL_PRIORITY_CLASS)
-                                        self._log_to_file(f"子进程优先级已回退到NORMAL_PRIORITY_CLASS (PID: {process.pid})")
-                                    except Exception as e:
-                                        self._log_to_file(f"设置进程优先级失败: {e}", "WARNING")
-                                
-                                # 方法2: 如果Windows优化可用，尝试设置线程优先级
-                                if WINDOWS_OPTIMIZATION_AVAILABLE:
-                                    try:
-                                        # 获取进程的所有线程
-                                        threads = child_process.threads()
-                                        for thread in threads:
-                                            if thread.id:
-                                                # 使用Windows API设置线程优先级
-                                                thread_handle = ctypes.windll.kernel32.OpenThread(
-                                                    0x0020,  # THREAD_SET_INFORMATION
-                                                    False,   # bInheritHandle
-                                                    thread.id
-                                                )
-                                                if thread_handle:
-                                                    # 根据Windows版本选择最佳线程优先级
-                                                    if IS_WINDOWS_11:
-                                                        # Windows 11中，THREAD_PRIORITY_ABOVE_NORMAL更稳定
-                                                        ctypes.windll.kernel32.SetThreadPriority(
-                                                            thread_handle, 
-                                                            THREAD_PRIORITY_ABOVE_NORMAL
-                                                        )
-                                                    else:
-                                                        # Windows 10及以下版本，可以使用THREAD_PRIORITY_HIGHEST
-                                                        ctypes.windll.kernel32.SetThreadPriority(
-                                                            thread_handle, 
-                                                            THREAD_PRIORITY_HIGHEST
-                                                        )
-                                                    ctypes.windll.kernel32.CloseHandle(thread_handle)
-                                        self._log_to_file(f"子进程线程优先级已优化 (PID: {process.pid})")
-                                    except Exception as e:
-                                        self._log_to_file(f"设置线程优先级时出错: {e}", "WARNING")
-                                        
-                            except Exception as e:
-                                self._log_to_file(f"设置子进程优先级时出错: {e}", "WARNING")
-            except Exception as e:
-                self._log_to_file(f"访问进程池进程时出错: {e}", "WARNING")
-            
-            # 提交所有任务
-            futures = [executor.submit(cy_batch_worker, args) for args in args_list]
-            
-        for fut in concurrent.futures.as_completed(futures):
-            try:
-                process_results = fut.result()
-                for end_date, stocks in process_results.items():
-                    if end_date in merged_results:
-                        merged_results[end_date].extend(stocks)
-            except Exception as e:
-                import traceback
-                print(f"子进程异常: {e}")
-                print(f"异常详情: {traceback.format_exc()}")
-                # 子进程异常记录到error_log.txt，与进程池日志分开
+        # 使用常驻进程池（获取时会做健康检查）；计算中子进程意外退出时重建进程池并重试一次未完成的任务
+        # 各分片的结果按分片顺序（即stock_idx顺序）合并，与完成先后无关
+        executor = self._get_process_pool(n_proc)
+        shard_results = [None] * len(args_list)
+        pending = {executor.submit(cy_batch_worker, args): shard for shard, args in enumerate(args_list)}
+        retried = False
+        while pending:
+            broken_shards = []
+            for fut in concurrent.futures.as_completed(list(pending)):
+                shard = pending.pop(fut)
                 try:
-                    with open('error_log.txt', 'a', encoding='utf-8') as f:
-                        f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - 子进程异常: {e}\n")
-                        f.write(f"异常详情: {traceback.format_exc()}\n")
-                        f.write("-" * 50 + "\n")
-                except:
-                    pass
+                    shard_results[shard] = fut.result()
+                except concurrent.futures.process.BrokenProcessPool as e:
+                    broken_shards.append(shard)
+                    broken_error = e
+                except Exception as e:
+                    import traceback
+                    print(f"子进程异常: {e}")
+                    print(f"异常详情: {traceback.format_exc()}")
+                    # 子进程异常记录到error_log.txt，与进程池日志分开
+                    try:
+                        with open('error_log.txt', 'a', encoding='utf-8') as f:
+                            f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - 子进程异常: {e}\n")
+                            f.write(f"异常详情: {traceback.format_exc()}\n")
+                            f.write("-" * 50 + "\n")
+                    except:
+                        pass
+            if broken_shards:
+                if retried:
+                    self._log_to_file(f"进程池重建后仍然损坏，放弃{len(broken_shards)}个任务: {broken_error}", "ERROR")
+                    break
+                retried = True
+                executor = process_pool_manager.respawn(broken_error)
+                pending = {executor.submit(cy_batch_worker, args_list[shard]): shard for shard in broken_shards}
+        if collect_metrics:
+            # 各分片按股票顺序拼接指标列；有分片失败时不缓存
+            metrics = None
+            if all(result is not None for result in shard_results):
+                metrics = MetricColumns(metric_key,
+                                        np.concatenate([result[1] for result in shard_results], axis=1),
+                                        np.concatenate([result[2] for result in shard_results], axis=0),
+                                        [date_columns[idx] for idx in range(end_date_start_idx, end_date_end_idx - 1, -1)],
+                                        process_pool_manager.dataset_lineage(),
+                                        np.concatenate([result[3] for result in shard_results], axis=0))
+                if row_mask is None:
+                    metric_cache.put(metrics)
+            if metrics_only:
+                print(f"calculate_batch_{n_proc}_cores 指标计算耗时: {time.time() - t0:.4f}秒")
+                return metrics
+            shard_results = [result[0] if result is not None else None for result in shard_results]
+        for process_results in shard_results:
+            if not process_results:
+                continue
+            for end_date, table in process_results.items():
+                if end_date in merged_results:
+                    merged_results[end_date].append(table)
+        for end_date in merged_results:
+            merged_results[end_date] = worker_threads_cy.ResultTable.concat(merged_results[end_date])
         t1 = time.time()
         total_time = t1 - t0
         print(f"calculate_batch_{n_proc}_cores 总耗时: {total_time:.4f}秒")
         self._log_to_file(f"计算完成，总耗时: {total_time:.4f}秒")
-        # 统一处理股票代码和名称
+        if return_tables:
+            return merged_results
+        return self._finalize_batch_results(merged_results, params, date_columns)
+
+
+    def _finalize_batch_results(self, merged_results, params, date_columns):
+        """
+        合并后的各日期结果表统一收尾：写入股票代码/名称、四舍五入、只显示选股结果时排序截断，
+        并添加每个日期的统计行和总体统计值，返回与 calculate_batch_16_cores 相同格式的结果
+        """
+        shift_days = params.get("shift_days")
+        select_count = int(params.get('select_count', 10))
+        sort_mode = params.get('sort_mode', '最大值排序')
+        only_show_selected = params.get('only_show_selected', False)
+        # 统一处理股票代码和名称（按 stock_idx 从预先生成的代码/名称数组中取值，按列写入结果表）
+        stock_codes, stock_names = stock_code_name_arrays(self.price_data)
         for end_date in merged_results:
-            for stock in merged_results[end_date]:
-                stock_idx = stock.get('stock_idx', None)
-                if stock_idx is not None:
-                    # 获取股票代码和名称
-                    code = self.price_data.iloc[stock_idx, 0]
-                    name = self.price_data.iloc[stock_idx, 1]
-                    
-                    # 格式化股票代码为6位数字格式
-                    if code is not None and code != '':
-                        try:
-                            code_str = str(code).strip()
-                            if code_str.isdigit() and len(code_str) < 6:
-                                code = code_str.zfill(6)
-                        except Exception:
-                            pass
-                    
-                    stock['code'] = code
-                    stock['name'] = name if name is not None else ''
-                
-                # 统一的数值四舍五入处理
-                self._round_numeric_values(stock)
+            table = merged_results[end_date]
+            stock_idx = np.asarray(table.columns['stock_idx'], dtype=np.intp)
+            table.set_values('code', stock_codes[stock_idx].tolist())
+            table.set_values('name', stock_names[stock_idx].tolist())
+            
+            # 统一的数值四舍五入处理
+            self._round_numeric_values(table)
         
         if only_show_selected:
             for end_date in merged_results:
-                merged_results[end_date] = sorted(
-                    merged_results[end_date],
-                    key=lambda x: x['score'],
-                    reverse=(sort_mode == "最大值排序")
-                )[:select_count]
+                table = merged_results[end_date]
+                scores = table.values('score')
+                order = sorted(range(len(table)), key=lambda k: scores[k], reverse=(sort_mode == "最大值排序"))
+                merged_results[end_date] = table.take(order[:select_count])
         
         # 定义数值字段和非数值字段
         numeric_fields = [
@@ -1016,117 +1791,48 @@ class CalculateThread(QThread):
             'has_three_consecutive_zeros'  # 布尔对象
         }
         
-        # 初始化总体统计收集器
-        overall_values = {field: [] for field in numeric_fields if field not in non_numeric_fields}
+        stat_fields = [field for field in dict.fromkeys(numeric_fields) if field not in non_numeric_fields]
+        # 初始化总体统计收集器（每个字段收集各日期的有效值数组）
+        overall_values = {field: [] for field in stat_fields}
         
         # 添加统计行：最大值、最小值、中值
         for end_date in merged_results:
-            stocks = merged_results[end_date]
-            if not stocks:
+            table = merged_results[end_date]
+            # 行字典只在界面访问时才按需创建
+            merged_results[end_date] = ResultRows(table)
+            if not len(table):
                 continue
-                
-            # 收集所有数值字段用于统计
-            stats = {}
-            for field in numeric_fields:
-                # 跳过非数值类型字段
-                if field in non_numeric_fields:
-                    continue
-                    
-                values = []
-                for stock in stocks:
-                    val = stock.get(field)
-                    if val is not None and val != '' and not (isinstance(val, float) and math.isnan(val)):
-                        try:
-                            float_val = float(val)
-                            values.append(float_val)
-                            # 同时收集总体统计值
-                            overall_values[field].append(float_val)
-                        except (ValueError, TypeError):
-                            continue
-                
-                if values:
-                    stats[f'{field}_max'] = max(values)
-                    stats[f'{field}_min'] = min(values)
-                    # 计算中值：如果是奇数个，取中间值；如果是偶数个，取中间两个值的平均值
-                    sorted_values = sorted(values)
-                    n = len(sorted_values)
-                    if n % 2 == 1:  # 奇数个
-                        stats[f'{field}_median'] = round(sorted_values[n // 2], 2)
-                    else:  # 偶数个
-                        stats[f'{field}_median'] = round((sorted_values[n // 2 - 1] + sorted_values[n // 2]) / 2, 2)
-                else:
-                    stats[f'{field}_max'] = None
-                    stats[f'{field}_min'] = None
-                    stats[f'{field}_median'] = None
             
-            # 创建统计行
+            # 创建统计行，非数值类型字段在统计行中留空
             max_row = {'code': '', 'name': '统计最大值', 'stock_idx': -3}
             min_row = {'code': '', 'name': '统计最小值', 'stock_idx': -2}
             median_row = {'code': '', 'name': '统计中值', 'stock_idx': -1}
-            
-            # 填充统计值
             for field in numeric_fields:
-                if field in non_numeric_fields:
-                    # 非数值类型字段在统计行中留空
-                    max_row[field] = ''
-                    min_row[field] = ''
-                    median_row[field] = ''
-                else:
-                    max_row[field] = stats.get(f'{field}_max')
-                    min_row[field] = stats.get(f'{field}_min')
-                    median_row[field] = stats.get(f'{field}_median')
+                max_row[field] = min_row[field] = median_row[field] = '' if field in non_numeric_fields else None
+            
+            # 按列取出有效数值计算统计值
+            for field in stat_fields:
+                values = stat_column_values(table, field)
+                overall_values[field].append(values)
+                if len(values):
+                    max_row[field] = float(values.max())
+                    min_row[field] = float(values.min())
+                    median_row[field] = median_value(values)
             
             # 将统计行添加到结果中
             merged_results[end_date].extend([max_row, min_row, median_row])
         
         # 计算总体统计值
         overall_stats = {}
-        for field, values in overall_values.items():
-            if values:
-                overall_stats[f'{field}_max'] = round(max(values), 2)
-                overall_stats[f'{field}_min'] = round(min(values), 2)
-                # 计算中值：如果是奇数个，取中间值；如果是偶数个，取中间两个值的平均值
-                sorted_values = sorted(values)
-                n = len(sorted_values)
-                if n % 2 == 1:  # 奇数个
-                    overall_stats[f'{field}_median'] = round(sorted_values[n // 2], 2)
-                else:  # 偶数个
-                    overall_stats[f'{field}_median'] = round((sorted_values[n // 2 - 1] + sorted_values[n // 2]) / 2, 2)
-                # 计算正值中值
-                positive_values = [v for v in sorted_values if v > 0]
-                n_pos = len(positive_values)
-                if n_pos > 0:
-                    if n_pos % 2 == 1:
-                        overall_stats[f'{field}_positive_median'] = round(positive_values[n_pos // 2], 2)
-                    else:
-                        overall_stats[f'{field}_positive_median'] = round((positive_values[n_pos // 2 - 1] + positive_values[n_pos // 2]) / 2, 2)
-                else:
-                    overall_stats[f'{field}_positive_median'] = None
-                # 计算负值中值
-                negative_values = [v for v in sorted_values if v < 0]
-                n_neg = len(negative_values)
-                if n_neg > 0:
-                    if n_neg % 2 == 1:
-                        overall_stats[f'{field}_negative_median'] = round(negative_values[n_neg // 2], 2)
-                    else:
-                        overall_stats[f'{field}_negative_median'] = round((negative_values[n_neg // 2 - 1] + negative_values[n_neg // 2]) / 2, 2)
-                else:
-                    overall_stats[f'{field}_negative_median'] = None
-                
-                # 专门打印 diff_end_value 的统计信息
-                # if field == 'diff_end_value':
-                #     print(f"[worker_threads] diff_end_value 统计数组长度: {len(values)}")
-                #     print(f"[worker_threads] diff_end_value 统计数组前10个值: {values[:10]}")
-                #     print(f"[worker_threads] diff_end_value 统计数组后10个值: {values[-10:]}")
-                #     print(f"[worker_threads] diff_end_value 最终统计值:")
-                #     print(f"  最大值: {overall_stats[f'{field}_max']}")
-                #     print(f"  最小值: {overall_stats[f'{field}_min']}")
-                #     print(f"  中值: {overall_stats[f'{field}_median']}")
-                #     print(f"  正值中值: {overall_stats[f'{field}_positive_median']}")
-                #     print(f"  负值中值: {overall_stats[f'{field}_negative_median']}")
-                #     print(f"  正值数量: {len(positive_values)}")
-                #     print(f"  负值数量: {len(negative_values)}")
-                #     print(f"  零值数量: {len([v for v in values if v == 0])}")
+        for field in stat_fields:
+            values = np.concatenate(overall_values[field]) if overall_values[field] else np.zeros(0)
+            if len(values):
+                overall_stats[f'{field}_max'] = round(float(values.max()), 2)
+                overall_stats[f'{field}_min'] = round(float(values.min()), 2)
+                overall_stats[f'{field}_median'] = median_value(values)
+                # 正值中值、负值中值
+                overall_stats[f'{field}_positive_median'] = median_value(values[values > 0])
+                overall_stats[f'{field}_negative_median'] = median_value(values[values < 0])
             else:
                 overall_stats[f'{field}_max'] = None
                 overall_stats[f'{field}_min'] = None
@@ -1147,7 +1853,6 @@ class CalculateThread(QThread):
         }
         return result
 
-
 class SelectStockThread(QThread):
     finished = pyqtSignal(list)
     def __init__(self, all_results, formula_expr, select_count, sort_mode):
@@ -1163,34 +1868,74 @@ class SelectStockThread(QThread):
         expr = self.formula_expr
         for abbr, full in abbr_map.items():
             expr = re.sub(r'\b' + abbr + r'\b', full, expr)
-        results = []
-        for row in self.all_results:
-            local_vars = dict(row)
-            print_flag = False
-            if print_flag:
-                print(f"[SelectStockThread] local_vars: {local_vars}")
-            # 只对极少数元组参数自动取数值
-            for k in ['max_value', 'min_value', 'end_value', 'start_value', 'actual_value', 'closest_value']:
-                v = local_vars.get(k)
-                if isinstance(v, (list, tuple)) and len(v) == 2 and isinstance(v[1], (int, float)):
-                    local_vars[k] = v[1]
-            if print_flag:
-                print(f"[SelectStockThread] eval expr: {expr}")
-            try:
-                exec(expr, {}, local_vars)
-                score = round(local_vars.get('result', 0), 2)
-            except Exception as e:
-                if print_flag:
-                    print(f"[SelectStockThread] eval error: {e}")
-                score = float('-inf') if self.sort_mode == '最大值排序' else float('inf')
-            if score is not None and score != float('inf') and score != float('-inf') and score != 0:
-                results.append({'code': row.get('code', ''), 'name': row.get('name', ''), 'hold_days': row.get('hold_days', ''), 'ops_change': row.get('ops_change', ''), 'ops_incre_rate': row.get('ops_incre_rate', ''), 'score': score})
-            print_flag = True
+        n = len(self.all_results)
+        scores = np.full(n, np.nan)
+        valid = np.zeros(n, dtype=bool)
+        # 先把公式用到的变量整理成列，整批向量化求值；含非数值变量的行再逐行exec
+        exec_rows = range(n)
+        names = worker_threads_cy.formula_names(expr)
+        if names is not None and n > 0:
+            columns = {name: np.full(n, np.nan) for name in names}
+            numeric = np.ones(n, dtype=bool)
+            for i, row in enumerate(self.all_results):
+                for name in names:
+                    v = self._numeric_value(row, name)
+                    if v is None:
+                        numeric[i] = False
+                        break
+                    columns[name][i] = v
+            evaluated = worker_threads_cy.evaluate_formula_columns(expr, columns, n)
+            if evaluated is not None:
+                result, has_result = evaluated
+                ok = np.flatnonzero(numeric & has_result)
+                # 与逐行路径一致使用Python的round保留两位小数
+                scores[ok] = [round(x, 2) for x in result[ok].tolist()]
+                valid[ok] = True
+                exec_rows = np.flatnonzero(~numeric)
+        for i in exec_rows:
+            score = self._exec_score(expr, self.all_results[i])
+            if score is not None:
+                scores[i] = score
+                valid[i] = True
+        with np.errstate(invalid='ignore'):
+            keep = valid & (scores != 0) & ~np.isinf(scores)
         reverse = self.sort_mode == '最大值排序'
-        results.sort(key=lambda x: x['score'], reverse=reverse)
-        selected = results[:self.select_count]
+        top = worker_threads_cy.select_top_indices(
+            scores, np.flatnonzero(keep & ~np.isnan(scores)), self.select_count, reverse)
+        if len(top) < self.select_count:
+            # score 为 NaN 的行排在最后
+            top = np.concatenate([top, np.flatnonzero(keep & np.isnan(scores))[:self.select_count - len(top)]])
+        selected = []
+        for i in top:
+            row = self.all_results[i]
+            selected.append({'code': row.get('code', ''), 'name': row.get('name', ''), 'hold_days': row.get('hold_days', ''), 'ops_change': row.get('ops_change', ''), 'ops_incre_rate': row.get('ops_incre_rate', ''), 'score': float(scores[i])})
         print(f"[SelectStockThread] selected: {selected}")
         self.finished.emit(selected)
+
+    @staticmethod
+    def _numeric_value(row, name):
+        """取行中变量的数值，非数值（None、日期、列表等）返回None"""
+        v = row.get(name)
+        # 只对极少数元组参数自动取数值
+        if name in ('max_value', 'min_value', 'end_value', 'start_value', 'actual_value', 'closest_value'):
+            if isinstance(v, (list, tuple)) and len(v) == 2 and isinstance(v[1], (int, float)):
+                v = v[1]
+        if isinstance(v, (int, float, np.integer, np.floating)):
+            return float(v)
+        return None
+
+    def _exec_score(self, expr, row):
+        """逐行exec计算score，出错或未赋值时返回None"""
+        local_vars = dict(row)
+        for k in ['max_value', 'min_value', 'end_value', 'start_value', 'actual_value', 'closest_value']:
+            v = local_vars.get(k)
+            if isinstance(v, (list, tuple)) and len(v) == 2 and isinstance(v[1], (int, float)):
+                local_vars[k] = v[1]
+        try:
+            exec(expr, {}, local_vars)
+            return round(local_vars.get('result', 0), 2)
+        except Exception:
+            return None
         
 def convert_expr_to_return_var_name(expr):
     """把返回变量的表达式转换成返回变量名的表达式
@@ -1242,6 +1987,233 @@ def make_user_func(expr):
         return local_vars.get('result', None)  # 直接返回表达式的结果，不做值判断
     return user_func
 
+# 创新高/创新低条件名称（参数 start_with_new_{name}_flag / new_{name}_range）
+NEW_HIGH_LOW_CONDITIONS = (
+    'before_high', 'before_high2', 'after_high', 'after_high2',
+    'before_low', 'before_low2', 'after_low', 'after_low2',
+)
+
+def range_table_levels(params):
+    """已启用的创新高/创新低条件中最大区间长度所需的稀疏表层数，没有启用的条件时为0"""
+    max_range = max((int(params.get(f'new_{name}_range', 0) or 0) for name in NEW_HIGH_LOW_CONDITIONS
+                     if params.get(f'start_with_new_{name}_flag', False)), default=0)
+    return max(max_range, 0).bit_length()
+
+def build_range_extreme_tables(price_data_np, levels):
+    """
+    构建创新高/创新低判断用的区间极值稀疏表，返回 (最大值下标表, 最小值下标表)，形状均为 (levels, 股票数, 日期数)。
+    第 j 层 [.., s, i] 为 price[s, i:i+2^j] 中非NaN、非0价格的最大/最小值所在日期下标，没有有效值为-1。
+    任意长度不超过 2^levels-1 的区间用两块重叠的 2^j 区间即可得到极值。
+    """
+    num_stocks, num_dates = price_data_np.shape
+    max_idx = np.full((levels, num_stocks, num_dates), -1, dtype=np.int32)
+    min_idx = np.full((levels, num_stocks, num_dates), -1, dtype=np.int32)
+    if levels == 0:
+        return max_idx, min_idx
+    valid = ~np.isnan(price_data_np) & (price_data_np != 0)
+    max_idx[0] = np.where(valid, np.arange(num_dates, dtype=np.int32), -1)
+    min_idx[0] = max_idx[0]
+    # 与下标表同步维护区间极值（无有效值时为 -inf/inf），逐层合并时不必再按下标取价格
+    for table, better, empty in ((max_idx, np.greater, -np.inf), (min_idx, np.less, np.inf)):
+        values = np.where(valid, price_data_np, empty)
+        for j in range(1, levels):
+            half = 1 << (j - 1)
+            a = table[j - 1][:, :num_dates - half]
+            b = table[j - 1][:, half:]
+            va = values[:, :num_dates - half]
+            vb = values[:, half:]
+            take_b = better(vb, va) | ((a < 0) & (b >= 0))
+            table[j][:, :num_dates - half] = np.where(take_b, b, a)
+            # 超出数据末尾的区间只覆盖到最后一天，查询时不会用到
+            table[j][:, num_dates - half:] = table[j - 1][:, num_dates - half:]
+            values[:, :num_dates - half] = np.where(take_b, vb, va)
+    return max_idx, min_idx
+
+def round_array(values, ndigits=2):
+    """
+    数组四舍五入，结果与逐个调用内置 round(x, ndigits) 相同。
+    np.round 是先放大再取整，恰好接近 .5 的值可能与 round 不一致，这些值（以及很大的值）单独用 round 计算
+    """
+    rounded = np.round(values, ndigits)
+    scaled = values * 10.0 ** ndigits
+    with np.errstate(invalid='ignore'):
+        suspect = (np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6) | (np.abs(scaled) >= 2.0 ** 30)
+    for i in np.flatnonzero(suspect).tolist():
+        rounded[i] = round(float(values[i]), ndigits)
+    return rounded
+
+
+def stat_column_values(table, field):
+    """
+    取出结果表一列中参与统计的有效数值（float64数组），跳过None、空字符串和NaN。
+    数值列直接用列数组和None掩码过滤，其他列逐个转换为float
+    """
+    if field not in table:
+        return np.zeros(0)
+    column = table.columns[field]
+    if isinstance(column, np.ndarray):
+        values = column.astype(np.float64)
+        mask = table.masks[field]
+        if mask is not None:
+            values = values[~mask]
+        return values[~np.isnan(values)]
+    values = []
+    for val in table.values(field):
+        if val is not None and val != '':
+            try:
+                values.append(float(val))
+            except (ValueError, TypeError):
+                continue
+    values = np.array(values, dtype=np.float64)
+    return values[~np.isnan(values)]
+
+
+def median_value(values):
+    """
+    中值（保留两位小数）：奇数个取中间值，偶数个取中间两个值的平均值；
+    用 np.partition 只做部分排序，空数组返回None
+    """
+    n = len(values)
+    if n == 0:
+        return None
+    half = n // 2
+    if n % 2 == 1:
+        return round(float(np.partition(values, half)[half]), 2)
+    part = np.partition(values, (half - 1, half))
+    return round((float(part[half - 1]) + float(part[half])) / 2, 2)
+
+
+def _value_abs_diff(a, b):
+    """两个结果值的绝对差：相同（含同为NaN/None）为0，一方缺失或类型不同为 inf，序列取逐项最大差"""
+    if a is b:
+        return 0.0
+    if isinstance(a, (list, tuple, np.ndarray)) or isinstance(b, (list, tuple, np.ndarray)):
+        try:
+            x, y = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+        except (TypeError, ValueError):
+            return 0.0 if list(a) == list(b) else math.inf
+        if x.shape != y.shape:
+            return math.inf
+        diff = np.abs(x - y)
+        diff[np.isnan(x) & np.isnan(y)] = 0.0
+        return float(np.nan_to_num(diff, nan=math.inf).max()) if diff.size else 0.0
+    if isinstance(a, (int, float, np.number)) and isinstance(b, (int, float, np.number)) and \
+            not isinstance(a, bool) and not isinstance(b, bool):
+        if math.isnan(a) and math.isnan(b):
+            return 0.0
+        diff = abs(float(a) - float(b))
+        return math.inf if math.isnan(diff) else diff
+    return 0.0 if a == b else math.inf
+
+
+def compare_batch_results(reference, candidate):
+    """
+    比较两次 calculate_batch_16_cores 的结果（如 float64 与 float32 模式）：逐日期比较入选股票（按 stock_idx），
+    共同入选的行逐字段比较，overall_stats 逐项比较。返回差异汇总：
+    dates 日期数，selection_diff_dates 入选股票不同的日期数，rows 共同入选行数，field_diffs 不同的字段值个数，
+    overall_diffs 不同的统计项个数，max_abs_diff / max_abs_diff_field 最大绝对差及其字段。
+    """
+    report = {'dates': 0, 'selection_diff_dates': 0, 'rows': 0, 'field_diffs': 0, 'overall_diffs': 0,
+              'max_abs_diff': 0.0, 'max_abs_diff_field': None}
+
+    def record(field, diff):
+        if diff > report['max_abs_diff']:
+            report['max_abs_diff'] = diff
+            report['max_abs_diff_field'] = field
+
+    ref_dates = (reference or {}).get('dates', {})
+    cand_dates = (candidate or {}).get('dates', {})
+    for end_date in sorted(set(ref_dates) | set(cand_dates)):
+        report['dates'] += 1
+        ref_rows = {row['stock_idx']: row for row in ref_dates.get(end_date, [])}
+        cand_rows = {row['stock_idx']: row for row in cand_dates.get(end_date, [])}
+        if set(ref_rows) != set(cand_rows):
+            report['selection_diff_dates'] += 1
+        for stock_idx in set(ref_rows) & set(cand_rows):
+            report['rows'] += 1
+            ref_row, cand_row = ref_rows[stock_idx], cand_rows[stock_idx]
+            for field in set(ref_row) | set(cand_row):
+                diff = _value_abs_diff(ref_row.get(field), cand_row.get(field))
+                if diff > 0:
+                    report['field_diffs'] += 1
+                    record(field, diff)
+    ref_stats = (reference or {}).get('overall_stats') or {}
+    cand_stats = (candidate or {}).get('overall_stats') or {}
+    for field in set(ref_stats) | set(cand_stats):
+        diff = _value_abs_diff(ref_stats.get(field), cand_stats.get(field))
+        if diff > 0:
+            report['overall_diffs'] += 1
+            record(field, diff)
+    return report
+
+def build_diff_prefix_sums(diff_data_np):
+    """
+    diff_data 每只股票按日期的正值前缀和与负值前缀和（NaN 记为0），以整数分（int64）累加，形状均为 (股票数, 日期数+1)，
+    区间 [lo, hi) 的正/负加和为 (prefix[:, hi] - prefix[:, lo]) / 100；普通和与绝对值和分别为两者之和与之差。
+    整数相减没有舍入误差，结果与逐段累加后保留两位小数相同。差值不全是两位小数（如乘了倍增系数）时
+    不能按分表示，返回两个空数组，内核改为逐段累加。
+    """
+    values = np.nan_to_num(np.asarray(diff_data_np, dtype=np.float64), nan=0.0)[:, ::-1] * 100
+    cents = np.rint(values)
+    if not np.all(np.abs(values - cents) <= 1e-6 * np.maximum(np.abs(values), 1.0)):
+        return np.zeros((0, 0), dtype=np.int64), np.zeros((0, 0), dtype=np.int64)
+    cents = cents.astype(np.int64)
+    pos_prefix = np.zeros((values.shape[0], values.shape[1] + 1), dtype=np.int64)
+    neg_prefix = np.zeros_like(pos_prefix)
+    # 从最早的日期（最后一列）开始累加并取负，prefix[:, i] = -sum(diff[:, i:])：
+    # 前面追加新交易日后旧日期上的值不变，增量沿用的指标列可直接与新计算的列拼接
+    np.cumsum(np.where(cents > 0, cents, 0), axis=1, out=pos_prefix[:, -2::-1])
+    np.cumsum(np.where(cents < 0, cents, 0), axis=1, out=neg_prefix[:, -2::-1])
+    np.negative(pos_prefix, out=pos_prefix)
+    np.negative(neg_prefix, out=neg_prefix)
+    return pos_prefix, neg_prefix
+
+# 子进程中已挂载的共享内存：{名称: (SharedMemory, ndarray)}
+_attached_shared_arrays = {}
+
+def publish_shared_array(arr, shared_blocks):
+    """
+    把数组复制到新建的共享内存块，返回子进程挂载用的描述信息 (名称, 形状, dtype)。
+    新建的共享内存块追加到shared_blocks，由创建方调用release_shared_arrays释放。
+    """
+    from multiprocessing import shared_memory
+    arr = np.ascontiguousarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    shared_blocks.append(shm)
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    return (shm.name, arr.shape, arr.dtype.str)
+
+def release_shared_arrays(shared_blocks):
+    """关闭并删除主进程创建的共享内存块"""
+    for shm in shared_blocks:
+        try:
+            shm.close()
+            shm.unlink()
+        except Exception as e:
+            print(f"释放共享内存失败: {e}")
+    shared_blocks.clear()
+
+def attach_shared_array(desc):
+    """子进程按描述信息挂载共享内存数组（零拷贝），同一块共享内存只挂载一次"""
+    name, shape, dtype = desc
+    cached = _attached_shared_arrays.get(name)
+    if cached is None:
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(name=name)
+        cached = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+        _attached_shared_arrays[name] = cached
+    return cached[1]
+
+def detach_shared_arrays(keep_names=()):
+    """关闭子进程中不再使用的共享内存挂载"""
+    for name in [n for n in _attached_shared_arrays if n not in keep_names]:
+        shm, arr = _attached_shared_arrays.pop(name)
+        del arr
+        try:
+            shm.close()
+        except Exception:
+            pass
+
 def cy_batch_worker(args):
     import worker_threads_cy
     (
@@ -1317,7 +2289,34 @@ def cy_batch_worker(args):
         start_with_new_after_low_flag,
         start_with_new_after_low2_flag,
         comparison_vars,  # 添加比较变量列表
+        kernel_threads,
+        range_max_idx,
+        range_min_idx,
+        diff_pos_prefix,
+        diff_neg_prefix,
+        collect_metrics,
+        row_mask,
+        metrics_only,
+        full_compute,
     ) = args
+    # 共享内存描述信息换成挂载的数组，释放上一次计算遗留的挂载
+    shared_descs = [desc for desc in (price_data_np, diff_data_np, date_columns, range_max_idx, range_min_idx,
+                                      diff_pos_prefix, diff_neg_prefix) if isinstance(desc, tuple)]
+    detach_shared_arrays({desc[0] for desc in shared_descs})
+    if isinstance(price_data_np, tuple):
+        price_data_np = attach_shared_array(price_data_np)
+    if isinstance(diff_data_np, tuple):
+        diff_data_np = attach_shared_array(diff_data_np)
+    if isinstance(date_columns, tuple):
+        date_columns = attach_shared_array(date_columns).tolist()
+    if isinstance(range_max_idx, tuple):
+        range_max_idx = attach_shared_array(range_max_idx)
+    if isinstance(range_min_idx, tuple):
+        range_min_idx = attach_shared_array(range_min_idx)
+    if isinstance(diff_pos_prefix, tuple):
+        diff_pos_prefix = attach_shared_array(diff_pos_prefix)
+    if isinstance(diff_neg_prefix, tuple):
+        diff_neg_prefix = attach_shared_array(diff_neg_prefix)
     stock_idx_arr = np.ascontiguousarray(stock_idx_arr, dtype=np.int32)
     date_grouped_results = worker_threads_cy.calculate_batch_cy(
         price_data_np, 
@@ -1392,6 +2391,15 @@ def cy_batch_worker(args):
         start_with_new_after_low_flag,
         start_with_new_after_low2_flag,
         comparison_vars,  # 添加比较变量列表
+        kernel_threads,
+        range_max_idx,
+        range_min_idx,
+        diff_pos_prefix,
+        diff_neg_prefix,
+        collect_metrics,
+        row_mask,
+        metrics_only,
+        full_compute,
     )
     return date_grouped_results
 
@@ -3,15 +3,21 @@
 # distutils: extra_compile_args = /openmp
 # distutils: extra_link_args = /openmp
 
+import math
 import numpy as np
 cimport numpy as np
-from libc.math cimport isnan, fabs, round, ceil
+from libc.math cimport isnan, fabs, round, ceil, trunc
 from libcpp.vector cimport vector
+from cython.parallel cimport prange, parallel, threadid
 from libc.stdio cimport printf
 from libc.errno cimport errno
 from libc.string cimport strerror
 
 ctypedef np.float64_t DTYPE_t
+# 读出后提升为 double 参与计算，累加与全部中间结果仍为 double（差值前缀和按原始 float64 数据以整数分累加）
+ctypedef fused data_t:
+    float
+    double
 from libc.math cimport NAN
 
 # 保留 round_to_2_nan 函数定义，用于记录哪些参数需要特殊处理
@@ -22,7 +28,7 @@ cdef inline double round_to_2_nan(double x) nogil:
     return result
 
 cdef bint calc_continuous_sum(
-    double[:] diff_slice,
+    data_t[:] diff_slice,
     vector[double]& cont_sum
 ) nogil:
     cdef int n = diff_slice.shape[0]
@@ -163,15 +169,3813 @@ cdef void calc_pos_neg_sum_halves(
         for i in range(neg_values.size() - half, neg_values.size()):
             neg_sum_second_half[0] += neg_values[i]
 
+cdef inline void prefix_pos_neg_sum(
+    np.int64_t[:, :] pos_prefix,
+    np.int64_t[:, :] neg_prefix,
+    int stock_idx,
+    int lo,
+    int hi,
+    double* pos_sum,
+    double* neg_sum
+) noexcept nogil:
+    """
+    diff_data[stock_idx, lo:hi] 中正值之和与负值之和（NaN 不计），由加载时构建的整数分前缀和相减后换算为元。
+    连续累加值每一段内非0值同号，所以按日期区间求和与按段求正/负加和结果相同；
+    整数相减没有舍入误差，结果即逐段累加后保留两位小数的值。
+    """
+    pos_sum[0] = (pos_prefix[stock_idx, hi] - pos_prefix[stock_idx, lo]) / 100.0
+    neg_sum[0] = (neg_prefix[stock_idx, hi] - neg_prefix[stock_idx, lo]) / 100.0
+
+# ===================== 选股公式编译执行 =====================
+# 选股公式只在每次计算开始时解析一次，编译成栈式指令后在 nogil 循环内直接求值，
+# 不再为每只股票每个日期构造 formula_vars 字典并 exec。
+# 不支持的语法（字符串/列表变量、函数定义等）由 compile_formula 返回 None，内核回退到 exec。
+
+# 公式可引用的数值变量，顺序即槽位顺序，必须与下方 FV_* 槽位常量保持一致
+FORMULA_VAR_NAMES = (
+    'max_value', 'min_value', 'end_value', 'start_value', 'actual_value', 'closest_value', 'continuous_len',
+    'continuous_start_value', 'continuous_start_next_value', 'continuous_start_next_next_value',
+    'continuous_end_value', 'continuous_end_prev_value', 'continuous_end_prev_prev_value',
+    'continuous_abs_sum_first_half', 'continuous_abs_sum_second_half', 'continuous_abs_sum_block1',
+    'continuous_abs_sum_block2', 'continuous_abs_sum_block3', 'continuous_abs_sum_block4',
+    'forward_max_continuous_start_value', 'forward_max_continuous_start_next_value',
+    'forward_max_continuous_start_next_next_value', 'forward_max_continuous_end_value',
+    'forward_max_continuous_end_prev_value', 'forward_max_continuous_end_prev_prev_value',
+    'forward_max_abs_sum_first_half', 'forward_max_abs_sum_second_half', 'forward_max_abs_sum_block1',
+    'forward_max_abs_sum_block2', 'forward_max_abs_sum_block3', 'forward_max_abs_sum_block4',
+    'forward_min_continuous_start_value', 'forward_min_continuous_start_next_value',
+    'forward_min_continuous_start_next_next_value', 'forward_min_continuous_end_value',
+    'forward_min_continuous_end_prev_value', 'forward_min_continuous_end_prev_prev_value',
+    'forward_min_abs_sum_first_half', 'forward_min_abs_sum_second_half', 'forward_min_abs_sum_block1',
+    'forward_min_abs_sum_block2', 'forward_min_abs_sum_block3', 'forward_min_abs_sum_block4', 'valid_sum_len',
+    'valid_pos_sum', 'valid_neg_sum', 'forward_max_valid_sum_len', 'forward_max_valid_pos_sum',
+    'forward_max_valid_neg_sum', 'forward_min_valid_sum_len', 'forward_min_valid_pos_sum',
+    'forward_min_valid_neg_sum', 'valid_abs_sum_first_half', 'valid_abs_sum_second_half',
+    'valid_abs_sum_block1', 'valid_abs_sum_block2', 'valid_abs_sum_block3', 'valid_abs_sum_block4',
+    'forward_max_valid_abs_sum_first_half', 'forward_max_valid_abs_sum_second_half',
+    'forward_max_valid_abs_sum_block1', 'forward_max_valid_abs_sum_block2',
+    'forward_max_valid_abs_sum_block3', 'forward_max_valid_abs_sum_block4',
+    'forward_min_valid_abs_sum_first_half', 'forward_min_valid_abs_sum_second_half',
+    'forward_min_valid_abs_sum_block1', 'forward_min_valid_abs_sum_block2',
+    'forward_min_valid_abs_sum_block3', 'forward_min_valid_abs_sum_block4', 'n_max_is_max',
+    'range_ratio_is_less', 'continuous_abs_is_less', 'valid_abs_is_less',
+    'forward_min_continuous_abs_is_less', 'forward_min_valid_abs_is_less',
+    'forward_max_continuous_abs_is_less', 'forward_max_valid_abs_is_less', 'n_days_max_value',
+    'prev_day_change', 'end_day_change', 'diff_end_value', 'increment_value', 'after_gt_end_value',
+    'after_gt_start_value', 'increment_change', 'after_gt_end_change', 'after_gt_start_change',
+    'adjust_ops_change', 'adjust_ops_incre_rate', 'hold_days', 'ops_change', 'adjust_days', 'ops_incre_rate',
+    'forward_max_result_len', 'forward_min_result_len', 'cont_sum_pos_sum', 'cont_sum_neg_sum',
+    'cont_sum_pos_sum_first_half', 'cont_sum_pos_sum_second_half', 'cont_sum_neg_sum_first_half',
+    'cont_sum_neg_sum_second_half', 'forward_max_cont_sum_pos_sum', 'forward_max_cont_sum_neg_sum',
+    'forward_min_cont_sum_pos_sum', 'forward_min_cont_sum_neg_sum', 'start_with_new_before_high',
+    'start_with_new_before_high2', 'start_with_new_after_high', 'start_with_new_after_high2',
+    'start_with_new_before_low', 'start_with_new_before_low2', 'start_with_new_after_low',
+    'start_with_new_after_low2', 'has_three_consecutive_zeros',
+)
+
+# 止盈止损模拟（op_days 循环）之后才得到的变量，其余变量只依赖结束日期窗口内的价格和涨跌
+FORMULA_OPS_VAR_NAMES = (
+    'increment_value', 'after_gt_end_value', 'after_gt_start_value', 'increment_change',
+    'after_gt_end_change', 'after_gt_start_change', 'adjust_ops_change', 'adjust_ops_incre_rate',
+    'hold_days', 'ops_change', 'adjust_days', 'ops_incre_rate',
+)
+
+# 公式可引用但不是数值的变量（日期字符串、列表），引用这些变量的公式走 exec
+FORMULA_OBJECT_VAR_NAMES = (
+    'max_value_date', 'min_value_date', 'end_value_date', 'start_value_date', 'actual_value_date',
+    'closest_value_date', 'continuous_results', 'forward_max_result', 'forward_min_result',
+    'valid_sum_arr', 'forward_max_valid_sum_arr', 'forward_min_valid_sum_arr',
+    'forward_max_date', 'forward_min_date',
+)
+
+# 公式变量槽位（formula_vals 下标）
+cdef enum:
+    FV_MAX_VALUE = 0
+    FV_MIN_VALUE
+    FV_END_VALUE
+    FV_START_VALUE
+    FV_ACTUAL_VALUE
+    FV_CLOSEST_VALUE
+    FV_CONTINUOUS_LEN
+    FV_CONTINUOUS_START_VALUE
+    FV_CONTINUOUS_START_NEXT_VALUE
+    FV_CONTINUOUS_START_NEXT_NEXT_VALUE
+    FV_CONTINUOUS_END_VALUE
+    FV_CONTINUOUS_END_PREV_VALUE
+    FV_CONTINUOUS_END_PREV_PREV_VALUE
+    FV_CONTINUOUS_ABS_SUM_FIRST_HALF
+    FV_CONTINUOUS_ABS_SUM_SECOND_HALF
+    FV_CONTINUOUS_ABS_SUM_BLOCK1
+    FV_CONTINUOUS_ABS_SUM_BLOCK2
+    FV_CONTINUOUS_ABS_SUM_BLOCK3
+    FV_CONTINUOUS_ABS_SUM_BLOCK4
+    FV_FORWARD_MAX_CONTINUOUS_START_VALUE
+    FV_FORWARD_MAX_CONTINUOUS_START_NEXT_VALUE
+    FV_FORWARD_MAX_CONTINUOUS_START_NEXT_NEXT_VALUE
+    FV_FORWARD_MAX_CONTINUOUS_END_VALUE
+    FV_FORWARD_MAX_CONTINUOUS_END_PREV_VALUE
+    FV_FORWARD_MAX_CONTINUOUS_END_PREV_PREV_VALUE
+    FV_FORWARD_MAX_ABS_SUM_FIRST_HALF
+    FV_FORWARD_MAX_ABS_SUM_SECOND_HALF
+    FV_FORWARD_MAX_ABS_SUM_BLOCK1
+    FV_FORWARD_MAX_ABS_SUM_BLOCK2
+    FV_FORWARD_MAX_ABS_SUM_BLOCK3
+    FV_FORWARD_MAX_ABS_SUM_BLOCK4
+    FV_FORWARD_MIN_CONTINUOUS_START_VALUE
+    FV_FORWARD_MIN_CONTINUOUS_START_NEXT_VALUE
+    FV_FORWARD_MIN_CONTINUOUS_START_NEXT_NEXT_VALUE
+    FV_FORWARD_MIN_CONTINUOUS_END_VALUE
+    FV_FORWARD_MIN_CONTINUOUS_END_PREV_VALUE
+    FV_FORWARD_MIN_CONTINUOUS_END_PREV_PREV_VALUE
+    FV_FORWARD_MIN_ABS_SUM_FIRST_HALF
+    FV_FORWARD_MIN_ABS_SUM_SECOND_HALF
+    FV_FORWARD_MIN_ABS_SUM_BLOCK1
+    FV_FORWARD_MIN_ABS_SUM_BLOCK2
+    FV_FORWARD_MIN_ABS_SUM_BLOCK3
+    FV_FORWARD_MIN_ABS_SUM_BLOCK4
+    FV_VALID_SUM_LEN
+    FV_VALID_POS_SUM
+    FV_VALID_NEG_SUM
+    FV_FORWARD_MAX_VALID_SUM_LEN
+    FV_FORWARD_MAX_VALID_POS_SUM
+    FV_FORWARD_MAX_VALID_NEG_SUM
+    FV_FORWARD_MIN_VALID_SUM_LEN
+    FV_FORWARD_MIN_VALID_POS_SUM
+    FV_FORWARD_MIN_VALID_NEG_SUM
+    FV_VALID_ABS_SUM_FIRST_HALF
+    FV_VALID_ABS_SUM_SECOND_HALF
+    FV_VALID_ABS_SUM_BLOCK1
+    FV_VALID_ABS_SUM_BLOCK2
+    FV_VALID_ABS_SUM_BLOCK3
+    FV_VALID_ABS_SUM_BLOCK4
+    FV_FORWARD_MAX_VALID_ABS_SUM_FIRST_HALF
+    FV_FORWARD_MAX_VALID_ABS_SUM_SECOND_HALF
+    FV_FORWARD_MAX_VALID_ABS_SUM_BLOCK1
+    FV_FORWARD_MAX_VALID_ABS_SUM_BLOCK2
+    FV_FORWARD_MAX_VALID_ABS_SUM_BLOCK3
+    FV_FORWARD_MAX_VALID_ABS_SUM_BLOCK4
+    FV_FORWARD_MIN_VALID_ABS_SUM_FIRST_HALF
+    FV_FORWARD_MIN_VALID_ABS_SUM_SECOND_HALF
+    FV_FORWARD_MIN_VALID_ABS_SUM_BLOCK1
+    FV_FORWARD_MIN_VALID_ABS_SUM_BLOCK2
+    FV_FORWARD_MIN_VALID_ABS_SUM_BLOCK3
+    FV_FORWARD_MIN_VALID_ABS_SUM_BLOCK4
+    FV_N_MAX_IS_MAX
+    FV_RANGE_RATIO_IS_LESS
+    FV_CONTINUOUS_ABS_IS_LESS
+    FV_VALID_ABS_IS_LESS
+    FV_FORWARD_MIN_CONTINUOUS_ABS_IS_LESS
+    FV_FORWARD_MIN_VALID_ABS_IS_LESS
+    FV_FORWARD_MAX_CONTINUOUS_ABS_IS_LESS
+    FV_FORWARD_MAX_VALID_ABS_IS_LESS
+    FV_N_DAYS_MAX_VALUE
+    FV_PREV_DAY_CHANGE
+    FV_END_DAY_CHANGE
+    FV_DIFF_END_VALUE
+    FV_INCREMENT_VALUE
+    FV_AFTER_GT_END_VALUE
+    FV_AFTER_GT_START_VALUE
+    FV_INCREMENT_CHANGE
+    FV_AFTER_GT_END_CHANGE
+    FV_AFTER_GT_START_CHANGE
+    FV_ADJUST_OPS_CHANGE
+    FV_ADJUST_OPS_INCRE_RATE
+    FV_HOLD_DAYS
+    FV_OPS_CHANGE
+    FV_ADJUST_DAYS
+    FV_OPS_INCRE_RATE
+    FV_FORWARD_MAX_RESULT_LEN
+    FV_FORWARD_MIN_RESULT_LEN
+    FV_CONT_SUM_POS_SUM
+    FV_CONT_SUM_NEG_SUM
+    FV_CONT_SUM_POS_SUM_FIRST_HALF
+    FV_CONT_SUM_POS_SUM_SECOND_HALF
+    FV_CONT_SUM_NEG_SUM_FIRST_HALF
+    FV_CONT_SUM_NEG_SUM_SECOND_HALF
+    FV_FORWARD_MAX_CONT_SUM_POS_SUM
+    FV_FORWARD_MAX_CONT_SUM_NEG_SUM
+    FV_FORWARD_MIN_CONT_SUM_POS_SUM
+    FV_FORWARD_MIN_CONT_SUM_NEG_SUM
+    FV_START_WITH_NEW_BEFORE_HIGH
+    FV_START_WITH_NEW_BEFORE_HIGH2
+    FV_START_WITH_NEW_AFTER_HIGH
+    FV_START_WITH_NEW_AFTER_HIGH2
+    FV_START_WITH_NEW_BEFORE_LOW
+    FV_START_WITH_NEW_BEFORE_LOW2
+    FV_START_WITH_NEW_AFTER_LOW
+    FV_START_WITH_NEW_AFTER_LOW2
+    FV_HAS_THREE_CONSECUTIVE_ZEROS
+    FV_COUNT
+
+cpdef enum FormulaOp:
+    FOP_CONST = 0
+    FOP_LOAD
+    FOP_POP
+    FOP_STORE_RESULT
+    FOP_NEG
+    FOP_NOT
+    FOP_ABS
+    FOP_ADD
+    FOP_SUB
+    FOP_MUL
+    FOP_DIV
+    FOP_MIN
+    FOP_MAX
+    FOP_LT
+    FOP_LE
+    FOP_GT
+    FOP_GE
+    FOP_EQ
+    FOP_NE
+    FOP_JUMP
+    FOP_POP_JUMP_IF_FALSE
+    FOP_JUMP_IF_FALSE_OR_POP
+    FOP_JUMP_IF_TRUE_OR_POP
+
+FORMULA_SLOT_INDEX = {name: i for i, name in enumerate(FORMULA_VAR_NAMES)}
+assert len(FORMULA_VAR_NAMES) == FV_COUNT
+
+
+class FormulaCompileError(Exception):
+    """公式中包含编译器不支持的语法"""
+    pass
+
+
+_FORMULA_BINOPS = {
+    'Add': FOP_ADD, 'Sub': FOP_SUB, 'Mult': FOP_MUL, 'Div': FOP_DIV,
+}
+_FORMULA_CMPOPS = {
+    'Lt': FOP_LT, 'LtE': FOP_LE, 'Gt': FOP_GT, 'GtE': FOP_GE, 'Eq': FOP_EQ, 'NotEq': FOP_NE,
+}
+
+
+class _FormulaCompiler:
+    def __init__(self):
+        self.ops = []
+        self.args = []
+
+    def emit(self, op, arg=0.0):
+        self.ops.append(int(op))
+        self.args.append(float(arg))
+        return len(self.ops) - 1
+
+    def patch(self, pos, target):
+        self.args[pos] = float(target)
+
+    def stmts(self, body):
+        import ast
+        for node in body:
+            if isinstance(node, ast.If):
+                self.expr(node.test)
+                jump_else = self.emit(FOP_POP_JUMP_IF_FALSE)
+                self.stmts(node.body)
+                if node.orelse:
+                    jump_end = self.emit(FOP_JUMP)
+                    self.patch(jump_else, len(self.ops))
+                    self.stmts(node.orelse)
+                    self.patch(jump_end, len(self.ops))
+                else:
+                    self.patch(jump_else, len(self.ops))
+            elif isinstance(node, ast.Assign):
+                if len(node.targets) != 1 or not isinstance(node.targets[0], ast.Name) or node.targets[0].id != 'result':
+                    raise FormulaCompileError('只支持对 result 赋值')
+                self.expr(node.value)
+                self.emit(FOP_STORE_RESULT)
+            elif isinstance(node, ast.Expr):
+                self.expr(node.value)
+                self.emit(FOP_POP)
+            elif isinstance(node, ast.Pass):
+                continue
+            else:
+                raise FormulaCompileError(f'不支持的语句: {type(node).__name__}')
+
+    def bool_chain(self, values, jump_op):
+        # a and b and c：任一为假即短路，返回值与Python语义一致（返回最后求值的操作数）
+        jumps = []
+        for i, value in enumerate(values):
+            value()
+            if i < len(values) - 1:
+                jumps.append(self.emit(jump_op))
+        for pos in jumps:
+            self.patch(pos, len(self.ops))
+
+    def expr(self, node):
+        import ast
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, (bool, int, float)):
+                self.emit(FOP_CONST, node.value)
+                return
+            raise FormulaCompileError(f'不支持的常量: {node.value!r}')
+        if isinstance(node, ast.Name):
+            if node.id not in FORMULA_SLOT_INDEX:
+                raise FormulaCompileError(f'不支持的变量: {node.id}')
+            self.emit(FOP_LOAD, FORMULA_SLOT_INDEX[node.id])
+            return
+        if isinstance(node, ast.BinOp):
+            op = _FORMULA_BINOPS.get(type(node.op).__name__)
+            if op is None:
+                raise FormulaCompileError(f'不支持的运算符: {type(node.op).__name__}')
+            self.expr(node.left)
+            self.expr(node.right)
+            self.emit(op)
+            return
+        if isinstance(node, ast.UnaryOp):
+            self.expr(node.operand)
+            if isinstance(node.op, ast.USub):
+                self.emit(FOP_NEG)
+            elif isinstance(node.op, ast.Not):
+                self.emit(FOP_NOT)
+            elif not isinstance(node.op, ast.UAdd):
+                raise FormulaCompileError(f'不支持的运算符: {type(node.op).__name__}')
+            return
+        if isinstance(node, ast.BoolOp):
+            jump_op = FOP_JUMP_IF_FALSE_OR_POP if isinstance(node.op, ast.And) else FOP_JUMP_IF_TRUE_OR_POP
+            self.bool_chain([lambda v=v: self.expr(v) for v in node.values], jump_op)
+            return
+        if isinstance(node, ast.Compare):
+            # a < b < c 等价于 a < b and b < c
+            operands = [node.left] + list(node.comparators)
+            def make_cmp(i):
+                def emit_cmp():
+                    op = _FORMULA_CMPOPS.get(type(node.ops[i]).__name__)
+                    if op is None:
+                        raise FormulaCompileError(f'不支持的比较: {type(node.ops[i]).__name__}')
+                    self.expr(operands[i])
+                    self.expr(operands[i + 1])
+                    self.emit(op)
+                return emit_cmp
+            self.bool_chain([make_cmp(i) for i in range(len(node.ops))], FOP_JUMP_IF_FALSE_OR_POP)
+            return
+        if isinstance(node, ast.IfExp):
+            self.expr(node.test)
+            jump_else = self.emit(FOP_POP_JUMP_IF_FALSE)
+            self.expr(node.body)
+            jump_end = self.emit(FOP_JUMP)
+            self.patch(jump_else, len(self.ops))
+            self.expr(node.orelse)
+            self.patch(jump_end, len(self.ops))
+            return
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+            if node.func.id == 'abs' and len(node.args) == 1:
+                self.expr(node.args[0])
+                self.emit(FOP_ABS)
+                return
+            if node.func.id in ('min', 'max') and len(node.args) >= 2:
+                op = FOP_MIN if node.func.id == 'min' else FOP_MAX
+                self.expr(node.args[0])
+                for arg in node.args[1:]:
+                    self.expr(arg)
+                    self.emit(op)
+                return
+        raise FormulaCompileError(f'不支持的表达式: {type(node).__name__}')
+
+
+def compile_formula(formula_expr):
+    """
+    把选股公式编译成 (ops, args) 指令，编译失败返回 None（调用方回退到 exec）。
+    ops 为 int32 操作码，args 为对应的常量/槽位/跳转目标。
+    """
+    import ast
+    if formula_expr is None:
+        return None
+    try:
+        tree = ast.parse(formula_expr, mode='exec')
+        compiler = _FormulaCompiler()
+        compiler.stmts(tree.body)
+    except (SyntaxError, FormulaCompileError, RecursionError):
+        return None
+    return (np.asarray(compiler.ops, dtype=np.int32), np.asarray(compiler.args, dtype=np.float64))
+
+
+def formula_prefilter_expr(formula_expr):
+    """
+    取出选股公式中不依赖止盈止损模拟的前置条件，返回 `result = 前置条件` 形式的公式。
+    公式须为单个 if 语句且 else 分支不可能入选（没有 else 或只有 result = 0），
+    前置条件为 if 条件中 and 连接的最长前缀，只能引用 FORMULA_OPS_VAR_NAMES 以外的变量；
+    前置条件为假或运行出错的行整条公式必然落选。没有可用的前置条件时返回 None。
+    """
+    import ast
+    if formula_expr is None:
+        return None
+    try:
+        tree = ast.parse(formula_expr, mode='exec')
+    except SyntaxError:
+        return None
+    if len(tree.body) != 1 or not isinstance(tree.body[0], ast.If):
+        return None
+    node = tree.body[0]
+    for stmt in node.orelse:
+        if isinstance(stmt, ast.Pass):
+            continue
+        if not (isinstance(stmt, ast.Assign) and isinstance(stmt.value, ast.Constant) and
+                not isinstance(stmt.value.value, bool) and stmt.value.value == 0):
+            return None
+    conjuncts = node.test.values if isinstance(node.test, ast.BoolOp) and isinstance(node.test.op, ast.And) else [node.test]
+    cheap_slots = {FORMULA_SLOT_INDEX[name] for name in FORMULA_VAR_NAMES if name not in FORMULA_OPS_VAR_NAMES}
+    prefilter = None
+    for k in range(1, len(conjuncts) + 1):
+        test = conjuncts[0] if k == 1 else ast.BoolOp(op=ast.And(), values=conjuncts[:k])
+        candidate = 'result = ' + ast.unparse(test)
+        program = compile_formula(candidate)
+        if program is None or not set(formula_program_slots(program)) <= cheap_slots:
+            break
+        prefilter = candidate
+    return prefilter
+
+
+def compile_formula_prefilter(formula_expr):
+    """formula_prefilter_expr 编译后的 (ops, args)，没有可用的前置条件时返回 None"""
+    prefilter = formula_prefilter_expr(formula_expr)
+    return compile_formula(prefilter) if prefilter is not None else None
+
+
+def formula_program_slots(formula_program):
+    """编译后公式引用到的变量槽位（按出现顺序去重）"""
+    ops, args = formula_program
+    slots = []
+    for j in range(len(ops)):
+        if ops[j] == FOP_LOAD and int(args[j]) not in slots:
+            slots.append(int(args[j]))
+    return slots
+
+
+class _FormulaColumnEvaluator:
+    """
+    按列对整批股票/日期一次性求值选股公式（NumPy 向量运算）。
+    每个表达式返回 (值, 出错掩码)，and/or/if 只把实际会执行到的分支的错误计入，
+    与逐行 exec 的短路、除零语义一致。
+    """
+    def __init__(self, columns, n):
+        self.columns = columns
+        self.n = n
+
+    @staticmethod
+    def truthy(value):
+        # Python 中 NaN 为真，只有 0 为假
+        return value != 0
+
+    def stmts(self, body, active, result, has_result, failed):
+        import ast
+        for node in body:
+            active = active & ~failed
+            if isinstance(node, ast.If):
+                test, err = self.expr(node.test)
+                failed |= active & err
+                cond = self.truthy(test) & ~err
+                self.stmts(node.body, active & cond, result, has_result, failed)
+                if node.orelse:
+                    self.stmts(node.orelse, active & ~cond & ~err, result, has_result, failed)
+            elif isinstance(node, ast.Assign):
+                if len(node.targets) != 1 or not isinstance(node.targets[0], ast.Name) or node.targets[0].id != 'result':
+                    raise FormulaCompileError('只支持对 result 赋值')
+                value, err = self.expr(node.value)
+                failed |= active & err
+                ok = active & ~err
+                result[ok] = value[ok]
+                has_result |= ok
+            elif isinstance(node, ast.Expr):
+                value, err = self.expr(node.value)
+                failed |= active & err
+            elif isinstance(node, ast.Pass):
+                continue
+            else:
+                raise FormulaCompileError(f'不支持的语句: {type(node).__name__}')
+
+    def bool_chain(self, values, is_and):
+        value, err = values[0]()
+        for next_value in values[1:]:
+            # 只有未短路的行才会继续求值后面的操作数
+            go_on = self.truthy(value) if is_and else ~self.truthy(value)
+            rhs, rhs_err = next_value()
+            err = err | (go_on & rhs_err)
+            value = np.where(go_on, rhs, value)
+        return value, err
+
+    def expr(self, node):
+        import ast
+        no_err = np.zeros(self.n, dtype=bool)
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, (bool, int, float)):
+                return np.full(self.n, float(node.value)), no_err
+            raise FormulaCompileError(f'不支持的常量: {node.value!r}')
+        if isinstance(node, ast.Name):
+            if node.id not in self.columns:
+                raise FormulaCompileError(f'不支持的变量: {node.id}')
+            return self.columns[node.id], no_err
+        if isinstance(node, ast.BinOp):
+            op = _FORMULA_BINOPS.get(type(node.op).__name__)
+            if op is None:
+                raise FormulaCompileError(f'不支持的运算符: {type(node.op).__name__}')
+            left, left_err = self.expr(node.left)
+            right, right_err = self.expr(node.right)
+            err = left_err | right_err
+            with np.errstate(all='ignore'):
+                if op == FOP_ADD:
+                    value = left + right
+                elif op == FOP_SUB:
+                    value = left - right
+                elif op == FOP_MUL:
+                    value = left * right
+                else:
+                    err = err | (right == 0)
+                    value = left / right
+            return value, err
+        if isinstance(node, ast.UnaryOp):
+            value, err = self.expr(node.operand)
+            if isinstance(node.op, ast.USub):
+                return -value, err
+            if isinstance(node.op, ast.Not):
+                return (value == 0).astype(np.float64), err
+            if isinstance(node.op, ast.UAdd):
+                return value, err
+            raise FormulaCompileError(f'不支持的运算符: {type(node.op).__name__}')
+        if isinstance(node, ast.BoolOp):
+            return self.bool_chain([lambda v=v: self.expr(v) for v in node.values], isinstance(node.op, ast.And))
+        if isinstance(node, ast.Compare):
+            operands = [node.left] + list(node.comparators)
+            def make_cmp(i):
+                def eval_cmp():
+                    op = _FORMULA_CMPOPS.get(type(node.ops[i]).__name__)
+                    if op is None:
+                        raise FormulaCompileError(f'不支持的比较: {type(node.ops[i]).__name__}')
+                    left, left_err = self.expr(operands[i])
+                    right, right_err = self.expr(operands[i + 1])
+                    if op == FOP_LT:
+                        value = left < right
+                    elif op == FOP_LE:
+                        value = left <= right
+                    elif op == FOP_GT:
+                        value = left > right
+                    elif op == FOP_GE:
+                        value = left >= right
+                    elif op == FOP_EQ:
+                        value = left == right
+                    else:
+                        value = left != right
+                    return value.astype(np.float64), left_err | right_err
+                return eval_cmp
+            return self.bool_chain([make_cmp(i) for i in range(len(node.ops))], True)
+        if isinstance(node, ast.IfExp):
+            test, test_err = self.expr(node.test)
+            cond = self.truthy(test)
+            body, body_err = self.expr(node.body)
+            orelse, orelse_err = self.expr(node.orelse)
+            err = test_err | (cond & body_err) | (~cond & orelse_err)
+            return np.where(cond, body, orelse), err
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+            if node.func.id == 'abs' and len(node.args) == 1:
+                value, err = self.expr(node.args[0])
+                return np.abs(value), err
+            if node.func.id in ('min', 'max') and len(node.args) >= 2:
+                value, err = self.expr(node.args[0])
+                for arg in node.args[1:]:
+                    other, other_err = self.expr(arg)
+                    take = other < value if node.func.id == 'min' else other > value
+                    value = np.where(take, other, value)
+                    err = err | other_err
+                return value, err
+        raise FormulaCompileError(f'不支持的表达式: {type(node).__name__}')
+
+
+def formula_names(formula_expr):
+    """公式中引用到的变量名，语法无法解析时返回 None"""
+    import ast
+    try:
+        tree = ast.parse(formula_expr, mode='exec')
+    except SyntaxError:
+        return None
+    func_names = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+    return sorted({node.id for node in ast.walk(tree)
+                   if isinstance(node, ast.Name) and node.id != 'result' and id(node) not in func_names})
+
+
+def evaluate_formula_columns(formula_expr, columns, n):
+    """
+    对列数据整体求值选股公式。
+    columns: {变量名: float64 一维数组}，长度均为 n
+    返回 (result, has_result)：has_result 为 False 的行相当于逐行 exec 得到 None（未赋值或运行出错）；
+    公式包含不支持的语法时返回 None。
+    """
+    import ast
+    try:
+        tree = ast.parse(formula_expr, mode='exec')
+        evaluator = _FormulaColumnEvaluator(columns, n)
+        result = np.full(n, NAN)
+        has_result = np.zeros(n, dtype=bool)
+        failed = np.zeros(n, dtype=bool)
+        evaluator.stmts(tree.body, np.ones(n, dtype=bool), result, has_result, failed)
+    except (SyntaxError, FormulaCompileError, RecursionError):
+        return None
+    return result, has_result & ~failed
+
+
+def select_top_indices(scores, candidates, select_count, descending=True):
+    """
+    从候选行中选出 score 排名前 select_count 的行，返回按名次排列的行号。
+    先用 argpartition 找到第 select_count 名的分数，再对入围行做稳定排序，
+    分数相同时行号小的在前（与逐行 append 后稳定排序再截断的结果一致）。
+    """
+    candidates = np.asarray(candidates, dtype=np.int64)
+    if select_count <= 0 or candidates.size == 0:
+        return candidates[:0]
+    order_key = -scores[candidates] if descending else scores[candidates]
+    if candidates.size > select_count:
+        kth = order_key[np.argpartition(order_key, select_count - 1)[:select_count]].max()
+        keep = order_key <= kth
+        candidates = candidates[keep]
+        order_key = order_key[keep]
+    order = np.lexsort((candidates, order_key))
+    return candidates[order[:select_count]]
+
+
+def select_formula_rows(formula_expr, formula_cols, column_names, row_ok, cmp_zero, int sort_mode_code, int select_count,
+                        bint return_scores=False, shard_bounds=None):
+    """
+    对第一遍收集的列矩阵整体求值选股公式，返回 (股票, 日期) 的入选掩码。
+    条件与逐行判断一致：公式有结果、结束值有效、持有天数不为-1、score 符号符合排序模式，
+    每个日期按 score 取前 select_count 名。return_scores 为真时返回 (入选掩码, score 矩阵)。
+    shard_bounds 为 [(起始行, 结束行), ...] 时按分片各取前 select_count 名（与各进程分别选股后合并的结果一致）。
+    """
+    n_stocks, n_end_dates = row_ok.shape
+    n = n_stocks * n_end_dates
+    columns = {name: formula_cols[j].reshape(n) for j, name in enumerate(column_names)}
+    evaluated = evaluate_formula_columns(formula_expr, columns, n)
+    if evaluated is None:
+        # 理论上不会发生（能编译的公式都能列式求值），保守起见全部交给第二遍逐行判断
+        if return_scores:
+            raise FormulaCompileError(formula_expr)
+        return np.ones((n_stocks, n_end_dates), dtype=np.uint8)
+    scores, has_result = evaluated
+    scores = scores.reshape(n_stocks, n_end_dates)
+    mask = (has_result.reshape(n_stocks, n_end_dates) & row_ok.astype(bool) & ~cmp_zero.astype(bool) &
+            ((scores > 0) if sort_mode_code == 1 else (scores < 0) if sort_mode_code == 2 else False))
+    row_mask = np.zeros((n_stocks, n_end_dates), dtype=np.uint8)
+    for d in range(n_end_dates):
+        for start, end in shard_bounds or [(0, n_stocks)]:
+            candidates = start + np.flatnonzero(mask[start:end, d])
+            if candidates.size:
+                row_mask[select_top_indices(scores[:, d], candidates, select_count, sort_mode_code == 1), d] = 1
+    if return_scores:
+        return row_mask, scores
+    return row_mask
+
+
+def formula_supports_columnar(formula_expr, comparison_vars):
+    """公式可编译且比较变量都是数值变量时，只显示选股结果可走列式两遍计算（与 calculate_batch_cy 的判断一致）"""
+    if compile_formula(formula_expr) is None:
+        return False
+    return not any(var in FORMULA_OBJECT_VAR_NAMES for var_pair in comparison_vars or [] for var in var_pair)
+
+
+def comparison_zero_columns(formula_cols, comparison_vars, shape):
+    """
+    与 comparison_pairs_zero 一致的列式判断：任意一对比较变量都为0（或变量不存在）时为True。
+    formula_cols 按 FORMULA_VAR_NAMES 顺序存放全部公式变量，shape 为 (股票, 日期)。
+    """
+    cmp_zero = np.zeros(shape, dtype=bool)
+    for var1, var2 in comparison_vars or []:
+        zero = np.ones(shape, dtype=bool)
+        for var in (var1, var2):
+            slot = FORMULA_SLOT_INDEX.get(var, -1)
+            if slot >= 0:
+                zero &= formula_cols[slot] == 0
+        cmp_zero |= zero
+    return cmp_zero.astype(np.uint8)
+
+
+def prefilter_pending_rows(formula_expr, formula_cols, pending):
+    """
+    待补算的行（第一遍被前置条件跳过、止盈止损变量为空）中，公式前置条件成立、需要补算完整指标的行。
+    formula_cols 按 FORMULA_VAR_NAMES 顺序存放全部公式变量，pending 为 (股票, 日期) 掩码；
+    前置条件不成立的行公式必然落选，不需要补算。公式没有可用的前置条件时所有待补算行都需要补算。
+    """
+    pending = np.asarray(pending, dtype=bool)
+    prefilter = formula_prefilter_expr(formula_expr)
+    if prefilter is None or not pending.any():
+        return pending.copy()
+    n = pending.size
+    columns = {name: formula_cols[FORMULA_SLOT_INDEX[name]].reshape(n) for name in formula_names(prefilter)}
+    evaluated = evaluate_formula_columns(prefilter, columns, n)
+    if evaluated is None:
+        return pending.copy()
+    value, has_result = evaluated
+    # 与第一遍一致：前置条件出错或为0时跳过，NaN 视为成立
+    return pending & (has_result & (value != 0)).reshape(pending.shape)
+
+
+def _range_condition_tree(formula_expr):
+    """
+    解析 `if 条件:` 形式的公式，返回语法树；公式不是单个 if 语句时返回 None。
+    条件顶层是 or、条件表达式等优先级低于 and 的运算时也返回 None：界面上的区间公式是在条件文本后直接拼接
+    ` and 变量 >= 下限 and 变量 <= 上限`，此时拼接结果只约束 or 的最后一项，与给整个条件追加区间含义不同
+    """
+    import ast
+    try:
+        tree = ast.parse(formula_expr, mode='exec')
+    except SyntaxError:
+        return None
+    if len(tree.body) != 1 or not isinstance(tree.body[0], ast.If):
+        return None
+    test = tree.body[0].test
+    if (isinstance(test, (ast.IfExp, ast.Lambda, ast.NamedExpr)) or
+            (isinstance(test, ast.BoolOp) and isinstance(test.op, ast.Or))):
+        return None
+    return tree
+
+
+def range_condition_formula(formula_expr, variable, lower, upper):
+    """
+    在 `if 条件:` 形式的公式条件末尾追加 `variable >= lower and variable <= upper`，返回新公式；
+    公式不是单个 if 语句或条件顶层优先级低于 and（见 _range_condition_tree）时返回 None
+    """
+    import ast
+    tree = _range_condition_tree(formula_expr)
+    if tree is None:
+        return None
+    node = tree.body[0]
+    var = ast.Name(id=variable, ctx=ast.Load())
+    node.test = ast.BoolOp(op=ast.And(), values=[
+        node.test,
+        ast.Compare(left=var, ops=[ast.GtE()], comparators=[ast.Constant(float(lower))]),
+        ast.Compare(left=var, ops=[ast.LtE()], comparators=[ast.Constant(float(upper))]),
+    ])
+    return ast.unparse(ast.fix_missing_locations(tree))
+
+
+def sweep_range_rows(formula_expr, formula_cols, column_names, row_ok, cmp_zero, variable, bound_pairs,
+                     int sort_mode_code, int select_count, shard_bounds=None):
+    """
+    区间条件扫描：对 range_condition_formula(formula_expr, variable, 下限, 上限) 的每组上下限，
+    返回与 select_formula_rows(..., return_scores=True) 相同的 (入选掩码, score 矩阵) 列表。
+    公式只拆成条件、result 分支、else 分支各求值一次；else 分支不可能入选时（如 result = 0），
+    每个日期/分片按变量值排序一次，之后每组上下限只需二分查找出区间内的候选行再取前 select_count 名。
+    公式形式不符或含不支持的语法时返回 None。
+    """
+    import ast
+    tree = _range_condition_tree(formula_expr)
+    if (tree is None or variable not in column_names or
+            any(not isinstance(stmt, ast.Assign) for stmt in tree.body[0].body + tree.body[0].orelse)):
+        return None
+    node = tree.body[0]
+    n_stocks, n_end_dates = row_ok.shape
+    n = n_stocks * n_end_dates
+    columns = {name: formula_cols[j].reshape(n) for j, name in enumerate(column_names)}
+    evaluator = _FormulaColumnEvaluator(columns, n)
+    try:
+        test, test_err = evaluator.expr(node.test)
+        branches = []
+        for body in (node.body, node.orelse):
+            value = np.full(n, NAN)
+            has_value = np.zeros(n, dtype=bool)
+            failed = np.zeros(n, dtype=bool)
+            evaluator.stmts(body, np.ones(n, dtype=bool), value, has_value, failed)
+            branches.append((value.reshape(n_stocks, n_end_dates), (has_value & ~failed).reshape(n_stocks, n_end_dates)))
+    except (FormulaCompileError, RecursionError):
+        return None
+    cond = (evaluator.truthy(test) & ~test_err).reshape(n_stocks, n_end_dates)
+    base_ok = row_ok.astype(bool) & ~cmp_zero.astype(bool) & ~test_err.reshape(n_stocks, n_end_dates)
+
+    def sign_ok(values):
+        return (values > 0) if sort_mode_code == 1 else (values < 0) if sort_mode_code == 2 else np.zeros(values.shape, dtype=bool)
+
+    then_value, then_ok = branches[0]
+    else_value, else_ok = branches[1]
+    then_sel = base_ok & cond & then_ok & sign_ok(then_value)
+    else_sel = base_ok & else_ok & sign_ok(else_value)
+    var = columns[variable].reshape(n_stocks, n_end_dates)
+    bounds = shard_bounds or [(0, n_stocks)]
+    results = []
+    if else_sel.any():
+        # else 分支也可能入选时逐组整体判断
+        for lower, upper in bound_pairs:
+            branch = cond & (var >= lower) & (var <= upper)
+            scores = np.where(branch, then_value, else_value)
+            selected = np.where(branch, then_sel, else_sel)
+            row_mask = np.zeros((n_stocks, n_end_dates), dtype=np.uint8)
+            for d in range(n_end_dates):
+                for start, end in bounds:
+                    candidates = start + np.flatnonzero(selected[start:end, d])
+                    if candidates.size:
+                        row_mask[select_top_indices(scores[:, d], candidates, select_count, sort_mode_code == 1), d] = 1
+            results.append((row_mask, scores))
+        return results
+    # 每个日期、分片的候选行按变量值排序一次
+    sorted_index = []
+    for d in range(n_end_dates):
+        for start, end in bounds:
+            candidates = start + np.flatnonzero(then_sel[start:end, d])
+            order = np.argsort(var[candidates, d], kind='stable')
+            sorted_index.append((d, candidates[order], var[candidates[order], d]))
+    for lower, upper in bound_pairs:
+        row_mask = np.zeros((n_stocks, n_end_dates), dtype=np.uint8)
+        for d, candidates, values in sorted_index:
+            lo = np.searchsorted(values, lower, side='left')
+            hi = np.searchsorted(values, upper, side='right')
+            if hi > lo:
+                row_mask[select_top_indices(then_value[:, d], candidates[lo:hi], select_count, sort_mode_code == 1), d] = 1
+        results.append((row_mask, then_value))
+    return results
+
+
+cdef inline double formula_safe(double x) nogil:
+    # 与 safe_formula_val 一致：NaN 视为 0
+    return 0.0 if isnan(x) else x
+
+
+cdef int eval_formula_program(
+    const int* ops,
+    const double* args,
+    int n_ops,
+    const double* fv,
+    double* stack,
+    double* result
+) nogil:
+    """执行编译后的公式，返回1表示得到result，0表示未赋值result，-1表示运行时错误（如除零）"""
+    cdef int pc = 0
+    cdef int sp = 0
+    cdef int op
+    cdef int has_result = 0
+    cdef double a, b
+    while pc < n_ops:
+        op = ops[pc]
+        if op == FOP_CONST:
+            stack[sp] = args[pc]
+            sp += 1
+        elif op == FOP_LOAD:
+            stack[sp] = fv[<int>args[pc]]
+            sp += 1
+        elif op == FOP_POP:
+            sp -= 1
+        elif op == FOP_STORE_RESULT:
+            sp -= 1
+            result[0] = stack[sp]
+            has_result = 1
+        elif op == FOP_NEG:
+            stack[sp - 1] = -stack[sp - 1]
+        elif op == FOP_NOT:
+            stack[sp - 1] = 1.0 if stack[sp - 1] == 0 else 0.0
+        elif op == FOP_ABS:
+            stack[sp - 1] = fabs(stack[sp - 1])
+        elif op == FOP_JUMP:
+            pc = <int>args[pc]
+            continue
+        elif op == FOP_POP_JUMP_IF_FALSE:
+            sp -= 1
+            if stack[sp] == 0:
+                pc = <int>args[pc]
+                continue
+        elif op == FOP_JUMP_IF_FALSE_OR_POP:
+            if stack[sp - 1] == 0:
+                pc = <int>args[pc]
+                continue
+            sp -= 1
+        elif op == FOP_JUMP_IF_TRUE_OR_POP:
+            if stack[sp - 1] != 0:
+                pc = <int>args[pc]
+                continue
+            sp -= 1
+        else:
+            sp -= 1
+            b = stack[sp]
+            a = stack[sp - 1]
+            if op == FOP_ADD:
+                a = a + b
+            elif op == FOP_SUB:
+                a = a - b
+            elif op == FOP_MUL:
+                a = a * b
+            elif op == FOP_DIV:
+                if b == 0:
+                    return -1
+                a = a / b
+            elif op == FOP_MIN:
+                if b < a:
+                    a = b
+            elif op == FOP_MAX:
+                if b > a:
+                    a = b
+            elif op == FOP_LT:
+                a = 1.0 if a < b else 0.0
+            elif op == FOP_LE:
+                a = 1.0 if a <= b else 0.0
+            elif op == FOP_GT:
+                a = 1.0 if a > b else 0.0
+            elif op == FOP_GE:
+                a = 1.0 if a >= b else 0.0
+            elif op == FOP_EQ:
+                a = 1.0 if a == b else 0.0
+            elif op == FOP_NE:
+                a = 1.0 if a != b else 0.0
+            else:
+                return -1
+            stack[sp - 1] = a
+        pc += 1
+    return has_result
+
+
+cdef inline bint comparison_pairs_zero(const int* slots, int n_slots, const double* fv) noexcept nogil:
+    """每对比较变量都为0（或变量不存在）时返回True，此时score直接为0"""
+    cdef int j
+    for j in range(0, n_slots, 2):
+        if (slots[j] < 0 or fv[slots[j]] == 0) and (slots[j + 1] < 0 or fv[slots[j + 1]] == 0):
+            return True
+    return False
+
+
+cdef bint formula_row_score(
+    const int* ops,
+    const double* args,
+    int n_ops,
+    const int* comparison_slots,
+    int n_comparison_slots,
+    const double* fv,
+    double* stack,
+    double* score
+) noexcept nogil:
+    """计算一行的score，返回score是否有效（公式未赋值或运行时错误时无效）"""
+    if comparison_pairs_zero(comparison_slots, n_comparison_slots, fv):
+        score[0] = 0
+        return True
+    return eval_formula_program(ops, args, n_ops, fv, stack, score) == 1
+
+
+def run_formula_program(formula_program, values):
+    """
+    在一行公式变量值上执行 compile_formula 编译出的 (ops, args)，与内核逐行执行的是同一段代码，用于核对编译结果。
+    values 按 FORMULA_VAR_NAMES 顺序排列；返回 result，未赋值或运行时错误（如除零）时返回 None
+    """
+    cdef int[::1] ops = np.ascontiguousarray(formula_program[0], dtype=np.int32)
+    cdef double[::1] args = np.ascontiguousarray(formula_program[1], dtype=np.float64)
+    cdef double[::1] fv = np.ascontiguousarray(values, dtype=np.float64)
+    cdef double[::1] stack = np.empty(ops.shape[0] + 1, dtype=np.float64)
+    cdef double result = NAN
+    if fv.shape[0] != FV_COUNT:
+        raise ValueError(f"values 长度应为 {FV_COUNT}")
+    if ops.shape[0] == 0:
+        return None
+    if eval_formula_program(&ops[0], &args[0], ops.shape[0], &fv[0], &stack[0], &result) != 1:
+        return None
+    return result
+
+
+def safe_formula_val(val):
+    if val is None:
+        return 0
+    if isinstance(val, float) and (math.isnan(val) or str(val).lower() == 'nan'):
+        return 0
+    return val
+
+
+def traditional_round(value, decimals=2):
+    # 传统四舍五入函数（向远离零的方向舍入）
+    multiplier = 10 ** decimals
+    return int(value * multiplier + (0.5 if value >= 0 else -0.5)) / multiplier
+
+
+cdef inline object nan_to_none(double x):
+    return None if isnan(x) else x
+
+
+# calculate_batch_cy 每行结果的字段（按此顺序组成元组，最终转换为列式的 ResultTable）
+RESULT_FIELDS = (
+    'stock_idx', 'max_value', 'max_value_date', 'min_value', 'min_value_date', 'end_value',
+    'end_value_date', 'start_value', 'start_value_date', 'actual_value', 'actual_value_date',
+    'closest_value', 'closest_value_date', 'continuous_results', 'continuous_len',
+    'continuous_start_value', 'continuous_start_next_value', 'continuous_start_next_next_value',
+    'continuous_end_value', 'continuous_end_prev_value', 'continuous_end_prev_prev_value',
+    'continuous_abs_sum_first_half', 'continuous_abs_sum_second_half', 'continuous_abs_sum_block1',
+    'continuous_abs_sum_block2', 'continuous_abs_sum_block3', 'continuous_abs_sum_block4',
+    'forward_max_result', 'forward_max_continuous_start_value',
+    'forward_max_continuous_start_next_value', 'forward_max_continuous_start_next_next_value',
+    'forward_max_continuous_end_value', 'forward_max_continuous_end_prev_value',
+    'forward_max_continuous_end_prev_prev_value', 'forward_max_abs_sum_first_half',
+    'forward_max_abs_sum_second_half', 'forward_max_abs_sum_block1', 'forward_max_abs_sum_block2',
+    'forward_max_abs_sum_block3', 'forward_max_abs_sum_block4', 'forward_min_result',
+    'forward_min_continuous_start_value', 'forward_min_continuous_start_next_value',
+    'forward_min_continuous_start_next_next_value', 'forward_min_continuous_end_value',
+    'forward_min_continuous_end_prev_value', 'forward_min_continuous_end_prev_prev_value',
+    'forward_min_abs_sum_first_half', 'forward_min_abs_sum_second_half',
+    'forward_min_abs_sum_block1', 'forward_min_abs_sum_block2', 'forward_min_abs_sum_block3',
+    'forward_min_abs_sum_block4', 'valid_sum_arr', 'valid_sum_len', 'valid_pos_sum',
+    'valid_neg_sum', 'forward_max_valid_sum_arr', 'forward_max_valid_sum_len',
+    'forward_max_valid_pos_sum', 'forward_max_valid_neg_sum', 'forward_min_valid_sum_arr',
+    'forward_min_valid_sum_len', 'forward_min_valid_pos_sum', 'forward_min_valid_neg_sum',
+    'valid_abs_sum_first_half', 'valid_abs_sum_second_half', 'valid_abs_sum_block1',
+    'valid_abs_sum_block2', 'valid_abs_sum_block3', 'valid_abs_sum_block4',
+    'forward_max_valid_abs_sum_first_half', 'forward_max_valid_abs_sum_second_half',
+    'forward_max_valid_abs_sum_block1', 'forward_max_valid_abs_sum_block2',
+    'forward_max_valid_abs_sum_block3', 'forward_max_valid_abs_sum_block4',
+    'forward_min_valid_abs_sum_first_half', 'forward_min_valid_abs_sum_second_half',
+    'forward_min_valid_abs_sum_block1', 'forward_min_valid_abs_sum_block2',
+    'forward_min_valid_abs_sum_block3', 'forward_min_valid_abs_sum_block4', 'forward_max_date',
+    'forward_min_date', 'n_max_is_max', 'range_ratio_is_less', 'continuous_abs_is_less',
+    'valid_abs_is_less', 'forward_min_continuous_abs_is_less', 'forward_min_valid_abs_is_less',
+    'forward_max_continuous_abs_is_less', 'forward_max_valid_abs_is_less', 'n_days_max_value',
+    'prev_day_change', 'end_day_change', 'diff_end_value', 'increment_value', 'after_gt_end_value',
+    'after_gt_start_value', 'ops_value', 'hold_days', 'ops_change', 'adjust_days',
+    'ops_incre_rate', 'increment_change', 'after_gt_end_change', 'after_gt_start_change',
+    'adjust_ops_change', 'adjust_ops_incre_rate', 'take_and_stop_increment_change',
+    'take_and_stop_after_gt_end_change', 'take_and_stop_after_gt_start_change',
+    'take_and_stop_change', 'take_and_stop_incre_rate', 'stop_and_take_increment_change',
+    'stop_and_take_after_gt_end_change', 'stop_and_take_after_gt_start_change',
+    'stop_and_take_change', 'stop_and_take_incre_rate', 'score', 'forward_max_result_len',
+    'forward_min_result_len', 'cont_sum_pos_sum', 'cont_sum_neg_sum',
+    'cont_sum_pos_sum_first_half', 'cont_sum_pos_sum_second_half', 'cont_sum_neg_sum_first_half',
+    'cont_sum_neg_sum_second_half', 'forward_max_cont_sum_pos_sum', 'forward_max_cont_sum_neg_sum',
+    'forward_min_cont_sum_pos_sum', 'forward_min_cont_sum_neg_sum', 'start_with_new_before_high',
+    'start_with_new_before_high2', 'start_with_new_after_high', 'start_with_new_after_high2',
+    'start_with_new_before_low', 'start_with_new_before_low2', 'start_with_new_after_low',
+    'start_with_new_after_low2', 'end_state', 'stop_loss', 'take_profit', 'op_day_change',
+    'has_three_consecutive_zeros',
+)
+RESULT_SCORE_POS = RESULT_FIELDS.index('score')
+
+# 结果中的累加值序列字段（变长，按 RaggedColumn 存储）
+RESULT_SEQUENCE_FIELDS = (
+    'continuous_results', 'forward_max_result', 'forward_min_result',
+    'valid_sum_arr', 'forward_max_valid_sum_arr', 'forward_min_valid_sum_arr',
+)
+cdef enum:
+    N_RESULT_SEQUENCES = 6
+
+_NONE_TYPE = type(None)
+
+
+cdef inline double traditional_round_2(double value) noexcept nogil:
+    # 与 traditional_round(value, 2) 一致
+    return trunc(value * 100 + (0.5 if value >= 0 else -0.5)) / 100
+
+
+cdef long long push_sequence(vector[double]& values, vector[long long]& offsets, vector[double]& src,
+                             bint round2=False, bint keep=True) noexcept:
+    """把一行的序列追加到缓冲区末尾（keep为False时追加空序列），返回该行在缓冲区中的行号"""
+    cdef size_t j
+    if keep and round2:
+        for j in range(src.size()):
+            values.push_back(traditional_round_2(src[j]))
+    elif keep:
+        values.insert(values.end(), src.begin(), src.end())
+    offsets.push_back(values.size())
+    return offsets.size() - 2
+
+
+cdef object double_vector_to_array(vector[double]& values):
+    if values.size() == 0:
+        return np.zeros(0, dtype=np.float64)
+    return np.asarray(<double[:values.size()]> values.data()).copy()
+
+
+class RaggedColumn:
+    """
+    变长序列列：所有行的序列连续存放在一个float64数组中，
+    第 i 行为 values[offsets[i]:offsets[i + 1]]，按行取出时是不复制的切片。
+    """
+
+    def __init__(self, values, offsets):
+        self.values = values
+        self.offsets = offsets
+
+    @classmethod
+    def from_lists(cls, lists):
+        lengths = np.fromiter(map(len, lists), dtype=np.int64, count=len(lists))
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        values = np.fromiter((v for seq in lists for v in seq), dtype=np.float64, count=int(offsets[len(lists)]))
+        return cls(values, offsets)
+
+    @classmethod
+    def concat(cls, columns):
+        offsets = [np.zeros(1, dtype=np.int64)]
+        base = 0
+        # 模块关闭了 wraparound，末尾元素用 len(column) 取，不用负下标
+        for column in columns:
+            offsets.append(column.offsets[1:] - column.offsets[0] + base)
+            base += column.offsets[len(column)] - column.offsets[0]
+        values = np.concatenate([column.values[column.offsets[0]:column.offsets[len(column)]] for column in columns])
+        return cls(values, np.concatenate(offsets))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def tolist(self):
+        return [self.values[self.offsets[i]:self.offsets[i + 1]].tolist() for i in range(len(self))]
+
+    def take(self, indices):
+        indices = np.asarray(indices, dtype=np.intp)
+        lengths = self.lengths()[indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        gather = np.repeat(self.offsets[indices] - offsets[:len(indices)], lengths) + np.arange(offsets[len(indices)])
+        return RaggedColumn(self.values[gather], offsets)
+
+
+def _pack_column(values):
+    """把一列Python值压缩为ndarray（float/int/bool），None用掩码记录；其他类型保留为list"""
+    kinds = set(map(type, values))
+    has_none = _NONE_TYPE in kinds
+    kinds.discard(_NONE_TYPE)
+    if len(kinds) != 1:
+        return list(values), None
+    kind = kinds.pop()
+    if kind is list and not has_none and all(type(x) is float for seq in values for x in seq):
+        return RaggedColumn.from_lists(values), None
+    if kind is float:
+        column = np.array([math.nan if v is None else v for v in values], dtype=np.float64)
+    elif kind is int:
+        try:
+            column = np.array([0 if v is None else v for v in values], dtype=np.int64)
+        except OverflowError:
+            return list(values), None
+    elif kind is bool:
+        column = np.array([False if v is None else v for v in values], dtype=np.bool_)
+    else:
+        return list(values), None
+    mask = np.array([v is None for v in values], dtype=np.bool_) if has_none else None
+    return column, mask
+
+
+class ResultTable:
+    """
+    一个结束日期的计算结果（列式存储）。
+    数值列保存为ndarray（None记录在掩码中），列表等其他值保存为list；
+    相比每行一个字典，占用内存和跨进程传输（pickle）的开销都小得多。
+    row(i) 按需还原为与原来相同的结果字典。
+    """
+
+    def __init__(self, fields, columns, masks, n_rows):
+        self.fields = list(fields)
+        self.columns = columns
+        self.masks = masks
+        self.n_rows = n_rows
+
+    @classmethod
+    def from_rows(cls, rows, fields=RESULT_FIELDS):
+        columns = {}
+        masks = {}
+        if rows:
+            for name, values in zip(fields, zip(*rows)):
+                columns[name], masks[name] = _pack_column(values)
+        else:
+            for name in fields:
+                columns[name], masks[name] = [], None
+        return cls(fields, columns, masks, len(rows))
+
+    @classmethod
+    def concat(cls, tables):
+        tables = [t for t in tables if t is not None]
+        if not tables:
+            return cls.from_rows([])
+        if len(tables) == 1:
+            return tables[0]
+        fields = tables[0].fields
+        columns = {}
+        masks = {}
+        for name in fields:
+            parts = [t.columns[name] for t in tables]
+            if all(isinstance(p, RaggedColumn) for p in parts):
+                columns[name], masks[name] = RaggedColumn.concat(parts), None
+            elif all(isinstance(p, np.ndarray) and p.dtype == parts[0].dtype for p in parts):
+                columns[name] = np.concatenate(parts)
+                if any(t.masks[name] is not None for t in tables):
+                    masks[name] = np.concatenate([
+                        t.masks[name] if t.masks[name] is not None else np.zeros(t.n_rows, dtype=np.bool_)
+                        for t in tables])
+                else:
+                    masks[name] = None
+            else:
+                values = []
+                for t in tables:
+                    values.extend(t.values(name))
+                columns[name], masks[name] = _pack_column(values)
+        return cls(fields, columns, masks, sum(t.n_rows for t in tables))
+
+    def __len__(self):
+        return self.n_rows
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def values(self, name):
+        """返回一列的Python值列表（None按掩码还原）"""
+        column = self.columns[name]
+        if isinstance(column, RaggedColumn):
+            return column.tolist()
+        if not isinstance(column, np.ndarray):
+            return list(column)
+        values = column.tolist()
+        mask = self.masks[name]
+        if mask is not None:
+            for i in np.flatnonzero(mask).tolist():
+                values[i] = None
+        return values
+
+    def set_values(self, name, values):
+        if name not in self.columns:
+            self.fields.append(name)
+        self.columns[name], self.masks[name] = _pack_column(values)
+
+    def value(self, name, i):
+        column = self.columns[name]
+        if isinstance(column, RaggedColumn):
+            return column[i].tolist()
+        if not isinstance(column, np.ndarray):
+            return column[i]
+        mask = self.masks[name]
+        if mask is not None and mask[i]:
+            return None
+        return column.item(i)
+
+    def row(self, i):
+        return {name: self.value(name, i) for name in self.fields}
+
+    def sequence(self, name, i):
+        """第i行的累加值序列（float64数组切片，不复制）"""
+        return self.columns[name][i]
+
+    def take(self, indices):
+        """按行号选取（并按给定顺序排列）部分行"""
+        indices = np.asarray(indices, dtype=np.intp)
+        columns = {}
+        masks = {}
+        for name in self.fields:
+            column = self.columns[name]
+            mask = self.masks[name]
+            if isinstance(column, (np.ndarray, RaggedColumn)):
+                columns[name] = column[indices] if isinstance(column, np.ndarray) else column.take(indices)
+            else:
+                columns[name] = [column[i] for i in indices.tolist()]
+            masks[name] = mask[indices] if mask is not None else None
+        return ResultTable(self.fields, columns, masks, len(indices))
+
+
+cdef struct KernelParams:
+    # calculate_batch_cy 的标量参数（字符串参数已转换为整数编码/布尔）
+    double after_gt_end_ratio
+    double after_gt_start_ratio
+    double continuous_abs_threshold
+    double inc_rate
+    bint is_forward
+    int loss_type_code
+    int n_days
+    int n_days_max
+    bint new_after_high2_and
+    int new_after_high2_range
+    int new_after_high2_span
+    int new_after_high2_start
+    bint new_after_high_and
+    int new_after_high_range
+    int new_after_high_span
+    int new_after_high_start
+    bint new_after_low2_and
+    int new_after_low2_range
+    int new_after_low2_span
+    int new_after_low2_start
+    bint new_after_low_and
+    int new_after_low_range
+    int new_after_low_span
+    int new_after_low_start
+    bint new_before_high2_and
+    int new_before_high2_range
+    int new_before_high2_span
+    int new_before_high2_start
+    bint new_before_high_and
+    int new_before_high_range
+    int new_before_high_span
+    int new_before_high_start
+    bint new_before_low2_and
+    int new_before_low2_range
+    int new_before_low2_span
+    int new_before_low2_start
+    bint new_before_low_and
+    int new_before_low_range
+    int new_before_low_span
+    int new_before_low_start
+    int num_dates
+    int op_days
+    double ops_change_input
+    # 列式选股第一遍的公式前置条件（prefilter_n_ops 为0时不预筛选），见 compile_formula_prefilter
+    const int* prefilter_ops
+    const double* prefilter_args
+    int prefilter_n_ops
+    int profit_type_code
+    int run_hi  # 连续累加分段表覆盖的日期下标范围 [run_lo, run_hi]
+    int run_lo
+    int shift_days
+    int start_option_code
+    bint start_with_new_after_high2_flag
+    bint start_with_new_after_high_flag
+    bint start_with_new_after_low2_flag
+    bint start_with_new_after_low_flag
+    bint start_with_new_before_high2_flag
+    bint start_with_new_before_high_flag
+    bint start_with_new_before_low2_flag
+    bint start_with_new_before_low_flag
+    double stop_loss_after_gt_end_ratio
+    double stop_loss_after_gt_start_ratio
+    double stop_loss_inc_rate
+    bint trade_t1_mode
+    double user_range_ratio
+    double valid_abs_sum_threshold
+    int width
+
+
+cdef struct RowMetrics:
+    # 单行（股票, 结束日期）在nogil内算出的全部指标，供构造Python结果使用
+    int actual_idx
+    double actual_value
+    int adjust_days
+    double adjust_ops_incre_rate
+    double after_gt_end_change
+    double after_gt_end_value
+    double after_gt_start_change
+    double after_gt_start_value
+    int closest_idx_in_window
+    double closest_value
+    double cont_sum_neg_sum
+    double cont_sum_neg_sum_first_half
+    double cont_sum_neg_sum_second_half
+    double cont_sum_pos_sum
+    double cont_sum_pos_sum_first_half
+    double cont_sum_pos_sum_second_half
+    bint continuous_abs_is_less
+    double continuous_abs_sum_block1
+    double continuous_abs_sum_block2
+    double continuous_abs_sum_block3
+    double continuous_abs_sum_block4
+    double continuous_abs_sum_first_half
+    double continuous_abs_sum_second_half
+    double continuous_end_prev_prev_value
+    double continuous_end_prev_value
+    double continuous_end_value
+    size_t continuous_len
+    double continuous_start_next_next_value
+    double continuous_start_next_value
+    double continuous_start_value
+    int end_date_idx
+    double end_day_change
+    int end_state
+    double end_value
+    double forward_max_abs_sum_block1
+    double forward_max_abs_sum_block2
+    double forward_max_abs_sum_block3
+    double forward_max_abs_sum_block4
+    double forward_max_abs_sum_first_half
+    double forward_max_abs_sum_second_half
+    double forward_max_cont_sum_neg_sum
+    double forward_max_cont_sum_pos_sum
+    bint forward_max_continuous_abs_is_less
+    double forward_max_continuous_end_prev_prev_value
+    double forward_max_continuous_end_prev_value
+    double forward_max_continuous_end_value
+    double forward_max_continuous_start_next_next_value
+    double forward_max_continuous_start_next_value
+    double forward_max_continuous_start_value
+    long forward_max_date_idx
+    int forward_max_result_len
+    bint forward_max_valid_abs_is_less
+    double forward_max_valid_abs_sum_block1
+    double forward_max_valid_abs_sum_block2
+    double forward_max_valid_abs_sum_block3
+    double forward_max_valid_abs_sum_block4
+    double forward_max_valid_abs_sum_first_half
+    double forward_max_valid_abs_sum_second_half
+    double forward_max_valid_neg_sum
+    double forward_max_valid_pos_sum
+    int forward_max_valid_sum_len
+    double forward_min_abs_sum_block1
+    double forward_min_abs_sum_block2
+    double forward_min_abs_sum_block3
+    double forward_min_abs_sum_block4
+    double forward_min_abs_sum_first_half
+    double forward_min_abs_sum_second_half
+    double forward_min_cont_sum_neg_sum
+    double forward_min_cont_sum_pos_sum
+    bint forward_min_continuous_abs_is_less
+    double forward_min_continuous_end_prev_prev_value
+    double forward_min_continuous_end_prev_value
+    double forward_min_continuous_end_value
+    double forward_min_continuous_start_next_next_value
+    double forward_min_continuous_start_next_value
+    double forward_min_continuous_start_value
+    long forward_min_date_idx
+    int forward_min_result_len
+    bint forward_min_valid_abs_is_less
+    double forward_min_valid_abs_sum_block1
+    double forward_min_valid_abs_sum_block2
+    double forward_min_valid_abs_sum_block3
+    double forward_min_valid_abs_sum_block4
+    double forward_min_valid_abs_sum_first_half
+    double forward_min_valid_abs_sum_second_half
+    double forward_min_valid_neg_sum
+    double forward_min_valid_pos_sum
+    int forward_min_valid_sum_len
+    int has_three_consecutive_zeros
+    int hold_days
+    double increment_change
+    double increment_value
+    int max_idx_in_window
+    double max_price
+    int min_idx_in_window
+    double min_price
+    double n_days_max_value
+    bint n_max_is_max_result
+    double op_day_change
+    double ops_change
+    double ops_incre_rate
+    double ops_value
+    double prev_day_change
+    bint range_ratio_is_less
+    int start_date_idx
+    double start_value
+    bint start_with_new_after_high
+    bint start_with_new_after_high2
+    bint start_with_new_after_low
+    bint start_with_new_after_low2
+    bint start_with_new_before_high
+    bint start_with_new_before_high2
+    bint start_with_new_before_low
+    bint start_with_new_before_low2
+    double stop_and_take_after_gt_end_change
+    double stop_and_take_after_gt_start_change
+    double stop_and_take_incre_rate
+    double stop_and_take_increment_change
+    double stop_loss
+    double stop_profit_and_take_loss_change
+    double take_and_stop_after_gt_end_change
+    double take_and_stop_after_gt_start_change
+    double take_and_stop_incre_rate
+    double take_and_stop_increment_change
+    double take_profit
+    double take_profit_and_stop_loss_change
+    double take_profit_and_take_loss_change
+    bint valid_abs_is_less
+    double valid_abs_sum_block1
+    double valid_abs_sum_block2
+    double valid_abs_sum_block3
+    double valid_abs_sum_block4
+    double valid_abs_sum_first_half
+    double valid_abs_sum_second_half
+    double valid_neg_sum
+    double valid_pos_sum
+    int valid_sum_len
+
+
+cdef struct RowSeries:
+    # 单行的连续累加值/有效累加值序列
+    vector[double] cont_sum
+    vector[double] forward_max_result_c
+    vector[double] forward_min_result_c
+    vector[double] valid_sum_vec
+    vector[double] forward_max_valid_sum_vec
+    vector[double] forward_min_valid_sum_vec
+
+
+cdef struct WindowDeques:
+    # 同一只股票结束日逐日前移时复用的单调队列（滑动窗口最大/最小值）
+    # max_q/min_q 中的下标从队头到队尾递减，对应价格严格递减/严格递增；
+    # 队头之前（max_head/min_head）的元素已滑出窗口
+    int stock_idx
+    int low
+    int max_head
+    int min_head
+    vector[int] max_q
+    vector[int] min_q
+
+
+cdef struct RunTable:
+    # 一只股票在 [lo, hi] 日期区间内 diff_data 的连续累加分段（按时间顺序，即下标从 hi 向 lo）
+    # run_first[r] 为第 r 段第一天的下标，run_sum[r] 为该段累加值（与 calc_continuous_sum 的累加顺序相同）；
+    # run_of[k-lo] 为第 k 天所属的段；zero3_pos[k-lo] 为 [lo, k] 内连续0个数达到3的最大下标，没有为 -1
+    int stock_idx
+    int lo
+    int hi
+    vector[int] run_of
+    vector[int] run_first
+    vector[double] run_sum
+    vector[int] zero3_pos
+
+
+cdef void build_run_table(
+    RunTable* rt,
+    data_t[:, :] diff_data_view,
+    int stock_idx,
+    int lo,
+    int hi
+) noexcept nogil:
+    """按 calc_continuous_sum 的规则把一只股票 [lo, hi] 区间的 diff_data 分段，每只股票每次计算只做一次"""
+    cdef int k, prev
+    cdef int consecutive_zeros = 0
+    cdef double v, sign
+    cdef double last_sign = 0
+    rt.stock_idx = stock_idx
+    rt.lo = lo
+    rt.hi = hi
+    rt.run_of.resize(hi - lo + 1)
+    rt.zero3_pos.resize(hi - lo + 1)
+    rt.run_first.clear()
+    rt.run_sum.clear()
+    rt.run_first.push_back(hi)
+    rt.run_sum.push_back(0)
+    for k in range(hi, lo - 1, -1):
+        v = diff_data_view[stock_idx, k]
+        rt.zero3_pos[k - lo] = 0
+        if not isnan(v):
+            if v == 0:
+                consecutive_zeros += 1
+                if consecutive_zeros >= 3:
+                    rt.zero3_pos[k - lo] = 1
+                sign = last_sign
+            else:
+                consecutive_zeros = 0
+                sign = 1.0 if v > 0 else -1.0
+            if sign == last_sign or last_sign == 0:
+                rt.run_sum[rt.run_sum.size() - 1] += v
+            else:
+                rt.run_first.push_back(k)
+                rt.run_sum.push_back(v)
+            last_sign = sign
+        rt.run_of[k - lo] = rt.run_first.size() - 1
+    # 标记换成前缀最大下标
+    prev = -1
+    for k in range(lo, hi + 1):
+        if rt.zero3_pos[k - lo]:
+            prev = k
+        rt.zero3_pos[k - lo] = prev
+
+
+cdef bint calc_continuous_sum_runs(
+    RunTable* rt,
+    data_t[:, :] diff_data_view,
+    int stock_idx,
+    int end_idx,
+    int start_idx,
+    vector[double]& cont_sum
+) noexcept nogil:
+    """
+    与 calc_continuous_sum(diff_data[stock_idx, end_idx:start_idx+1][::-1], cont_sum) 结果相同，
+    要求 rt 已按该股票构建且 rt.lo <= end_idx、start_idx <= rt.hi。
+    只逐日扫描窗口首段（开头的0不继承窗口外的符号）和被结束日截断的尾段，中间完整的段直接取分段表。
+    """
+    cdef int k = start_idx
+    cdef int r, r_last, consecutive_zeros = 0
+    cdef double cur_sum = 0
+    cdef double last_sign = 0
+    cdef double v, sign
+    cdef bint has_three_consecutive_zeros = 0
+    cont_sum.clear()
+    if start_idx < end_idx:
+        return 0
+    # 首段：逐日扫描到第一次变号
+    while k >= end_idx:
+        v = diff_data_view[stock_idx, k]
+        if isnan(v):
+            k -= 1
+            continue
+        if v == 0:
+            consecutive_zeros += 1
+            if consecutive_zeros >= 3:
+                has_three_consecutive_zeros = 1
+            sign = last_sign
+        else:
+            sign = 1.0 if v > 0 else -1.0
+            if last_sign != 0 and sign != last_sign:
+                break
+            consecutive_zeros = 0
+        cur_sum += v
+        last_sign = sign
+        k -= 1
+    cont_sum.push_back(cur_sum)
+    if k < end_idx:
+        return has_three_consecutive_zeros
+    # 变号处是分段表中一段的开头，之后的连续0计数与整段分段一致
+    if rt.zero3_pos[k - rt.lo] >= end_idx:
+        has_three_consecutive_zeros = 1
+    r = rt.run_of[k - rt.lo]
+    while True:
+        r_last = rt.run_first[r + 1] + 1 if r + 1 < <int>rt.run_first.size() else rt.lo
+        if r_last >= end_idx:
+            cont_sum.push_back(rt.run_sum[r])
+            if r_last == end_idx:
+                break
+            r += 1
+        else:
+            # 尾段被结束日截断，按原顺序重新累加
+            cur_sum = 0
+            for k in range(rt.run_first[r], end_idx - 1, -1):
+                v = diff_data_view[stock_idx, k]
+                if not isnan(v):
+                    cur_sum += v
+            cont_sum.push_back(cur_sum)
+            break
+    return has_three_consecutive_zeros
+
+
+def continuous_sums(diff_row, int end_idx, int start_idx, int lo=-1, int hi=-1):
+    """
+    一只股票的 diff 序列在 [end_idx, start_idx] 窗口内（按时间顺序，即下标从 start_idx 向 end_idx）的连续累加值与是否有连续3个0。
+    给出 lo/hi 时用 [lo, hi] 的分段表计算（build_run_table + calc_continuous_sum_runs），否则逐日累加（calc_continuous_sum），
+    用于核对两者结果一致
+    """
+    cdef double[:, :] view = np.ascontiguousarray(diff_row, dtype=np.float64).reshape(1, -1)
+    cdef vector[double] cont_sum
+    cdef RunTable rt
+    cdef bint has_three_consecutive_zeros
+    if lo < 0:
+        has_three_consecutive_zeros = calc_continuous_sum(view[0, end_idx:start_idx + 1][::-1], cont_sum)
+    else:
+        if not (0 <= lo <= end_idx and start_idx <= hi < view.shape[1]):
+            raise ValueError("分段表区间 [lo, hi] 须覆盖窗口")
+        build_run_table(&rt, view, 0, lo, hi)
+        has_three_consecutive_zeros = calc_continuous_sum_runs(&rt, view, 0, end_idx, start_idx, cont_sum)
+    return list(cont_sum), bool(has_three_consecutive_zeros)
+
+
+cdef inline void window_advance(
+    WindowDeques* w,
+    data_t[:, :] price_data_view,
+    int stock_idx,
+    int idx,
+    int hi
+) noexcept nogil:
+    """
+    把窗口推进到 [idx, hi]。结束日按从旧到新（idx 递减）遍历时，
+    每个日期只入队一次，均摊 O(1)；换股票或顺序不连续时重建。
+    """
+    cdef int k
+    cdef double v
+    if w.stock_idx != stock_idx or idx >= w.low or w.low > hi + 1:
+        w.stock_idx = stock_idx
+        w.low = hi + 1
+        w.max_head = 0
+        w.min_head = 0
+        w.max_q.clear()
+        w.min_q.clear()
+    for k in range(w.low - 1, idx - 1, -1):
+        v = price_data_view[stock_idx, k]
+        if isnan(v):
+            continue
+        # 相等时保留下标更小（更靠近结束日）的元素，与顺序扫描取第一个极值一致
+        while <int>w.max_q.size() > w.max_head and price_data_view[stock_idx, w.max_q.back()] <= v:
+            w.max_q.pop_back()
+        w.max_q.push_back(k)
+        while <int>w.min_q.size() > w.min_head and price_data_view[stock_idx, w.min_q.back()] >= v:
+            w.min_q.pop_back()
+        w.min_q.push_back(k)
+    w.low = idx
+    while w.max_head < <int>w.max_q.size() and w.max_q[w.max_head] > hi:
+        w.max_head += 1
+    while w.min_head < <int>w.min_q.size() and w.min_q[w.min_head] > hi:
+        w.min_head += 1
+
+
+cdef inline int deque_prefix_pick(vector[int]& q, int head, int m) noexcept nogil:
+    """
+    返回窗口 [low, m] 内极值的日期下标（无有效值返回 -1）。
+    队列中第一个下标 <= m 的元素即为该前缀区间的极值，二分查找。
+    """
+    cdef int lo = head
+    cdef int hi = q.size()
+    cdef int mid
+    while lo < hi:
+        mid = (lo + hi) >> 1
+        if q[mid] <= m:
+            hi = mid
+        else:
+            lo = mid + 1
+    return q[lo] if lo < <int>q.size() else -1
+
+
+cdef inline double range_extreme_valid(
+    int[:, :, :] table,
+    data_t[:, :] price_data_view,
+    int stock_idx,
+    int lo,
+    int n,
+    bint want_max
+) noexcept nogil:
+    """
+    [lo, lo+n) 区间内非NaN、非0价格的最大值（want_max）或最小值，没有有效值返回NAN。
+    table 为加载数据时预先构建的稀疏表（第 j 层记录 [i, i+2^j) 的极值下标，-1 表示无有效值），
+    层数足够且区间在数据范围内时两次查表 O(1) 得到结果，否则退回顺序扫描。
+    """
+    cdef int j = 0
+    cdef int a, b, k
+    cdef double va, vb, v
+    cdef double best = NAN
+    if n <= 0:
+        return NAN
+    while (2 << j) <= n:
+        j += 1
+    if j < table.shape[0] and lo >= 0 and lo + n <= table.shape[2]:
+        a = table[j, stock_idx, lo]
+        b = table[j, stock_idx, lo + n - (1 << j)]
+        if a < 0:
+            return price_data_view[stock_idx, b] if b >= 0 else NAN
+        va = price_data_view[stock_idx, a]
+        if b < 0:
+            return va
+        vb = price_data_view[stock_idx, b]
+        if want_max:
+            return vb if vb > va else va
+        return vb if vb < va else va
+    # 顺序扫描时把区间截到数据范围内（模块关闭了 wraparound/boundscheck，负下标或越界不会报错）
+    for k in range(max(lo, 0), min(lo + n, <int>price_data_view.shape[1])):
+        v = price_data_view[stock_idx, k]
+        if isnan(v) or v == 0:
+            continue
+        if isnan(best) or (v > best if want_max else v < best):
+            best = v
+    return best
+
+
+# compute_row 的返回值
+cdef enum:
+    ROW_SKIPPED = 0
+    ROW_COMPUTED = 1
+    ROW_PRUNED = 2
+
+
+cdef int compute_row(
+    const KernelParams* p,
+    data_t[:, :] price_data_view,
+    data_t[:, :] diff_data_view,
+    int stock_idx,
+    int idx,
+    RowMetrics* m,
+    RowSeries* s,
+    WindowDeques* w,
+    int[:, :, :] range_max_view,
+    int[:, :, :] range_min_view,
+    np.int64_t[:, :] diff_pos_prefix_view,
+    np.int64_t[:, :] diff_neg_prefix_view,
+    RunTable* rt,
+    double* formula_vals,
+    double* prefilter_stack
+) noexcept nogil:
+    """
+    计算一只股票在一个结束日期（idx）上的全部指标，结果写入 m / s。
+    formula_vals 不为 NULL 时同时填充选股公式变量槽位。
+    创新高/创新低条件不满足时该行不输出，返回 ROW_SKIPPED；正常计算完成返回 ROW_COMPUTED。
+    prefilter_stack 不为 NULL 且 p 带有公式前置条件时，前置条件不成立的行不做止盈止损模拟，
+    止盈止损相关的公式变量槽位置为 NaN，返回 ROW_PRUNED。
+    只读参数和输出都通过指针传递，可在 prange 中由多个线程并行调用。
+    """
+    cdef double after_gt_end_ratio = p.after_gt_end_ratio
+    cdef double after_gt_start_ratio = p.after_gt_start_ratio
+    cdef double continuous_abs_threshold = p.continuous_abs_threshold
+    cdef double inc_rate = p.inc_rate
+    cdef bint is_forward = p.is_forward
+    cdef int loss_type_code = p.loss_type_code
+    cdef int n_days = p.n_days
+    cdef int n_days_max = p.n_days_max
+    cdef bint new_after_high2_and = p.new_after_high2_and
+    cdef int new_after_high2_range = p.new_after_high2_range
+    cdef int new_after_high2_span = p.new_after_high2_span
+    cdef int new_after_high2_start = p.new_after_high2_start
+    cdef bint new_after_high_and = p.new_after_high_and
+    cdef int new_after_high_range = p.new_after_high_range
+    cdef int new_after_high_span = p.new_after_high_span
+    cdef int new_after_high_start = p.new_after_high_start
+    cdef bint new_after_low2_and = p.new_after_low2_and
+    cdef int new_after_low2_range = p.new_after_low2_range
+    cdef int new_after_low2_span = p.new_after_low2_span
+    cdef int new_after_low2_start = p.new_after_low2_start
+    cdef bint new_after_low_and = p.new_after_low_and
+    cdef int new_after_low_range = p.new_after_low_range
+    cdef int new_after_low_span = p.new_after_low_span
+    cdef int new_after_low_start = p.new_after_low_start
+    cdef bint new_before_high2_and = p.new_before_high2_and
+    cdef int new_before_high2_range = p.new_before_high2_range
+    cdef int new_before_high2_span = p.new_before_high2_span
+    cdef int new_before_high2_start = p.new_before_high2_start
+    cdef bint new_before_high_and = p.new_before_high_and
+    cdef int new_before_high_range = p.new_before_high_range
+    cdef int new_before_high_span = p.new_before_high_span
+    cdef int new_before_high_start = p.new_before_high_start
+    cdef bint new_before_low2_and = p.new_before_low2_and
+    cdef int new_before_low2_range = p.new_before_low2_range
+    cdef int new_before_low2_span = p.new_before_low2_span
+    cdef int new_before_low2_start = p.new_before_low2_start
+    cdef bint new_before_low_and = p.new_before_low_and
+    cdef int new_before_low_range = p.new_before_low_range
+    cdef int new_before_low_span = p.new_before_low_span
+    cdef int new_before_low_start = p.new_before_low_start
+    cdef int num_dates = p.num_dates
+    cdef int op_days = p.op_days
+    cdef double ops_change_input = p.ops_change_input
+    cdef int profit_type_code = p.profit_type_code
+    cdef int shift_days = p.shift_days
+    cdef int start_option_code = p.start_option_code
+    cdef bint start_with_new_after_high2_flag = p.start_with_new_after_high2_flag
+    cdef bint start_with_new_after_high_flag = p.start_with_new_after_high_flag
+    cdef bint start_with_new_after_low2_flag = p.start_with_new_after_low2_flag
+    cdef bint start_with_new_after_low_flag = p.start_with_new_after_low_flag
+    cdef bint start_with_new_before_high2_flag = p.start_with_new_before_high2_flag
+    cdef bint start_with_new_before_high_flag = p.start_with_new_before_high_flag
+    cdef bint start_with_new_before_low2_flag = p.start_with_new_before_low2_flag
+    cdef bint start_with_new_before_low_flag = p.start_with_new_before_low_flag
+    cdef double stop_loss_after_gt_end_ratio = p.stop_loss_after_gt_end_ratio
+    cdef double stop_loss_after_gt_start_ratio = p.stop_loss_after_gt_start_ratio
+    cdef double stop_loss_inc_rate = p.stop_loss_inc_rate
+    cdef bint trade_t1_mode = p.trade_t1_mode
+    cdef double user_range_ratio = p.user_range_ratio
+    cdef double valid_abs_sum_threshold = p.valid_abs_sum_threshold
+    cdef int width = p.width
+    cdef double abs_v
+    cdef int actual_idx
+    cdef double actual_value
+    cdef int adjust_days
+    cdef double adjust_ops_incre_rate
+    cdef int after_gt_end_days = -1
+    cdef double after_gt_end_threshold
+    cdef double after_gt_end_value = NAN
+    cdef int after_gt_start_days = -1
+    cdef double after_gt_start_threshold
+    cdef double after_gt_start_value = NAN
+    cdef int base_idx
+    cdef int check_idx
+    cdef int closest_idx_in_window
+    cdef double closest_value
+    cdef int cont_n
+    cdef double cont_sum_neg_sum = NAN
+    cdef double cont_sum_neg_sum_first_half = NAN
+    cdef double cont_sum_neg_sum_second_half = NAN
+    cdef double cont_sum_pos_sum = NAN
+    cdef double cont_sum_pos_sum_first_half = NAN
+    cdef double cont_sum_pos_sum_second_half = NAN
+    cdef bint continuous_abs_is_less
+    cdef double continuous_abs_sum_block1
+    cdef double continuous_abs_sum_block2
+    cdef double continuous_abs_sum_block3
+    cdef double continuous_abs_sum_block4
+    cdef double continuous_abs_sum_first_half
+    cdef double continuous_abs_sum_second_half
+    cdef double continuous_end_prev_prev_value
+    cdef double continuous_end_prev_value
+    cdef double continuous_end_value
+    cdef double continuous_start_next_next_value
+    cdef double continuous_start_next_value
+    cdef double continuous_start_value
+    cdef double cur_val
+    cdef double default_ops_change
+    cdef double diff
+    cdef int end_date_idx
+    cdef double end_day_change = NAN
+    cdef int end_state
+    cdef double end_value
+    cdef double forward_max_abs_sum_block1
+    cdef double forward_max_abs_sum_block2
+    cdef double forward_max_abs_sum_block3
+    cdef double forward_max_abs_sum_block4
+    cdef double forward_max_abs_sum_first_half
+    cdef double forward_max_abs_sum_second_half
+    cdef double forward_max_cont_sum_neg_sum = NAN
+    cdef double forward_max_cont_sum_pos_sum = NAN
+    cdef bint forward_max_continuous_abs_is_less
+    cdef double forward_max_continuous_end_prev_prev_value
+    cdef double forward_max_continuous_end_prev_value
+    cdef double forward_max_continuous_end_value
+    cdef double forward_max_continuous_start_next_next_value
+    cdef double forward_max_continuous_start_next_value
+    cdef double forward_max_continuous_start_value
+    cdef int forward_max_date_idx
+    cdef int forward_max_idx_in_window
+    cdef double forward_max_price
+    cdef int forward_max_result_len
+    cdef bint forward_max_valid_abs_is_less
+    cdef double forward_max_valid_abs_sum_block1
+    cdef double forward_max_valid_abs_sum_block2
+    cdef double forward_max_valid_abs_sum_block3
+    cdef double forward_max_valid_abs_sum_block4
+    cdef double forward_max_valid_abs_sum_first_half
+    cdef double forward_max_valid_abs_sum_second_half
+    cdef double forward_max_valid_neg_sum
+    cdef double forward_max_valid_pos_sum
+    cdef int forward_max_valid_sum_len
+    cdef double forward_min_abs_sum_block1
+    cdef double forward_min_abs_sum_block2
+    cdef double forward_min_abs_sum_block3
+    cdef double forward_min_abs_sum_block4
+    cdef double forward_min_abs_sum_first_half
+    cdef double forward_min_abs_sum_second_half
+    cdef double forward_min_cont_sum_neg_sum = NAN
+    cdef double forward_min_cont_sum_pos_sum = NAN
+    cdef bint forward_min_continuous_abs_is_less
+    cdef double forward_min_continuous_end_prev_prev_value
+    cdef double forward_min_continuous_end_prev_value
+    cdef double forward_min_continuous_end_value
+    cdef double forward_min_continuous_start_next_next_value
+    cdef double forward_min_continuous_start_next_value
+    cdef double forward_min_continuous_start_value
+    cdef int forward_min_date_idx
+    cdef int forward_min_idx_in_window
+    cdef double forward_min_price
+    cdef int forward_min_result_len
+    cdef bint forward_min_valid_abs_is_less
+    cdef double forward_min_valid_abs_sum_block1
+    cdef double forward_min_valid_abs_sum_block2
+    cdef double forward_min_valid_abs_sum_block3
+    cdef double forward_min_valid_abs_sum_block4
+    cdef double forward_min_valid_abs_sum_first_half
+    cdef double forward_min_valid_abs_sum_second_half
+    cdef double forward_min_valid_neg_sum
+    cdef double forward_min_valid_pos_sum
+    cdef int forward_min_valid_sum_len
+    cdef int found_before_new_low
+    cdef int found_new_after_high
+    cdef int found_new_after_high2
+    cdef int found_new_after_low
+    cdef int found_new_after_low2
+    cdef int found_new_before_high
+    cdef int found_new_before_high2
+    cdef int found_new_before_low2
+    cdef int ge_end_state = 0
+    cdef double ge_stop_loss
+    cdef double ge_take_profit
+    cdef int gs_end_state = 0
+    cdef double gs_stop_loss
+    cdef double gs_take_profit
+    cdef int half
+    cdef int half_valid
+    # 窗口为空时为0（不能沿用上一行的值，否则结果会随同批计算了哪些行而变化）
+    cdef bint has_three_consecutive_zeros = 0
+    cdef int hold_days
+    cdef int inc_end_state = 0
+    cdef double inc_stop_loss
+    cdef double inc_take_profit
+    cdef int increment_days = -1
+    cdef double increment_threshold
+    cdef double increment_value = NAN
+    cdef int j
+    cdef int k
+    cdef int loss_days
+    cdef int loss_end_state
+    cdef double loss_ops_value
+    cdef double max_abs_val
+    cdef int max_idx_in_window
+    cdef double max_price
+    cdef double max_val
+    cdef double min_diff
+    cdef int min_idx_in_window
+    cdef double min_price
+    cdef double min_val
+    cdef int n
+    cdef double n_days_max_value = NAN
+    cdef bint n_max_is_max_result
+    cdef int n_valid
+    cdef int new_after_high2_start_idx
+    cdef int new_after_high_start_idx
+    cdef int new_after_low2_start_idx
+    cdef int new_after_low_start_idx
+    cdef int new_before_high2_start_idx
+    cdef int new_before_high_start_idx
+    cdef int new_before_low2_start_idx
+    cdef int new_before_low_start_idx
+    cdef double op_day_change = NAN  # op_days <= 0 时不计算
+    cdef int op_idx_when_take_stop_nan
+    cdef double ops_change
+    cdef double ops_incre_rate
+    cdef double ops_value
+    cdef double prefilter_value
+    cdef double prev_day_change = NAN
+    cdef double price_arr[3]
+    cdef int profit_days
+    cdef int profit_end_state
+    cdef double profit_ops_value
+    cdef int q1
+    cdef bint range_ratio_is_less
+    cdef int span_offset
+    cdef int start_date_idx
+    cdef double start_value
+    cdef bint start_with_new_after_high
+    cdef bint start_with_new_after_high2
+    cdef bint start_with_new_after_low
+    cdef bint start_with_new_after_low2
+    cdef bint start_with_new_before_high
+    cdef bint start_with_new_before_high2
+    cdef bint start_with_new_before_low
+    cdef bint start_with_new_before_low2
+    cdef double stop_and_take_incre_rate
+    cdef double stop_loss
+    cdef double stop_loss_after_gt_end_threshold
+    cdef double stop_loss_after_gt_start_threshold
+    cdef double stop_loss_inc_threshold
+    cdef double stop_loss_var
+    cdef double stop_profit_and_stop_loss_change
+    cdef double stop_profit_and_take_loss_change
+    cdef double stop_profit_var
+    cdef double take_and_stop_incre_rate
+    cdef double take_loss_var
+    cdef double take_profit
+    cdef double take_profit_and_stop_loss_change
+    cdef double take_profit_and_take_loss_change
+    cdef double take_profit_var
+    cdef double v = NAN  # AGS 止盈涨幅沿用前面循环最后取到的价格，前面循环未执行时为 NaN
+    cdef bint valid_abs_is_less
+    cdef double valid_abs_sum_block1
+    cdef double valid_abs_sum_block2
+    cdef double valid_abs_sum_block3
+    cdef double valid_abs_sum_block4
+    cdef double valid_abs_sum_first_half
+    cdef double valid_abs_sum_second_half
+    cdef double valid_neg_sum = NAN
+    cdef double valid_pos_sum = NAN
+    cdef int valid_sum_len
+    cdef int window_len
+    cdef bint use_deques
+    cdef bint use_runs
+    cdef bint use_prefix = diff_pos_prefix_view.shape[0] > 0
+    cdef vector[double] cont_sum
+    cdef vector[double] forward_max_result_c
+    cdef vector[double] forward_min_result_c
+    cdef vector[double] valid_sum_vec
+    cdef vector[double] forward_max_valid_sum_vec
+    cdef vector[double] forward_min_valid_sum_vec
+
+    # 复用行缓冲区中序列的容量
+    cont_sum.swap(s.cont_sum)
+    forward_max_result_c.swap(s.forward_max_result_c)
+    forward_min_result_c.swap(s.forward_min_result_c)
+    valid_sum_vec.swap(s.valid_sum_vec)
+    forward_max_valid_sum_vec.swap(s.forward_max_valid_sum_vec)
+    forward_min_valid_sum_vec.swap(s.forward_min_valid_sum_vec)
+
+    # --- 创前新高1起始条件判断 ---
+    if start_with_new_before_high_flag:
+        new_before_high_start_idx = idx + new_before_high_start
+        found_new_before_high = 0
+        if new_before_high_and:
+            found_new_before_high = 1
+            for span_offset in range(new_before_high_span):
+                check_idx = new_before_high_start_idx + span_offset
+                cur_val = price_data_view[stock_idx, check_idx]
+                max_val = range_extreme_valid(range_max_view, price_data_view, stock_idx, check_idx + 1, new_before_high_range, 1)
+                has_valid_value = not isnan(max_val)
+                #if stock_idx == 3:
+                    #printf(b"new_before_high_start_idx=%d, span_offset=%d\n", new_before_high_start_idx, span_offset)
+
+                #if stock_idx == 3:
+                    #printf(b"new_before_high and logic, cur_val=%f, max_val=%f\n", cur_val, max_val)
+                    #printf(b"New High Check: stock_idx=%d, span_offset=%d, new_high_span=%d, check_idx=%d, range: %d ~ %d\n", stock_idx, span_offset, new_before_high_span, check_idx, check_idx + new_before_high_range + 1, check_idx + 1)
+                if not has_valid_value or isnan(cur_val):
+                    found_new_before_high = 0
+                    continue
+                if cur_val <= max_val:
+                    found_new_before_high = 0
+                    break
+        else:
+            for span_offset in range(new_before_high_span):
+                check_idx = new_before_high_start_idx + span_offset
+                cur_val = price_data_view[stock_idx, check_idx]
+                max_val = range_extreme_valid(range_max_view, price_data_view, stock_idx, check_idx + 1, new_before_high_range, 1)
+                has_valid_value = not isnan(max_val)
+                #if stock_idx == 3:
+                    #printf(b"new_before_high_start_idx=%d, span_offset=%d\n", new_before_high_start_idx, span_offset)
+                #if stock_idx == 3:
+                    #printf(b"new_before_high or logic, cur_val=%f, max_val=%f\n", cur_val, max_val)
+                    #printf(b"New High Check: stock_idx=%d, span_offset=%d, new_high_span=%d, check_idx=%d, range: %d ~ %d\n", stock_idx, span_offset, new_before_high_span, check_idx, check_idx + new_before_high_range + 1, check_idx + 1)
+                if not has_valid_value or isnan(cur_val):
+                    continue
+                if cur_val > max_val:
+                    found_new_before_high = 1
+                    break
+        start_with_new_before_high = found_new_before_high == 1
+        # 如果没有创前新高1，跳过后续计算
+        if not start_with_new_before_high:
+            return ROW_SKIPPED
+    else:
+        start_with_new_before_high = 0
+    #if stock_idx == 0:
+        #printf(b"running1\n")
+
+    # --- 创前新高2起始条件判断 ---
+    if start_with_new_before_high2_flag:
+        new_before_high2_start_idx = idx + new_before_high2_start
+        found_new_before_high2 = 0
+        if new_before_high2_and:
+            found_new_before_high2 = 1
+            for span_offset in range(new_before_high2_span):
+                check_idx = new_before_high2_start_idx + span_offset
+                cur_val = price_data_view[stock_idx, check_idx]
+                max_val = range_extreme_valid(range_max_view, price_data_view, stock_idx, check_idx + 1, new_before_high2_range, 1)
+                has_valid_value = not isnan(max_val)
+
+                #if stock_idx == 2:
+                    #printf(b"new_before_high2 and logic, cur_val=%f, max_val=%f, has_valid_value=%d\n", cur_val, max_val, has_valid_value)
+                    #printf(b"New High2 Check: stock_idx=%d, span_offset=%d, new_high2_span=%d, check_idx=%d, range: %d ~ %d\n", stock_idx, span_offset, new_before_high2_span, check_idx, check_idx + new_before_high2_range + 1, check_idx + 1)
+                if not has_valid_value or isnan(cur_val):
+                    found_new_before_high2 = 0
+                    continue
+                if cur_val <= max_val:
+                    found_new_before_high2 = 0
+                    break
+        else:
+            for span_offset in range(new_before_high2_span):
+                check_idx = new_before_high2_start_idx + span_offset
+                cur_val = price_data_view[stock_idx, check_idx]
+                max_val = range_extreme_valid(range_max_view, price_data_view, stock_idx, check_idx + 1, new_before_high2_range, 1)
+                has_valid_value = not isnan(max_val)
+                #if stock_idx == 2:
+                    #printf(b"new_before_high2 or logic, cur_val=%f, max_val=%f, has_valid_value=%d \n", cur_val, max_val, has_valid_value)
+                    #printf(b"New High2 Check: stock_idx=%d, span_offset=%d, new_high2_span=%d, check_idx=%d, range: %d ~ %d\n", stock_idx, span_offset, new_before_high2_span, check_idx, check_idx + new_before_high2_range + 1, check_idx + 1)
+                if not has_valid_value or isnan(cur_val):
+                    continue
+                if cur_val > max_val:
+                    found_new_before_high2 = 1
+                    break
+        start_with_new_before_high2 = found_new_before_high2 == 1
+
+        #if stock_idx == 2:
+            #printf(b"stock_idx=%d, start_with_new_before_high=%d, found_new_before_high=%d, start_with_new_before_high2=%d, found_new_before_high2=%d\n", stock_idx, start_with_new_before_high, found_new_before_high, start_with_new_before_high2, found_new_before_high2)
+        # 如果没有创前新高2，跳过后续计算
+        if not start_with_new_before_high2:
+            return ROW_SKIPPED
+    else:
+        start_with_new_before_high2 = 0
+    #if stock_idx == 0:
+        #printf(b"running2\n")
+
+    # --- 创后新高起始条件判断 ---
+    if start_with_new_after_high_flag:
+        new_after_high_start_idx = idx + new_after_high_start + new_after_high_range
+        found_new_after_high = 0
+        if new_after_high_and:
+            found_new_after_high = 1
+            for span_offset in range(new_after_high_span):
+                check_idx = new_after_high_start_idx + span_offset
+                #if stock_idx == 0:
+                    #printf(b"New After High1 Check: new_after_high_start_idx=%d, check_idx=%d, span_offset=%d, new_after_high_start=%d, new_after_high_range=%d\n",new_after_high_start_idx, check_idx, span_offset, new_after_high_start, new_after_high_range)
+                    #printf(b"New After High1 Check: stock_idx=%d, new_after_high_span=%d, range: %d ~ %d\n", stock_idx, new_after_high_span, check_idx - new_after_high_range, check_idx)
+                cur_val = price_data_view[stock_idx, check_idx]
+                max_val = range_extreme_valid(range_max_view, price_data_view, stock_idx, check_idx - new_after_high_range, new_after_high_range, 1)
+                has_valid_value = not isnan(max_val)
+
+                #if stock_idx == 2:
+                    #printf(b"new_after_high and logic, cur_val=%f, max_val=%f, has_valid_value=%d\n", cur_val, max_val, has_valid_value)
+                    #printf(b"New After High Check: stock_idx=%d, span_offset=%d, new_high_span=%d, check_idx=%d, range: %d ~ %d\n", stock_idx, span_offset, new_after_high_span, check_idx, check_idx - new_after_high_range, check_idx)
+                if not has_valid_value or isnan(cur_val):
+                    found_new_after_high = 0
+                    continue
+                if cur_val <= max_val:
+                    found_new_after_high = 0
+                    break
+        else:
+            for span_offset in range(new_after_high_span):
+                check_idx = new_after_high_start_idx + span_offset
+                cur_val = price_data_view[stock_idx, check_idx]
+                max_val = range_extreme_valid(range_max_view, price_data_view, stock_idx, check_idx - new_after_high_range, new_after_high_range, 1)
+                has_valid_value = not isnan(max_val)
+                #if stock_idx == 2:
+                    #printf(b"New After High1 or Check: new_after_high_start_idx=%d, check_idx=%d, span_offset=%d, new_after_high_start=%d, new_after_high_range=%d\n",new_after_high_start_idx, check_idx, span_offset, new_after_high_start, new_after_high_range)
+                    #printf(b"New After High1 or Check: stock_idx=%d, new_after_high_span=%d, range: %d ~ %d\n", stock_idx, new_after_high_span, check_idx - new_after_high_range, check_idx)
+                #if stock_idx == 2:
+                    #printf(b"new_after_high1 or logic, cur_val=%f, max_val=%f, has_valid_value=%d \n", cur_val, max_val, has_valid_value)
+                if not has_valid_value or isnan(cur_val):
+                    continue
+                if cur_val > max_val:
+                    found_new_after_high = 1
+                    break
+        start_with_new_after_high = found_new_after_high == 1
+        # 如果没有创后新高1，跳过后续计算
+        if not start_with_new_after_high:
+            return ROW_SKIPPED
+    else:
+        start_with_new_after_high = 0
+
+    #if stock_idx == 0:
+        #printf(b"running3\n")
+
+    # --- 创后新高2起始条件判断 ---
+    if start_with_new_after_high2_flag:
+        new_after_high2_start_idx = idx + new_after_high2_start + new_after_high2_range
+        found_new_after_high2 = 0
+        if new_after_high2_and:
+            found_new_after_high2 = 1
+            for span_offset in range(new_after_high2_span):
+                check_idx = new_after_high2_start_idx + span_offset
+                cur_val = price_data_view[stock_idx, check_idx]
+                max_val = range_extreme_valid(range_max_view, price_data_view, stock_idx, check_idx - new_after_high2_range, new_after_high2_range, 1)
+                has_valid_value = not isnan(max_val)
+
+                #if stock_idx == 2:
+                    #printf(b"new_after_high2 and logic, cur_val=%f, max_val=%f, has_valid_value=%d\n", cur_val, max_val, has_valid_value)
+                    #printf(b"New After High2 Check: stock_idx=%d, span_offset=%d, new_high2_span=%d, check_idx=%d, range: %d ~ %d\n", stock_idx, span_offset, new_after_high2_span, check_idx, check_idx - new_after_high2_range, check_idx)
+                if not has_valid_value or isnan(cur_val):
+                    found_new_after_high2 = 0
+                    continue
+                if cur_val <= max_val:
+                    found_new_after_high2 = 0
+                    break
+        else:
+            for span_offset in range(new_after_high2_span):
+                check_idx = new_after_high2_start_idx + span_offset
+                cur_val = price_data_view[stock_idx, check_idx]
+                max_val = range_extreme_valid(range_max_view, price_data_view, stock_idx, check_idx - new_after_high2_range, new_after_high2_range, 1)
+                has_valid_value = not isnan(max_val)
+                #if stock_idx == 2:
+                    #printf(b"new_after_high2 or logic, cur_val=%f, max_val=%f, has_valid_value=%d \n", cur_val, max_val, has_valid_value)
+                    #printf(b"New After High2 Check: stock_idx=%d, span_offset=%d, new_high2_span=%d, check_idx=%d, range: %d ~ %d\n", stock_idx, span_offset, new_after_high2_span, check_idx, check_idx - new_after_high2_range, check_idx)
+                if not has_valid_value or isnan(cur_val):
+                    continue
+                if cur_val > max_val:
+                    found_new_after_high2 = 1
+                    break
+        start_with_new_after_high2 = found_new_after_high2 == 1
+        # 如果没有创后新高2，跳过后续计算
+        if not start_with_new_after_high2:
+            return ROW_SKIPPED
+    else:
+        start_with_new_after_high2 = 0
+
+    #if stock_idx == 2:
+        #printf(b"stock_idx=%d, start_with_new_after_high=%d, found_new_after_high=%d, start_with_new_after_high2=%d, found_new_after_high2=%d\n", stock_idx, start_with_new_after_high, found_new_after_high, start_with_new_after_high2, found_new_after_high2)
+
+    #if stock_idx == 0:
+        #printf(b"running4\n")
+
+    # --- 创前新低1起始条件判断 ---
+    if start_with_new_before_low_flag:
+        new_before_low_start_idx = idx + new_before_low_start
+        found_before_new_low = 0
+        if new_before_low_and:
+            found_before_new_low = 1
+            for span_offset in range(new_before_low_span):
+                check_idx = new_before_low_start_idx + span_offset
+                if check_idx >= price_data_view.shape[1] or check_idx + new_before_low_range >= price_data_view.shape[1]:
+                    continue
+                cur_val = price_data_view[stock_idx, check_idx]
+                min_val = range_extreme_valid(range_min_view, price_data_view, stock_idx, check_idx + 1, new_before_low_range, 0)
+                has_valid_value = not isnan(min_val)
+                if not has_valid_value or isnan(cur_val):
+                    found_before_new_low = 0
+                    break
+                if cur_val >= min_val:
+                    found_before_new_low = 0
+                    break
+        else:  # "或"逻辑
+            for span_offset in range(new_before_low_span):
+                check_idx = new_before_low_start_idx + span_offset
+                if check_idx >= price_data_view.shape[1] or check_idx + new_before_low_range >= price_data_view.shape[1]:
+                    continue
+                cur_val = price_data_view[stock_idx, check_idx]
+                min_val = range_extreme_valid(range_min_view, price_data_view, stock_idx, check_idx + 1, new_before_low_range, 0)
+                has_valid_value = not isnan(min_val)
+                if not has_valid_value or isnan(cur_val):
+                    continue
+                if cur_val < min_val:
+                    found_before_new_low = 1
+                    break
+        start_with_new_before_low = found_before_new_low == 1
+        # 如果没有创前新低1，跳过后续计算
+        if not start_with_new_before_low:
+            return ROW_SKIPPED
+    else:
+        start_with_new_before_low = 0
+    #if stock_idx == 0:
+        #printf(b"running5\n")
+
+    # --- 创前新低2起始条件判断 ---
+    if start_with_new_before_low2_flag:
+        new_before_low2_start_idx = idx + new_before_low2_start
+        found_new_before_low2 = 0
+        if new_before_low2_and:
+            found_new_before_low2 = 1
+            for span_offset in range(new_before_low2_span):
+                check_idx = new_before_low2_start_idx + span_offset
+                if check_idx >= price_data_view.shape[1] or check_idx + new_before_low2_range >= price_data_view.shape[1]:
+                    continue
+                cur_val = price_data_view[stock_idx, check_idx]
+                min_val = range_extreme_valid(range_min_view, price_data_view, stock_idx, check_idx + 1, new_before_low2_range, 0)
+                has_valid_value = not isnan(min_val)
+                if not has_valid_value or isnan(cur_val):
+                    found_new_before_low2 = 0
+                    break
+                if cur_val >= min_val:
+                    found_new_before_low2 = 0
+                    break
+        else:  # "或"逻辑
+            for span_offset in range(new_before_low2_span):
+                check_idx = new_before_low2_start_idx + span_offset
+                if check_idx >= price_data_view.shape[1] or check_idx + new_before_low2_range >= price_data_view.shape[1]:
+                    continue
+                cur_val = price_data_view[stock_idx, check_idx]
+                min_val = range_extreme_valid(range_min_view, price_data_view, stock_idx, check_idx + 1, new_before_low2_range, 0)
+                has_valid_value = not isnan(min_val)
+                if not has_valid_value or isnan(cur_val):
+                    continue
+                if cur_val < min_val:
+                    found_new_before_low2 = 1
+                    break
+        start_with_new_before_low2 = found_new_before_low2 == 1
+        # 如果没有创前新低2，跳过后续计算
+        if not start_with_new_before_low2:
+            return ROW_SKIPPED
+    else:
+        start_with_new_before_low2 = 0
+
+    #if stock_idx == 0:
+        #printf(b"running6\n")
+
+    # --- 创后新低1起始条件判断 ---
+    if start_with_new_after_low_flag:
+        new_after_low_start_idx = idx + new_after_low_start + new_after_low_range
+        found_new_after_low = 0
+        if new_after_low_and:
+            found_new_after_low = 1
+            for span_offset in range(new_after_low_span):
+                check_idx = new_after_low_start_idx + span_offset
+                if check_idx >= price_data_view.shape[1] or check_idx + new_after_low_range >= price_data_view.shape[1]:
+                    continue
+                cur_val = price_data_view[stock_idx, check_idx]
+                min_val = range_extreme_valid(range_min_view, price_data_view, stock_idx, check_idx - new_after_low_range, new_after_low_range, 0)
+                has_valid_value = not isnan(min_val)
+                if not has_valid_value or isnan(cur_val):
+                    found_new_after_low = 0
+                    break
+                if cur_val >= min_val:
+                    found_new_after_low = 0
+                    break
+        else:  # "或"逻辑
+            for span_offset in range(new_after_low_span):
+                check_idx = new_after_low_start_idx + span_offset
+                if check_idx >= price_data_view.shape[1] or check_idx + new_after_low_range >= price_data_view.shape[1]:
+                    continue
+                cur_val = price_data_view[stock_idx, check_idx]
+                min_val = range_extreme_valid(range_min_view, price_data_view, stock_idx, check_idx - new_after_low_range, new_after_low_range, 0)
+                has_valid_value = not isnan(min_val)
+                if not has_valid_value or isnan(cur_val):
+                    continue
+                if cur_val < min_val:
+                    found_new_after_low = 1
+                    break
+        start_with_new_after_low = found_new_after_low == 1
+        # 如果没有创后新低1，跳过后续计算
+        if not start_with_new_after_low:
+            return ROW_SKIPPED
+
+    else:
+        start_with_new_after_low = 0
+
+    #if stock_idx == 0:
+        #printf(b"running7\n")
+
+    # --- 创后新低2起始条件判断 ---
+    if start_with_new_after_low2_flag:
+        new_after_low2_start_idx = idx + new_after_low2_start + new_after_low2_range
+        found_new_after_low2 = 0
+        if new_after_low2_and:
+            found_new_after_low2 = 1
+            for span_offset in range(new_after_low2_span):
+                check_idx = new_after_low2_start_idx + span_offset
+                if check_idx >= price_data_view.shape[1] or check_idx + new_after_low2_range >= price_data_view.shape[1]:
+                    continue
+                cur_val = price_data_view[stock_idx, check_idx]
+                min_val = range_extreme_valid(range_min_view, price_data_view, stock_idx, check_idx - new_after_low2_range, new_after_low2_range, 0)
+                has_valid_value = not isnan(min_val)
+                if not has_valid_value or isnan(cur_val):
+                    found_new_after_low2 = 0
+                    break
+                if cur_val >= min_val:
+                    found_new_after_low2 = 0
+                    break
+        else:  # "或"逻辑
+            for span_offset in range(new_after_low2_span):
+                check_idx = new_after_low2_start_idx + span_offset
+                if check_idx >= price_data_view.shape[1] or check_idx + new_after_low2_range >= price_data_view.shape[1]:
+                    continue
+                cur_val = price_data_view[stock_idx, check_idx]
+                min_val = range_extreme_valid(range_min_view, price_data_view, stock_idx, check_idx - new_after_low2_range, new_after_low2_range, 0)
+                has_valid_value = not isnan(min_val)
+                if not has_valid_value or isnan(cur_val):
+                    continue
+                if cur_val < min_val:
+                    found_new_after_low2 = 1
+                    break
+        start_with_new_after_low2 = found_new_after_low2 == 1
+        # 如果没有创后新低2，跳过后续计算
+        if not start_with_new_after_low2:
+            return ROW_SKIPPED
+    else:
+        start_with_new_after_low2 = 0
+
+    #if stock_idx == 0:
+        #printf(b"running1\n")
+
+    # 原有的with nogil内容
+    end_date_idx = idx
+    start_date_idx = end_date_idx + width
+    max_price = -1e308
+    min_price = 1e308
+    max_idx_in_window = -1
+    min_idx_in_window = -1
+    window_len = width + 1
+    use_deques = start_date_idx < num_dates
+    if use_deques:
+        # 单调队列滑动窗口：相邻结束日的窗口只差首尾两天
+        window_advance(w, price_data_view, stock_idx, end_date_idx, start_date_idx)
+        k = deque_prefix_pick(w.max_q, w.max_head, start_date_idx)
+        if k >= 0:
+            max_price = price_data_view[stock_idx, k]
+            max_idx_in_window = k - end_date_idx
+        k = deque_prefix_pick(w.min_q, w.min_head, start_date_idx)
+        if k >= 0:
+            min_price = price_data_view[stock_idx, k]
+            min_idx_in_window = k - end_date_idx
+    else:
+        for j in range(window_len):
+            if not isnan(price_data_view[stock_idx, end_date_idx + j]):
+                if price_data_view[stock_idx, end_date_idx + j] > max_price:
+                    max_price = price_data_view[stock_idx, end_date_idx + j]
+                    max_idx_in_window = j
+                if price_data_view[stock_idx, end_date_idx + j] < min_price:
+                    min_price = price_data_view[stock_idx, end_date_idx + j]
+                    min_idx_in_window = j
+
+    # 检查是否找到了有效值，如果没有找到则设置为nan
+    if max_idx_in_window == -1:
+        max_price = NAN
+    if min_idx_in_window == -1:
+        min_price = NAN
+
+    end_value = price_data_view[stock_idx, end_date_idx]
+    start_value = price_data_view[stock_idx, start_date_idx]
+
+    # 计算最接近值
+    closest_value = NAN
+    closest_idx_in_window = -1
+    if not isnan(end_value):
+        min_diff = 1e308
+        for j in range(1, window_len):  # j=0为结束日自身，跳过
+            if not isnan(price_data_view[stock_idx, end_date_idx + j]):
+                diff = fabs(price_data_view[stock_idx, end_date_idx + j] - end_value)
+                if diff < min_diff:
+                    min_diff = diff
+                    closest_value = price_data_view[stock_idx, end_date_idx + j]
+                    closest_idx_in_window = j
+
+    # 确定实际开始值索引
+    if start_option_code == 1:
+        base_idx = end_date_idx + max_idx_in_window if max_idx_in_window >= 0 else -1
+    elif start_option_code == 2:
+        base_idx = end_date_idx + min_idx_in_window if min_idx_in_window >= 0 else -1
+    elif start_option_code == 3:
+        base_idx = end_date_idx + closest_idx_in_window if closest_idx_in_window >= 0 else -1
+    else:
+        base_idx = start_date_idx
+
+    actual_idx = base_idx - shift_days if base_idx >= 0 else -1
+    actual_value = price_data_view[stock_idx, actual_idx] if actual_idx >= 0 and actual_idx < num_dates else NAN
+
+
+    # 计算连续累加值
+    use_runs = end_date_idx >= p.run_lo and actual_idx <= p.run_hi
+    if use_runs and rt.stock_idx != stock_idx:
+        build_run_table(rt, diff_data_view, stock_idx, p.run_lo, p.run_hi)
+    if actual_idx >= 0 and actual_idx >= end_date_idx:
+        if use_runs:
+            has_three_consecutive_zeros = calc_continuous_sum_runs(rt, diff_data_view, stock_idx, end_date_idx, actual_idx, cont_sum)
+        else:
+            has_three_consecutive_zeros = calc_continuous_sum(diff_data_view[stock_idx, end_date_idx:actual_idx+1][::-1], cont_sum)
+        if has_three_consecutive_zeros:
+            cont_sum.clear()
+    else:
+        cont_sum.clear()
+    # 计算连续累加值正加和与负加和
+    if use_prefix and cont_sum.size() > 0:
+        prefix_pos_neg_sum(diff_pos_prefix_view, diff_neg_prefix_view, stock_idx,
+                           end_date_idx, min(actual_idx + 1, num_dates), &cont_sum_pos_sum, &cont_sum_neg_sum)
+    else:
+        calc_pos_neg_sum(cont_sum, &cont_sum_pos_sum, &cont_sum_neg_sum)
+    # 注意：cont_sum_pos_sum, cont_sum_neg_sum 使用了 round_to_2_nan，需要在Python层处理
+
+    # 计算连续累加值正负加值的前一半、后一半累加值
+    calc_pos_neg_sum_halves(cont_sum, &cont_sum_pos_sum_first_half, &cont_sum_pos_sum_second_half, &cont_sum_neg_sum_first_half, &cont_sum_neg_sum_second_half)
+    # 注意：cont_sum_pos_sum_first_half, cont_sum_pos_sum_second_half, cont_sum_neg_sum_first_half, cont_sum_neg_sum_second_half 使用了 round_to_2_nan，需要在Python层处理
+
+    # 计算向前最大连续累加值
+    if is_forward and actual_idx > 0:
+        forward_max_price = -1e308
+        forward_min_price = 1e308
+        forward_max_idx_in_window = -1
+        forward_min_idx_in_window = -1
+        if use_deques and actual_idx - 1 <= start_date_idx:
+            # [end_date_idx, actual_idx) 是当前窗口的前缀，直接在单调队列上查
+            k = deque_prefix_pick(w.max_q, w.max_head, actual_idx - 1)
+            if k >= 0:
+                forward_max_price = price_data_view[stock_idx, k]
+                forward_max_idx_in_window = k - end_date_idx
+            k = deque_prefix_pick(w.min_q, w.min_head, actual_idx - 1)
+            if k >= 0:
+                forward_min_price = price_data_view[stock_idx, k]
+                forward_min_idx_in_window = k - end_date_idx
+        else:
+            window = price_data_view[stock_idx, end_date_idx:actual_idx]
+            for j in range(window.shape[0]):
+                v = window[j]
+                if not isnan(v):
+                    if v > forward_max_price:
+                        forward_max_price = v
+                        forward_max_idx_in_window = j
+                    if v < forward_min_price:
+                        forward_min_price = v
+                        forward_min_idx_in_window = j
+        forward_max_date_idx = end_date_idx + forward_max_idx_in_window if forward_max_idx_in_window >= 0 else -1
+        forward_min_date_idx = end_date_idx + forward_min_idx_in_window if forward_min_idx_in_window >= 0 else -1
+
+        # 2. 计算向前最大连续累加值
+        if forward_max_idx_in_window >= 0 and not has_three_consecutive_zeros:
+            if use_runs:
+                calc_continuous_sum_runs(rt, diff_data_view, stock_idx, end_date_idx, forward_max_date_idx - 1, forward_max_result_c)
+            else:
+                calc_continuous_sum(
+                    diff_data_view[stock_idx, end_date_idx:forward_max_date_idx][::-1],
+                    forward_max_result_c
+                )
+        else:
+            forward_max_result_c.clear()
+
+        # 3. 计算向前最小连续累加值
+        if forward_min_idx_in_window >= 0 and not has_three_consecutive_zeros:
+            if use_runs:
+                calc_continuous_sum_runs(rt, diff_data_view, stock_idx, end_date_idx, forward_min_date_idx - 1, forward_min_result_c)
+            else:
+                calc_continuous_sum(
+                    diff_data_view[stock_idx, end_date_idx:forward_min_date_idx][::-1],
+                    forward_min_result_c
+                )
+        else:
+            forward_min_result_c.clear()
+    else:
+        forward_max_result_c.clear()
+        forward_min_result_c.clear()
+        forward_max_date_idx = -1
+        forward_min_date_idx = -1
+
+    #计算向前最大最小连续累加值正加和与负加和
+    if is_forward:
+        if use_prefix and forward_max_result_c.size() > 0:
+            prefix_pos_neg_sum(diff_pos_prefix_view, diff_neg_prefix_view, stock_idx, end_date_idx,
+                               min(forward_max_date_idx, num_dates), &forward_max_cont_sum_pos_sum, &forward_max_cont_sum_neg_sum)
+        else:
+            calc_pos_neg_sum(forward_max_result_c, &forward_max_cont_sum_pos_sum, &forward_max_cont_sum_neg_sum)
+        if use_prefix and forward_min_result_c.size() > 0:
+            prefix_pos_neg_sum(diff_pos_prefix_view, diff_neg_prefix_view, stock_idx, end_date_idx,
+                               min(forward_min_date_idx, num_dates), &forward_min_cont_sum_pos_sum, &forward_min_cont_sum_neg_sum)
+        else:
+            calc_pos_neg_sum(forward_min_result_c, &forward_min_cont_sum_pos_sum, &forward_min_cont_sum_neg_sum)
+    else:
+        forward_max_cont_sum_pos_sum = NAN
+        forward_max_cont_sum_neg_sum = NAN
+        forward_min_cont_sum_pos_sum = NAN
+        forward_min_cont_sum_neg_sum = NAN
+    # 注意：forward_max_cont_sum_pos_sum, forward_max_cont_sum_neg_sum 使用了 round_to_2_nan，需要在Python层处理
+    # 注意：forward_min_cont_sum_pos_sum, forward_min_cont_sum_neg_sum 使用了 round_to_2_nan，需要在Python层处理
+
+    #if stock_idx == 0:
+        #printf(b"running2\n")
+
+    # 主连续累加值的有效累加值及正负加和
+    valid_sum_vec.clear()
+    calc_valid_sum_and_pos_neg(
+        cont_sum, valid_sum_vec, &valid_sum_len, &valid_pos_sum, &valid_neg_sum)
+
+    n = cont_sum.size()
+    half = int(round(n / 2.0))
+    q1 = <int>ceil(n / 4.0)
+    continuous_abs_sum_first_half = 0
+    continuous_abs_sum_second_half = 0
+    continuous_abs_sum_block1 = 0
+    continuous_abs_sum_block2 = 0
+    continuous_abs_sum_block3 = 0
+    continuous_abs_sum_block4 = 0
+    # 前一半
+    for j in range(half):
+        continuous_abs_sum_first_half += fabs(cont_sum[j])
+    # 后一半
+    for j in range(n - half, n):
+        continuous_abs_sum_second_half += fabs(cont_sum[j])
+    # block1: 前q1
+    for j in range(min(q1, n)):
+        continuous_abs_sum_block1 += fabs(cont_sum[j])
+    # block2: q1~2q1
+    for j in range(q1, min(2*q1, n)):
+        continuous_abs_sum_block2 += fabs(cont_sum[j])
+    # block4: 从后往前q1
+    for j in range(n-1, max(n-1-q1, -1), -1):
+        continuous_abs_sum_block4 += fabs(cont_sum[j])
+    # block3: 再往前q1
+    for j in range(n-1-q1, max(n-1-2*q1, -1), -1):
+        continuous_abs_sum_block3 += fabs(cont_sum[j])
+    # 移除 round_to_2 调用，保持原始精度
+
+    # 计算向前最大最小连续累加值
+    if is_forward:
+        # 向前最大连续累加值绝对值数组长度，前一半绝对值之和、后一半绝对值之和
+        forward_max_result_len = forward_max_result_c.size()
+        if forward_max_result_len > 0:
+            n = forward_max_result_len
+            half = int(round(n / 2.0))
+            q1 = <int>ceil(n / 4.0)
+            forward_max_abs_sum_first_half = 0
+            forward_max_abs_sum_second_half = 0
+            forward_max_abs_sum_block1 = 0
+            forward_max_abs_sum_block2 = 0
+            forward_max_abs_sum_block3 = 0
+            forward_max_abs_sum_block4 = 0
+            # 前一半
+            for j in range(half):
+                forward_max_abs_sum_first_half += fabs(forward_max_result_c[j])
+            # 后一半
+            for j in range(n - half, n):
+                forward_max_abs_sum_second_half += fabs(forward_max_result_c[j])
+            # block1: 前q1
+            for j in range(min(q1, n)):
+                forward_max_abs_sum_block1 += fabs(forward_max_result_c[j])
+            # block2: q1~2q1
+            for j in range(q1, min(2*q1, n)):
+                forward_max_abs_sum_block2 += fabs(forward_max_result_c[j])
+            # block4: 从后往前q1
+            for j in range(n-1, max(n-1-q1, -1), -1):
+                forward_max_abs_sum_block4 += fabs(forward_max_result_c[j])
+            # block3: 再往前q1
+            for j in range(n-1-q1, max(n-1-2*q1, -1), -1):
+                forward_max_abs_sum_block3 += fabs(forward_max_result_c[j])
+            # 移除 round_to_2 调用，保持原始精度
+        else:
+            forward_max_abs_sum_first_half = NAN
+            forward_max_abs_sum_second_half = NAN
+            forward_max_abs_sum_block1 = NAN
+            forward_max_abs_sum_block2 = NAN
+            forward_max_abs_sum_block3 = NAN
+            forward_max_abs_sum_block4 = NAN
+
+        # 向前最小有效累加值数组长度，前一半绝对值之和、后一半绝对值之和
+        forward_min_result_len = forward_min_result_c.size()
+        if forward_min_result_len > 0:
+            n = forward_min_result_len
+            half = int(round(n / 2.0))
+            q1 = <int>ceil(n / 4.0)
+            forward_min_abs_sum_first_half = 0
+            forward_min_abs_sum_second_half = 0
+            forward_min_abs_sum_block1 = 0
+            forward_min_abs_sum_block2 = 0
+            forward_min_abs_sum_block3 = 0
+            forward_min_abs_sum_block4 = 0
+            # 前一半
+            for j in range(half):
+                forward_min_abs_sum_first_half += fabs(forward_min_result_c[j])
+            # 后一半
+            for j in range(n - half, n):
+                forward_min_abs_sum_second_half += fabs(forward_min_result_c[j])
+            # block1: 前q1
+            for j in range(min(q1, n)):
+                forward_min_abs_sum_block1 += fabs(forward_min_result_c[j])
+            # block2: q1~2q1
+            for j in range(q1, min(2*q1, n)):
+                forward_min_abs_sum_block2 += fabs(forward_min_result_c[j])
+            # block4: 从后往前q1
+            for j in range(n-1, max(n-1-q1, -1), -1):
+                forward_min_abs_sum_block4 += fabs(forward_min_result_c[j])
+            # block3: 再往前q1
+            for j in range(n-1-q1, max(n-1-2*q1, -1), -1):
+                forward_min_abs_sum_block3 += fabs(forward_min_result_c[j])
+            # 移除 round_to_2 调用，保持原始精度
+        else:
+            forward_min_abs_sum_first_half = NAN
+            forward_min_abs_sum_second_half = NAN
+            forward_min_abs_sum_block1 = NAN
+            forward_min_abs_sum_block2 = NAN
+            forward_min_abs_sum_block3 = NAN
+            forward_min_abs_sum_block4 = NAN
+
+    else:
+        forward_max_result_len = 0
+        forward_max_abs_sum_first_half = NAN
+        forward_max_abs_sum_second_half = NAN
+        forward_max_abs_sum_block1 = NAN
+        forward_max_abs_sum_block2 = NAN
+        forward_max_abs_sum_block3 = NAN
+        forward_max_abs_sum_block4 = NAN
+        forward_min_result_len = 0
+        forward_min_abs_sum_first_half = NAN
+        forward_min_abs_sum_second_half = NAN
+        forward_min_abs_sum_block1 = NAN
+        forward_min_abs_sum_block2 = NAN
+        forward_min_abs_sum_block3 = NAN
+        forward_min_abs_sum_block4 = NAN
+
+    # 计算正累加和和负累加和
+    # 向前最大有效累加值的正负加和
+    forward_max_valid_sum_vec.clear()
+    if is_forward and forward_max_result_c.size() > 0:
+        calc_valid_sum_and_pos_neg(
+            forward_max_result_c,
+            forward_max_valid_sum_vec, &forward_max_valid_sum_len,
+            &forward_max_valid_pos_sum, &forward_max_valid_neg_sum)
+        # 注意：forward_max_valid_pos_sum, forward_max_valid_neg_sum 使用了 round_to_2_nan，需要在Python层处理
+    else:
+        forward_max_valid_sum_len = 0
+        forward_max_valid_pos_sum = NAN
+        forward_max_valid_neg_sum = NAN
+
+    # 向前最小有效累加值的正负加和
+    forward_min_valid_sum_vec.clear()
+    if is_forward and forward_min_result_c.size() > 0:
+        calc_valid_sum_and_pos_neg(
+            forward_min_result_c,
+            forward_min_valid_sum_vec, &forward_min_valid_sum_len,
+            &forward_min_valid_pos_sum, &forward_min_valid_neg_sum)
+        # 注意：forward_min_valid_pos_sum, forward_min_valid_neg_sum 使用了 round_to_2_nan，需要在Python层处理
+    else:
+        forward_min_valid_sum_len = 0
+        forward_min_valid_pos_sum = NAN
+        forward_min_valid_neg_sum = NAN
+
+    # 连续累加值绝对值最大值判断
+    max_abs_val = 0
+    if continuous_abs_threshold > 0 and cont_sum.size() > 0:
+        for j in range(cont_sum.size()):
+            abs_v = fabs(cont_sum[j])
+            if abs_v > max_abs_val:
+                max_abs_val = abs_v
+        continuous_abs_is_less = max_abs_val < continuous_abs_threshold
+    else:
+        continuous_abs_is_less = False
+
+    # 有效累加值绝对值最大值判断
+    valid_max_abs_val = 0
+    if valid_abs_sum_threshold > 0 and valid_sum_len > 0:
+        for j in range(valid_sum_len):
+            abs_v = fabs(valid_sum_vec[j])
+            if abs_v > valid_max_abs_val:
+                valid_max_abs_val = abs_v
+        valid_abs_is_less = valid_max_abs_val < valid_abs_sum_threshold
+    else:
+        valid_abs_is_less = False
+
+    # 向前最小连续累加值绝对值最大值判断
+    forward_min_max_abs_val = 0
+    if is_forward and continuous_abs_threshold > 0 and forward_min_result_c.size() > 0:
+        for j in range(forward_min_result_c.size()):
+            abs_v = fabs(forward_min_result_c[j])
+            if abs_v > forward_min_max_abs_val:
+                forward_min_max_abs_val = abs_v
+        forward_min_continuous_abs_is_less = forward_min_max_abs_val < continuous_abs_threshold
+    else:
+        forward_min_continuous_abs_is_less = False
+
+    # 向前最小有效累加值绝对值最大值判断
+    forward_min_valid_max_abs_val = 0
+    if is_forward and valid_abs_sum_threshold > 0 and forward_min_valid_sum_len > 0:
+        for j in range(forward_min_valid_sum_len):
+            abs_v = fabs(forward_min_valid_sum_vec[j])
+            if abs_v > forward_min_valid_max_abs_val:
+                forward_min_valid_max_abs_val = abs_v
+        forward_min_valid_abs_is_less = forward_min_valid_max_abs_val < valid_abs_sum_threshold
+    else:
+        forward_min_valid_abs_is_less = False
+
+    # 向前最大连续累加值绝对值最大值判断
+    forward_max_max_abs_val = 0
+    if is_forward and continuous_abs_threshold > 0 and forward_max_result_c.size() > 0:
+        for j in range(forward_max_result_c.size()):
+            abs_v = fabs(forward_max_result_c[j])
+            if abs_v > forward_max_max_abs_val:
+                forward_max_max_abs_val = abs_v
+        forward_max_continuous_abs_is_less = forward_max_max_abs_val < continuous_abs_threshold
+    else:
+        forward_max_continuous_abs_is_less = False
+
+    # 向前最大有效累加值绝对值最大值判断
+    forward_max_valid_max_abs_val = 0
+    if is_forward and valid_abs_sum_threshold > 0 and forward_max_valid_sum_len > 0:
+        for j in range(forward_max_valid_sum_len):
+            abs_v = fabs(forward_max_valid_sum_vec[j])
+            if abs_v > forward_max_valid_max_abs_val:
+                forward_max_valid_max_abs_val = abs_v
+        forward_max_valid_abs_is_less = forward_max_valid_max_abs_val < valid_abs_sum_threshold
+    else:
+        forward_max_valid_abs_is_less = False
+
+
+    # 计算continuous_len
+    continuous_len = cont_sum.size()
+
+    # 前n_days_max区间最大值
+    n_days_max_value = NAN
+    if n_days_max > 0 and end_date_idx + n_days_max <= num_dates:
+        if use_deques and n_days_max - 1 <= width:
+            k = deque_prefix_pick(w.max_q, w.max_head, end_date_idx + n_days_max - 1)
+            n_days_max_value = price_data_view[stock_idx, k] if k >= 0 else NAN
+        else:
+            maxv = -1e308
+            for j in range(n_days_max):
+                v = price_data_view[stock_idx, end_date_idx + j]
+                if not isnan(v) and v > maxv:
+                    maxv = v
+            n_days_max_value = maxv if maxv > -1e308 else NAN
+
+    # 计算结束地址前1日涨跌幅和结束日涨跌幅
+    prev_day_change = NAN
+    end_day_change = NAN
+
+    # 只用到结束日及前两日的价格
+    for j in range(min(window_len, 3)):
+        price_arr[j] = price_data_view[stock_idx, end_date_idx + j]
+
+    # 在nogil区域之前计算长度
+    price_arr_len = window_len
+
+    if price_arr_len >= 3:
+        if price_arr[2] != 0 and not isnan(price_arr[2]):
+            prev_day_change = ((price_arr[1] - price_arr[2]) / price_arr[2]) * 100  # 移除 round_to_2
+        if price_arr[1] != 0 and not isnan(price_arr[1]):
+            end_day_change = ((price_arr[0] - price_arr[1]) / price_arr[1]) * 100  # 移除 round_to_2
+    elif price_arr_len == 2:
+        if price_arr[1] != 0 and not isnan(price_arr[1]):
+            end_day_change = ((price_arr[0] - price_arr[1]) / price_arr[1]) * 100  # 移除 round_to_2
+
+    # 有效累加值分块绝对值之和
+    if valid_sum_len > 0:
+        valid_abs_sum_first_half = 0
+        valid_abs_sum_second_half = 0
+        valid_abs_sum_block1 = 0
+        valid_abs_sum_block2 = 0
+        valid_abs_sum_block3 = 0
+        valid_abs_sum_block4 = 0
+        n_valid = valid_sum_len
+        half_valid = int(round(n_valid / 2.0))
+        q1 = <int>ceil(n_valid / 4.0)
+        # 前一半
+        for j in range(half_valid):
+            valid_abs_sum_first_half += fabs(valid_sum_vec[j])
+        # 后一半
+        for j in range(n_valid - half_valid, n_valid):
+            valid_abs_sum_second_half += fabs(valid_sum_vec[j])
+        # block1: 前q1
+        for j in range(min(q1, n_valid)):
+            valid_abs_sum_block1 += fabs(valid_sum_vec[j])
+        # block2: q1~2q1
+        for j in range(q1, min(2*q1, n_valid)):
+            valid_abs_sum_block2 += fabs(valid_sum_vec[j])
+        # block4: 从后往前q1
+        for j in range(n_valid-1, max(n_valid-1-q1, -1), -1):
+            valid_abs_sum_block4 += fabs(valid_sum_vec[j])
+        # block3: 再往前q1
+        for j in range(n_valid-1-q1, max(n_valid-1-2*q1, -1), -1):
+            valid_abs_sum_block3 += fabs(valid_sum_vec[j])
+        # 移除 round_to_2 调用，保持原始精度
+    else:
+        valid_abs_sum_first_half = NAN
+        valid_abs_sum_second_half = NAN
+        valid_abs_sum_block1 = NAN
+        valid_abs_sum_block2 = NAN
+        valid_abs_sum_block3 = NAN
+        valid_abs_sum_block4 = NAN
+
+    # 计算向前最大有效连续累加值的分块和绝对值之和（全部在Cython区完成）
+    forward_max_valid_abs_sum_first_half = 0
+    forward_max_valid_abs_sum_second_half = 0
+    forward_max_valid_abs_sum_block1 = 0
+    forward_max_valid_abs_sum_block2 = 0
+    forward_max_valid_abs_sum_block3 = 0
+    forward_max_valid_abs_sum_block4 = 0
+    if is_forward and forward_max_valid_sum_len > 0:
+        n = forward_max_valid_sum_len
+        half = int(round(n / 2.0))
+        q1 = <int>ceil(n / 4.0)
+        # 前一半
+        for j in range(half):
+            forward_max_valid_abs_sum_first_half += fabs(forward_max_valid_sum_vec[j])
+        # 后一半
+        for j in range(n - half, n):
+            forward_max_valid_abs_sum_second_half += fabs(forward_max_valid_sum_vec[j])
+        # block1: 前q1
+        for j in range(min(q1, n)):
+            forward_max_valid_abs_sum_block1 += fabs(forward_max_valid_sum_vec[j])
+        # block2: q1~2q1
+        for j in range(q1, min(2*q1, n)):
+            forward_max_valid_abs_sum_block2 += fabs(forward_max_valid_sum_vec[j])
+        # block4: 从后往前q1
+        for j in range(n-1, max(n-1-q1, -1), -1):
+            forward_max_valid_abs_sum_block4 += fabs(forward_max_valid_sum_vec[j])
+        # block3: 再往前q1
+        for j in range(n-1-q1, max(n-1-2*q1, -1), -1):
+            forward_max_valid_abs_sum_block3 += fabs(forward_max_valid_sum_vec[j])
+        # 移除 round_to_2 调用，保持原始精度
+    else:
+        forward_max_valid_abs_sum_first_half = NAN
+        forward_max_valid_abs_sum_second_half = NAN
+        forward_max_valid_abs_sum_block1 = NAN
+        forward_max_valid_abs_sum_block2 = NAN
+        forward_max_valid_abs_sum_block3 = NAN
+        forward_max_valid_abs_sum_block4 = NAN
+
+    # 计算向前最小有效连续累加值的分块和绝对值之和（全部在Cython区完成）
+    forward_min_valid_abs_sum_first_half = 0
+    forward_min_valid_abs_sum_second_half = 0
+    forward_min_valid_abs_sum_block1 = 0
+    forward_min_valid_abs_sum_block2 = 0
+    forward_min_valid_abs_sum_block3 = 0
+    forward_min_valid_abs_sum_block4 = 0
+    if is_forward and forward_min_valid_sum_len > 0:
+        n = forward_min_valid_sum_len
+        half = int(round(n / 2.0))
+        q1 = <int>ceil(n / 4.0)
+        # 前一半
+        for j in range(half):
+            forward_min_valid_abs_sum_first_half += fabs(forward_min_valid_sum_vec[j])
+        # 后一半
+        for j in range(n - half, n):
+            forward_min_valid_abs_sum_second_half += fabs(forward_min_valid_sum_vec[j])
+        # block1: 前q1
+        for j in range(min(q1, n)):
+            forward_min_valid_abs_sum_block1 += fabs(forward_min_valid_sum_vec[j])
+        # block2: q1~2q1
+        for j in range(q1, min(2*q1, n)):
+            forward_min_valid_abs_sum_block2 += fabs(forward_min_valid_sum_vec[j])
+        # block4: 从后往前q1
+        for j in range(n-1, max(n-1-q1, -1), -1):
+            forward_min_valid_abs_sum_block4 += fabs(forward_min_valid_sum_vec[j])
+        # block3: 再往前q1
+        for j in range(n-1-q1, max(n-1-2*q1, -1), -1):
+            forward_min_valid_abs_sum_block3 += fabs(forward_min_valid_sum_vec[j])
+        # 移除 round_to_2 调用，保持原始精度
+    else:
+        forward_min_valid_abs_sum_first_half = NAN
+        forward_min_valid_abs_sum_second_half = NAN
+        forward_min_valid_abs_sum_block1 = NAN
+        forward_min_valid_abs_sum_block2 = NAN
+        forward_min_valid_abs_sum_block3 = NAN
+        forward_min_valid_abs_sum_block4 = NAN
+
+    if valid_pos_sum == 0:
+        valid_pos_sum = NAN
+    if valid_neg_sum == 0:
+        valid_neg_sum = NAN
+    # 移除 round_to_2 调用，保持原始精度
+
+    # 计算range_ratio_is_less
+    range_ratio_is_less = False
+    if (min_price != 0 and not isnan(min_price) and
+        not isnan(max_price) and not isnan(user_range_ratio)):
+        range_ratio_is_less = (max_price / min_price) < user_range_ratio
+    # 计算n_max_is_max
+    n_max_is_max_result = max_idx_in_window < n_days if n_days > 0 else False
+
+    # 连续累加值基本参数（不存在时为NAN，构造结果时转为None）
+    cont_n = cont_sum.size()
+    continuous_start_value = cont_sum[0] if cont_n > 0 else NAN
+    continuous_start_next_value = cont_sum[1] if cont_n > 1 else NAN
+    continuous_start_next_next_value = cont_sum[2] if cont_n > 2 else NAN
+    continuous_end_value = cont_sum[cont_n-1] if cont_n > 0 else NAN
+    continuous_end_prev_value = cont_sum[cont_n-2] if cont_n > 1 else NAN
+    continuous_end_prev_prev_value = cont_sum[cont_n-3] if cont_n > 2 else NAN
+    # 向前最大连续累加值相关参数
+    cont_n = forward_max_result_c.size() if is_forward else 0
+    forward_max_continuous_start_value = forward_max_result_c[0] if cont_n > 0 else NAN
+    forward_max_continuous_start_next_value = forward_max_result_c[1] if cont_n > 1 else NAN
+    forward_max_continuous_start_next_next_value = forward_max_result_c[2] if cont_n > 2 else NAN
+    forward_max_continuous_end_value = forward_max_result_c[cont_n-1] if cont_n > 0 else NAN
+    forward_max_continuous_end_prev_value = forward_max_result_c[cont_n-2] if cont_n > 1 else NAN
+    forward_max_continuous_end_prev_prev_value = forward_max_result_c[cont_n-3] if cont_n > 2 else NAN
+    # 向前最小连续累加值相关参数
+    cont_n = forward_min_result_c.size() if is_forward else 0
+    forward_min_continuous_start_value = forward_min_result_c[0] if cont_n > 0 else NAN
+    forward_min_continuous_start_next_value = forward_min_result_c[1] if cont_n > 1 else NAN
+    forward_min_continuous_start_next_next_value = forward_min_result_c[2] if cont_n > 2 else NAN
+    forward_min_continuous_end_value = forward_min_result_c[cont_n-1] if cont_n > 0 else NAN
+    forward_min_continuous_end_prev_value = forward_min_result_c[cont_n-2] if cont_n > 1 else NAN
+    forward_min_continuous_end_prev_prev_value = forward_min_result_c[cont_n-3] if cont_n > 2 else NAN
+
+    # 填充选股公式变量槽位（止盈止损相关的槽位在模拟之后填充）
+    if formula_vals != NULL:
+        formula_vals[FV_MAX_VALUE] = formula_safe(max_price)
+        formula_vals[FV_MIN_VALUE] = formula_safe(min_price)
+        formula_vals[FV_END_VALUE] = formula_safe(end_value)
+        formula_vals[FV_START_VALUE] = formula_safe(start_value)
+        formula_vals[FV_ACTUAL_VALUE] = formula_safe(actual_value)
+        formula_vals[FV_CLOSEST_VALUE] = formula_safe(closest_value)
+        formula_vals[FV_CONTINUOUS_LEN] = continuous_len
+        formula_vals[FV_CONTINUOUS_START_VALUE] = formula_safe(continuous_start_value)
+        formula_vals[FV_CONTINUOUS_START_NEXT_VALUE] = formula_safe(continuous_start_next_value)
+        formula_vals[FV_CONTINUOUS_START_NEXT_NEXT_VALUE] = formula_safe(continuous_start_next_next_value)
+        formula_vals[FV_CONTINUOUS_END_VALUE] = formula_safe(continuous_end_value)
+        formula_vals[FV_CONTINUOUS_END_PREV_VALUE] = formula_safe(continuous_end_prev_value)
+        formula_vals[FV_CONTINUOUS_END_PREV_PREV_VALUE] = formula_safe(continuous_end_prev_prev_value)
+        formula_vals[FV_CONTINUOUS_ABS_SUM_FIRST_HALF] = formula_safe(continuous_abs_sum_first_half)
+        formula_vals[FV_CONTINUOUS_ABS_SUM_SECOND_HALF] = formula_safe(continuous_abs_sum_second_half)
+        formula_vals[FV_CONTINUOUS_ABS_SUM_BLOCK1] = formula_safe(continuous_abs_sum_block1)
+        formula_vals[FV_CONTINUOUS_ABS_SUM_BLOCK2] = formula_safe(continuous_abs_sum_block2)
+        formula_vals[FV_CONTINUOUS_ABS_SUM_BLOCK3] = formula_safe(continuous_abs_sum_block3)
+        formula_vals[FV_CONTINUOUS_ABS_SUM_BLOCK4] = formula_safe(continuous_abs_sum_block4)
+        formula_vals[FV_FORWARD_MAX_CONTINUOUS_START_VALUE] = formula_safe(forward_max_continuous_start_value)
+        formula_vals[FV_FORWARD_MAX_CONTINUOUS_START_NEXT_VALUE] = formula_safe(forward_max_continuous_start_next_value)
+        formula_vals[FV_FORWARD_MAX_CONTINUOUS_START_NEXT_NEXT_VALUE] = formula_safe(forward_max_continuous_start_next_next_value)
+        formula_vals[FV_FORWARD_MAX_CONTINUOUS_END_VALUE] = formula_safe(forward_max_continuous_end_value)
+        formula_vals[FV_FORWARD_MAX_CONTINUOUS_END_PREV_VALUE] = formula_safe(forward_max_continuous_end_prev_value)
+        formula_vals[FV_FORWARD_MAX_CONTINUOUS_END_PREV_PREV_VALUE] = formula_safe(forward_max_continuous_end_prev_prev_value)
+        formula_vals[FV_FORWARD_MAX_ABS_SUM_FIRST_HALF] = formula_safe(forward_max_abs_sum_first_half)
+        formula_vals[FV_FORWARD_MAX_ABS_SUM_SECOND_HALF] = formula_safe(forward_max_abs_sum_second_half)
+        formula_vals[FV_FORWARD_MAX_ABS_SUM_BLOCK1] = formula_safe(forward_max_abs_sum_block1)
+        formula_vals[FV_FORWARD_MAX_ABS_SUM_BLOCK2] = formula_safe(forward_max_abs_sum_block2)
+        formula_vals[FV_FORWARD_MAX_ABS_SUM_BLOCK3] = formula_safe(forward_max_abs_sum_block3)
+        formula_vals[FV_FORWARD_MAX_ABS_SUM_BLOCK4] = formula_safe(forward_max_abs_sum_block4)
+        formula_vals[FV_FORWARD_MIN_CONTINUOUS_START_VALUE] = formula_safe(forward_min_continuous_start_value)
+        formula_vals[FV_FORWARD_MIN_CONTINUOUS_START_NEXT_VALUE] = formula_safe(forward_min_continuous_start_next_value)
+        formula_vals[FV_FORWARD_MIN_CONTINUOUS_START_NEXT_NEXT_VALUE] = formula_safe(forward_min_continuous_start_next_next_value)
+        formula_vals[FV_FORWARD_MIN_CONTINUOUS_END_VALUE] = formula_safe(forward_min_continuous_end_value)
+        formula_vals[FV_FORWARD_MIN_CONTINUOUS_END_PREV_VALUE] = formula_safe(forward_min_continuous_end_prev_value)
+        formula_vals[FV_FORWARD_MIN_CONTINUOUS_END_PREV_PREV_VALUE] = formula_safe(forward_min_continuous_end_prev_prev_value)
+        formula_vals[FV_FORWARD_MIN_ABS_SUM_FIRST_HALF] = formula_safe(forward_min_abs_sum_first_half)
+        formula_vals[FV_FORWARD_MIN_ABS_SUM_SECOND_HALF] = formula_safe(forward_min_abs_sum_second_half)
+        formula_vals[FV_FORWARD_MIN_ABS_SUM_BLOCK1] = formula_safe(forward_min_abs_sum_block1)
+        formula_vals[FV_FORWARD_MIN_ABS_SUM_BLOCK2] = formula_safe(forward_min_abs_sum_block2)
+        formula_vals[FV_FORWARD_MIN_ABS_SUM_BLOCK3] = formula_safe(forward_min_abs_sum_block3)
+        formula_vals[FV_FORWARD_MIN_ABS_SUM_BLOCK4] = formula_safe(forward_min_abs_sum_block4)
+        formula_vals[FV_VALID_SUM_LEN] = valid_sum_len
+        formula_vals[FV_VALID_POS_SUM] = formula_safe(valid_pos_sum)
+        formula_vals[FV_VALID_NEG_SUM] = formula_safe(valid_neg_sum)
+        formula_vals[FV_FORWARD_MAX_VALID_SUM_LEN] = forward_max_valid_sum_len
+        formula_vals[FV_FORWARD_MAX_VALID_POS_SUM] = formula_safe(forward_max_valid_pos_sum)
+        formula_vals[FV_FORWARD_MAX_VALID_NEG_SUM] = formula_safe(forward_max_valid_neg_sum)
+        formula_vals[FV_FORWARD_MIN_VALID_SUM_LEN] = forward_min_valid_sum_len
+        formula_vals[FV_FORWARD_MIN_VALID_POS_SUM] = formula_safe(forward_min_valid_pos_sum)
+        formula_vals[FV_FORWARD_MIN_VALID_NEG_SUM] = formula_safe(forward_min_valid_neg_sum)
+        formula_vals[FV_VALID_ABS_SUM_FIRST_HALF] = formula_safe(valid_abs_sum_first_half)
+        formula_vals[FV_VALID_ABS_SUM_SECOND_HALF] = formula_safe(valid_abs_sum_second_half)
+        formula_vals[FV_VALID_ABS_SUM_BLOCK1] = formula_safe(valid_abs_sum_block1)
+        formula_vals[FV_VALID_ABS_SUM_BLOCK2] = formula_safe(valid_abs_sum_block2)
+        formula_vals[FV_VALID_ABS_SUM_BLOCK3] = formula_safe(valid_abs_sum_block3)
+        formula_vals[FV_VALID_ABS_SUM_BLOCK4] = formula_safe(valid_abs_sum_block4)
+        formula_vals[FV_FORWARD_MAX_VALID_ABS_SUM_FIRST_HALF] = formula_safe(forward_max_valid_abs_sum_first_half)
+        formula_vals[FV_FORWARD_MAX_VALID_ABS_SUM_SECOND_HALF] = formula_safe(forward_max_valid_abs_sum_second_half)
+        formula_vals[FV_FORWARD_MAX_VALID_ABS_SUM_BLOCK1] = formula_safe(forward_max_valid_abs_sum_block1)
+        formula_vals[FV_FORWARD_MAX_VALID_ABS_SUM_BLOCK2] = formula_safe(forward_max_valid_abs_sum_block2)
+        formula_vals[FV_FORWARD_MAX_VALID_ABS_SUM_BLOCK3] = formula_safe(forward_max_valid_abs_sum_block3)
+        formula_vals[FV_FORWARD_MAX_VALID_ABS_SUM_BLOCK4] = formula_safe(forward_max_valid_abs_sum_block4)
+        formula_vals[FV_FORWARD_MIN_VALID_ABS_SUM_FIRST_HALF] = formula_safe(forward_min_valid_abs_sum_first_half)
+        formula_vals[FV_FORWARD_MIN_VALID_ABS_SUM_SECOND_HALF] = formula_safe(forward_min_valid_abs_sum_second_half)
+        formula_vals[FV_FORWARD_MIN_VALID_ABS_SUM_BLOCK1] = formula_safe(forward_min_valid_abs_sum_block1)
+        formula_vals[FV_FORWARD_MIN_VALID_ABS_SUM_BLOCK2] = formula_safe(forward_min_valid_abs_sum_block2)
+        formula_vals[FV_FORWARD_MIN_VALID_ABS_SUM_BLOCK3] = formula_safe(forward_min_valid_abs_sum_block3)
+        formula_vals[FV_FORWARD_MIN_VALID_ABS_SUM_BLOCK4] = formula_safe(forward_min_valid_abs_sum_block4)
+        formula_vals[FV_N_MAX_IS_MAX] = n_max_is_max_result
+        formula_vals[FV_RANGE_RATIO_IS_LESS] = range_ratio_is_less
+        formula_vals[FV_CONTINUOUS_ABS_IS_LESS] = continuous_abs_is_less
+        formula_vals[FV_VALID_ABS_IS_LESS] = valid_abs_is_less
+        formula_vals[FV_FORWARD_MIN_CONTINUOUS_ABS_IS_LESS] = forward_min_continuous_abs_is_less
+        formula_vals[FV_FORWARD_MIN_VALID_ABS_IS_LESS] = forward_min_valid_abs_is_less
+        formula_vals[FV_FORWARD_MAX_CONTINUOUS_ABS_IS_LESS] = forward_max_continuous_abs_is_less
+        formula_vals[FV_FORWARD_MAX_VALID_ABS_IS_LESS] = forward_max_valid_abs_is_less
+        formula_vals[FV_N_DAYS_MAX_VALUE] = formula_safe(n_days_max_value)
+        formula_vals[FV_PREV_DAY_CHANGE] = formula_safe(prev_day_change)
+        formula_vals[FV_END_DAY_CHANGE] = formula_safe(end_day_change)
+        formula_vals[FV_DIFF_END_VALUE] = diff_data_view[stock_idx, end_date_idx]
+        formula_vals[FV_FORWARD_MAX_RESULT_LEN] = forward_max_result_len
+        formula_vals[FV_FORWARD_MIN_RESULT_LEN] = forward_min_result_len
+        formula_vals[FV_CONT_SUM_POS_SUM] = formula_safe(cont_sum_pos_sum)
+        formula_vals[FV_CONT_SUM_NEG_SUM] = formula_safe(cont_sum_neg_sum)
+        formula_vals[FV_CONT_SUM_POS_SUM_FIRST_HALF] = formula_safe(cont_sum_pos_sum_first_half)
+        formula_vals[FV_CONT_SUM_POS_SUM_SECOND_HALF] = formula_safe(cont_sum_pos_sum_second_half)
+        formula_vals[FV_CONT_SUM_NEG_SUM_FIRST_HALF] = formula_safe(cont_sum_neg_sum_first_half)
+        formula_vals[FV_CONT_SUM_NEG_SUM_SECOND_HALF] = formula_safe(cont_sum_neg_sum_second_half)
+        formula_vals[FV_FORWARD_MAX_CONT_SUM_POS_SUM] = formula_safe(forward_max_cont_sum_pos_sum)
+        formula_vals[FV_FORWARD_MAX_CONT_SUM_NEG_SUM] = formula_safe(forward_max_cont_sum_neg_sum)
+        formula_vals[FV_FORWARD_MIN_CONT_SUM_POS_SUM] = formula_safe(forward_min_cont_sum_pos_sum)
+        formula_vals[FV_FORWARD_MIN_CONT_SUM_NEG_SUM] = formula_safe(forward_min_cont_sum_neg_sum)
+        formula_vals[FV_START_WITH_NEW_BEFORE_HIGH] = start_with_new_before_high
+        formula_vals[FV_START_WITH_NEW_BEFORE_HIGH2] = start_with_new_before_high2
+        formula_vals[FV_START_WITH_NEW_AFTER_HIGH] = start_with_new_after_high
+        formula_vals[FV_START_WITH_NEW_AFTER_HIGH2] = start_with_new_after_high2
+        formula_vals[FV_START_WITH_NEW_BEFORE_LOW] = start_with_new_before_low
+        formula_vals[FV_START_WITH_NEW_BEFORE_LOW2] = start_with_new_before_low2
+        formula_vals[FV_START_WITH_NEW_AFTER_LOW] = start_with_new_after_low
+        formula_vals[FV_START_WITH_NEW_AFTER_LOW2] = start_with_new_after_low2
+        formula_vals[FV_HAS_THREE_CONSECUTIVE_ZEROS] = has_three_consecutive_zeros
+        # 列式选股第一遍预筛选：公式前置条件只引用上面的变量，不成立的行必然落选，不再做止盈止损模拟
+        if prefilter_stack != NULL and p.prefilter_n_ops > 0:
+            if (eval_formula_program(p.prefilter_ops, p.prefilter_args, p.prefilter_n_ops, formula_vals,
+                                     prefilter_stack, &prefilter_value) != 1 or prefilter_value == 0):
+                formula_vals[FV_INCREMENT_VALUE] = NAN
+                formula_vals[FV_AFTER_GT_END_VALUE] = NAN
+                formula_vals[FV_AFTER_GT_START_VALUE] = NAN
+                formula_vals[FV_INCREMENT_CHANGE] = NAN
+                formula_vals[FV_AFTER_GT_END_CHANGE] = NAN
+                formula_vals[FV_AFTER_GT_START_CHANGE] = NAN
+                formula_vals[FV_ADJUST_OPS_CHANGE] = NAN
+                formula_vals[FV_ADJUST_OPS_INCRE_RATE] = NAN
+                formula_vals[FV_HOLD_DAYS] = NAN
+                formula_vals[FV_OPS_CHANGE] = NAN
+                formula_vals[FV_ADJUST_DAYS] = NAN
+                formula_vals[FV_OPS_INCRE_RATE] = NAN
+                return ROW_PRUNED
+
+    # 递增值计算逻辑
+    # 停盈停损
+    increment_value = NAN
+    loss_increment_value = NAN
+    increment_days = -1
+    loss_increment_days = -1
+
+    after_gt_end_value = NAN
+    loss_after_gt_end_value = NAN
+    after_gt_end_days = -1
+    loss_after_gt_end_days = -1
+
+    after_gt_start_value = NAN
+    loss_after_gt_start_value = NAN
+    after_gt_start_days = -1
+    loss_after_gt_start_days = -1
+
+    # 止盈止损
+    increment_change = NAN
+    after_gt_end_change = NAN
+    after_gt_start_change = NAN
+
+    # INC 止盈、 停盈、止损 、停损
+    take_inc = NAN
+    stop_inc = NAN
+    take_loss_inc = NAN
+    stop_loss_inc = NAN
+
+    # AGE 止盈、 停盈、止损 、停损
+    take_age = NAN
+    stop_age = NAN
+    take_loss_age = NAN
+    stop_loss_age = NAN
+
+    # AGS 止盈、 停盈、止损 、停损
+    take_ags = NAN
+    stop_ags = NAN
+    take_loss_ags = NAN
+    stop_loss_ags = NAN
+
+    # INC/AGE/AGS 止盈、止损涨幅及结束状态（每行重置，不沿用上一行的值）。
+    # 原来的串行循环不重置：一行只触发止盈（或止损）时，另一侧保留上一行的值（如止损0.0、止盈2.22）；
+    # 按股票并行后上一行可能属于别的线程，这里有意修正为 NaN，take_profit_*/stop_loss_* 统计会随之变化
+    inc_take_profit = NAN
+    inc_stop_loss = NAN
+    ge_take_profit = NAN
+    ge_stop_loss = NAN
+    gs_take_profit = NAN
+    gs_stop_loss = NAN
+    inc_end_state = 0
+    ge_end_state = 0
+    gs_end_state = 0
+
+    # 止盈停损相关
+    take_and_stop_increment_change = NAN
+    take_and_stop_after_gt_end_change = NAN
+    take_and_stop_after_gt_start_change = NAN
+    # 停盈止损相关
+    stop_and_take_increment_change = NAN
+    stop_and_take_after_gt_end_change = NAN
+    stop_and_take_after_gt_start_change = NAN
+
+    if op_days > 0:
+        end_value = price_data_view[stock_idx, end_date_idx]
+
+        # 新增：计算操作日当天涨跌幅
+        if end_date_idx > 0:
+            op_day_idx = end_date_idx - op_days
+            op_day_prev_idx = end_date_idx - op_days + 1
+
+            # 处理索引越界情况
+            if op_day_idx < 0:
+                op_day_idx = 0
+                op_day_prev_idx = 1
+
+            # 检查索引边界 - 确保不会越界
+            if op_day_idx < num_dates and op_day_prev_idx < num_dates and op_day_idx >= 0 and op_day_prev_idx >= 0:
+                op_day_price = price_data_view[stock_idx, op_day_idx]
+                op_day_prev_price = price_data_view[stock_idx, op_day_prev_idx]
+
+                if not isnan(op_day_price) and not isnan(op_day_prev_price) and op_day_prev_price != 0:
+                    op_day_change = ((op_day_price - op_day_prev_price) / op_day_prev_price) * 100  # 移除 round_to_2
+
+        if not isnan(end_value):
+            # 递增值
+            found = False
+            for n, k in enumerate(range(end_date_idx - 1, end_date_idx - op_days - 1, -1), 1):
+                if k < 0:
+                    break
+                v = price_data_view[stock_idx, k]
+                if isnan(v) or (trade_t1_mode and n == 1):
+                    continue
+                increment_threshold = end_value * inc_rate * n
+                stop_loss_inc_threshold = end_value * stop_loss_inc_rate * n
+
+                if n == 1:
+                    prev_price = end_value
+                else:
+                    prev_price = price_data_view[stock_idx, k + 1]
+
+                if increment_threshold != 0 and (v - end_value) > increment_threshold:
+                    increment_value = v
+                    increment_days = n
+                    increment_change = inc_rate * n * 100
+                    take_inc = inc_rate * n * 100
+                    if end_value != 0 and not isnan(end_value):
+                        stop_inc = ((v - end_value) / end_value) * 100
+                        stop_and_take_increment_change = ((v - end_value) / end_value) * 100  # 移除 round_to_2
+                    else:
+                        stop_inc = NAN
+                        stop_and_take_increment_change = NAN
+                    take_and_stop_increment_change = increment_change
+
+                    #if not isnan(prev_price) and prev_price != 0:
+                    #   inc_take_profit = ((v - prev_price) / prev_price) * 100  # 移除 round_to_2
+                    #else:
+                    #   inc_take_profit = NAN
+
+                    # INC 前几天的涨幅 / 持有天数
+                    inc_take_profit = ((v - end_value) / end_value) * 100 / n
+                    found = True
+                    inc_end_state = 1
+                    break
+
+                #if stock_idx == 2164:
+                    #printf("stock_idx=%d, n=%d, v=%.2f, end_value=%.2f, stop_loss_inc_rate=%.4f, stop_loss_inc_threshold=%.2f\n",
+                           #stock_idx, n, v, end_value, stop_loss_inc_rate, stop_loss_inc_threshold)
+
+                if stop_loss_inc_threshold != 0 and (v - end_value) < stop_loss_inc_threshold:
+                    increment_value = v  # 移除 round_to_2
+                    loss_increment_days = n
+                    increment_change = stop_loss_inc_rate * n * 100
+                    take_loss_inc = stop_loss_inc_rate * n * 100
+                    if end_value != 0 and not isnan(end_value):
+                        stop_loss_inc = ((v - end_value) / end_value) * 100
+                        take_and_stop_increment_change = ((v - end_value) / end_value) * 100  # 移除 round_to_2
+                    else:
+                        stop_loss_inc = NAN
+                        take_and_stop_increment_change = NAN
+                    stop_and_take_increment_change = increment_change
+
+                    #if not isnan(prev_price) and prev_price != 0:
+                    #    inc_stop_loss = ((v - prev_price) / prev_price) * 100  # 移除 round_to_2
+                    #else:
+                    #    inc_stop_loss = NAN
+
+                    # INC 前几天的涨幅 / 持有天数
+                    inc_stop_loss = ((v - end_value) / end_value) * 100 / n
+
+                    found = True
+                    inc_end_state = 2
+                    break
+
+            if not found:
+                increment_value = NAN
+                increment_days = -1
+                loss_increment_days = -1
+                increment_change = NAN
+                inc_end_state = 0
+                inc_take_profit = NAN
+                inc_stop_loss = NAN
+                take_and_stop_increment_change = NAN
+                stop_and_take_increment_change = NAN
+                take_inc = NAN
+                stop_inc = NAN
+                take_loss_inc = NAN
+                stop_loss_inc = NAN
+
+            # after_gt_end_value 计算（方向：end_date_idx-1 向 end_date_idx-op_days）
+            found = False
+            for n, k in enumerate(range(end_date_idx - 1, end_date_idx - op_days - 1, -1), 1):
+                if k < 0:
+                    break
+                v = price_data_view[stock_idx, k]
+                if isnan(v) or (trade_t1_mode and n == 1):
+                    continue
+
+                if n == 1:
+                    prev_price = end_value
+                else:
+                    # 检查边界，确保 k + 1 在有效范围内
+                    if k + 1 < num_dates:
+                        prev_price = price_data_view[stock_idx, k + 1]
+                    else:
+                        prev_price = NAN
+
+                after_gt_end_threshold = end_value * after_gt_end_ratio
+                # 计算止损阈值
+                stop_loss_after_gt_end_threshold = end_value * stop_loss_after_gt_end_ratio
+                #if stock_idx == 2164:
+                    #printf("stock_idx=%d, n=%d, v=%.2f, end_value=%.2f, after_gt_end_ratio=%.4f, after_gt_end_threshold=%.2f\n",
+                           #stock_idx, n, v, end_value, after_gt_end_ratio, after_gt_end_threshold)
+
+                if after_gt_end_ratio != 0 and (v - end_value) > after_gt_end_threshold:
+                    after_gt_end_value = v  # 移除 round_to_2
+                    after_gt_end_days = n
+                    after_gt_end_change = after_gt_end_ratio * 100
+                    take_age = after_gt_end_ratio * 100
+                    if end_value != 0 and not isnan(end_value):
+                        stop_age = ((v - end_value) / end_value) * 100
+                        stop_and_take_after_gt_end_change = ((v - end_value) / end_value) * 100  # 移除 round_to_2
+                    else:
+                        stop_age = NAN
+                        stop_and_take_after_gt_end_change = NAN
+                    take_and_stop_after_gt_end_change = after_gt_end_change
+                    found = True
+                    ge_end_state = 1
+
+                    #if not isnan(prev_price) and prev_price != 0:
+                    #    ge_take_profit = ((v - prev_price) / prev_price) * 100  # 移除 round_to_2
+                    #else:
+                    #    ge_take_profit = NAN
+
+                    # AGE 前面天数的涨幅
+                    if end_value != 0 and not isnan(end_value):
+                        ge_take_profit = ((v - end_value) / end_value) * 100
+                    else:
+                        ge_take_profit = NAN
+
+                    break
+
+                #if stock_idx == 2164:
+                    #printf("stock_idx=%d, n=%d, v=%.2f, end_value=%.2f, stop_loss_after_gt_end_ratio=%.4f, stop_loss_after_gt_end_threshold=%.2f\n",
+                           #stock_idx, n, v, end_value, stop_loss_after_gt_end_ratio, stop_loss_after_gt_end_threshold)
+
+                if stop_loss_after_gt_end_ratio != 0 and (v - end_value) < stop_loss_after_gt_end_threshold:
+                    after_gt_end_value = v  # 移除 round_to_2
+                    loss_after_gt_end_days = n
+                    after_gt_end_change = stop_loss_after_gt_end_ratio * 100
+                    take_loss_age = stop_loss_after_gt_end_ratio * 100
+                    if end_value != 0 and not isnan(end_value):
+                        stop_loss_age = ((v - end_value) / end_value) * 100
+                        take_and_stop_after_gt_end_change = ((v - end_value) / end_value) * 100  # 移除 round_to_2
+                    else:
+                        stop_loss_age = NAN
+                        take_and_stop_after_gt_end_change = NAN
+                    stop_and_take_after_gt_end_change = after_gt_end_change
+                    found = True
+                    ge_end_state = 2
+                    #if not isnan(prev_price) and prev_price != 0:
+                    #    ge_stop_loss = ((v - prev_price) / prev_price) * 100  # 移除 round_to_2
+                    #else:
+                    #    ge_stop_loss = NAN
+
+                    # AGE 前面天数的涨幅
+                    if end_value != 0 and not isnan(end_value):
+                        ge_stop_loss = ((v - end_value) / end_value) * 100
+                    else:
+                        ge_stop_loss = NAN
+
+                    break
+
+            if not found:
+                after_gt_end_value = NAN
+                after_gt_end_days = -1
+                loss_after_gt_end_days = -1
+                ge_end_state = 0
+                ge_take_profit = NAN
+                ge_stop_loss = NAN
+                take_and_stop_after_gt_end_change = NAN
+                stop_and_take_after_gt_end_change = NAN
+                take_age = NAN
+                take_loss_age = NAN
+                stop_age = NAN
+                stop_loss_age = NAN
+
+            # after_gt_start_value 计算（方向：end_date_idx 向 end_date_idx-op_days，判断k和k-1）
+            found = False
+            for n, k in enumerate(range(end_date_idx, end_date_idx - op_days, -1), 1):
+                if k - 1 < 0 or k >= num_dates:
+                    continue
+                v_now = price_data_view[stock_idx, k]
+                v_prev = price_data_view[stock_idx, k - 1]
+                if n == 1:
+                    prev_price = end_value
+                else:
+                    # 检查边界，确保 k + 1 在有效范围内
+                    if k + 1 < num_dates:
+                        prev_price = price_data_view[stock_idx, k + 1]
+                    else:
+                        prev_price = NAN
+
+                if isnan(v_now) or isnan(v_prev) or (trade_t1_mode and n == 1):
+                    continue
+                after_gt_start_threshold = v_now * after_gt_start_ratio
+                if after_gt_start_ratio != 0 and (v_prev - v_now) > after_gt_start_threshold:
+                    after_gt_start_value = v_prev  # 移除 round_to_2
+                    after_gt_start_days = n
+                    if n == 1:
+                        after_gt_start_change = after_gt_start_ratio * 100
+                    else:
+                        if end_value != 0 and not isnan(end_value):
+                            after_gt_start_change = ((1 + (v_now - end_value) / end_value) * (1 + after_gt_start_ratio) - 1) * 100  # 移除 round_to_2
+                        else:
+                            after_gt_start_change = NAN
+
+                    take_and_stop_after_gt_start_change = after_gt_start_change
+                    take_ags = after_gt_start_change
+                    if end_value != 0 and not isnan(end_value):
+                        stop_ags = ((v_prev - end_value) / end_value) * 100
+                        stop_and_take_after_gt_start_change = ((v_prev - end_value) / end_value) * 100  # 移除 round_to_2
+                    else:
+                        stop_ags = NAN
+                        stop_and_take_after_gt_start_change = NAN
+
+                    #if stock_idx == 5377:
+                        #printf("stock_idx=%d, n=%d, v_now=%.2f, v_prev=%.2f, end_value=%.2f, after_gt_start_ratio=%.4f, after_gt_start_change=%.2f\n",
+                            #stock_idx, n, v_now, v_prev, end_value, after_gt_start_ratio, after_gt_start_change)
+
+                    gs_end_state = 1
+
+                    # AGS 第N天的涨幅
+                    if not isnan(prev_price) and prev_price != 0:
+                        gs_take_profit = ((v - prev_price) / prev_price) * 100  # 移除 round_to_2
+                    else:
+                        gs_take_profit = NAN
+                    found = True
+                    break
+
+                # 计算止损阈值
+                stop_loss_after_gt_start_threshold = v_now * stop_loss_after_gt_start_ratio
+                if stop_loss_after_gt_start_ratio != 0 and (v_prev - v_now) < stop_loss_after_gt_start_threshold:
+                    after_gt_start_value = v_prev  # 移除 round_to_2
+                    loss_after_gt_start_days = n
+                    gs_end_state = 2
+                    if n == 1:
+                        after_gt_start_change = stop_loss_after_gt_start_ratio  * 100
+                    else:
+                        if end_value != 0 and not isnan(end_value):
+                            after_gt_start_change = ((1 + (v_now - end_value) / end_value) * (1 + stop_loss_after_gt_start_ratio) - 1) * 100  # 移除 round_to_2
+                        else:
+                            after_gt_start_change = NAN
+                    if end_value != 0 and not isnan(end_value):
+                        take_and_stop_after_gt_start_change = ((v_prev - end_value) / end_value) * 100  # 移除 round_to_2
+                        stop_loss_ags = ((v_prev - end_value) / end_value) * 100
+                    else:
+                        take_and_stop_after_gt_start_change = NAN
+                        stop_loss_ags = NAN
+                    take_loss_ags = after_gt_start_change
+                    stop_and_take_after_gt_start_change = after_gt_start_change
+
+                    #if stock_idx == 2315:
+                        #printf("stock_idx=2315, take_loss_ags=%.6f, stop_loss_ags=%.6f\n", take_loss_ags, stop_loss_ags)
+
+                    # AGS 第N天的涨幅
+                    if not isnan(prev_price) and prev_price != 0:
+                        gs_stop_loss = ((v - prev_price) / prev_price) * 100  # 移除 round_to_2
+                    else:
+                        gs_stop_loss = NAN
+                    found = True
+                    break
+
+            if not found:
+                after_gt_start_value = NAN
+                after_gt_start_days = -1
+                loss_after_gt_start_days = -1
+                after_gt_start_change = NAN
+                gs_end_state = 0
+                gs_take_profit = NAN
+                gs_stop_loss = NAN
+                take_and_stop_after_gt_start_change = NAN
+                stop_and_take_after_gt_start_change = NAN
+                take_ags = NAN
+                stop_ags = NAN
+                take_loss_ags = NAN
+                stop_loss_ags = NAN
+
+    #if stock_idx == 0:
+        #printf(b"running3\n")
+
+    # 处理NAN值
+    if isnan(increment_value):
+        increment_value = NAN
+    if isnan(after_gt_end_value):
+        after_gt_end_value = NAN
+    if isnan(after_gt_start_value):
+        after_gt_start_value = NAN
+    # 递增值等都算好后，计算 ops_value
+    end_state = 0
+    take_profit = 0
+    stop_loss = 0
+    # 获取profit_type对应的天数
+    profit_days = -1
+    profit_ops_value = NAN
+    profit_end_state = 0
+    take_profit_var = NAN
+    stop_profit_var = NAN
+    if profit_type_code == 0:
+        take_profit_var = take_inc
+        stop_profit_var = stop_inc
+        take_profit = inc_take_profit
+        profit_ops_value = increment_value
+        if increment_days != -1:
+            profit_days = increment_days
+        if inc_end_state != 0:
+            profit_end_state = inc_end_state
+    elif profit_type_code == 1:
+        take_profit_var = take_age
+        stop_profit_var = stop_age
+        take_profit = ge_take_profit
+        profit_ops_value = after_gt_end_value
+        if after_gt_end_days != -1:
+            profit_days = after_gt_end_days
+        if ge_end_state != 0:
+            profit_end_state = ge_end_state
+    elif profit_type_code == 2:
+        take_profit_var = take_ags
+        stop_profit_var = stop_ags
+        take_profit = gs_take_profit
+        profit_ops_value = after_gt_start_value
+        if after_gt_start_days != -1:
+            profit_days = after_gt_start_days
+        if gs_end_state != 0:
+            profit_end_state = gs_end_state
+
+    # 获取loss_type对应的天数
+    loss_days = -1
+    loss_ops_value = NAN
+    loss_end_state = 0
+    ops_value = 0
+    hold_days = 0
+    take_loss_var = NAN
+    stop_loss_var = NAN
+    if loss_type_code == 0:
+        take_loss_var = take_loss_inc
+        stop_loss_var = stop_loss_inc
+        stop_loss = inc_stop_loss
+        loss_ops_value = loss_increment_value
+        if loss_increment_days != -1:
+            loss_days = loss_increment_days
+        if inc_end_state != 0:
+            loss_end_state = inc_end_state
+    elif loss_type_code == 1:
+        take_loss_var = take_loss_age
+        stop_loss_var = stop_loss_age
+        stop_loss = ge_stop_loss
+        loss_ops_value = loss_after_gt_end_value
+        if loss_after_gt_end_days != -1:
+            loss_days = loss_after_gt_end_days
+        if ge_end_state != 0:
+            loss_end_state = ge_end_state
+    elif loss_type_code == 2:
+        take_loss_var = take_loss_ags
+        stop_loss_var = stop_loss_ags
+        stop_loss = gs_stop_loss
+        loss_ops_value = loss_after_gt_start_value
+        if loss_after_gt_start_days != -1:
+            loss_days = loss_after_gt_start_days
+        if gs_end_state != 0:
+            loss_end_state = gs_end_state
+
+    # 比较profit_days和loss_days，取较小的值作为hold_days，并据此选择四种止盈止损组合
+    if profit_days != -1 and (loss_days == -1 or profit_days <= loss_days):
+        # 盈先触发（或只有盈有效）
+        hold_days = profit_days
+        ops_value = profit_ops_value
+        end_state = profit_end_state
+        # 止盈止损
+        take_profit_and_take_loss_change = take_profit_var if not isnan(take_profit_var) else take_loss_var
+        # 止盈停损
+        take_profit_and_stop_loss_change = take_profit_var if not isnan(take_profit_var) else stop_loss_var
+        # 停盈停损
+        stop_profit_and_stop_loss_change = stop_profit_var if not isnan(stop_profit_var) else stop_loss_var
+        # 停盈止损
+        stop_profit_and_take_loss_change = stop_profit_var if not isnan(stop_profit_var) else take_loss_var
+    elif loss_days != -1:
+        # 损先触发（或只有损有效）
+        hold_days = loss_days
+        ops_value = loss_ops_value
+        end_state = loss_end_state
+        take_profit_and_take_loss_change = take_loss_var if not isnan(take_loss_var) else take_profit_var
+        take_profit_and_stop_loss_change = stop_loss_var if not isnan(stop_loss_var) else take_profit_var
+        stop_profit_and_stop_loss_change = stop_loss_var if not isnan(stop_loss_var) else stop_profit_var
+        stop_profit_and_take_loss_change = take_loss_var if not isnan(take_loss_var) else stop_profit_var
+    else:
+        # 两个都无效，使用默认逻辑：持有op_days天（不足则持有到最新日期）
+        hold_days = op_days
+        if end_date_idx - hold_days >= 0:
+            op_idx_when_take_stop_nan = end_date_idx - hold_days
+        else:
+            hold_days = end_date_idx
+            op_idx_when_take_stop_nan = 0
+        if end_value != 0 and not isnan(end_value):
+            default_ops_change = (price_data_view[stock_idx, op_idx_when_take_stop_nan] - end_value) / end_value * 100
+        else:
+            default_ops_change = NAN
+        take_profit_and_take_loss_change = default_ops_change
+        take_profit_and_stop_loss_change = default_ops_change
+        stop_profit_and_stop_loss_change = default_ops_change
+        stop_profit_and_take_loss_change = default_ops_change
+
+    # 新增：计算操作涨幅、调整天数、日均涨幅
+    if end_date_idx - hold_days >= 0:
+        op_idx_when_take_stop_nan = end_date_idx - hold_days
+    else:
+        op_idx_when_take_stop_nan = 0
+    if end_value != 0 and not isnan(end_value):
+        ops_change = (price_data_view[stock_idx, op_idx_when_take_stop_nan] - end_value) / end_value * 100
+    else:
+        ops_change = NAN
+
+    # 调整天数计算
+    if hold_days > 0:
+        if not trade_t1_mode:  # T+0模式
+            if hold_days == 1:
+                adjust_days = 2 if ops_change > ops_change_input else 1
+            else:
+                adjust_days = hold_days
+        else:  # T+1模式
+            adjust_days = hold_days + 1
+    else:
+        adjust_days = 0
+
+    # 调天日均涨幅 （停盈停损日均涨幅），adjust_days为0时为None
+    ops_incre_rate = stop_profit_and_stop_loss_change / adjust_days if adjust_days != 0 else NAN
+    # 调幅日均涨幅： 调整涨幅 / 持有天数 （止盈止损）
+    adjust_ops_incre_rate = NAN
+    if not isnan(take_profit_and_take_loss_change) and hold_days != 0:
+        adjust_ops_incre_rate = take_profit_and_take_loss_change / hold_days
+    # 日均涨幅 止盈停损 / 持有天数
+    take_and_stop_incre_rate = NAN
+    if not isnan(take_profit_and_stop_loss_change) and hold_days != 0:
+        take_and_stop_incre_rate = take_profit_and_stop_loss_change / hold_days
+    #日均涨幅： 停盈止损 / 调整天数
+    stop_and_take_incre_rate = NAN
+    if not isnan(stop_profit_and_take_loss_change) and adjust_days != 0:
+        stop_and_take_incre_rate = stop_profit_and_take_loss_change / adjust_days
+
+
+    # 填充止盈止损相关的选股公式变量槽位
+    if formula_vals != NULL:
+        formula_vals[FV_INCREMENT_VALUE] = formula_safe(increment_value)
+        formula_vals[FV_AFTER_GT_END_VALUE] = formula_safe(after_gt_end_value)
+        formula_vals[FV_AFTER_GT_START_VALUE] = formula_safe(after_gt_start_value)
+        formula_vals[FV_INCREMENT_CHANGE] = formula_safe(increment_change)
+        formula_vals[FV_AFTER_GT_END_CHANGE] = formula_safe(after_gt_end_change)
+        formula_vals[FV_AFTER_GT_START_CHANGE] = formula_safe(after_gt_start_change)
+        formula_vals[FV_ADJUST_OPS_CHANGE] = formula_safe(take_profit_and_take_loss_change)
+        formula_vals[FV_ADJUST_OPS_INCRE_RATE] = formula_safe(adjust_ops_incre_rate)
+        formula_vals[FV_HOLD_DAYS] = hold_days
+        formula_vals[FV_OPS_CHANGE] = formula_safe(ops_change)
+        formula_vals[FV_ADJUST_DAYS] = adjust_days
+        formula_vals[FV_OPS_INCRE_RATE] = formula_safe(ops_incre_rate)
+
+    m.actual_idx = actual_idx
+    m.actual_value = actual_value
+    m.adjust_days = adjust_days
+    m.adjust_ops_incre_rate = adjust_ops_incre_rate
+    m.after_gt_end_change = after_gt_end_change
+    m.after_gt_end_value = after_gt_end_value
+    m.after_gt_start_change = after_gt_start_change
+    m.after_gt_start_value = after_gt_start_value
+    m.closest_idx_in_window = closest_idx_in_window
+    m.closest_value = closest_value
+    m.cont_sum_neg_sum = cont_sum_neg_sum
+    m.cont_sum_neg_sum_first_half = cont_sum_neg_sum_first_half
+    m.cont_sum_neg_sum_second_half = cont_sum_neg_sum_second_half
+    m.cont_sum_pos_sum = cont_sum_pos_sum
+    m.cont_sum_pos_sum_first_half = cont_sum_pos_sum_first_half
+    m.cont_sum_pos_sum_second_half = cont_sum_pos_sum_second_half
+    m.continuous_abs_is_less = continuous_abs_is_less
+    m.continuous_abs_sum_block1 = continuous_abs_sum_block1
+    m.continuous_abs_sum_block2 = continuous_abs_sum_block2
+    m.continuous_abs_sum_block3 = continuous_abs_sum_block3
+    m.continuous_abs_sum_block4 = continuous_abs_sum_block4
+    m.continuous_abs_sum_first_half = continuous_abs_sum_first_half
+    m.continuous_abs_sum_second_half = continuous_abs_sum_second_half
+    m.continuous_end_prev_prev_value = continuous_end_prev_prev_value
+    m.continuous_end_prev_value = continuous_end_prev_value
+    m.continuous_end_value = continuous_end_value
+    m.continuous_len = continuous_len
+    m.continuous_start_next_next_value = continuous_start_next_next_value
+    m.continuous_start_next_value = continuous_start_next_value
+    m.continuous_start_value = continuous_start_value
+    m.end_date_idx = end_date_idx
+    m.end_day_change = end_day_change
+    m.end_state = end_state
+    m.end_value = end_value
+    m.forward_max_abs_sum_block1 = forward_max_abs_sum_block1
+    m.forward_max_abs_sum_block2 = forward_max_abs_sum_block2
+    m.forward_max_abs_sum_block3 = forward_max_abs_sum_block3
+    m.forward_max_abs_sum_block4 = forward_max_abs_sum_block4
+    m.forward_max_abs_sum_first_half = forward_max_abs_sum_first_half
+    m.forward_max_abs_sum_second_half = forward_max_abs_sum_second_half
+    m.forward_max_cont_sum_neg_sum = forward_max_cont_sum_neg_sum
+    m.forward_max_cont_sum_pos_sum = forward_max_cont_sum_pos_sum
+    m.forward_max_continuous_abs_is_less = forward_max_continuous_abs_is_less
+    m.forward_max_continuous_end_prev_prev_value = forward_max_continuous_end_prev_prev_value
+    m.forward_max_continuous_end_prev_value = forward_max_continuous_end_prev_value
+    m.forward_max_continuous_end_value = forward_max_continuous_end_value
+    m.forward_max_continuous_start_next_next_value = forward_max_continuous_start_next_next_value
+    m.forward_max_continuous_start_next_value = forward_max_continuous_start_next_value
+    m.forward_max_continuous_start_value = forward_max_continuous_start_value
+    m.forward_max_date_idx = forward_max_date_idx
+    m.forward_max_result_len = forward_max_result_len
+    m.forward_max_valid_abs_is_less = forward_max_valid_abs_is_less
+    m.forward_max_valid_abs_sum_block1 = forward_max_valid_abs_sum_block1
+    m.forward_max_valid_abs_sum_block2 = forward_max_valid_abs_sum_block2
+    m.forward_max_valid_abs_sum_block3 = forward_max_valid_abs_sum_block3
+    m.forward_max_valid_abs_sum_block4 = forward_max_valid_abs_sum_block4
+    m.forward_max_valid_abs_sum_first_half = forward_max_valid_abs_sum_first_half
+    m.forward_max_valid_abs_sum_second_half = forward_max_valid_abs_sum_second_half
+    m.forward_max_valid_neg_sum = forward_max_valid_neg_sum
+    m.forward_max_valid_pos_sum = forward_max_valid_pos_sum
+    m.forward_max_valid_sum_len = forward_max_valid_sum_len
+    m.forward_min_abs_sum_block1 = forward_min_abs_sum_block1
+    m.forward_min_abs_sum_block2 = forward_min_abs_sum_block2
+    m.forward_min_abs_sum_block3 = forward_min_abs_sum_block3
+    m.forward_min_abs_sum_block4 = forward_min_abs_sum_block4
+    m.forward_min_abs_sum_first_half = forward_min_abs_sum_first_half
+    m.forward_min_abs_sum_second_half = forward_min_abs_sum_second_half
+    m.forward_min_cont_sum_neg_sum = forward_min_cont_sum_neg_sum
+    m.forward_min_cont_sum_pos_sum = forward_min_cont_sum_pos_sum
+    m.forward_min_continuous_abs_is_less = forward_min_continuous_abs_is_less
+    m.forward_min_continuous_end_prev_prev_value = forward_min_continuous_end_prev_prev_value
+    m.forward_min_continuous_end_prev_value = forward_min_continuous_end_prev_value
+    m.forward_min_continuous_end_value = forward_min_continuous_end_value
+    m.forward_min_continuous_start_next_next_value = forward_min_continuous_start_next_next_value
+    m.forward_min_continuous_start_next_value = forward_min_continuous_start_next_value
+    m.forward_min_continuous_start_value = forward_min_continuous_start_value
+    m.forward_min_date_idx = forward_min_date_idx
+    m.forward_min_result_len = forward_min_result_len
+    m.forward_min_valid_abs_is_less = forward_min_valid_abs_is_less
+    m.forward_min_valid_abs_sum_block1 = forward_min_valid_abs_sum_block1
+    m.forward_min_valid_abs_sum_block2 = forward_min_valid_abs_sum_block2
+    m.forward_min_valid_abs_sum_block3 = forward_min_valid_abs_sum_block3
+    m.forward_min_valid_abs_sum_block4 = forward_min_valid_abs_sum_block4
+    m.forward_min_valid_abs_sum_first_half = forward_min_valid_abs_sum_first_half
+    m.forward_min_valid_abs_sum_second_half = forward_min_valid_abs_sum_second_half
+    m.forward_min_valid_neg_sum = forward_min_valid_neg_sum
+    m.forward_min_valid_pos_sum = forward_min_valid_pos_sum
+    m.forward_min_valid_sum_len = forward_min_valid_sum_len
+    m.has_three_consecutive_zeros = has_three_consecutive_zeros
+    m.hold_days = hold_days
+    m.increment_change = increment_change
+    m.increment_value = increment_value
+    m.max_idx_in_window = max_idx_in_window
+    m.max_price = max_price
+    m.min_idx_in_window = min_idx_in_window
+    m.min_price = min_price
+    m.n_days_max_value = n_days_max_value
+    m.n_max_is_max_result = n_max_is_max_result
+    m.op_day_change = op_day_change
+    m.ops_change = ops_change
+    m.ops_incre_rate = ops_incre_rate
+    m.ops_value = ops_value
+    m.prev_day_change = prev_day_change
+    m.range_ratio_is_less = range_ratio_is_less
+    m.start_date_idx = start_date_idx
+    m.start_value = start_value
+    m.start_with_new_after_high = start_with_new_after_high
+    m.start_with_new_after_high2 = start_with_new_after_high2
+    m.start_with_new_after_low = start_with_new_after_low
+    m.start_with_new_after_low2 = start_with_new_after_low2
+    m.start_with_new_before_high = start_with_new_before_high
+    m.start_with_new_before_high2 = start_with_new_before_high2
+    m.start_with_new_before_low = start_with_new_before_low
+    m.start_with_new_before_low2 = start_with_new_before_low2
+    m.stop_and_take_after_gt_end_change = stop_and_take_after_gt_end_change
+    m.stop_and_take_after_gt_start_change = stop_and_take_after_gt_start_change
+    m.stop_and_take_incre_rate = stop_and_take_incre_rate
+    m.stop_and_take_increment_change = stop_and_take_increment_change
+    m.stop_loss = stop_loss
+    m.stop_profit_and_take_loss_change = stop_profit_and_take_loss_change
+    m.take_and_stop_after_gt_end_change = take_and_stop_after_gt_end_change
+    m.take_and_stop_after_gt_start_change = take_and_stop_after_gt_start_change
+    m.take_and_stop_incre_rate = take_and_stop_incre_rate
+    m.take_and_stop_increment_change = take_and_stop_increment_change
+    m.take_profit = take_profit
+    m.take_profit_and_stop_loss_change = take_profit_and_stop_loss_change
+    m.take_profit_and_take_loss_change = take_profit_and_take_loss_change
+    m.valid_abs_is_less = valid_abs_is_less
+    m.valid_abs_sum_block1 = valid_abs_sum_block1
+    m.valid_abs_sum_block2 = valid_abs_sum_block2
+    m.valid_abs_sum_block3 = valid_abs_sum_block3
+    m.valid_abs_sum_block4 = valid_abs_sum_block4
+    m.valid_abs_sum_first_half = valid_abs_sum_first_half
+    m.valid_abs_sum_second_half = valid_abs_sum_second_half
+    m.valid_neg_sum = valid_neg_sum
+    m.valid_pos_sum = valid_pos_sum
+    m.valid_sum_len = valid_sum_len
+    s.cont_sum.swap(cont_sum)
+    s.forward_max_result_c.swap(forward_max_result_c)
+    s.forward_min_result_c.swap(forward_min_result_c)
+    s.valid_sum_vec.swap(valid_sum_vec)
+    s.forward_max_valid_sum_vec.swap(forward_max_valid_sum_vec)
+    s.forward_min_valid_sum_vec.swap(forward_min_valid_sum_vec)
+    return ROW_COMPUTED
+
+
 def calculate_batch_cy(
-    np.ndarray[DTYPE_t, ndim=2] price_data,
+    np.ndarray price_data,
     list date_columns,
     int width,
     str start_option,
     int shift_days,
     int end_date_start_idx,
     int end_date_end_idx,
-    np.ndarray[DTYPE_t, ndim=2] diff_data,
+    np.ndarray diff_data,
     np.ndarray[np.int32_t, ndim=1] stock_idx_arr,
     bint is_forward,
     int n_days,
@@ -235,7 +4039,16 @@ def calculate_batch_cy(
     bint start_with_new_before_low2_flag=False,
     bint start_with_new_after_low_flag=False,
     bint start_with_new_after_low2_flag=False,
-    list comparison_vars_list=None
+    list comparison_vars_list=None,
+    int num_threads=1,
+    np.ndarray range_max_idx=None,
+    np.ndarray range_min_idx=None,
+    np.ndarray diff_pos_prefix=None,
+    np.ndarray diff_neg_prefix=None,
+    bint collect_metrics=False,
+    np.ndarray row_mask=None,
+    bint metrics_only=False,
+    bint full_compute=False
 ):
     # 在函数开始处打印进程信息
     #import os
@@ -250,23 +4063,42 @@ def calculate_batch_cy(
     cdef int max_idx_in_window, min_idx_in_window, closest_idx_in_window
     cdef int i, j, window_len, base_idx, actual_idx
     cdef dict all_results = {}
+    # 累加值序列缓冲区：下标为 date_pos * N_RESULT_SEQUENCES + 序列编号（按 RESULT_SEQUENCE_FIELDS 顺序）
+    cdef vector[vector[double]] seq_values
+    cdef vector[vector[long long]] seq_offsets
+    cdef int seq_base
+    cdef long long seq_row
     cdef vector[double] cont_sum
     cdef vector[double] forward_max_result_c, forward_min_result_c
-    cdef double[:, :] price_data_view = price_data
-    cdef double[:, :] diff_data_view = diff_data
+    # 价格/差值矩阵为 float32 时走 float 特化的 compute_row，否则按 float64 计算
+    cdef bint use_float32 = price_data.dtype == np.float32
+    cdef double[:, :] price_data_view
+    cdef double[:, :] diff_data_view
+    cdef float[:, :] price_data_view32
+    cdef float[:, :] diff_data_view32
+    if use_float32:
+        price_data_view32 = price_data
+        diff_data_view32 = diff_data
+    else:
+        price_data_view = price_data
+        diff_data_view = diff_data
+    # 创新高/创新低区间极值稀疏表，未提供时各条件退回顺序扫描
+    cdef int[:, :, :] range_max_view = range_max_idx if range_max_idx is not None else np.empty((0, 0, 0), dtype=np.int32)
+    cdef int[:, :, :] range_min_view = range_min_idx if range_min_idx is not None else np.empty((0, 0, 0), dtype=np.int32)
+    # diff_data 正值/负值前缀和（单位：分），未提供（或为空，如使用了倍增系数）时正负加和按序列逐项累加
+    cdef np.int64_t[:, :] diff_pos_prefix_view = diff_pos_prefix if diff_pos_prefix is not None else np.empty((0, 0), dtype=np.int64)
+    cdef np.int64_t[:, :] diff_neg_prefix_view = diff_neg_prefix if diff_neg_prefix is not None else np.empty((0, 0), dtype=np.int64)
     cdef int[:] stock_idx_arr_view = stock_idx_arr
     cdef double min_diff, diff
     cdef int n, half, q1, q2, q3
     cdef double continuous_abs_sum_first_half, continuous_abs_sum_second_half
     cdef double continuous_abs_sum_block1, continuous_abs_sum_block2, continuous_abs_sum_block3, continuous_abs_sum_block4
-    cdef double valid_sum_arr[1000]
     cdef int valid_sum_len
     cdef double valid_pos_sum = NAN
     cdef double valid_neg_sum = NAN
     cdef double prev_day_change = NAN
     cdef double end_day_change = NAN
     cdef double n_days_max_value = NAN
-    cdef double price_arr[1000]
     cdef int n_valid, half_valid, q1_valid, q2_valid, q3_valid
     cdef double valid_abs_sum_first_half, valid_abs_sum_second_half
     cdef double valid_abs_sum_block1, valid_abs_sum_block2, valid_abs_sum_block3, valid_abs_sum_block4
@@ -373,2203 +4205,592 @@ def calculate_batch_cy(
     cdef double forward_max_price, forward_min_price
     cdef int forward_max_idx_in_window, forward_min_idx_in_window
 
+    # 原先在Python层计算的止盈止损、持有天数等变量，改为C类型在nogil内计算（NAN表示None）
+    cdef bint range_ratio_is_less, n_max_is_max_result
+    cdef int cont_n
+    cdef double continuous_start_value, continuous_start_next_value, continuous_start_next_next_value
+    cdef double continuous_end_value, continuous_end_prev_value, continuous_end_prev_prev_value
+    cdef double forward_max_continuous_start_value, forward_max_continuous_start_next_value, forward_max_continuous_start_next_next_value
+    cdef double forward_max_continuous_end_value, forward_max_continuous_end_prev_value, forward_max_continuous_end_prev_prev_value
+    cdef double forward_min_continuous_start_value, forward_min_continuous_start_next_value, forward_min_continuous_start_next_next_value
+    cdef double forward_min_continuous_end_value, forward_min_continuous_end_prev_value, forward_min_continuous_end_prev_prev_value
+    cdef int end_state, profit_days, loss_days, profit_end_state, loss_end_state, hold_days, adjust_days
+    cdef int op_idx_when_take_stop_nan
+    cdef double take_profit, stop_loss, ops_value, profit_ops_value, loss_ops_value
+    cdef double take_profit_var, stop_profit_var, take_loss_var, stop_loss_var
+    cdef double default_ops_change
+    cdef double take_profit_and_take_loss_change, take_profit_and_stop_loss_change
+    cdef double stop_profit_and_stop_loss_change, stop_profit_and_take_loss_change
+    cdef double ops_change, ops_incre_rate, adjust_ops_incre_rate
+    cdef double take_and_stop_incre_rate, stop_and_take_incre_rate
+    cdef double score = NAN
+    cdef bint score_valid, row_selected
+
+    # 字符串参数在进入nogil前转换为整数/布尔，避免在nogil内比较Python对象
+    cdef int start_option_code = 0  # 0: 开始值 1: 最大值 2: 最小值 3: 接近值
+    if start_option == "最大值":
+        start_option_code = 1
+    elif start_option == "最小值":
+        start_option_code = 2
+    elif start_option == "接近值":
+        start_option_code = 3
+    cdef int profit_type_code = -1  # 0: INC 1: AGE 2: AGS
+    cdef int loss_type_code = -1
+    if profit_type in ("INC", "AGE", "AGS"):
+        profit_type_code = ("INC", "AGE", "AGS").index(profit_type)
+    if loss_type in ("INC", "AGE", "AGS"):
+        loss_type_code = ("INC", "AGE", "AGS").index(loss_type)
+    cdef int sort_mode_code = 0  # 1: 最大值排序 2: 最小值排序
+    if sort_mode == "最大值排序":
+        sort_mode_code = 1
+    elif sort_mode == "最小值排序":
+        sort_mode_code = 2
+    cdef bint new_before_high_and = new_before_high_logic == "与"
+    cdef bint new_before_high2_and = new_before_high2_logic == "与"
+    cdef bint new_after_high_and = new_after_high_logic == "与"
+    cdef bint new_after_high2_and = new_after_high2_logic == "与"
+    cdef bint new_before_low_and = new_before_low_logic == "与"
+    cdef bint new_before_low2_and = new_before_low2_logic == "与"
+    cdef bint new_after_low_and = new_after_low_logic == "与"
+    cdef bint new_after_low2_and = new_after_low2_logic == "与"
+
+    # 选股公式只编译一次；编译失败（不支持的语法）时回退到逐行exec
+    cdef vector[int] formula_ops
+    cdef vector[double] formula_args
+    cdef vector[int] comparison_slots  # 成对存放，-1 表示变量不存在（按0处理）
+    cdef bint use_formula_program = False
+    cdef int n_formula_ops = 0
+    formula_program = compile_formula(formula_expr)
+    if formula_program is not None and comparison_vars_list:
+        for var_pair in comparison_vars_list:
+            var1, var2 = var_pair
+            if var1 in FORMULA_OBJECT_VAR_NAMES or var2 in FORMULA_OBJECT_VAR_NAMES:
+                formula_program = None
+                break
+            comparison_slots.push_back(FORMULA_SLOT_INDEX.get(var1, -1))
+            comparison_slots.push_back(FORMULA_SLOT_INDEX.get(var2, -1))
+    if formula_program is not None:
+        for j in range(len(formula_program[0])):
+            formula_ops.push_back(formula_program[0][j])
+            formula_args.push_back(formula_program[1][j])
+        n_formula_ops = formula_ops.size()
+        use_formula_program = True
+    elif formula_expr is not None:
+        print(f"[calculate_batch_cy] 选股公式无法编译，回退到exec执行: {formula_expr}")
+
+    # 列式选股：只显示选股结果且公式可编译时分两遍计算。
+    # 第一遍只把公式用到的指标写入 (变量, 股票, 日期) 列矩阵，整批向量化求值公式后
+    # 用 argpartition 选出每个日期的前 select_count 名；第二遍只为入选行构造结果。
+    # collect_metrics 为真时第一遍收集全部公式变量并随结果返回（供主进程缓存）；
+    # 传入 row_mask（主进程用缓存的指标列选好的入选掩码）时跳过第一遍。
+    # metrics_only 为真时只做第一遍（与公式无关），返回空结果和全部指标列；
+    # 同时传入 row_mask 时第一遍只计算掩码内的行（为缓存中待补算的行补算完整指标）。
+    # 第一遍先用公式中不依赖止盈止损模拟的前置条件筛选，不成立的行跳过模拟，
+    # 这些行的止盈止损变量列为 NaN、row_ok 为0，并在 pending 掩码中标记为待补算；
+    # metrics_only 或 full_compute 为真时不预筛选。
+    cdef int n_stocks = stock_idx_arr_view.shape[0]
+    # 起始、截止结束日期颠倒时区间为空，按0个日期处理（返回空结果）
+    cdef int n_end_dates = max(end_date_start_idx - end_date_end_idx + 1, 0)
+    cdef bint columnar_mode = ((metrics_only or row_mask is not None or (only_show_selected and use_formula_program)) and
+                               n_stocks > 0 and n_end_dates > 0)
+    collect_metrics = collect_metrics or metrics_only
+    cdef bint fill_mode = columnar_mode and metrics_only and row_mask is not None
+    cdef int date_pos = 0
+    cdef vector[int] column_slots
+    cdef double[:, :, ::1] formula_cols_view
+    cdef unsigned char[:, ::1] row_ok_view
+    cdef unsigned char[:, ::1] cmp_zero_view
+    cdef unsigned char[:, ::1] row_mask_view
+    cdef unsigned char[:, ::1] pending_view
+    formula_cols = None
+    row_ok = None
+    pending = None
+    if columnar_mode and row_mask is not None:
+        row_mask_view = np.ascontiguousarray(row_mask, dtype=np.uint8)
+    if columnar_mode and (row_mask is None or fill_mode):
+        for slot in (range(FV_COUNT) if collect_metrics else formula_program_slots(formula_program)):
+            column_slots.push_back(slot)
+        formula_cols = np.zeros((max(<int>column_slots.size(), 1), n_stocks, n_end_dates), dtype=np.float64)
+        row_ok = np.zeros((n_stocks, n_end_dates), dtype=np.uint8)
+        cmp_zero = np.zeros((n_stocks, n_end_dates), dtype=np.uint8)
+        pending = np.zeros((n_stocks, n_end_dates), dtype=np.uint8)
+        formula_cols_view = formula_cols
+        row_ok_view = row_ok
+        cmp_zero_view = cmp_zero
+        pending_view = pending
+    cdef vector[int] prefilter_ops
+    cdef vector[double] prefilter_args
+    if columnar_mode and row_mask is None and not metrics_only and not full_compute:
+        prefilter_program = compile_formula_prefilter(formula_expr)
+        if prefilter_program is not None:
+            for j in range(len(prefilter_program[0])):
+                prefilter_ops.push_back(prefilter_program[0][j])
+                prefilter_args.push_back(prefilter_program[1][j])
+
     # 初始化结果字典
     for idx in range(end_date_start_idx, end_date_end_idx-1, -1):
         end_date = date_columns[idx]
         all_results[end_date] = []
+    seq_values.resize(n_end_dates * N_RESULT_SEQUENCES)
+    seq_offsets.resize(n_end_dates * N_RESULT_SEQUENCES)
+    for j in range(<int>seq_offsets.size()):
+        seq_offsets[j].push_back(0)
     
-    # 单线程处理每个股票
-    for i in range(stock_idx_arr_view.shape[0]):
-        stock_idx = stock_idx_arr_view[i]
-        #if stock_idx == 0:
-            # 在 nogil 块外打印进程信息
-            #import os
-            #current_pid = os.getpid()
-            #print(f"进程 {current_pid}: 开始计算 stock_idx={stock_idx}")
-            #print(f"进程 {current_pid}: only_show_selected={only_show_selected}")
-            #printf(b"Calculating stock_idx=%d\n", stock_idx)
-            #printf(b"only_show_selected=%d\n", only_show_selected)
-        for idx in range(end_date_start_idx, end_date_end_idx-1, -1):
-            try:
-                with nogil:
-                    # --- 创前新高1起始条件判断 ---
-                    if start_with_new_before_high_flag:
-                        new_before_high_start_idx = idx + new_before_high_start
-                        found_new_before_high = 0
-                        if new_before_high_logic == "与":
-                            found_new_before_high = 1
-                            for span_offset in range(new_before_high_span):
-                                check_idx = new_before_high_start_idx + span_offset
-                                cur_val = price_data_view[stock_idx, check_idx]
-                                max_val = -1e308
-                                has_valid_value = 0
-                                #if stock_idx == 3:
-                                    #printf(b"new_before_high_start_idx=%d, span_offset=%d\n", new_before_high_start_idx, span_offset)
-                                for k in range(check_idx + 1, check_idx + new_before_high_range + 1):
-                                    v = price_data_view[stock_idx, k]
-                                    if isnan(v) or v == 0:
-                                        continue
-                                    has_valid_value = 1
-                                    if v > max_val:
-                                        max_val = v
-                                
-                                #if stock_idx == 3:
-                                    #printf(b"new_before_high and logic, cur_val=%f, max_val=%f\n", cur_val, max_val)
-                                    #printf(b"New High Check: stock_idx=%d, span_offset=%d, new_high_span=%d, check_idx=%d, range: %d ~ %d\n", stock_idx, span_offset, new_before_high_span, check_idx, check_idx + new_before_high_range + 1, check_idx + 1)
-                                if not has_valid_value or isnan(cur_val):
-                                    found_new_before_high = 0
-                                    continue
-                                if cur_val <= max_val:
-                                    found_new_before_high = 0
-                                    break
-                        else:
-                            for span_offset in range(new_before_high_span):
-                                check_idx = new_before_high_start_idx + span_offset
-                                cur_val = price_data_view[stock_idx, check_idx]
-                                max_val = -1e308
-                                has_valid_value = 0
-                                #if stock_idx == 3:
-                                    #printf(b"new_before_high_start_idx=%d, span_offset=%d\n", new_before_high_start_idx, span_offset)
-                                for k in range(check_idx + 1, check_idx + new_before_high_range + 1):
-                                    v = price_data_view[stock_idx, k]
-                                    #if stock_idx == 3:
-                                        #printf(b"k=%d, v=%d\n", k, v)
-                                    if isnan(v) or v == 0:
-                                        continue
-                                    has_valid_value = 1
-                                    if v > max_val:
-                                        max_val = v
-                                #if stock_idx == 3:
-                                    #printf(b"new_before_high or logic, cur_val=%f, max_val=%f\n", cur_val, max_val)
-                                    #printf(b"New High Check: stock_idx=%d, span_offset=%d, new_high_span=%d, check_idx=%d, range: %d ~ %d\n", stock_idx, span_offset, new_before_high_span, check_idx, check_idx + new_before_high_range + 1, check_idx + 1)
-                                if not has_valid_value or isnan(cur_val):
-                                    continue
-                                if cur_val > max_val:
-                                    found_new_before_high = 1
-                                    break
-                        start_with_new_before_high = found_new_before_high == 1
-                        # 如果没有创前新高1，跳过后续计算
-                        if not start_with_new_before_high:
-                            continue
-                    else:
-                        start_with_new_before_high = 0
-                    #if stock_idx == 0:
-                        #printf(b"running1\n")
-
-                    # --- 创前新高2起始条件判断 ---
-                    if start_with_new_before_high2_flag:
-                        new_before_high2_start_idx = idx + new_before_high2_start
-                        found_new_before_high2 = 0
-                        if new_before_high2_logic == "与":
-                            found_new_before_high2 = 1
-                            for span_offset in range(new_before_high2_span):
-                                check_idx = new_before_high2_start_idx + span_offset
-                                cur_val = price_data_view[stock_idx, check_idx]
-                                max_val = -1e308
-                                has_valid_value = 0
-                                for k in range(check_idx + 1, check_idx + new_before_high2_range + 1):
-                                    v = price_data_view[stock_idx, k]
-                                    if isnan(v) or v == 0:
-                                        continue
-                                    has_valid_value = 1
-                                    if v > max_val:
-                                        max_val = v
-                                
-                                #if stock_idx == 2:
-                                    #printf(b"new_before_high2 and logic, cur_val=%f, max_val=%f, has_valid_value=%d\n", cur_val, max_val, has_valid_value)
-                                    #printf(b"New High2 Check: stock_idx=%d, span_offset=%d, new_high2_span=%d, check_idx=%d, range: %d ~ %d\n", stock_idx, span_offset, new_before_high2_span, check_idx, check_idx + new_before_high2_range + 1, check_idx + 1)
-                                if not has_valid_value or isnan(cur_val):
-                                    found_new_before_high2 = 0
-                                    continue
-                                if cur_val <= max_val:
-                                    found_new_before_high2 = 0
-                                    break
-                        else:
-                            for span_offset in range(new_before_high2_span):
-                                check_idx = new_before_high2_start_idx + span_offset
-                                cur_val = price_data_view[stock_idx, check_idx]
-                                max_val = -1e308
-                                has_valid_value = 0
-                                for k in range(check_idx + 1, check_idx + new_before_high2_range + 1):
-                                    v = price_data_view[stock_idx, k]
-                                    if isnan(v) or v == 0:
-                                        continue
-                                    has_valid_value = 1
-                                    if v > max_val:
-                                        max_val = v
-                                #if stock_idx == 2:
-                                    #printf(b"new_before_high2 or logic, cur_val=%f, max_val=%f, has_valid_value=%d \n", cur_val, max_val, has_valid_value)
-                                    #printf(b"New High2 Check: stock_idx=%d, span_offset=%d, new_high2_span=%d, check_idx=%d, range: %d ~ %d\n", stock_idx, span_offset, new_before_high2_span, check_idx, check_idx + new_before_high2_range + 1, check_idx + 1)
-                                if not has_valid_value or isnan(cur_val):
-                                    continue
-                                if cur_val > max_val:
-                                    found_new_before_high2 = 1
-                                    break
-                        start_with_new_before_high2 = found_new_before_high2 == 1
-
-                        #if stock_idx == 2:
-                            #printf(b"stock_idx=%d, start_with_new_before_high=%d, found_new_before_high=%d, start_with_new_before_high2=%d, found_new_before_high2=%d\n", stock_idx, start_with_new_before_high, found_new_before_high, start_with_new_before_high2, found_new_before_high2)
-                        # 如果没有创前新高2，跳过后续计算
-                        if not start_with_new_before_high2:
-                            continue
-                    else:
-                        start_with_new_before_high2 = 0
-                    #if stock_idx == 0:
-                        #printf(b"running2\n")
-
-                    # --- 创后新高起始条件判断 --- 
-                    if start_with_new_after_high_flag:
-                        new_after_high_start_idx = idx + new_after_high_start + new_after_high_range
-                        found_new_after_high = 0
-                        if new_after_high_logic == "与":
-                            found_new_after_high = 1
-                            for span_offset in range(new_after_high_span):
-                                check_idx = new_after_high_start_idx + span_offset 
-                                #if stock_idx == 0:
-                                    #printf(b"New After High1 Check: new_after_high_start_idx=%d, check_idx=%d, span_offset=%d, new_after_high_start=%d, new_after_high_range=%d\n",new_after_high_start_idx, check_idx, span_offset, new_after_high_start, new_after_high_range)
-                                    #printf(b"New After High1 Check: stock_idx=%d, new_after_high_span=%d, range: %d ~ %d\n", stock_idx, new_after_high_span, check_idx - new_after_high_range, check_idx)
-                                cur_val = price_data_view[stock_idx, check_idx]
-                                max_val = -1e308
-                                has_valid_value = 0
-                                for k in range(check_idx - new_after_high_range, check_idx):
-                                    #if stock_idx == 0:
-                                        #printf(b"k = %d\n", k)
-                                    v = price_data_view[stock_idx, k]
-                                    if isnan(v) or v == 0:
-                                        continue
-                                    has_valid_value = 1
-                                    if v > max_val:
-                                        max_val = v
-                                
-                                #if stock_idx == 2:
-                                    #printf(b"new_after_high and logic, cur_val=%f, max_val=%f, has_valid_value=%d\n", cur_val, max_val, has_valid_value)
-                                    #printf(b"New After High Check: stock_idx=%d, span_offset=%d, new_high_span=%d, check_idx=%d, range: %d ~ %d\n", stock_idx, span_offset, new_after_high_span, check_idx, check_idx - new_after_high_range, check_idx)
-                                if not has_valid_value or isnan(cur_val):
-                                    found_new_after_high = 0
-                                    continue
-                                if cur_val <= max_val:
-                                    found_new_after_high = 0
-                                    break
-                        else:
-                            for span_offset in range(new_after_high_span):
-                                check_idx = new_after_high_start_idx + span_offset
-                                cur_val = price_data_view[stock_idx, check_idx]
-                                max_val = -1e308
-                                has_valid_value = 0
-                                #if stock_idx == 2:
-                                    #printf(b"New After High1 or Check: new_after_high_start_idx=%d, check_idx=%d, span_offset=%d, new_after_high_start=%d, new_after_high_range=%d\n",new_after_high_start_idx, check_idx, span_offset, new_after_high_start, new_after_high_range)
-                                    #printf(b"New After High1 or Check: stock_idx=%d, new_after_high_span=%d, range: %d ~ %d\n", stock_idx, new_after_high_span, check_idx - new_after_high_range, check_idx)
-                                for k in range(check_idx - new_after_high_range, check_idx):
-                                    v = price_data_view[stock_idx, k]
-                                    #if stock_idx == 2:
-                                        #printf(b"k = %d\n", k)
-                                    if isnan(v) or v == 0:
-                                        continue
-                                    has_valid_value = 1
-                                    if v > max_val:
-                                        max_val = v
-                                #if stock_idx == 2:
-                                    #printf(b"new_after_high1 or logic, cur_val=%f, max_val=%f, has_valid_value=%d \n", cur_val, max_val, has_valid_value)
-                                if not has_valid_value or isnan(cur_val):
-                                    continue
-                                if cur_val > max_val:
-                                    found_new_after_high = 1
-                                    break
-                        start_with_new_after_high = found_new_after_high == 1
-                        # 如果没有创后新高1，跳过后续计算
-                        if not start_with_new_after_high:
-                            continue
-                    else:
-                        start_with_new_after_high = 0
-
-                    #if stock_idx == 0:
-                        #printf(b"running3\n")
-
-                    # --- 创后新高2起始条件判断 ---
-                    if start_with_new_after_high2_flag:
-                        new_after_high2_start_idx = idx + new_after_high2_start + new_after_high2_range
-                        found_new_after_high2 = 0
-                        if new_after_high2_logic == "与":
-                            found_new_after_high2 = 1
-                            for span_offset in range(new_after_high2_span):
-                                check_idx = new_after_high2_start_idx + span_offset
-                                cur_val = price_data_view[stock_idx, check_idx]
-                                max_val = -1e308
-                                has_valid_value = 0
-                                for k in range(check_idx - new_after_high2_range, check_idx):
-                                    v = price_data_view[stock_idx, k]
-                                    if isnan(v) or v == 0:
-                                        continue
-                                    has_valid_value = 1
-                                    if v > max_val:
-                                        max_val = v
-                                
-                                #if stock_idx == 2:
-                                    #printf(b"new_after_high2 and logic, cur_val=%f, max_val=%f, has_valid_value=%d\n", cur_val, max_val, has_valid_value)
-                                    #printf(b"New After High2 Check: stock_idx=%d, span_offset=%d, new_high2_span=%d, check_idx=%d, range: %d ~ %d\n", stock_idx, span_offset, new_after_high2_span, check_idx, check_idx - new_after_high2_range, check_idx)
-                                if not has_valid_value or isnan(cur_val):
-                                    found_new_after_high2 = 0
-                                    continue
-                                if cur_val <= max_val:
-                                    found_new_after_high2 = 0
-                                    break
-                        else:
-                            for span_offset in range(new_after_high2_span):
-                                check_idx = new_after_high2_start_idx + span_offset
-                                cur_val = price_data_view[stock_idx, check_idx]
-                                max_val = -1e308
-                                has_valid_value = 0
-                                for k in range(check_idx - new_after_high2_range, check_idx):
-                                    v = price_data_view[stock_idx, k]
-                                    if isnan(v) or v == 0:
-                                        continue
-                                    has_valid_value = 1
-                                    if v > max_val:
-                                        max_val = v
-                                #if stock_idx == 2:
-                                    #printf(b"new_after_high2 or logic, cur_val=%f, max_val=%f, has_valid_value=%d \n", cur_val, max_val, has_valid_value)
-                                    #printf(b"New After High2 Check: stock_idx=%d, span_offset=%d, new_high2_span=%d, check_idx=%d, range: %d ~ %d\n", stock_idx, span_offset, new_after_high2_span, check_idx, check_idx - new_after_high2_range, check_idx)
-                                if not has_valid_value or isnan(cur_val):
-                                    continue
-                                if cur_val > max_val:
-                                    found_new_after_high2 = 1
-                                    break
-                        start_with_new_after_high2 = found_new_after_high2 == 1
-                        # 如果没有创后新高2，跳过后续计算
-                        if not start_with_new_after_high2:
-                            continue
-                    else:
-                        start_with_new_after_high2 = 0
-
-                    #if stock_idx == 2:
-                        #printf(b"stock_idx=%d, start_with_new_after_high=%d, found_new_after_high=%d, start_with_new_after_high2=%d, found_new_after_high2=%d\n", stock_idx, start_with_new_after_high, found_new_after_high, start_with_new_after_high2, found_new_after_high2)
-                    
-                    #if stock_idx == 0:
-                        #printf(b"running4\n")
-
-                    # --- 创前新低1起始条件判断 ---
-                    if start_with_new_before_low_flag:
-                        new_before_low_start_idx = idx + new_before_low_start
-                        found_before_new_low = 0
-                        if new_before_low_logic == "与":
-                            found_before_new_low = 1
-                            for span_offset in range(new_before_low_span):
-                                check_idx = new_before_low_start_idx + span_offset
-                                if check_idx >= price_data_view.shape[1] or check_idx + new_before_low_range >= price_data_view.shape[1]:
-                                    continue
-                                cur_val = price_data_view[stock_idx, check_idx]
-                                min_val = 1e308
-                                has_valid_value = 0
-                                for k in range(check_idx + 1, check_idx + new_before_low_range + 1):
-                                    v = price_data_view[stock_idx, k]
-                                    if isnan(v) or v == 0:
-                                        continue
-                                    has_valid_value = 1
-                                    if v < min_val:
-                                        min_val = v
-                                if not has_valid_value or isnan(cur_val):
-                                    found_before_new_low = 0
-                                    break
-                                if cur_val >= min_val:
-                                    found_before_new_low = 0
-                                    break
-                        else:  # "或"逻辑
-                            for span_offset in range(new_before_low_span):
-                                check_idx = new_before_low_start_idx + span_offset
-                                if check_idx >= price_data_view.shape[1] or check_idx + new_before_low_range >= price_data_view.shape[1]:
-                                    continue
-                                cur_val = price_data_view[stock_idx, check_idx]
-                                min_val = 1e308
-                                has_valid_value = 0
-                                for k in range(check_idx + 1, check_idx + new_before_low_range + 1):
-                                    v = price_data_view[stock_idx, k]
-                                    if isnan(v) or v == 0:
-                                        continue
-                                    has_valid_value = 1
-                                    if v < min_val:
-                                        min_val = v
-                                if not has_valid_value or isnan(cur_val):
-                                    continue
-                                if cur_val < min_val:
-                                    found_before_new_low = 1
-                                    break
-                        start_with_new_before_low = found_before_new_low == 1
-                        # 如果没有创前新低1，跳过后续计算
-                        if not start_with_new_before_low:
-                            continue
-                    else:
-                        start_with_new_before_low = 0
-                    #if stock_idx == 0:
-                        #printf(b"running5\n")
-
-                    # --- 创前新低2起始条件判断 ---
-                    if start_with_new_before_low2_flag:
-                        new_before_low2_start_idx = idx + new_before_low2_start
-                        found_new_before_low2 = 0
-                        if new_before_low2_logic == "与":
-                            found_new_before_low2 = 1
-                            for span_offset in range(new_before_low2_span):
-                                check_idx = new_before_low2_start_idx + span_offset
-                                if check_idx >= price_data_view.shape[1] or check_idx + new_before_low2_range >= price_data_view.shape[1]:
-                                    continue
-                                cur_val = price_data_view[stock_idx, check_idx]
-                                min_val = 1e308
-                                has_valid_value = 0
-                                for k in range(check_idx + 1, check_idx + new_before_low2_range + 1):
-                                    v = price_data_view[stock_idx, k]
-                                    if isnan(v) or v == 0:
-                                        continue
-                                    has_valid_value = 1
-                                    if v < min_val:
-                                        min_val = v
-                                if not has_valid_value or isnan(cur_val):
-                                    found_new_before_low2 = 0
-                                    break
-                                if cur_val >= min_val:
-                                    found_new_before_low2 = 0
-                                    break
-                        else:  # "或"逻辑
-                            for span_offset in range(new_before_low2_span):
-                                check_idx = new_before_low2_start_idx + span_offset
-                                if check_idx >= price_data_view.shape[1] or check_idx + new_before_low2_range >= price_data_view.shape[1]:
-                                    continue
-                                cur_val = price_data_view[stock_idx, check_idx]
-                                min_val = 1e308
-                                has_valid_value = 0
-                                for k in range(check_idx + 1, check_idx + new_before_low2_range + 1):
-                                    v = price_data_view[stock_idx, k]
-                                    if isnan(v) or v == 0:
-                                        continue
-                                    has_valid_value = 1
-                                    if v < min_val:
-                                        min_val = v
-                                if not has_valid_value or isnan(cur_val):
-                                    continue
-                                if cur_val < min_val:
-                                    found_new_before_low2 = 1
-                                    break
-                        start_with_new_before_low2 = found_new_before_low2 == 1
-                        # 如果没有创前新低2，跳过后续计算
-                        if not start_with_new_before_low2:
-                            continue
-                    else:
-                        start_with_new_before_low2 = 0
-
-                    #if stock_idx == 0:
-                        #printf(b"running6\n")
-
-                    # --- 创后新低1起始条件判断 ---
-                    if start_with_new_after_low_flag:
-                        new_after_low_start_idx = idx + new_after_low_start + new_after_low_range
-                        found_new_after_low = 0
-                        if new_after_low_logic == "与":
-                            found_new_after_low = 1
-                            for span_offset in range(new_after_low_span):
-                                check_idx = new_after_low_start_idx + span_offset
-                                if check_idx >= price_data_view.shape[1] or check_idx + new_after_low_range >= price_data_view.shape[1]:
-                                    continue
-                                cur_val = price_data_view[stock_idx, check_idx]
-                                min_val = 1e308
-                                has_valid_value = 0
-                                for k in range(check_idx - new_after_low_range, check_idx):
-                                    v = price_data_view[stock_idx, k]
-                                    if isnan(v) or v == 0:
-                                        continue
-                                    has_valid_value = 1
-                                    if v < min_val:
-                                        min_val = v
-                                if not has_valid_value or isnan(cur_val):
-                                    found_new_after_low = 0
-                                    break
-                                if cur_val >= min_val:
-                                    found_new_after_low = 0
-                                    break
-                        else:  # "或"逻辑
-                            for span_offset in range(new_after_low_span):
-                                check_idx = new_after_low_start_idx + span_offset
-                                if check_idx >= price_data_view.shape[1] or check_idx + new_after_low_range >= price_data_view.shape[1]:
-                                    continue
-                                cur_val = price_data_view[stock_idx, check_idx]
-                                min_val = 1e308
-                                has_valid_value = 0
-                                for k in range(check_idx - new_after_low_range, check_idx):
-                                    v = price_data_view[stock_idx, k]
-                                    if isnan(v) or v == 0:
-                                        continue
-                                    has_valid_value = 1
-                                    if v < min_val:
-                                        min_val = v
-                                if not has_valid_value or isnan(cur_val):
-                                    continue
-                                if cur_val < min_val:
-                                    found_new_after_low = 1
-                                    break
-                        start_with_new_after_low = found_new_after_low == 1
-                        # 如果没有创后新低1，跳过后续计算
-                        if not start_with_new_after_low:
-                            continue
-                    
-                    else:
-                        start_with_new_after_low = 0
-
-                    #if stock_idx == 0:
-                        #printf(b"running7\n")
-
-                    # --- 创后新低2起始条件判断 ---
-                    if start_with_new_after_low2_flag:
-                        new_after_low2_start_idx = idx + new_after_low2_start + new_after_low2_range
-                        found_new_after_low2 = 0
-                        if new_after_low2_logic == "与":
-                            found_new_after_low2 = 1
-                            for span_offset in range(new_after_low2_span):
-                                check_idx = new_after_low2_start_idx + span_offset
-                                if check_idx >= price_data_view.shape[1] or check_idx + new_after_low2_range >= price_data_view.shape[1]:
-                                    continue
-                                cur_val = price_data_view[stock_idx, check_idx]
-                                min_val = 1e308
-                                has_valid_value = 0
-                                for k in range(check_idx - new_after_low2_range, check_idx):
-                                    v = price_data_view[stock_idx, k]
-                                    if isnan(v) or v == 0:
-                                        continue
-                                    has_valid_value = 1
-                                    if v < min_val:
-                                        min_val = v
-                                if not has_valid_value or isnan(cur_val):
-                                    found_new_after_low2 = 0
-                                    break
-                                if cur_val >= min_val:
-                                    found_new_after_low2 = 0
-                                    break
-                        else:  # "或"逻辑
-                            for span_offset in range(new_after_low2_span):
-                                check_idx = new_after_low2_start_idx + span_offset
-                                if check_idx >= price_data_view.shape[1] or check_idx + new_after_low2_range >= price_data_view.shape[1]:
-                                    continue
-                                cur_val = price_data_view[stock_idx, check_idx]
-                                min_val = 1e308
-                                has_valid_value = 0
-                                for k in range(check_idx - new_after_low2_range, check_idx):
-                                    v = price_data_view[stock_idx, k]
-                                    if isnan(v) or v == 0:
-                                        continue
-                                    has_valid_value = 1
-                                    if v < min_val:
-                                        min_val = v
-                                if not has_valid_value or isnan(cur_val):
-                                    continue
-                                if cur_val < min_val:
-                                    found_new_after_low2 = 1
-                                    break
-                        start_with_new_after_low2 = found_new_after_low2 == 1
-                        # 如果没有创后新低2，跳过后续计算
-                        if not start_with_new_after_low2:
-                            continue
-                    else:
-                        start_with_new_after_low2 = 0
-
-                    #if stock_idx == 0:
-                        #printf(b"running1\n")
-                        
-                    # 原有的with nogil内容
-                    end_date_idx = idx
-                    start_date_idx = end_date_idx + width
-                    max_price = -1e308
-                    min_price = 1e308
-                    max_idx_in_window = -1
-                    min_idx_in_window = -1
-                    window_len = width + 1 
-                    for j in range(window_len):
-                        if not isnan(price_data_view[stock_idx, end_date_idx + j]):
-                            if price_data_view[stock_idx, end_date_idx + j] > max_price:
-                                max_price = price_data_view[stock_idx, end_date_idx + j]
-                                max_idx_in_window = j
-                            if price_data_view[stock_idx, end_date_idx + j] < min_price:
-                                min_price = price_data_view[stock_idx, end_date_idx + j]
-                                min_idx_in_window = j
-                    
-                    # 检查是否找到了有效值，如果没有找到则设置为nan
-                    if max_idx_in_window == -1:
-                        max_price = NAN
-                    if min_idx_in_window == -1:
-                        min_price = NAN
-                    
-                    end_value = price_data_view[stock_idx, end_date_idx]
-                    start_value = price_data_view[stock_idx, start_date_idx]
-                    
-                    # 计算最接近值
-                    closest_value = NAN
-                    closest_idx_in_window = -1
-                    if not isnan(end_value):
-                        min_diff = 1e308
-                        for j in range(1, window_len):  # j=0为结束日自身，跳过
-                            if not isnan(price_data_view[stock_idx, end_date_idx + j]):
-                                diff = fabs(price_data_view[stock_idx, end_date_idx + j] - end_value)
-                                if diff < min_diff:
-                                    min_diff = diff
-                                    closest_value = price_data_view[stock_idx, end_date_idx + j]
-                                    closest_idx_in_window = j
-                    
-                    # 确定实际开始值索引
-                    if start_option == "最大值":
-                        base_idx = end_date_idx + max_idx_in_window if max_idx_in_window >= 0 else -1
-                    elif start_option == "最小值":
-                        base_idx = end_date_idx + min_idx_in_window if min_idx_in_window >= 0 else -1
-                    elif start_option == "接近值":
-                        base_idx = end_date_idx + closest_idx_in_window if closest_idx_in_window >= 0 else -1
-                    else:
-                        base_idx = start_date_idx
-                    
-                    actual_idx = base_idx - shift_days if base_idx >= 0 else -1
-                    actual_value = price_data_view[stock_idx, actual_idx] if actual_idx >= 0 and actual_idx < num_dates else NAN
-
-                    
-                    # 计算连续累加值
-                    if actual_idx >= 0 and actual_idx >= end_date_idx:
-                        has_three_consecutive_zeros = calc_continuous_sum(diff_data_view[stock_idx, end_date_idx:actual_idx+1][::-1], cont_sum)
-                        if has_three_consecutive_zeros:
-                            cont_sum.clear()
-                    else:
-                        cont_sum.clear()
-                    # 计算连续累加值正加和与负加和
-                    calc_pos_neg_sum(cont_sum, &cont_sum_pos_sum, &cont_sum_neg_sum)
-                    # 注意：cont_sum_pos_sum, cont_sum_neg_sum 使用了 round_to_2_nan，需要在Python层处理
-
-                    # 计算连续累加值正负加值的前一半、后一半累加值
-                    calc_pos_neg_sum_halves(cont_sum, &cont_sum_pos_sum_first_half, &cont_sum_pos_sum_second_half, &cont_sum_neg_sum_first_half, &cont_sum_neg_sum_second_half)
-                    # 注意：cont_sum_pos_sum_first_half, cont_sum_pos_sum_second_half, cont_sum_neg_sum_first_half, cont_sum_neg_sum_second_half 使用了 round_to_2_nan，需要在Python层处理
-
-                    # 计算向前最大连续累加值
-                    if is_forward and actual_idx > 0:
-                        forward_max_price = -1e308
-                        forward_min_price = 1e308
-                        forward_max_idx_in_window = -1
-                        forward_min_idx_in_window = -1
-                        window = price_data_view[stock_idx, end_date_idx:actual_idx]
-                        for j in range(window.shape[0]):
-                            v = window[j]
-                            if not isnan(v):
-                                if v > forward_max_price:
-                                    forward_max_price = v
-                                    forward_max_idx_in_window = j
-                                if v < forward_min_price:
-                                    forward_min_price = v
-                                    forward_min_idx_in_window = j
-                        forward_max_date_idx = end_date_idx + forward_max_idx_in_window if forward_max_idx_in_window >= 0 else -1
-                        forward_min_date_idx = end_date_idx + forward_min_idx_in_window if forward_min_idx_in_window >= 0 else -1
-
-                        # 2. 计算向前最大连续累加值
-                        if forward_max_idx_in_window >= 0 and not has_three_consecutive_zeros:
-                            calc_continuous_sum(
-                                diff_data_view[stock_idx, end_date_idx:forward_max_date_idx][::-1],
-                                forward_max_result_c
-                            )
-                        else:
-                            forward_max_result_c.clear()
-
-                        # 3. 计算向前最小连续累加值
-                        if forward_min_idx_in_window >= 0 and not has_three_consecutive_zeros:
-                            calc_continuous_sum(
-                                diff_data_view[stock_idx, end_date_idx:forward_min_date_idx][::-1],
-                                forward_min_result_c
-                            )
-                        else:
-                            forward_min_result_c.clear()
-                    else:
-                        forward_max_result_c.clear()
-                        forward_min_result_c.clear()
-                        forward_max_date_idx = -1  
-                        forward_min_date_idx = -1  
-
-                    #计算向前最大最小连续累加值正加和与负加和
-                    if is_forward:
-                        calc_pos_neg_sum(forward_max_result_c, &forward_max_cont_sum_pos_sum, &forward_max_cont_sum_neg_sum)
-                        calc_pos_neg_sum(forward_min_result_c, &forward_min_cont_sum_pos_sum, &forward_min_cont_sum_neg_sum)
-                    else:
-                        forward_max_cont_sum_pos_sum = NAN
-                        forward_max_cont_sum_neg_sum = NAN
-                        forward_min_cont_sum_pos_sum = NAN
-                        forward_min_cont_sum_neg_sum = NAN
-                    # 注意：forward_max_cont_sum_pos_sum, forward_max_cont_sum_neg_sum 使用了 round_to_2_nan，需要在Python层处理
-                    # 注意：forward_min_cont_sum_pos_sum, forward_min_cont_sum_neg_sum 使用了 round_to_2_nan，需要在Python层处理
-
-                    #if stock_idx == 0:
-                        #printf(b"running2\n")
-
-                    # 递增值计算逻辑
-                    # 停盈停损
-                    increment_value = NAN
-                    loss_increment_value = NAN
-                    increment_days = -1
-                    loss_increment_days = -1
-
-                    after_gt_end_value = NAN
-                    loss_after_gt_end_value = NAN
-                    after_gt_end_days = -1
-                    loss_after_gt_end_days = -1
-                    
-                    after_gt_start_value = NAN
-                    loss_after_gt_start_value = NAN
-                    after_gt_start_days = -1
-                    loss_after_gt_start_days = -1
-
-                    # 止盈止损
-                    increment_change = NAN
-                    after_gt_end_change = NAN
-                    after_gt_start_change = NAN
-
-                    # INC 止盈、 停盈、止损 、停损
-                    take_inc = NAN
-                    stop_inc = NAN
-                    take_loss_inc = NAN
-                    stop_loss_inc = NAN
-
-                    # AGE 止盈、 停盈、止损 、停损
-                    take_age = NAN
-                    stop_age = NAN
-                    take_loss_age = NAN
-                    stop_loss_age = NAN
-
-                    # AGS 止盈、 停盈、止损 、停损
-                    take_ags = NAN
-                    stop_ags = NAN
-                    take_loss_ags = NAN
-                    stop_loss_ags = NAN
-
-                    # 止盈停损相关
-                    take_and_stop_increment_change = NAN
-                    take_and_stop_after_gt_end_change = NAN
-                    take_and_stop_after_gt_start_change = NAN
-                    # 停盈止损相关
-                    stop_and_take_increment_change = NAN
-                    stop_and_take_after_gt_end_change = NAN
-                    stop_and_take_after_gt_start_change = NAN
-
-                    if op_days > 0:
-                        end_value = price_data_view[stock_idx, end_date_idx]
-                        
-                        # 新增：计算操作日当天涨跌幅
-                        op_day_change = NAN
-                        if end_date_idx > 0:
-                            op_day_idx = end_date_idx - op_days
-                            op_day_prev_idx = end_date_idx - op_days + 1
-                            
-                            # 处理索引越界情况
-                            if op_day_idx < 0:
-                                op_day_idx = 0
-                                op_day_prev_idx = 1
-                            
-                            # 检查索引边界 - 确保不会越界
-                            if op_day_idx < num_dates and op_day_prev_idx < num_dates and op_day_idx >= 0 and op_day_prev_idx >= 0:
-                                op_day_price = price_data_view[stock_idx, op_day_idx]
-                                op_day_prev_price = price_data_view[stock_idx, op_day_prev_idx]
-                                
-                                if not isnan(op_day_price) and not isnan(op_day_prev_price) and op_day_prev_price != 0:
-                                    op_day_change = ((op_day_price - op_day_prev_price) / op_day_prev_price) * 100  # 移除 round_to_2
-                        
-                        if not isnan(end_value):
-                            # 递增值
-                            found = False
-                            for n, k in enumerate(range(end_date_idx - 1, end_date_idx - op_days - 1, -1), 1):
-                                if k < 0:
-                                    break
-                                v = price_data_view[stock_idx, k]
-                                if isnan(v) or (trade_t1_mode and n == 1):
-                                    continue
-                                increment_threshold = end_value * inc_rate * n
-                                stop_loss_inc_threshold = end_value * stop_loss_inc_rate * n
-
-                                if n == 1:
-                                    prev_price = end_value
-                                else:
-                                    prev_price = price_data_view[stock_idx, k + 1]
-
-                                if increment_threshold != 0 and (v - end_value) > increment_threshold:
-                                    increment_value = v
-                                    increment_days = n
-                                    increment_change = inc_rate * n * 100
-                                    take_inc = inc_rate * n * 100
-                                    if end_value != 0 and not isnan(end_value):
-                                        stop_inc = ((v - end_value) / end_value) * 100
-                                        stop_and_take_increment_change = ((v - end_value) / end_value) * 100  # 移除 round_to_2
-                                    else:
-                                        stop_inc = NAN
-                                        stop_and_take_increment_change = NAN
-                                    take_and_stop_increment_change = increment_change
-                                    
-                                    #if not isnan(prev_price) and prev_price != 0:
-                                    #   inc_take_profit = ((v - prev_price) / prev_price) * 100  # 移除 round_to_2
-                                    #else:
-                                    #   inc_take_profit = NAN
-
-                                    # INC 前几天的涨幅 / 持有天数
-                                    inc_take_profit = ((v - end_value) / end_value) * 100 / n
-                                    found = True
-                                    inc_end_state = 1
-                                    break
-                                    
-                                #if stock_idx == 2164:
-                                    #printf("stock_idx=%d, n=%d, v=%.2f, end_value=%.2f, stop_loss_inc_rate=%.4f, stop_loss_inc_threshold=%.2f\n", 
-                                           #stock_idx, n, v, end_value, stop_loss_inc_rate, stop_loss_inc_threshold)
-
-                                if stop_loss_inc_threshold != 0 and (v - end_value) < stop_loss_inc_threshold:
-                                    increment_value = v  # 移除 round_to_2
-                                    loss_increment_days = n
-                                    increment_change = stop_loss_inc_rate * n * 100
-                                    take_loss_inc = stop_loss_inc_rate * n * 100
-                                    if end_value != 0 and not isnan(end_value):
-                                        stop_loss_inc = ((v - end_value) / end_value) * 100
-                                        take_and_stop_increment_change = ((v - end_value) / end_value) * 100  # 移除 round_to_2
-                                    else:
-                                        stop_loss_inc = NAN
-                                        take_and_stop_increment_change = NAN
-                                    stop_and_take_increment_change = increment_change
-
-                                    #if not isnan(prev_price) and prev_price != 0:
-                                    #    inc_stop_loss = ((v - prev_price) / prev_price) * 100  # 移除 round_to_2
-                                    #else:
-                                    #    inc_stop_loss = NAN
-
-                                    # INC 前几天的涨幅 / 持有天数
-                                    inc_stop_loss = ((v - end_value) / end_value) * 100 / n
-
-                                    found = True
-                                    inc_end_state = 2
-                                    break
-
-                            if not found:
-                                increment_value = NAN
-                                increment_days = -1
-                                loss_increment_days = -1
-                                increment_change = NAN
-                                inc_end_state = 0
-                                inc_take_profit = NAN
-                                inc_stop_loss = NAN
-                                take_and_stop_increment_change = NAN
-                                stop_and_take_increment_change = NAN
-                                take_inc = NAN
-                                stop_inc = NAN
-                                take_loss_inc = NAN
-                                stop_loss_inc = NAN
-
-                            # after_gt_end_value 计算（方向：end_date_idx-1 向 end_date_idx-op_days）
-                            found = False
-                            for n, k in enumerate(range(end_date_idx - 1, end_date_idx - op_days - 1, -1), 1):
-                                if k < 0:
-                                    break
-                                v = price_data_view[stock_idx, k]
-                                if isnan(v) or (trade_t1_mode and n == 1):
-                                    continue
-
-                                if n == 1:
-                                    prev_price = end_value
-                                else:
-                                    # 检查边界，确保 k + 1 在有效范围内
-                                    if k + 1 < num_dates:
-                                        prev_price = price_data_view[stock_idx, k + 1]
-                                    else:
-                                        prev_price = NAN
-
-                                after_gt_end_threshold = end_value * after_gt_end_ratio
-                                # 计算止损阈值
-                                stop_loss_after_gt_end_threshold = end_value * stop_loss_after_gt_end_ratio
-                                #if stock_idx == 2164:
-                                    #printf("stock_idx=%d, n=%d, v=%.2f, end_value=%.2f, after_gt_end_ratio=%.4f, after_gt_end_threshold=%.2f\n", 
-                                           #stock_idx, n, v, end_value, after_gt_end_ratio, after_gt_end_threshold)
-
-                                if after_gt_end_ratio != 0 and (v - end_value) > after_gt_end_threshold:
-                                    after_gt_end_value = v  # 移除 round_to_2
-                                    after_gt_end_days = n
-                                    after_gt_end_change = after_gt_end_ratio * 100
-                                    take_age = after_gt_end_ratio * 100
-                                    if end_value != 0 and not isnan(end_value):
-                                        stop_age = ((v - end_value) / end_value) * 100
-                                        stop_and_take_after_gt_end_change = ((v - end_value) / end_value) * 100  # 移除 round_to_2
-                                    else:
-                                        stop_age = NAN
-                                        stop_and_take_after_gt_end_change = NAN
-                                    take_and_stop_after_gt_end_change = after_gt_end_change
-                                    found = True
-                                    ge_end_state = 1
-
-                                    #if not isnan(prev_price) and prev_price != 0:
-                                    #    ge_take_profit = ((v - prev_price) / prev_price) * 100  # 移除 round_to_2
-                                    #else:
-                                    #    ge_take_profit = NAN
-
-                                    # AGE 前面天数的涨幅
-                                    if end_value != 0 and not isnan(end_value):
-                                        ge_take_profit = ((v - end_value) / end_value) * 100
-                                    else:
-                                        ge_take_profit = NAN
-
-                                    break
-
-                                #if stock_idx == 2164:
-                                    #printf("stock_idx=%d, n=%d, v=%.2f, end_value=%.2f, stop_loss_after_gt_end_ratio=%.4f, stop_loss_after_gt_end_threshold=%.2f\n", 
-                                           #stock_idx, n, v, end_value, stop_loss_after_gt_end_ratio, stop_loss_after_gt_end_threshold)
-
-                                if stop_loss_after_gt_end_ratio != 0 and (v - end_value) < stop_loss_after_gt_end_threshold:
-                                    after_gt_end_value = v  # 移除 round_to_2
-                                    loss_after_gt_end_days = n
-                                    after_gt_end_change = stop_loss_after_gt_end_ratio * 100
-                                    take_loss_age = stop_loss_after_gt_end_ratio * 100
-                                    if end_value != 0 and not isnan(end_value):
-                                        stop_loss_age = ((v - end_value) / end_value) * 100
-                                        take_and_stop_after_gt_end_change = ((v - end_value) / end_value) * 100  # 移除 round_to_2
-                                    else:
-                                        stop_loss_age = NAN
-                                        take_and_stop_after_gt_end_change = NAN
-                                    stop_and_take_after_gt_end_change = after_gt_end_change
-                                    found = True
-                                    ge_end_state = 2
-                                    #if not isnan(prev_price) and prev_price != 0:
-                                    #    ge_stop_loss = ((v - prev_price) / prev_price) * 100  # 移除 round_to_2
-                                    #else:
-                                    #    ge_stop_loss = NAN
-
-                                    # AGE 前面天数的涨幅
-                                    if end_value != 0 and not isnan(end_value):
-                                        ge_stop_loss = ((v - end_value) / end_value) * 100
-                                    else:
-                                        ge_stop_loss = NAN
-
-                                    break
-
-                            if not found:
-                                after_gt_end_value = NAN
-                                after_gt_end_days = -1
-                                loss_after_gt_end_days = -1
-                                ge_end_state = 0
-                                ge_take_profit = NAN
-                                ge_stop_loss = NAN
-                                take_and_stop_after_gt_end_change = NAN
-                                stop_and_take_after_gt_end_change = NAN
-                                take_age = NAN
-                                take_loss_age = NAN
-                                stop_age = NAN
-                                stop_loss_age = NAN
-
-                            # after_gt_start_value 计算（方向：end_date_idx 向 end_date_idx-op_days，判断k和k-1）
-                            found = False
-                            for n, k in enumerate(range(end_date_idx, end_date_idx - op_days, -1), 1):
-                                if k - 1 < 0 or k >= num_dates:
-                                    continue
-                                v_now = price_data_view[stock_idx, k]
-                                v_prev = price_data_view[stock_idx, k - 1]
-                                if n == 1:
-                                    prev_price = end_value
-                                else:
-                                    # 检查边界，确保 k + 1 在有效范围内
-                                    if k + 1 < num_dates:
-                                        prev_price = price_data_view[stock_idx, k + 1]
-                                    else:
-                                        prev_price = NAN
-                                
-                                if isnan(v_now) or isnan(v_prev) or (trade_t1_mode and n == 1):
-                                    continue
-                                after_gt_start_threshold = v_now * after_gt_start_ratio
-                                if after_gt_start_ratio != 0 and (v_prev - v_now) > after_gt_start_threshold:
-                                    after_gt_start_value = v_prev  # 移除 round_to_2
-                                    after_gt_start_days = n
-                                    if n == 1:
-                                        after_gt_start_change = after_gt_start_ratio * 100
-                                    else:
-                                        if end_value != 0 and not isnan(end_value):
-                                            after_gt_start_change = ((1 + (v_now - end_value) / end_value) * (1 + after_gt_start_ratio) - 1) * 100  # 移除 round_to_2
-                                        else:
-                                            after_gt_start_change = NAN
-
-                                    take_and_stop_after_gt_start_change = after_gt_start_change
-                                    take_ags = after_gt_start_change
-                                    if end_value != 0 and not isnan(end_value):
-                                        stop_ags = ((v_prev - end_value) / end_value) * 100
-                                        stop_and_take_after_gt_start_change = ((v_prev - end_value) / end_value) * 100  # 移除 round_to_2
-                                    else:
-                                        stop_ags = NAN
-                                        stop_and_take_after_gt_start_change = NAN
-
-                                    #if stock_idx == 5377:
-                                        #printf("stock_idx=%d, n=%d, v_now=%.2f, v_prev=%.2f, end_value=%.2f, after_gt_start_ratio=%.4f, after_gt_start_change=%.2f\n", 
-                                            #stock_idx, n, v_now, v_prev, end_value, after_gt_start_ratio, after_gt_start_change)
-                                    
-                                    gs_end_state = 1
-
-                                    # AGS 第N天的涨幅
-                                    if not isnan(prev_price) and prev_price != 0:
-                                        gs_take_profit = ((v - prev_price) / prev_price) * 100  # 移除 round_to_2
-                                    else:
-                                        gs_take_profit = NAN
-                                    found = True
-                                    break
-
-                                # 计算止损阈值
-                                stop_loss_after_gt_start_threshold = v_now * stop_loss_after_gt_start_ratio
-                                if stop_loss_after_gt_start_ratio != 0 and (v_prev - v_now) < stop_loss_after_gt_start_threshold:
-                                    after_gt_start_value = v_prev  # 移除 round_to_2
-                                    loss_after_gt_start_days = n
-                                    gs_end_state = 2
-                                    if n == 1:
-                                        after_gt_start_change = stop_loss_after_gt_start_ratio  * 100
-                                    else:
-                                        if end_value != 0 and not isnan(end_value):
-                                            after_gt_start_change = ((1 + (v_now - end_value) / end_value) * (1 + stop_loss_after_gt_start_ratio) - 1) * 100  # 移除 round_to_2
-                                        else:
-                                            after_gt_start_change = NAN
-                                    if end_value != 0 and not isnan(end_value):
-                                        take_and_stop_after_gt_start_change = ((v_prev - end_value) / end_value) * 100  # 移除 round_to_2
-                                        stop_loss_ags = ((v_prev - end_value) / end_value) * 100
-                                    else:
-                                        take_and_stop_after_gt_start_change = NAN
-                                        stop_loss_ags = NAN
-                                    take_loss_ags = after_gt_start_change
-                                    stop_and_take_after_gt_start_change = after_gt_start_change
-                                    
-                                    #if stock_idx == 2315:
-                                        #printf("stock_idx=2315, take_loss_ags=%.6f, stop_loss_ags=%.6f\n", take_loss_ags, stop_loss_ags)
-
-                                    # AGS 第N天的涨幅
-                                    if not isnan(prev_price) and prev_price != 0:
-                                        gs_stop_loss = ((v - prev_price) / prev_price) * 100  # 移除 round_to_2
-                                    else:
-                                        gs_stop_loss = NAN
-                                    found = True
-                                    break
-                                
-                            if not found:
-                                after_gt_start_value = NAN
-                                after_gt_start_days = -1
-                                loss_after_gt_start_days = -1
-                                after_gt_start_change = NAN
-                                gs_end_state = 0
-                                gs_take_profit = NAN
-                                gs_stop_loss = NAN
-                                take_and_stop_after_gt_start_change = NAN
-                                stop_and_take_after_gt_start_change = NAN
-                                take_ags = NAN
-                                stop_ags = NAN
-                                take_loss_ags = NAN
-                                stop_loss_ags = NAN
-                    
-                    #if stock_idx == 0:
-                        #printf(b"running3\n")
-
-                    # 处理NAN值
-                    if isnan(increment_value):
-                        increment_value = NAN
-                    if isnan(after_gt_end_value):
-                        after_gt_end_value = NAN
-                    if isnan(after_gt_start_value):
-                        after_gt_start_value = NAN
-                    # 主连续累加值的有效累加值及正负加和
-                    valid_sum_vec.clear()
-                    calc_valid_sum_and_pos_neg(
-                        cont_sum, valid_sum_vec, &valid_sum_len, &valid_pos_sum, &valid_neg_sum)
-                    
-                    n = cont_sum.size()
-                    half = int(round(n / 2.0))
-                    q1 = <int>ceil(n / 4.0)
-                    continuous_abs_sum_first_half = 0
-                    continuous_abs_sum_second_half = 0
-                    continuous_abs_sum_block1 = 0
-                    continuous_abs_sum_block2 = 0
-                    continuous_abs_sum_block3 = 0
-                    continuous_abs_sum_block4 = 0
-                    # 前一半
-                    for j in range(half):
-                        continuous_abs_sum_first_half += fabs(cont_sum[j])
-                    # 后一半
-                    for j in range(n - half, n):
-                        continuous_abs_sum_second_half += fabs(cont_sum[j])
-                    # block1: 前q1
-                    for j in range(min(q1, n)):
-                        continuous_abs_sum_block1 += fabs(cont_sum[j])
-                    # block2: q1~2q1
-                    for j in range(q1, min(2*q1, n)):
-                        continuous_abs_sum_block2 += fabs(cont_sum[j])
-                    # block4: 从后往前q1
-                    for j in range(n-1, max(n-1-q1, -1), -1):
-                        continuous_abs_sum_block4 += fabs(cont_sum[j])
-                    # block3: 再往前q1
-                    for j in range(n-1-q1, max(n-1-2*q1, -1), -1):
-                        continuous_abs_sum_block3 += fabs(cont_sum[j])
-                    # 移除 round_to_2 调用，保持原始精度
-
-                    # 计算向前最大最小连续累加值
-                    if is_forward:
-                        # 向前最大连续累加值绝对值数组长度，前一半绝对值之和、后一半绝对值之和
-                        forward_max_result_len = forward_max_result_c.size()
-                        if forward_max_result_len > 0:
-                            n = forward_max_result_len
-                            half = int(round(n / 2.0))
-                            q1 = <int>ceil(n / 4.0)
-                            forward_max_abs_sum_first_half = 0
-                            forward_max_abs_sum_second_half = 0
-                            forward_max_abs_sum_block1 = 0
-                            forward_max_abs_sum_block2 = 0
-                            forward_max_abs_sum_block3 = 0
-                            forward_max_abs_sum_block4 = 0
-                            # 前一半
-                            for j in range(half):
-                                forward_max_abs_sum_first_half += fabs(forward_max_result_c[j])
-                            # 后一半
-                            for j in range(n - half, n):
-                                forward_max_abs_sum_second_half += fabs(forward_max_result_c[j])
-                            # block1: 前q1
-                            for j in range(min(q1, n)):
-                                forward_max_abs_sum_block1 += fabs(forward_max_result_c[j])
-                            # block2: q1~2q1
-                            for j in range(q1, min(2*q1, n)):
-                                forward_max_abs_sum_block2 += fabs(forward_max_result_c[j])
-                            # block4: 从后往前q1
-                            for j in range(n-1, max(n-1-q1, -1), -1):
-                                forward_max_abs_sum_block4 += fabs(forward_max_result_c[j])
-                            # block3: 再往前q1
-                            for j in range(n-1-q1, max(n-1-2*q1, -1), -1):
-                                forward_max_abs_sum_block3 += fabs(forward_max_result_c[j])
-                            # 移除 round_to_2 调用，保持原始精度
-                        else:
-                            forward_max_abs_sum_first_half = NAN
-                            forward_max_abs_sum_second_half = NAN
-                            forward_max_abs_sum_block1 = NAN
-                            forward_max_abs_sum_block2 = NAN
-                            forward_max_abs_sum_block3 = NAN
-                            forward_max_abs_sum_block4 = NAN
-
-                        # 向前最小有效累加值数组长度，前一半绝对值之和、后一半绝对值之和
-                        forward_min_result_len = forward_min_result_c.size()
-                        if forward_min_result_len > 0:
-                            n = forward_min_result_len
-                            half = int(round(n / 2.0))
-                            q1 = <int>ceil(n / 4.0)
-                            forward_min_abs_sum_first_half = 0
-                            forward_min_abs_sum_second_half = 0
-                            forward_min_abs_sum_block1 = 0
-                            forward_min_abs_sum_block2 = 0
-                            forward_min_abs_sum_block3 = 0
-                            forward_min_abs_sum_block4 = 0
-                            # 前一半
-                            for j in range(half):
-                                forward_min_abs_sum_first_half += fabs(forward_min_result_c[j])
-                            # 后一半
-                            for j in range(n - half, n):
-                                forward_min_abs_sum_second_half += fabs(forward_min_result_c[j])
-                            # block1: 前q1
-                            for j in range(min(q1, n)):
-                                forward_min_abs_sum_block1 += fabs(forward_min_result_c[j])
-                            # block2: q1~2q1
-                            for j in range(q1, min(2*q1, n)):
-                                forward_min_abs_sum_block2 += fabs(forward_min_result_c[j])
-                            # block4: 从后往前q1
-                            for j in range(n-1, max(n-1-q1, -1), -1):
-                                forward_min_abs_sum_block4 += fabs(forward_min_result_c[j])
-                            # block3: 再往前q1
-                            for j in range(n-1-q1, max(n-1-2*q1, -1), -1):
-                                forward_min_abs_sum_block3 += fabs(forward_min_result_c[j])
-                            # 移除 round_to_2 调用，保持原始精度
-                        else:
-                            forward_min_abs_sum_first_half = NAN
-                            forward_min_abs_sum_second_half = NAN
-                            forward_min_abs_sum_block1 = NAN
-                            forward_min_abs_sum_block2 = NAN
-                            forward_min_abs_sum_block3 = NAN
-                            forward_min_abs_sum_block4 = NAN
-
-                    else:
-                        forward_max_result_len = 0
-                        forward_max_abs_sum_first_half = NAN
-                        forward_max_abs_sum_second_half = NAN
-                        forward_max_abs_sum_block1 = NAN
-                        forward_max_abs_sum_block2 = NAN
-                        forward_max_abs_sum_block3 = NAN
-                        forward_max_abs_sum_block4 = NAN
-                        forward_min_result_len = 0
-                        forward_min_abs_sum_first_half = NAN
-                        forward_min_abs_sum_second_half = NAN
-                        forward_min_abs_sum_block1 = NAN
-                        forward_min_abs_sum_block2 = NAN
-                        forward_min_abs_sum_block3 = NAN
-                        forward_min_abs_sum_block4 = NAN
-
-                    # 计算正累加和和负累加和
-                    # 向前最大有效累加值的正负加和
-                    forward_max_valid_sum_vec.clear()
-                    if is_forward and forward_max_result_c.size() > 0:
-                        calc_valid_sum_and_pos_neg(
-                            forward_max_result_c,
-                            forward_max_valid_sum_vec, &forward_max_valid_sum_len,
-                            &forward_max_valid_pos_sum, &forward_max_valid_neg_sum)
-                        # 注意：forward_max_valid_pos_sum, forward_max_valid_neg_sum 使用了 round_to_2_nan，需要在Python层处理
-                    else:
-                        forward_max_valid_sum_len = 0
-                        forward_max_valid_pos_sum = NAN
-                        forward_max_valid_neg_sum = NAN
-
-                    # 向前最小有效累加值的正负加和
-                    forward_min_valid_sum_vec.clear()
-                    if is_forward and forward_min_result_c.size() > 0:
-                        calc_valid_sum_and_pos_neg(
-                            forward_min_result_c,
-                            forward_min_valid_sum_vec, &forward_min_valid_sum_len,
-                            &forward_min_valid_pos_sum, &forward_min_valid_neg_sum)
-                        # 注意：forward_min_valid_pos_sum, forward_min_valid_neg_sum 使用了 round_to_2_nan，需要在Python层处理
-                    else:
-                        forward_min_valid_sum_len = 0
-                        forward_min_valid_pos_sum = NAN
-                        forward_min_valid_neg_sum = NAN
-
-                    # 连续累加值绝对值最大值判断
-                    max_abs_val = 0
-                    if continuous_abs_threshold > 0 and cont_sum.size() > 0:
-                        for j in range(cont_sum.size()):
-                            abs_v = fabs(cont_sum[j])
-                            if abs_v > max_abs_val:
-                                max_abs_val = abs_v
-                        continuous_abs_is_less = max_abs_val < continuous_abs_threshold
-                    else:
-                        continuous_abs_is_less = False
-
-                    # 有效累加值绝对值最大值判断
-                    valid_max_abs_val = 0
-                    if valid_abs_sum_threshold > 0 and valid_sum_len > 0:
-                        for j in range(valid_sum_len):
-                            abs_v = fabs(valid_sum_vec[j])
-                            if abs_v > valid_max_abs_val:
-                                valid_max_abs_val = abs_v
-                        valid_abs_is_less = valid_max_abs_val < valid_abs_sum_threshold
-                    else:
-                        valid_abs_is_less = False
-
-                    # 向前最小连续累加值绝对值最大值判断
-                    forward_min_max_abs_val = 0
-                    if is_forward and continuous_abs_threshold > 0 and forward_min_result_c.size() > 0:
-                        for j in range(forward_min_result_c.size()):
-                            abs_v = fabs(forward_min_result_c[j])
-                            if abs_v > forward_min_max_abs_val:
-                                forward_min_max_abs_val = abs_v
-                        forward_min_continuous_abs_is_less = forward_min_max_abs_val < continuous_abs_threshold
-                    else:
-                        forward_min_continuous_abs_is_less = False
-
-                    # 向前最小有效累加值绝对值最大值判断
-                    forward_min_valid_max_abs_val = 0
-                    if is_forward and valid_abs_sum_threshold > 0 and forward_min_valid_sum_len > 0:
-                        for j in range(forward_min_valid_sum_len):
-                            abs_v = fabs(forward_min_valid_sum_vec[j])
-                            if abs_v > forward_min_valid_max_abs_val:
-                                forward_min_valid_max_abs_val = abs_v
-                        forward_min_valid_abs_is_less = forward_min_valid_max_abs_val < valid_abs_sum_threshold
-                    else:
-                        forward_min_valid_abs_is_less = False
-
-                    # 向前最大连续累加值绝对值最大值判断
-                    forward_max_max_abs_val = 0
-                    if is_forward and continuous_abs_threshold > 0 and forward_max_result_c.size() > 0:
-                        for j in range(forward_max_result_c.size()):
-                            abs_v = fabs(forward_max_result_c[j])
-                            if abs_v > forward_max_max_abs_val:
-                                forward_max_max_abs_val = abs_v
-                        forward_max_continuous_abs_is_less = forward_max_max_abs_val < continuous_abs_threshold
-                    else:
-                        forward_max_continuous_abs_is_less = False
-
-                    # 向前最大有效累加值绝对值最大值判断
-                    forward_max_valid_max_abs_val = 0
-                    if is_forward and valid_abs_sum_threshold > 0 and forward_max_valid_sum_len > 0:
-                        for j in range(forward_max_valid_sum_len):
-                            abs_v = fabs(forward_max_valid_sum_vec[j])
-                            if abs_v > forward_max_valid_max_abs_val:
-                                forward_max_valid_max_abs_val = abs_v
-                        forward_max_valid_abs_is_less = forward_max_valid_max_abs_val < valid_abs_sum_threshold
-                    else:
-                        forward_max_valid_abs_is_less = False
-                
-                    
-                    # 计算continuous_len
-                    continuous_len = cont_sum.size()
-                    
-                    # 前n_days_max区间最大值
-                    n_days_max_value = NAN
-                    if n_days_max > 0 and end_date_idx + n_days_max <= num_dates:
-                        maxv = -1e308
-                        for j in range(n_days_max):
-                            v = price_data_view[stock_idx, end_date_idx + j]
-                            if not isnan(v) and v > maxv:
-                                maxv = v
-                        n_days_max_value = maxv if maxv > -1e308 else NAN
-                    
-                    # 计算结束地址前1日涨跌幅和结束日涨跌幅
-                    prev_day_change = NAN
-                    end_day_change = NAN
-                    
-                    for j in range(window_len):
-                        price_arr[j] = price_data_view[stock_idx, end_date_idx + j]
-                    
-                    # 在nogil区域之前计算长度
-                    price_arr_len = window_len
-                    
-                    if price_arr_len >= 3:
-                        if price_arr[2] != 0 and not isnan(price_arr[2]):
-                            prev_day_change = ((price_arr[1] - price_arr[2]) / price_arr[2]) * 100  # 移除 round_to_2
-                        if price_arr[1] != 0 and not isnan(price_arr[1]):
-                            end_day_change = ((price_arr[0] - price_arr[1]) / price_arr[1]) * 100  # 移除 round_to_2
-                    elif price_arr_len == 2:
-                        if price_arr[1] != 0 and not isnan(price_arr[1]):
-                            end_day_change = ((price_arr[0] - price_arr[1]) / price_arr[1]) * 100  # 移除 round_to_2
-                    
-                    # 有效累加值分块绝对值之和
-                    if valid_sum_len > 0:
-                        valid_abs_sum_first_half = 0
-                        valid_abs_sum_second_half = 0
-                        valid_abs_sum_block1 = 0
-                        valid_abs_sum_block2 = 0
-                        valid_abs_sum_block3 = 0
-                        valid_abs_sum_block4 = 0
-                        n_valid = valid_sum_len
-                        half_valid = int(round(n_valid / 2.0))
-                        q1 = <int>ceil(n_valid / 4.0)
-                        # 前一半
-                        for j in range(half_valid):
-                            valid_abs_sum_first_half += fabs(valid_sum_vec[j])
-                        # 后一半
-                        for j in range(n_valid - half_valid, n_valid):
-                            valid_abs_sum_second_half += fabs(valid_sum_vec[j])
-                        # block1: 前q1
-                        for j in range(min(q1, n_valid)):
-                            valid_abs_sum_block1 += fabs(valid_sum_vec[j])
-                        # block2: q1~2q1
-                        for j in range(q1, min(2*q1, n_valid)):
-                            valid_abs_sum_block2 += fabs(valid_sum_vec[j])
-                        # block4: 从后往前q1
-                        for j in range(n_valid-1, max(n_valid-1-q1, -1), -1):
-                            valid_abs_sum_block4 += fabs(valid_sum_vec[j])
-                        # block3: 再往前q1
-                        for j in range(n_valid-1-q1, max(n_valid-1-2*q1, -1), -1):
-                            valid_abs_sum_block3 += fabs(valid_sum_vec[j])
-                        # 移除 round_to_2 调用，保持原始精度
-                    else:
-                        valid_abs_sum_first_half = NAN
-                        valid_abs_sum_second_half = NAN
-                        valid_abs_sum_block1 = NAN
-                        valid_abs_sum_block2 = NAN
-                        valid_abs_sum_block3 = NAN
-                        valid_abs_sum_block4 = NAN
-
-                    # 计算向前最大有效连续累加值的分块和绝对值之和（全部在Cython区完成）
-                    forward_max_valid_abs_sum_first_half = 0
-                    forward_max_valid_abs_sum_second_half = 0
-                    forward_max_valid_abs_sum_block1 = 0
-                    forward_max_valid_abs_sum_block2 = 0
-                    forward_max_valid_abs_sum_block3 = 0
-                    forward_max_valid_abs_sum_block4 = 0
-                    if is_forward and forward_max_valid_sum_len > 0:
-                        n = forward_max_valid_sum_len
-                        half = int(round(n / 2.0))
-                        q1 = <int>ceil(n / 4.0)
-                        # 前一半
-                        for j in range(half):
-                            forward_max_valid_abs_sum_first_half += fabs(forward_max_valid_sum_vec[j])
-                        # 后一半
-                        for j in range(n - half, n):
-                            forward_max_valid_abs_sum_second_half += fabs(forward_max_valid_sum_vec[j])
-                        # block1: 前q1
-                        for j in range(min(q1, n)):
-                            forward_max_valid_abs_sum_block1 += fabs(forward_max_valid_sum_vec[j])
-                        # block2: q1~2q1
-                        for j in range(q1, min(2*q1, n)):
-                            forward_max_valid_abs_sum_block2 += fabs(forward_max_valid_sum_vec[j])
-                        # block4: 从后往前q1
-                        for j in range(n-1, max(n-1-q1, -1), -1):
-                            forward_max_valid_abs_sum_block4 += fabs(forward_max_valid_sum_vec[j])
-                        # block3: 再往前q1
-                        for j in range(n-1-q1, max(n-1-2*q1, -1), -1):
-                            forward_max_valid_abs_sum_block3 += fabs(forward_max_valid_sum_vec[j])
-                        # 移除 round_to_2 调用，保持原始精度
-                    else:
-                        forward_max_valid_abs_sum_first_half = NAN
-                        forward_max_valid_abs_sum_second_half = NAN
-                        forward_max_valid_abs_sum_block1 = NAN
-                        forward_max_valid_abs_sum_block2 = NAN
-                        forward_max_valid_abs_sum_block3 = NAN
-                        forward_max_valid_abs_sum_block4 = NAN
-
-                    # 计算向前最小有效连续累加值的分块和绝对值之和（全部在Cython区完成）
-                    forward_min_valid_abs_sum_first_half = 0
-                    forward_min_valid_abs_sum_second_half = 0
-                    forward_min_valid_abs_sum_block1 = 0
-                    forward_min_valid_abs_sum_block2 = 0
-                    forward_min_valid_abs_sum_block3 = 0
-                    forward_min_valid_abs_sum_block4 = 0
-                    if is_forward and forward_min_valid_sum_len > 0:
-                        n = forward_min_valid_sum_len
-                        half = int(round(n / 2.0))
-                        q1 = <int>ceil(n / 4.0)
-                        # 前一半
-                        for j in range(half):
-                            forward_min_valid_abs_sum_first_half += fabs(forward_min_valid_sum_vec[j])
-                        # 后一半
-                        for j in range(n - half, n):
-                            forward_min_valid_abs_sum_second_half += fabs(forward_min_valid_sum_vec[j])
-                        # block1: 前q1
-                        for j in range(min(q1, n)):
-                            forward_min_valid_abs_sum_block1 += fabs(forward_min_valid_sum_vec[j])
-                        # block2: q1~2q1
-                        for j in range(q1, min(2*q1, n)):
-                            forward_min_valid_abs_sum_block2 += fabs(forward_min_valid_sum_vec[j])
-                        # block4: 从后往前q1
-                        for j in range(n-1, max(n-1-q1, -1), -1):
-                            forward_min_valid_abs_sum_block4 += fabs(forward_min_valid_sum_vec[j])
-                        # block3: 再往前q1
-                        for j in range(n-1-q1, max(n-1-2*q1, -1), -1):
-                            forward_min_valid_abs_sum_block3 += fabs(forward_min_valid_sum_vec[j])
-                        # 移除 round_to_2 调用，保持原始精度
-                    else:
-                        forward_min_valid_abs_sum_first_half = NAN
-                        forward_min_valid_abs_sum_second_half = NAN
-                        forward_min_valid_abs_sum_block1 = NAN
-                        forward_min_valid_abs_sum_block2 = NAN
-                        forward_min_valid_abs_sum_block3 = NAN
-                        forward_min_valid_abs_sum_block4 = NAN
-
-                    if valid_pos_sum == 0:
-                        valid_pos_sum = NAN
-                    if valid_neg_sum == 0:
-                        valid_neg_sum = NAN
-                    # 移除 round_to_2 调用，保持原始精度
+    # 行计算参数（compute_row 在nogil/prange内只读访问）
+    cdef KernelParams kp
+    kp.after_gt_end_ratio = after_gt_end_ratio
+    kp.after_gt_start_ratio = after_gt_start_ratio
+    kp.continuous_abs_threshold = continuous_abs_threshold
+    kp.inc_rate = inc_rate
+    kp.is_forward = is_forward
+    kp.loss_type_code = loss_type_code
+    kp.n_days = n_days
+    kp.n_days_max = n_days_max
+    kp.new_after_high2_and = new_after_high2_and
+    kp.new_after_high2_range = new_after_high2_range
+    kp.new_after_high2_span = new_after_high2_span
+    kp.new_after_high2_start = new_after_high2_start
+    kp.new_after_high_and = new_after_high_and
+    kp.new_after_high_range = new_after_high_range
+    kp.new_after_high_span = new_after_high_span
+    kp.new_after_high_start = new_after_high_start
+    kp.new_after_low2_and = new_after_low2_and
+    kp.new_after_low2_range = new_after_low2_range
+    kp.new_after_low2_span = new_after_low2_span
+    kp.new_after_low2_start = new_after_low2_start
+    kp.new_after_low_and = new_after_low_and
+    kp.new_after_low_range = new_after_low_range
+    kp.new_after_low_span = new_after_low_span
+    kp.new_after_low_start = new_after_low_start
+    kp.new_before_high2_and = new_before_high2_and
+    kp.new_before_high2_range = new_before_high2_range
+    kp.new_before_high2_span = new_before_high2_span
+    kp.new_before_high2_start = new_before_high2_start
+    kp.new_before_high_and = new_before_high_and
+    kp.new_before_high_range = new_before_high_range
+    kp.new_before_high_span = new_before_high_span
+    kp.new_before_high_start = new_before_high_start
+    kp.new_before_low2_and = new_before_low2_and
+    kp.new_before_low2_range = new_before_low2_range
+    kp.new_before_low2_span = new_before_low2_span
+    kp.new_before_low2_start = new_before_low2_start
+    kp.new_before_low_and = new_before_low_and
+    kp.new_before_low_range = new_before_low_range
+    kp.new_before_low_span = new_before_low_span
+    kp.new_before_low_start = new_before_low_start
+    kp.num_dates = num_dates
+    kp.op_days = op_days
+    kp.ops_change_input = ops_change_input
+    kp.profit_type_code = profit_type_code
+    kp.shift_days = shift_days
+    kp.start_option_code = start_option_code
+    kp.start_with_new_after_high2_flag = start_with_new_after_high2_flag
+    kp.start_with_new_after_high_flag = start_with_new_after_high_flag
+    kp.start_with_new_after_low2_flag = start_with_new_after_low2_flag
+    kp.start_with_new_after_low_flag = start_with_new_after_low_flag
+    kp.start_with_new_before_high2_flag = start_with_new_before_high2_flag
+    kp.start_with_new_before_high_flag = start_with_new_before_high_flag
+    kp.start_with_new_before_low2_flag = start_with_new_before_low2_flag
+    kp.start_with_new_before_low_flag = start_with_new_before_low_flag
+    kp.stop_loss_after_gt_end_ratio = stop_loss_after_gt_end_ratio
+    kp.stop_loss_after_gt_start_ratio = stop_loss_after_gt_start_ratio
+    kp.stop_loss_inc_rate = stop_loss_inc_rate
+    kp.trade_t1_mode = trade_t1_mode
+    kp.user_range_ratio = user_range_ratio
+    kp.valid_abs_sum_threshold = valid_abs_sum_threshold
+    kp.width = width
+    kp.prefilter_ops = prefilter_ops.data()
+    kp.prefilter_args = prefilter_args.data()
+    kp.prefilter_n_ops = prefilter_ops.size()
+    # 各结束日的连续累加窗口都落在 [最早结束日, 最晚结束日+width-负的shift_days] 内
+    kp.run_lo = end_date_end_idx
+    kp.run_hi = min(end_date_start_idx + width - min(shift_days, 0), num_dates - 1)
 
-                #if stock_idx == 0:
-                    #printf(b"running4\n")    
-                # with gil
-                start_with_new_before_high_py = bool(start_with_new_before_high)
-                start_with_new_before_high2_py = bool(start_with_new_before_high2)
-                start_with_new_after_high_py = bool(start_with_new_after_high)
-                start_with_new_after_high2_py = bool(start_with_new_after_high2)
-                start_with_new_before_low_py = bool(start_with_new_before_low)
-                start_with_new_before_low2_py = bool(start_with_new_before_low2)
-                start_with_new_after_low_py = bool(start_with_new_after_low)
-                start_with_new_after_low2_py = bool(start_with_new_after_low2)
-                
-                has_three_consecutive_zeros_py = bool(has_three_consecutive_zeros)
-                #if stock_idx == 0:
-                    #printf(b"running4.1\n")    
-                # 计算range_ratio_is_less
-                range_ratio_is_less = False
-                if (min_price is not None and min_price != 0 and not isnan(min_price) and 
-                    max_price is not None and not isnan(max_price) and not isnan(user_range_ratio)):
-                    range_ratio_is_less = (max_price / min_price) < user_range_ratio
-
-                # 计算日期索引和n_max_is_max
-                n_max_is_max_result = max_idx_in_window < n_days if n_days > 0 else False
-
-                # 计算所有日期和值的组合
-                max_value_date = date_columns[end_date_idx + max_idx_in_window] if max_idx_in_window >= 0 else None
-                min_value_date = date_columns[end_date_idx + min_idx_in_window] if min_idx_in_window >= 0 else None
-                end_value_date = date_columns[end_date_idx]
-                start_value_date = date_columns[start_date_idx]
-                actual_value_date = date_columns[actual_idx] if actual_idx >= 0 and actual_idx < num_dates else None
-                closest_value_date = date_columns[end_date_idx + closest_idx_in_window] if closest_idx_in_window >= 0 else None
-                
-                forward_max_date_str = date_columns[forward_max_date_idx] if forward_max_date_idx >= 0 else None
-                forward_min_date_str = date_columns[forward_min_date_idx] if forward_min_date_idx >= 0 else None
-
-                #if stock_idx == 0:
-                    #printf("running4.2\n")  
-
-                # 移除所有 round_to_2 调用，保持原始精度
-                # 先定义所有表达式可能用到的参数变量
-                # 连续累加值基本参数
-                continuous_start_value = cont_sum[0] if cont_sum.size() > 0 else None
-                continuous_start_next_value = cont_sum[1] if cont_sum.size() > 1 else None
-                continuous_start_next_next_value = cont_sum[2] if cont_sum.size() > 2 else None
-                continuous_end_value = cont_sum[cont_sum.size()-1] if cont_sum.size() > 0 else None
-                continuous_end_prev_value = cont_sum[cont_sum.size()-2] if cont_sum.size() > 1 else None
-                continuous_end_prev_prev_value = cont_sum[cont_sum.size()-3] if cont_sum.size() > 2 else None
-
-                # 向前最大连续累加值相关参数
-                if is_forward:
-                    forward_max_continuous_start_value = forward_max_result_c[0] if forward_max_result_c.size() > 0 else None
-                    forward_max_continuous_start_next_value = forward_max_result_c[1] if forward_max_result_c.size() > 1 else None
-                    forward_max_continuous_start_next_next_value = forward_max_result_c[2] if forward_max_result_c.size() > 2 else None
-                    forward_max_continuous_end_value = forward_max_result_c[forward_max_result_c.size()-1] if forward_max_result_c.size() > 0 else None
-                    forward_max_continuous_end_prev_value = forward_max_result_c[forward_max_result_c.size()-2] if forward_max_result_c.size() > 1 else None
-                    forward_max_continuous_end_prev_prev_value = forward_max_result_c[forward_max_result_c.size()-3] if forward_max_result_c.size() > 2 else None
-                else:
-                    forward_max_continuous_start_value = None
-                    forward_max_continuous_start_next_value = None
-                    forward_max_continuous_start_next_next_value = None
-                    forward_max_continuous_end_value = None
-                    forward_max_continuous_end_prev_value = None
-                    forward_max_continuous_end_prev_prev_value = None
-                
-                # 向前最小连续累加值相关参数
-                if is_forward:
-                    forward_min_continuous_start_value = forward_min_result_c[0] if forward_min_result_c.size() > 0 else None
-                    forward_min_continuous_start_next_value = forward_min_result_c[1] if forward_min_result_c.size() > 1 else None
-                    forward_min_continuous_start_next_next_value = forward_min_result_c[2] if forward_min_result_c.size() > 2 else None
-                    forward_min_continuous_end_value = forward_min_result_c[forward_min_result_c.size()-1] if forward_min_result_c.size() > 0 else None
-                    forward_min_continuous_end_prev_value = forward_min_result_c[forward_min_result_c.size()-2] if forward_min_result_c.size() > 1 else None
-                    forward_min_continuous_end_prev_prev_value = forward_min_result_c[forward_min_result_c.size()-3] if forward_min_result_c.size() > 2 else None
-                else:
-                    forward_min_continuous_start_value = None
-                    forward_min_continuous_start_next_value = None
-                    forward_min_continuous_start_next_next_value = None
-                    forward_min_continuous_end_value = None
-                    forward_min_continuous_end_prev_value = None
-                    forward_min_continuous_end_prev_prev_value = None
-
-                #if stock_idx == 0:
-                    #printf("running4.3\n")  
-                
-                # 传统四舍五入函数（向远离零的方向舍入）
-                def traditional_round(value, decimals=2):
-                    multiplier = 10 ** decimals
-                    return int(value * multiplier + (0.5 if value >= 0 else -0.5)) / multiplier
-                
-                # 最后只在返回时转为Python对象
-                py_cont_sum = list(cont_sum)
-                if is_forward:
-                    forward_max_result = [traditional_round(forward_max_result_c[j], 2) for j in range(forward_max_result_c.size())]
-                    forward_min_result = [traditional_round(forward_min_result_c[j], 2) for j in range(forward_min_result_c.size())]
-                    forward_max_valid_sum_arr = [traditional_round(forward_max_valid_sum_vec[j], 2) for j in range(forward_max_valid_sum_vec.size())]
-                    forward_min_valid_sum_arr = [traditional_round(forward_min_valid_sum_vec[j], 2) for j in range(forward_min_valid_sum_vec.size())]
-                else:
-                    forward_max_result = []
-                    forward_min_result = []
-                    forward_max_valid_sum_arr = []
-                    forward_min_valid_sum_arr = []
-                py_valid_sum_arr = [valid_sum_vec[j] for j in range(valid_sum_vec.size())]
-
-                #if stock_idx == 0:
-                    #printf("running4.4\n")  
-
-                # 递增值等都算好后，计算 ops_value
-                inc_value = increment_value
-                age_value = after_gt_end_value
-                ags_value = after_gt_start_value
-                end_state = 0
-                take_profit = 0
-                stop_loss = 0 
-
-                # INC 止盈止损，止盈停损，停盈停损，停盈止损
-                                # 获取profit_type对应的天数
-                profit_days = -1
-                profit_ops_value = None
-                profit_end_state = 0
-                if profit_type == "INC":
-                    take_profit_var = take_inc
-                    stop_profit_var = stop_inc
-                    take_profit = inc_take_profit
-                    if not isnan(increment_value):
-                        profit_ops_value = increment_value
-                    if increment_days != -1:
-                        profit_days = increment_days
-                    if inc_end_state != 0:
-                        profit_end_state = inc_end_state
-                elif profit_type == "AGE":
-                    take_profit_var = take_age
-                    stop_profit_var = stop_age
-                    take_profit = ge_take_profit
-                    if not isnan(after_gt_end_value):
-                        profit_ops_value = after_gt_end_value
-                    if after_gt_end_days != -1:
-                        profit_days = after_gt_end_days
-                    if ge_end_state != 0:
-                        profit_end_state = ge_end_state
-                elif profit_type == "AGS":
-                    take_profit_var = take_ags
-                    stop_profit_var = stop_ags
-                    take_profit = gs_take_profit
-                    if not isnan(after_gt_start_value):
-                        profit_ops_value = after_gt_start_value
-                    if after_gt_start_days != -1:
-                        profit_days = after_gt_start_days
-                    if gs_end_state != 0:
-                        profit_end_state = gs_end_state
-
-                # 获取loss_type对应的天数
-                loss_days = -1
-                loss_ops_value = None
-                loss_end_state = 0
-                ops_value = 0
-                hold_days = 0
-                if loss_type == "INC":
-                    take_loss_var = take_loss_inc 
-                    stop_loss_var = stop_loss_inc
-                    stop_loss = inc_stop_loss
-                    if not isnan(loss_increment_value):
-                        loss_ops_value = loss_increment_value
-                    if loss_increment_days != -1:
-                        loss_days = loss_increment_days
-                    if inc_end_state != 0:
-                        loss_end_state = inc_end_state
-                elif loss_type == "AGE":
-                    take_loss_var = take_loss_age 
-                    stop_loss_var = stop_loss_age
-                    stop_loss = ge_stop_loss
-                    if not isnan(loss_after_gt_end_value):
-                        loss_ops_value = loss_after_gt_end_value
-                    if loss_after_gt_end_days != -1:
-                        loss_days = loss_after_gt_end_days
-                    if ge_end_state != 0:
-                        loss_end_state = ge_end_state
-                elif loss_type == "AGS":
-                    take_loss_var = take_loss_ags
-                    stop_loss_var = stop_loss_ags
-                    stop_loss = gs_stop_loss
-                    if not isnan(loss_after_gt_start_value):
-                        loss_ops_value = loss_after_gt_start_value
-                    if loss_after_gt_start_days != -1:
-                        loss_days = loss_after_gt_start_days
-                    if gs_end_state != 0:
-                        loss_end_state = gs_end_state
-
-                # 比较profit_days和loss_days，取较小的值作为hold_days
-                if profit_days != -1 and loss_days != -1:
-                    # 两个都有有效值，比较天数选择较小的
-                    hold_days = min(profit_days, loss_days)
-                    # 根据较小的天数设置对应的ops_value和end_state
-                    if profit_days <= loss_days:
-                        ops_value = profit_ops_value
-                        end_state = profit_end_state
-                    else:
-                        ops_value = loss_ops_value
-                        end_state = loss_end_state
-                elif profit_days != -1:
-                    # 只有profit_days有效
-                    hold_days = profit_days
-                    ops_value = profit_ops_value
-                    end_state = profit_end_state
-                elif loss_days != -1:
-                    # 只有loss_days有效
-                    hold_days = loss_days
-                    ops_value = loss_ops_value
-                    end_state = loss_end_state
-
-                #if stock_idx == 0:
-                    #print(f"stock_idx={stock_idx}, profit_type={profit_type}, loss_type={loss_type}, profit_days={profit_days}, loss_days={loss_days}, hold_days={hold_days}, profit_ops_value={profit_ops_value}, loss_ops_value={loss_ops_value}, ops_value={ops_value}")
-                    #print(f"take_loss_inc={take_loss_inc}, stop_loss_inc={stop_loss_inc}, inc_stop_loss={inc_stop_loss}, loss_after_gt_start_value={loss_after_gt_start_value}, loss_increment_days={loss_increment_days}")
-                    #print(f"take_age={take_age}, stop_age={stop_age}, ge_take_profit={ge_take_profit}, after_gt_end_value={after_gt_end_value}, loss_after_gt_start_days={loss_after_gt_start_days}")
-                    
-
-                #if stock_idx == 1805:
-                    #print(f"profit_type={profit_type}, loss_type={loss_type}, take_age={take_age}, stop_age={stop_age}, take_loss_age={take_loss_age}, stop_loss_age={stop_loss_age}, take_loss_var={take_loss_var}, stop_loss_var={stop_loss_var}")
-                        
-                # 止盈止损 - 根据天数选择较小的值
-                if profit_days != -1 and loss_days != -1:
-                    # 两个都有有效值，比较天数选择较小的
-                    if profit_days <= loss_days:
-                        take_profit_and_take_loss_change = take_profit_var if not isnan(take_profit_var) else take_loss_var
-                    else:
-                        take_profit_and_take_loss_change = take_loss_var if not isnan(take_loss_var) else take_profit_var
-                elif profit_days != -1:
-                    # 只有profit_days有效
-                    take_profit_and_take_loss_change = take_profit_var if not isnan(take_profit_var) else take_loss_var
-                elif loss_days != -1:
-                    # 只有loss_days有效
-                    take_profit_and_take_loss_change = take_loss_var if not isnan(take_loss_var) else take_profit_var
-                else:
-                    # 两个都无效，使用默认逻辑
-                    hold_days = op_days
-                    op_days_when_take_stop_nan = min(hold_days, end_date_idx)
-                    if end_date_idx - hold_days >= 0:
-                        op_idx_when_take_stop_nan = end_date_idx - hold_days
-                    else:
-                        hold_days = end_date_idx
-                        op_idx_when_take_stop_nan = 0
-                    if end_value != 0 and not isnan(end_value):
-                        take_profit_and_take_loss_change = (price_data_view[stock_idx, op_idx_when_take_stop_nan] - end_value) / end_value * 100
-                    else:
-                        take_profit_and_take_loss_change = NAN
-
-                #if stock_idx == 0:
-                    #printf("running4.5\n")  
+    # 按股票并行（OpenMP prange）计算各行指标，每个线程使用自己的公式缓冲区；
+    # Python对象只在并行区之后按股票、日期顺序串行构造，结果顺序与单线程一致
+    cdef int n_threads = max(1, num_threads)
+    cdef int tid, row, chunk_start, chunk_end
+    cdef int chunk_stocks = max(n_threads * 4, 4096 // max(n_end_dates, 1))
+    cdef int formula_stack_size = max(n_formula_ops, <int>prefilter_ops.size()) + 1
+    cdef int n_comparison_slots = comparison_slots.size()
+    cdef double* fv
+    cdef RowMetrics* m
+    cdef int row_status
+    cdef vector[RowMetrics] thread_metrics
+    cdef vector[RowSeries] thread_series
+    cdef vector[WindowDeques] thread_windows
+    cdef vector[RunTable] thread_runs
+    cdef vector[double] thread_formula_vals
+    cdef vector[double] thread_formula_stack
+    cdef vector[RowMetrics] chunk_metrics
+    cdef vector[RowSeries] chunk_series
+    cdef vector[unsigned char] chunk_computed
+    cdef vector[unsigned char] chunk_score_valid
+    cdef vector[double] chunk_scores
+    thread_metrics.resize(n_threads)
+    thread_series.resize(n_threads)
+    thread_windows.resize(n_threads)
+    thread_runs.resize(n_threads)
+    for tid in range(n_threads):
+        thread_windows[tid].stock_idx = -1
+        thread_runs[tid].stock_idx = -1
+    thread_formula_vals.resize(n_threads * FV_COUNT)
+    thread_formula_stack.resize(n_threads * formula_stack_size)
 
-                # 止盈停损 - 根据天数选择较小的值
-                if profit_days != -1 and loss_days != -1:
-                    # 两个都有有效值，比较天数选择较小的
-                    if profit_days <= loss_days:
-                        take_profit_and_stop_loss_change = take_profit_var if not isnan(take_profit_var) else stop_loss_var
-                    else:
-                        take_profit_and_stop_loss_change = stop_loss_var if not isnan(stop_loss_var) else take_profit_var
-                elif profit_days != -1:
-                    # 只有profit_days有效
-                    take_profit_and_stop_loss_change = take_profit_var if not isnan(take_profit_var) else stop_loss_var
-                elif loss_days != -1:
-                    # 只有loss_days有效
-                    take_profit_and_stop_loss_change = stop_loss_var if not isnan(stop_loss_var) else take_profit_var
-                else:
-                    # 两个都无效，使用默认逻辑
-                    hold_days = op_days
-                    op_days_when_take_stop_nan = min(hold_days, end_date_idx)
-                    if end_date_idx - hold_days >= 0:
-                        op_idx_when_take_stop_nan = end_date_idx - hold_days
-                    else:
-                        hold_days = end_date_idx
-                        op_idx_when_take_stop_nan = 0
-                    if end_value != 0 and not isnan(end_value):
-                        take_profit_and_stop_loss_change = (price_data_view[stock_idx, op_idx_when_take_stop_nan] - end_value) / end_value * 100
+    # 列式选股第一遍：只收集公式列，不构造任何结果
+    if columnar_mode and (row_mask is None or fill_mode):
+        with nogil, parallel(num_threads=n_threads):
+            for i in prange(n_stocks, schedule='dynamic'):
+                tid = threadid()
+                fv = &thread_formula_vals[tid * FV_COUNT]
+                for date_pos in range(n_end_dates):
+                    if fill_mode and not row_mask_view[i, date_pos]:
+                        continue
+                    if use_float32:
+                        row_status = compute_row(&kp, price_data_view32, diff_data_view32, stock_idx_arr_view[i],
+                                                 end_date_start_idx - date_pos, &thread_metrics[tid], &thread_series[tid],
+                                                 &thread_windows[tid], range_max_view, range_min_view,
+                                                 diff_pos_prefix_view, diff_neg_prefix_view, &thread_runs[tid], fv,
+                                                 &thread_formula_stack[tid * formula_stack_size])
                     else:
-                        take_profit_and_stop_loss_change = NAN
-
-                #if stock_idx == 0:
-                    #printf("running4.6\n")  
+                        row_status = compute_row(&kp, price_data_view, diff_data_view, stock_idx_arr_view[i],
+                                                 end_date_start_idx - date_pos, &thread_metrics[tid], &thread_series[tid],
+                                                 &thread_windows[tid], range_max_view, range_min_view,
+                                                 diff_pos_prefix_view, diff_neg_prefix_view, &thread_runs[tid], fv,
+                                                 &thread_formula_stack[tid * formula_stack_size])
+                    if row_status == ROW_SKIPPED:
+                        continue
+                    for j in range(<int>column_slots.size()):
+                        formula_cols_view[j, i, date_pos] = fv[column_slots[j]]
+                    if row_status == ROW_PRUNED:
+                        pending_view[i, date_pos] = 1
+                        continue
+                    row_ok_view[i, date_pos] = not isnan(thread_metrics[tid].end_value) and thread_metrics[tid].hold_days != -1
+                    cmp_zero_view[i, date_pos] = comparison_pairs_zero(comparison_slots.data(), n_comparison_slots, fv)
+        if metrics_only:
+            row_mask_view = np.zeros((n_stocks, n_end_dates), dtype=np.uint8)
+        else:
+            row_mask_view = select_formula_rows(
+                formula_expr, formula_cols, [FORMULA_VAR_NAMES[column_slots[j]] for j in range(column_slots.size())],
+                row_ok, cmp_zero, sort_mode_code, select_count)
 
-                # 停盈停损 - 根据天数选择较小的值
-                if profit_days != -1 and loss_days != -1:
-                    # 两个都有有效值，比较天数选择较小的
-                    if profit_days <= loss_days:
-                        stop_profit_and_stop_loss_change = stop_profit_var if not isnan(stop_profit_var) else stop_loss_var
-                    else:
-                        stop_profit_and_stop_loss_change = stop_loss_var if not isnan(stop_loss_var) else stop_profit_var
-                elif profit_days != -1:
-                    # 只有profit_days有效
-                    stop_profit_and_stop_loss_change = stop_profit_var if not isnan(stop_profit_var) else stop_loss_var
-                elif loss_days != -1:
-                    # 只有loss_days有效
-                    stop_profit_and_stop_loss_change = stop_loss_var if not isnan(stop_loss_var) else stop_profit_var
-                else:
-                    # 两个都无效，使用默认逻辑
-                    hold_days = op_days
-                    op_days_when_take_stop_nan = min(hold_days, end_date_idx)
-                    if end_date_idx - hold_days >= 0:
-                        op_idx_when_take_stop_nan = end_date_idx - hold_days
-                    else:
-                        hold_days = end_date_idx
-                        op_idx_when_take_stop_nan = 0
-                    if end_value != 0 and not isnan(end_value):
-                        stop_profit_and_stop_loss_change = (price_data_view[stock_idx, op_idx_when_take_stop_nan] - end_value) / end_value * 100
+    for chunk_start in range(0, n_stocks, chunk_stocks):
+        chunk_end = min(chunk_start + chunk_stocks, n_stocks)
+        chunk_metrics.resize((chunk_end - chunk_start) * n_end_dates)
+        chunk_series.resize((chunk_end - chunk_start) * n_end_dates)
+        chunk_computed.assign((chunk_end - chunk_start) * n_end_dates, 0)
+        chunk_score_valid.assign((chunk_end - chunk_start) * n_end_dates, 0)
+        chunk_scores.assign((chunk_end - chunk_start) * n_end_dates, NAN)
+        with nogil, parallel(num_threads=n_threads):
+            for i in prange(chunk_start, chunk_end, schedule='dynamic'):
+                tid = threadid()
+                fv = &thread_formula_vals[tid * FV_COUNT] if use_formula_program else NULL
+                for date_pos in range(n_end_dates):
+                    # 列式选股第二遍只计算入选的行
+                    if columnar_mode and not row_mask_view[i, date_pos]:
+                        continue
+                    row = (i - chunk_start) * n_end_dates + date_pos
+                    if use_float32:
+                        row_status = compute_row(&kp, price_data_view32, diff_data_view32, stock_idx_arr_view[i],
+                                                 end_date_start_idx - date_pos, &chunk_metrics[row], &chunk_series[row],
+                                                 &thread_windows[tid], range_max_view, range_min_view,
+                                                 diff_pos_prefix_view, diff_neg_prefix_view, &thread_runs[tid], fv, NULL)
                     else:
-                        stop_profit_and_stop_loss_change = NAN
+                        row_status = compute_row(&kp, price_data_view, diff_data_view, stock_idx_arr_view[i],
+                                                 end_date_start_idx - date_pos, &chunk_metrics[row], &chunk_series[row],
+                                                 &thread_windows[tid], range_max_view, range_min_view,
+                                                 diff_pos_prefix_view, diff_neg_prefix_view, &thread_runs[tid], fv, NULL)
+                    if row_status != ROW_COMPUTED:
+                        continue
+                    chunk_computed[row] = 1
+                    if use_formula_program:
+                        chunk_score_valid[row] = formula_row_score(
+                            formula_ops.data(), formula_args.data(), n_formula_ops,
+                            comparison_slots.data(), n_comparison_slots, fv,
+                            &thread_formula_stack[tid * formula_stack_size], &chunk_scores[row])
 
-                #if stock_idx == 0:
-                    #printf("running4.7\n")  
-
-                #if stock_idx == 0:
-                    #print(f"stock_idx={stock_idx}, end_date_idx={end_date_idx}, stop_profit_var={stop_profit_var}, stop_loss_var={stop_loss_var}, stop_profit_and_stop_loss_change={stop_profit_and_stop_loss_change}")
-
-                # 停盈止损 - 根据天数选择较小的值
-                if profit_days != -1 and loss_days != -1:
-                    # 两个都有有效值，比较天数选择较小的
-                    if profit_days <= loss_days:
-                        stop_profit_and_take_loss_change = stop_profit_var if not isnan(stop_profit_var) else take_loss_var
-                    else:
-                        stop_profit_and_take_loss_change = take_loss_var if not isnan(take_loss_var) else stop_profit_var
-                elif profit_days != -1:
-                    # 只有profit_days有效
-                    stop_profit_and_take_loss_change = stop_profit_var if not isnan(stop_profit_var) else take_loss_var
-                elif loss_days != -1:
-                    # 只有loss_days有效
-                    stop_profit_and_take_loss_change = take_loss_var if not isnan(take_loss_var) else stop_profit_var
-                else:
-                    # 两个都无效，使用默认逻辑
-                    hold_days = op_days
-                    op_days_when_take_stop_nan = min(hold_days, end_date_idx)
-                    if end_date_idx - hold_days >= 0:
-                        op_idx_when_take_stop_nan = end_date_idx - hold_days
-                    else:
-                        hold_days = end_date_idx
-                        op_idx_when_take_stop_nan = 0
-                    if end_value != 0 and not isnan(end_value):
-                        stop_profit_and_take_loss_change = (price_data_view[stock_idx, op_idx_when_take_stop_nan] - end_value) / end_value * 100
-                    else:
-                        stop_profit_and_take_loss_change = NAN
+        for i in range(chunk_start, chunk_end):
+            stock_idx = stock_idx_arr_view[i]
+            for date_pos in range(n_end_dates):
+                row = (i - chunk_start) * n_end_dates + date_pos
+                if not chunk_computed[row]:
+                    continue
+                idx = end_date_start_idx - date_pos
+                m = &chunk_metrics[row]
+                score = chunk_scores[row]
+                score_valid = chunk_score_valid[row]
+                # 只显示选股结果时，在C层先判断是否入选，编译公式路径下未入选的行不再构造Python对象
+                row_selected = (score_valid and score != 0 and not isnan(m.end_value) and m.hold_days != -1 and
+                                ((sort_mode_code == 1 and score > 0) or (sort_mode_code == 2 and score < 0)))
+                if only_show_selected and use_formula_program and not row_selected:
+                    continue
+                try:
+                    actual_idx = m.actual_idx
+                    actual_value = m.actual_value
+                    adjust_days = m.adjust_days
+                    adjust_ops_incre_rate = m.adjust_ops_incre_rate
+                    after_gt_end_change = m.after_gt_end_change
+                    after_gt_end_value = m.after_gt_end_value
+                    after_gt_start_change = m.after_gt_start_change
+                    after_gt_start_value = m.after_gt_start_value
+                    closest_idx_in_window = m.closest_idx_in_window
+                    closest_value = m.closest_value
+                    cont_sum_neg_sum = m.cont_sum_neg_sum
+                    cont_sum_neg_sum_first_half = m.cont_sum_neg_sum_first_half
+                    cont_sum_neg_sum_second_half = m.cont_sum_neg_sum_second_half
+                    cont_sum_pos_sum = m.cont_sum_pos_sum
+                    cont_sum_pos_sum_first_half = m.cont_sum_pos_sum_first_half
+                    cont_sum_pos_sum_second_half = m.cont_sum_pos_sum_second_half
+                    continuous_abs_is_less = m.continuous_abs_is_less
+                    continuous_abs_sum_block1 = m.continuous_abs_sum_block1
+                    continuous_abs_sum_block2 = m.continuous_abs_sum_block2
+                    continuous_abs_sum_block3 = m.continuous_abs_sum_block3
+                    continuous_abs_sum_block4 = m.continuous_abs_sum_block4
+                    continuous_abs_sum_first_half = m.continuous_abs_sum_first_half
+                    continuous_abs_sum_second_half = m.continuous_abs_sum_second_half
+                    continuous_end_prev_prev_value = m.continuous_end_prev_prev_value
+                    continuous_end_prev_value = m.continuous_end_prev_value
+                    continuous_end_value = m.continuous_end_value
+                    continuous_len = m.continuous_len
+                    continuous_start_next_next_value = m.continuous_start_next_next_value
+                    continuous_start_next_value = m.continuous_start_next_value
+                    continuous_start_value = m.continuous_start_value
+                    end_date_idx = m.end_date_idx
+                    end_day_change = m.end_day_change
+                    end_state = m.end_state
+                    end_value = m.end_value
+                    forward_max_abs_sum_block1 = m.forward_max_abs_sum_block1
+                    forward_max_abs_sum_block2 = m.forward_max_abs_sum_block2
+                    forward_max_abs_sum_block3 = m.forward_max_abs_sum_block3
+                    forward_max_abs_sum_block4 = m.forward_max_abs_sum_block4
+                    forward_max_abs_sum_first_half = m.forward_max_abs_sum_first_half
+                    forward_max_abs_sum_second_half = m.forward_max_abs_sum_second_half
+                    forward_max_cont_sum_neg_sum = m.forward_max_cont_sum_neg_sum
+                    forward_max_cont_sum_pos_sum = m.forward_max_cont_sum_pos_sum
+                    forward_max_continuous_abs_is_less = m.forward_max_continuous_abs_is_less
+                    forward_max_continuous_end_prev_prev_value = m.forward_max_continuous_end_prev_prev_value
+                    forward_max_continuous_end_prev_value = m.forward_max_continuous_end_prev_value
+                    forward_max_continuous_end_value = m.forward_max_continuous_end_value
+                    forward_max_continuous_start_next_next_value = m.forward_max_continuous_start_next_next_value
+                    forward_max_continuous_start_next_value = m.forward_max_continuous_start_next_value
+                    forward_max_continuous_start_value = m.forward_max_continuous_start_value
+                    forward_max_date_idx = m.forward_max_date_idx
+                    forward_max_result_len = m.forward_max_result_len
+                    forward_max_valid_abs_is_less = m.forward_max_valid_abs_is_less
+                    forward_max_valid_abs_sum_block1 = m.forward_max_valid_abs_sum_block1
+                    forward_max_valid_abs_sum_block2 = m.forward_max_valid_abs_sum_block2
+                    forward_max_valid_abs_sum_block3 = m.forward_max_valid_abs_sum_block3
+                    forward_max_valid_abs_sum_block4 = m.forward_max_valid_abs_sum_block4
+                    forward_max_valid_abs_sum_first_half = m.forward_max_valid_abs_sum_first_half
+                    forward_max_valid_abs_sum_second_half = m.forward_max_valid_abs_sum_second_half
+                    forward_max_valid_neg_sum = m.forward_max_valid_neg_sum
+                    forward_max_valid_pos_sum = m.forward_max_valid_pos_sum
+                    forward_max_valid_sum_len = m.forward_max_valid_sum_len
+                    forward_min_abs_sum_block1 = m.forward_min_abs_sum_block1
+                    forward_min_abs_sum_block2 = m.forward_min_abs_sum_block2
+                    forward_min_abs_sum_block3 = m.forward_min_abs_sum_block3
+                    forward_min_abs_sum_block4 = m.forward_min_abs_sum_block4
+                    forward_min_abs_sum_first_half = m.forward_min_abs_sum_first_half
+                    forward_min_abs_sum_second_half = m.forward_min_abs_sum_second_half
+                    forward_min_cont_sum_neg_sum = m.forward_min_cont_sum_neg_sum
+                    forward_min_cont_sum_pos_sum = m.forward_min_cont_sum_pos_sum
+                    forward_min_continuous_abs_is_less = m.forward_min_continuous_abs_is_less
+                    forward_min_continuous_end_prev_prev_value = m.forward_min_continuous_end_prev_prev_value
+                    forward_min_continuous_end_prev_value = m.forward_min_continuous_end_prev_value
+                    forward_min_continuous_end_value = m.forward_min_continuous_end_value
+                    forward_min_continuous_start_next_next_value = m.forward_min_continuous_start_next_next_value
+                    forward_min_continuous_start_next_value = m.forward_min_continuous_start_next_value
+                    forward_min_continuous_start_value = m.forward_min_continuous_start_value
+                    forward_min_date_idx = m.forward_min_date_idx
+                    forward_min_result_len = m.forward_min_result_len
+                    forward_min_valid_abs_is_less = m.forward_min_valid_abs_is_less
+                    forward_min_valid_abs_sum_block1 = m.forward_min_valid_abs_sum_block1
+                    forward_min_valid_abs_sum_block2 = m.forward_min_valid_abs_sum_block2
+                    forward_min_valid_abs_sum_block3 = m.forward_min_valid_abs_sum_block3
+                    forward_min_valid_abs_sum_block4 = m.forward_min_valid_abs_sum_block4
+                    forward_min_valid_abs_sum_first_half = m.forward_min_valid_abs_sum_first_half
+                    forward_min_valid_abs_sum_second_half = m.forward_min_valid_abs_sum_second_half
+                    forward_min_valid_neg_sum = m.forward_min_valid_neg_sum
+                    forward_min_valid_pos_sum = m.forward_min_valid_pos_sum
+                    forward_min_valid_sum_len = m.forward_min_valid_sum_len
+                    has_three_consecutive_zeros = m.has_three_consecutive_zeros
+                    hold_days = m.hold_days
+                    increment_change = m.increment_change
+                    increment_value = m.increment_value
+                    max_idx_in_window = m.max_idx_in_window
+                    max_price = m.max_price
+                    min_idx_in_window = m.min_idx_in_window
+                    min_price = m.min_price
+                    n_days_max_value = m.n_days_max_value
+                    n_max_is_max_result = m.n_max_is_max_result
+                    op_day_change = m.op_day_change
+                    ops_change = m.ops_change
+                    ops_incre_rate = m.ops_incre_rate
+                    ops_value = m.ops_value
+                    prev_day_change = m.prev_day_change
+                    range_ratio_is_less = m.range_ratio_is_less
+                    start_date_idx = m.start_date_idx
+                    start_value = m.start_value
+                    start_with_new_after_high = m.start_with_new_after_high
+                    start_with_new_after_high2 = m.start_with_new_after_high2
+                    start_with_new_after_low = m.start_with_new_after_low
+                    start_with_new_after_low2 = m.start_with_new_after_low2
+                    start_with_new_before_high = m.start_with_new_before_high
+                    start_with_new_before_high2 = m.start_with_new_before_high2
+                    start_with_new_before_low = m.start_with_new_before_low
+                    start_with_new_before_low2 = m.start_with_new_before_low2
+                    stop_and_take_after_gt_end_change = m.stop_and_take_after_gt_end_change
+                    stop_and_take_after_gt_start_change = m.stop_and_take_after_gt_start_change
+                    stop_and_take_incre_rate = m.stop_and_take_incre_rate
+                    stop_and_take_increment_change = m.stop_and_take_increment_change
+                    stop_loss = m.stop_loss
+                    stop_profit_and_take_loss_change = m.stop_profit_and_take_loss_change
+                    take_and_stop_after_gt_end_change = m.take_and_stop_after_gt_end_change
+                    take_and_stop_after_gt_start_change = m.take_and_stop_after_gt_start_change
+                    take_and_stop_incre_rate = m.take_and_stop_incre_rate
+                    take_and_stop_increment_change = m.take_and_stop_increment_change
+                    take_profit = m.take_profit
+                    take_profit_and_stop_loss_change = m.take_profit_and_stop_loss_change
+                    take_profit_and_take_loss_change = m.take_profit_and_take_loss_change
+                    valid_abs_is_less = m.valid_abs_is_less
+                    valid_abs_sum_block1 = m.valid_abs_sum_block1
+                    valid_abs_sum_block2 = m.valid_abs_sum_block2
+                    valid_abs_sum_block3 = m.valid_abs_sum_block3
+                    valid_abs_sum_block4 = m.valid_abs_sum_block4
+                    valid_abs_sum_first_half = m.valid_abs_sum_first_half
+                    valid_abs_sum_second_half = m.valid_abs_sum_second_half
+                    valid_neg_sum = m.valid_neg_sum
+                    valid_pos_sum = m.valid_pos_sum
+                    valid_sum_len = m.valid_sum_len
+                    cont_sum.swap(chunk_series[row].cont_sum)
+                    forward_max_result_c.swap(chunk_series[row].forward_max_result_c)
+                    forward_min_result_c.swap(chunk_series[row].forward_min_result_c)
+                    valid_sum_vec.swap(chunk_series[row].valid_sum_vec)
+                    forward_max_valid_sum_vec.swap(chunk_series[row].forward_max_valid_sum_vec)
+                    forward_min_valid_sum_vec.swap(chunk_series[row].forward_min_valid_sum_vec)
+                    start_with_new_before_high_py = bool(start_with_new_before_high)
+                    start_with_new_before_high2_py = bool(start_with_new_before_high2)
+                    start_with_new_after_high_py = bool(start_with_new_after_high)
+                    start_with_new_after_high2_py = bool(start_with_new_after_high2)
+                    start_with_new_before_low_py = bool(start_with_new_before_low)
+                    start_with_new_before_low2_py = bool(start_with_new_before_low2)
+                    start_with_new_after_low_py = bool(start_with_new_after_low)
+                    start_with_new_after_low2_py = bool(start_with_new_after_low2)
+                    has_three_consecutive_zeros_py = bool(has_three_consecutive_zeros)
 
-                #if stock_idx == 1805:
-                    #print(f"stop_profit_var={stop_profit_var}, stop_loss_var={stop_loss_var}, stop_profit_and_take_loss_change={stop_profit_and_take_loss_change}")
+                    # 计算所有日期和值的组合
+                    max_value_date = date_columns[end_date_idx + max_idx_in_window] if max_idx_in_window >= 0 else None
+                    min_value_date = date_columns[end_date_idx + min_idx_in_window] if min_idx_in_window >= 0 else None
+                    end_value_date = date_columns[end_date_idx]
+                    start_value_date = date_columns[start_date_idx]
+                    actual_value_date = date_columns[actual_idx] if actual_idx >= 0 and actual_idx < num_dates else None
+                    closest_value_date = date_columns[end_date_idx + closest_idx_in_window] if closest_idx_in_window >= 0 else None
+                    forward_max_date_str = date_columns[forward_max_date_idx] if forward_max_date_idx >= 0 else None
+                    forward_min_date_str = date_columns[forward_min_date_idx] if forward_min_date_idx >= 0 else None
 
-                #if stock_idx == 0:
-                    #print("running 5")
-                # 新增：计算操作涨幅、调整天数、日均涨幅
-                if end_date_idx - hold_days >= 0:
-                    op_idx_when_take_stop_nan = end_date_idx - hold_days
-                else:
-                    op_idx_when_take_stop_nan = 0
-                if end_value != 0 and not isnan(end_value):
-                    ops_change = (price_data_view[stock_idx, op_idx_when_take_stop_nan] - end_value) / end_value * 100
-                else:
-                    ops_change = NAN
-                
-                #if stock_idx == 2315:
-                    #print(f"stock_idx=2315, ops_value={price_data_view[stock_idx, op_idx_when_take_stop_nan]}, end_value={end_value}")
-                adjust_days = None
-                ops_incre_rate = None
-                end_value_for_ops = end_value if not isnan(end_value) else None
-
-                # 调整天数计算
-                if hold_days is not None and hold_days > 0:
-                    if not trade_t1_mode:  # T+0模式
-                        if hold_days == 1:
-                            if ops_change is not None and ops_change > ops_change_input:
-                                adjust_days = 2
-                            else:
-                                adjust_days = 1
+                    # 新增：score 计算
+                    score_obj = None
+                    if use_formula_program:
+                        if score_valid:
+                            score_obj = score
+                    elif formula_expr is not None:
+                        # exec公式需要Python列表形式的累加值序列
+                        py_cont_sum = list(cont_sum)
+                        if is_forward:
+                            forward_max_result = [traditional_round(forward_max_result_c[j], 2) for j in range(forward_max_result_c.size())]
+                            forward_min_result = [traditional_round(forward_min_result_c[j], 2) for j in range(forward_min_result_c.size())]
+                            forward_max_valid_sum_arr = [traditional_round(forward_max_valid_sum_vec[j], 2) for j in range(forward_max_valid_sum_vec.size())]
+                            forward_min_valid_sum_arr = [traditional_round(forward_min_valid_sum_vec[j], 2) for j in range(forward_min_valid_sum_vec.size())]
                         else:
-                            adjust_days = hold_days
-                    else:  # T+1模式
-                        adjust_days = hold_days + 1
-                else:
-                    adjust_days = 0
-
-                # 调天日均涨幅 （停盈停损日均涨幅）
-                if stop_profit_and_stop_loss_change is not None and adjust_days not in (None, 0):
-                    try:
-                        #ops_incre_rate = ops_change / adjust_days  # 移除 round_to_2
-                        ops_incre_rate = stop_profit_and_stop_loss_change / adjust_days
-                    except Exception:
-                        ops_incre_rate = None
-
-                 # 当stock_idx=0时打印相关参数
-                #if stock_idx == 0:
-                    #print(f"stock_idx={stock_idx}, ops_change={ops_change}, adjust_days={adjust_days}, ops_incre_rate={ops_incre_rate}")
-                    
-                # 调幅日均涨幅： 调整涨幅 / 持有天数 （止盈止损）
-                adjust_ops_incre_rate = None  # 先初始化为None
-                if take_profit_and_take_loss_change is not None and not isnan(take_profit_and_take_loss_change) and hold_days not in (None, 0):
-                    try:
-                        #adjust_ops_incre_rate = adjust_ops_change / hold_days  # 移除 round_to_2
-                        adjust_ops_incre_rate = take_profit_and_take_loss_change / hold_days
-                    except Exception:
-                        adjust_ops_incre_rate = None
-
-                # 日均涨幅 止盈停损 / 持有天数
-                take_and_stop_incre_rate = None
-                if take_profit_and_stop_loss_change is not None and not isnan(take_profit_and_stop_loss_change) and hold_days not in (None, 0):
-                    try:
-                        take_and_stop_incre_rate = take_profit_and_stop_loss_change / hold_days
-                    except Exception:
-                        take_and_stop_incre_rate = None
-
-                #日均涨幅： 停盈止损 / 调整天数
-                stop_and_take_incre_rate = None
-                if stop_profit_and_take_loss_change is not None and not isnan(stop_profit_and_take_loss_change) and adjust_days not in (None, 0):
-                    try:
-                        stop_and_take_incre_rate = stop_profit_and_take_loss_change / adjust_days  # 移除 round_to_2
-                    except Exception:
-                        stop_and_take_incre_rate = None
-                    
-                #if stock_idx == 0:
-                    #print("running 6")
-                # 新增：score 计算
-                score = None
-                if formula_expr is not None:
-                    # 预先计算所有需要的变量
-                    def safe_formula_val(val):
-                        import math
-                        if val is None:
-                            return 0
-                        if isinstance(val, float) and (math.isnan(val) or str(val).lower() == 'nan'):
-                            return 0
-                        return val
-
-                    formula_vars = {
-                        'max_value': safe_formula_val(max_price),
-                        'max_value_date': max_value_date,
-                        'min_value': safe_formula_val(min_price),
-                        'min_value_date': min_value_date,
-                        'end_value': safe_formula_val(end_value),
-                        'end_value_date': end_value_date,
-                        'start_value': safe_formula_val(start_value),
-                        'start_value_date': start_value_date,
-                        'actual_value': safe_formula_val(actual_value),
-                        'actual_value_date': actual_value_date,
-                        'closest_value': safe_formula_val(closest_value),
-                        'closest_value_date': closest_value_date,
-                        'continuous_results': py_cont_sum,
-                        'continuous_len': safe_formula_val(continuous_len),
-                        'continuous_start_value': safe_formula_val(continuous_start_value),
-                        'continuous_start_next_value': safe_formula_val(continuous_start_next_value),
-                        'continuous_start_next_next_value': safe_formula_val(continuous_start_next_next_value),
-                        'continuous_end_value': safe_formula_val(continuous_end_value),
-                        'continuous_end_prev_value': safe_formula_val(continuous_end_prev_value),
-                        'continuous_end_prev_prev_value': safe_formula_val(continuous_end_prev_prev_value),
-                        'continuous_abs_sum_first_half': safe_formula_val(continuous_abs_sum_first_half),
-                        'continuous_abs_sum_second_half': safe_formula_val(continuous_abs_sum_second_half),
-                        'continuous_abs_sum_block1': safe_formula_val(continuous_abs_sum_block1),
-                        'continuous_abs_sum_block2': safe_formula_val(continuous_abs_sum_block2),
-                        'continuous_abs_sum_block3': safe_formula_val(continuous_abs_sum_block3),
-                        'continuous_abs_sum_block4': safe_formula_val(continuous_abs_sum_block4),
-                        'forward_max_result': forward_max_result,
-                        'forward_max_continuous_start_value': safe_formula_val(forward_max_continuous_start_value),
-                        'forward_max_continuous_start_next_value': safe_formula_val(forward_max_continuous_start_next_value),
-                        'forward_max_continuous_start_next_next_value': safe_formula_val(forward_max_continuous_start_next_next_value),
-                        'forward_max_continuous_end_value': safe_formula_val(forward_max_continuous_end_value),
-                        'forward_max_continuous_end_prev_value': safe_formula_val(forward_max_continuous_end_prev_value),
-                        'forward_max_continuous_end_prev_prev_value': safe_formula_val(forward_max_continuous_end_prev_prev_value),
-                        'forward_max_abs_sum_first_half': safe_formula_val(forward_max_abs_sum_first_half),
-                        'forward_max_abs_sum_second_half': safe_formula_val(forward_max_abs_sum_second_half),
-                        'forward_max_abs_sum_block1': safe_formula_val(forward_max_abs_sum_block1),
-                        'forward_max_abs_sum_block2': safe_formula_val(forward_max_abs_sum_block2),
-                        'forward_max_abs_sum_block3': safe_formula_val(forward_max_abs_sum_block3),
-                        'forward_max_abs_sum_block4': safe_formula_val(forward_max_abs_sum_block4),
-                        'forward_min_result': forward_min_result,
-                        'forward_min_continuous_start_value': safe_formula_val(forward_min_continuous_start_value),
-                        'forward_min_continuous_start_next_value': safe_formula_val(forward_min_continuous_start_next_value),
-                        'forward_min_continuous_start_next_next_value': safe_formula_val(forward_min_continuous_start_next_next_value),
-                        'forward_min_continuous_end_value': safe_formula_val(forward_min_continuous_end_value),
-                        'forward_min_continuous_end_prev_value': safe_formula_val(forward_min_continuous_end_prev_value),
-                        'forward_min_continuous_end_prev_prev_value': safe_formula_val(forward_min_continuous_end_prev_prev_value),
-                        'forward_min_abs_sum_first_half': safe_formula_val(forward_min_abs_sum_first_half),
-                        'forward_min_abs_sum_second_half': safe_formula_val(forward_min_abs_sum_second_half),
-                        'forward_min_abs_sum_block1': safe_formula_val(forward_min_abs_sum_block1),
-                        'forward_min_abs_sum_block2': safe_formula_val(forward_min_abs_sum_block2),
-                        'forward_min_abs_sum_block3': safe_formula_val(forward_min_abs_sum_block3),
-                        'forward_min_abs_sum_block4': safe_formula_val(forward_min_abs_sum_block4),
-                        'valid_sum_arr': py_valid_sum_arr,
-                        'valid_sum_len': safe_formula_val(valid_sum_len),
-                        'valid_pos_sum': safe_formula_val(valid_pos_sum),
-                        'valid_neg_sum': safe_formula_val(valid_neg_sum),
-                        'forward_max_valid_sum_arr': forward_max_valid_sum_arr,
-                        'forward_max_valid_sum_len': safe_formula_val(forward_max_valid_sum_len),
-                        'forward_max_valid_pos_sum': safe_formula_val(forward_max_valid_pos_sum),
-                        'forward_max_valid_neg_sum': safe_formula_val(forward_max_valid_neg_sum),
-                        'forward_min_valid_sum_arr': forward_min_valid_sum_arr,
-                        'forward_min_valid_sum_len': safe_formula_val(forward_min_valid_sum_len),
-                        'forward_min_valid_pos_sum': safe_formula_val(forward_min_valid_pos_sum),
-                        'forward_min_valid_neg_sum': safe_formula_val(forward_min_valid_neg_sum),
-                        'valid_abs_sum_first_half': safe_formula_val(valid_abs_sum_first_half),
-                        'valid_abs_sum_second_half': safe_formula_val(valid_abs_sum_second_half),
-                        'valid_abs_sum_block1': safe_formula_val(valid_abs_sum_block1),
-                        'valid_abs_sum_block2': safe_formula_val(valid_abs_sum_block2),
-                        'valid_abs_sum_block3': safe_formula_val(valid_abs_sum_block3),
-                        'valid_abs_sum_block4': safe_formula_val(valid_abs_sum_block4),
-                        'forward_max_valid_abs_sum_first_half': safe_formula_val(forward_max_valid_abs_sum_first_half),
-                        'forward_max_valid_abs_sum_second_half': safe_formula_val(forward_max_valid_abs_sum_second_half),
-                        'forward_max_valid_abs_sum_block1': safe_formula_val(forward_max_valid_abs_sum_block1),
-                        'forward_max_valid_abs_sum_block2': safe_formula_val(forward_max_valid_abs_sum_block2),
-                        'forward_max_valid_abs_sum_block3': safe_formula_val(forward_max_valid_abs_sum_block3),
-                        'forward_max_valid_abs_sum_block4': safe_formula_val(forward_max_valid_abs_sum_block4),
-                        'forward_min_valid_abs_sum_first_half': safe_formula_val(forward_min_valid_abs_sum_first_half),
-                        'forward_min_valid_abs_sum_second_half': safe_formula_val(forward_min_valid_abs_sum_second_half),
-                        'forward_min_valid_abs_sum_block1': safe_formula_val(forward_min_valid_abs_sum_block1),
-                        'forward_min_valid_abs_sum_block2': safe_formula_val(forward_min_valid_abs_sum_block2),
-                        'forward_min_valid_abs_sum_block3': safe_formula_val(forward_min_valid_abs_sum_block3),
-                        'forward_min_valid_abs_sum_block4': safe_formula_val(forward_min_valid_abs_sum_block4),
-                        'forward_max_date': forward_max_date_str,
-                        'forward_min_date': forward_min_date_str,
-                        'n_max_is_max': n_max_is_max_result,
-                        'range_ratio_is_less': range_ratio_is_less,
-                        'continuous_abs_is_less': continuous_abs_is_less,
-                        'valid_abs_is_less': valid_abs_is_less,
-                        'forward_min_continuous_abs_is_less': forward_min_continuous_abs_is_less,
-                        'forward_min_valid_abs_is_less': forward_min_valid_abs_is_less,
-                        'forward_max_continuous_abs_is_less': forward_max_continuous_abs_is_less,
-                        'forward_max_valid_abs_is_less': forward_max_valid_abs_is_less,
-                        'n_days_max_value': safe_formula_val(n_days_max_value),
-                        'prev_day_change': safe_formula_val(prev_day_change),
-                        'end_day_change': safe_formula_val(end_day_change),
-                        'diff_end_value': diff_data_view[stock_idx, end_date_idx],
-                        'increment_value': safe_formula_val(increment_value),
-                        'after_gt_end_value': safe_formula_val(after_gt_end_value),
-                        'after_gt_start_value': safe_formula_val(after_gt_start_value),
-                        'increment_change': safe_formula_val(increment_change),
-                        'after_gt_end_change': safe_formula_val(after_gt_end_change),
-                        'after_gt_start_change': safe_formula_val(after_gt_start_change),
-                        'adjust_ops_change': safe_formula_val(take_profit_and_take_loss_change),
-                        'adjust_ops_incre_rate': safe_formula_val(adjust_ops_incre_rate),
-                        'hold_days': safe_formula_val(hold_days),
-                        'ops_change': safe_formula_val(ops_change),
-                        'adjust_days': safe_formula_val(adjust_days),
-                        'ops_incre_rate': safe_formula_val(ops_incre_rate),
-                        'forward_max_result_len': safe_formula_val(forward_max_result_len),
-                        'forward_min_result_len': safe_formula_val(forward_min_result_len),
-                        'cont_sum_pos_sum': safe_formula_val(cont_sum_pos_sum),
-                        'cont_sum_neg_sum': safe_formula_val(cont_sum_neg_sum),
-                        'cont_sum_pos_sum_first_half': safe_formula_val(cont_sum_pos_sum_first_half),
-                        'cont_sum_pos_sum_second_half': safe_formula_val(cont_sum_pos_sum_second_half),
-                        'cont_sum_neg_sum_first_half': safe_formula_val(cont_sum_neg_sum_first_half),
-                        'cont_sum_neg_sum_second_half': safe_formula_val(cont_sum_neg_sum_second_half),
-                        'forward_max_cont_sum_pos_sum': safe_formula_val(forward_max_cont_sum_pos_sum),
-                        'forward_max_cont_sum_neg_sum': safe_formula_val(forward_max_cont_sum_neg_sum),
-                        'forward_min_cont_sum_pos_sum': safe_formula_val(forward_min_cont_sum_pos_sum),
-                        'forward_min_cont_sum_neg_sum': safe_formula_val(forward_min_cont_sum_neg_sum),
-                        'start_with_new_before_high': start_with_new_before_high_py,
-                        'start_with_new_before_high2': start_with_new_before_high2_py,
-                        'start_with_new_after_high': start_with_new_after_high_py,
-                        'start_with_new_after_high2': start_with_new_after_high2_py,
-                        'start_with_new_before_low': start_with_new_before_low_py,
-                        'start_with_new_before_low2': start_with_new_before_low2_py,
-                        'start_with_new_after_low': start_with_new_after_low_py,
-                        'start_with_new_after_low2': start_with_new_after_low2_py,
-                        'has_three_consecutive_zeros': has_three_consecutive_zeros_py
-                    }
-
-                    # 在执行公式前检查每对比较变量
-                    should_exec_formula = True  # 添加flag控制是否执行公式
-                    if comparison_vars_list:
-                        for var_pair in comparison_vars_list:
-                            var1, var2 = var_pair  # 解包元组对
-                            var1_value = formula_vars.get(var1, 0)
-                            var2_value = formula_vars.get(var2, 0)
-                            # 如果一对变量都为0，设置flag为False
-                            if (var1_value == 0 or var1_value is None) and (var2_value == 0 or var2_value is None):
-                                should_exec_formula = False
-                                score = 0
-                                break
-
-                    try:
-                        # 根据flag决定是否执行选股公式
-                        if should_exec_formula:
-                            exec(formula_expr, {}, formula_vars)
-                            score = formula_vars.get('result', None)
-                    except Exception as e:
-                        import traceback
-                        print(f"[calculate_batch_cy] 执行公式异常: {e}")
-                        print(f"公式内容: {formula_expr}")
-                        print(traceback.format_exc())
-                        score = None
-                
-                #if stock_idx == 2315:
-                    #print(f"stock_idx=2315, score={score}, cont_sum_pos_sum={cont_sum_pos_sum}, cont_sum_neg_sum={cont_sum_neg_sum}, valid_pos_sum={valid_pos_sum}, valid_neg_sum={valid_neg_sum}, 选股公式: {formula_expr}")
-                #if stock_idx == 129:
-                    #print(f"stock_idx={stock_idx}, cont_sum_pos_sum={cont_sum_pos_sum}, valid_pos_sum={valid_pos_sum}, forward_min_cont_sum_pos_sum={forward_min_cont_sum_pos_sum}")
-                if only_show_selected:
-                    if score is not None and score != 0 and not isnan(end_value) and hold_days != -1:
-                        # 根据排序模式过滤score
-                        if (sort_mode == "最大值排序" and score > 0) or (sort_mode == "最小值排序" and score < 0):
-                            row_result = {
-                                'stock_idx': stock_idx,
-                                'max_value': max_price,
-                                'max_value_date': max_value_date,
-                                'min_value': min_price,
-                                'min_value_date': min_value_date,
-                                'end_value': end_value,
-                                'end_value_date': end_value_date,
-                                'start_value': start_value,
-                                'start_value_date': start_value_date,
-                                'actual_value': actual_value,
-                                'actual_value_date': actual_value_date,
-                                'closest_value': closest_value,
-                                'closest_value_date': closest_value_date,
-                                'continuous_results': py_cont_sum,
-                                'continuous_len': continuous_len,
-                                'continuous_start_value': continuous_start_value,
-                                'continuous_start_next_value': continuous_start_next_value,
-                                'continuous_start_next_next_value': continuous_start_next_next_value,
-                                'continuous_end_value': continuous_end_value,
-                                'continuous_end_prev_value': continuous_end_prev_value,
-                                'continuous_end_prev_prev_value': continuous_end_prev_prev_value,
-                                'continuous_abs_sum_first_half': continuous_abs_sum_first_half,
-                                'continuous_abs_sum_second_half': continuous_abs_sum_second_half,
-                                'continuous_abs_sum_block1': continuous_abs_sum_block1,
-                                'continuous_abs_sum_block2': continuous_abs_sum_block2,
-                                'continuous_abs_sum_block3': continuous_abs_sum_block3,
-                                'continuous_abs_sum_block4': continuous_abs_sum_block4,
-                                'forward_max_result': forward_max_result,
-                                'forward_max_continuous_start_value': forward_max_continuous_start_value,
-                                'forward_max_continuous_start_next_value': forward_max_continuous_start_next_value,
-                                'forward_max_continuous_start_next_next_value': forward_max_continuous_start_next_next_value,
-                                'forward_max_continuous_end_value': forward_max_continuous_end_value,
-                                'forward_max_continuous_end_prev_value': forward_max_continuous_end_prev_value,
-                                'forward_max_continuous_end_prev_prev_value': forward_max_continuous_end_prev_prev_value,
-                                'forward_max_abs_sum_first_half': forward_max_abs_sum_first_half,
-                                'forward_max_abs_sum_second_half': forward_max_abs_sum_second_half,
-                                'forward_max_abs_sum_block1': forward_max_abs_sum_block1,
-                                'forward_max_abs_sum_block2': forward_max_abs_sum_block2,
-                                'forward_max_abs_sum_block3': forward_max_abs_sum_block3,
-                                'forward_max_abs_sum_block4': forward_max_abs_sum_block4,
-                                'forward_min_result': forward_min_result,
-                                'forward_min_continuous_start_value': forward_min_continuous_start_value,
-                                'forward_min_continuous_start_next_value': forward_min_continuous_start_next_value,
-                                'forward_min_continuous_start_next_next_value': forward_min_continuous_start_next_next_value,
-                                'forward_min_continuous_end_value': forward_min_continuous_end_value,
-                                'forward_min_continuous_end_prev_value': forward_min_continuous_end_prev_value,
-                                'forward_min_continuous_end_prev_prev_value': forward_min_continuous_end_prev_prev_value,
-                                'forward_min_abs_sum_first_half': forward_min_abs_sum_first_half,
-                                'forward_min_abs_sum_second_half': forward_min_abs_sum_second_half,
-                                'forward_min_abs_sum_block1': forward_min_abs_sum_block1,
-                                'forward_min_abs_sum_block2': forward_min_abs_sum_block2,
-                                'forward_min_abs_sum_block3': forward_min_abs_sum_block3,
-                                'forward_min_abs_sum_block4': forward_min_abs_sum_block4,
-                                'valid_sum_arr': py_valid_sum_arr,
-                                'valid_sum_len': valid_sum_len,
-                                'valid_pos_sum': valid_pos_sum,
-                                'valid_neg_sum': valid_neg_sum,
-                                'forward_max_valid_sum_arr': forward_max_valid_sum_arr,
-                                'forward_max_valid_sum_len': forward_max_valid_sum_len,
-                                'forward_max_valid_pos_sum': forward_max_valid_pos_sum,
-                                'forward_max_valid_neg_sum': forward_max_valid_neg_sum,
-                                'forward_min_valid_sum_arr': forward_min_valid_sum_arr,
-                                'forward_min_valid_sum_len': forward_min_valid_sum_len,
-                                'forward_min_valid_pos_sum': forward_min_valid_pos_sum,
-                                'forward_min_valid_neg_sum': forward_min_valid_neg_sum,
-                                'valid_abs_sum_first_half': valid_abs_sum_first_half,
-                                'valid_abs_sum_second_half': valid_abs_sum_second_half,
-                                'valid_abs_sum_block1': valid_abs_sum_block1,
-                                'valid_abs_sum_block2': valid_abs_sum_block2,
-                                'valid_abs_sum_block3': valid_abs_sum_block3,
-                                'valid_abs_sum_block4': valid_abs_sum_block4,
-                                'forward_max_valid_abs_sum_first_half': forward_max_valid_abs_sum_first_half,
-                                'forward_max_valid_abs_sum_second_half': forward_max_valid_abs_sum_second_half,
-                                'forward_max_valid_abs_sum_block1': forward_max_valid_abs_sum_block1,
-                                'forward_max_valid_abs_sum_block2': forward_max_valid_abs_sum_block2,
-                                'forward_max_valid_abs_sum_block3': forward_max_valid_abs_sum_block3,
-                                'forward_max_valid_abs_sum_block4': forward_max_valid_abs_sum_block4,
-                                'forward_min_valid_abs_sum_first_half': forward_min_valid_abs_sum_first_half,
-                                'forward_min_valid_abs_sum_second_half': forward_min_valid_abs_sum_second_half,
-                                'forward_min_valid_abs_sum_block1': forward_min_valid_abs_sum_block1,
-                                'forward_min_valid_abs_sum_block2': forward_min_valid_abs_sum_block2,
-                                'forward_min_valid_abs_sum_block3': forward_min_valid_abs_sum_block3,
-                                'forward_min_valid_abs_sum_block4': forward_min_valid_abs_sum_block4,
-                                'forward_max_date': forward_max_date_str,
-                                'forward_min_date': forward_min_date_str,
-                                'n_max_is_max': n_max_is_max_result,
-                                'range_ratio_is_less': range_ratio_is_less,
-                                'continuous_abs_is_less': continuous_abs_is_less,
-                                'valid_abs_is_less': valid_abs_is_less,
-                                'forward_min_continuous_abs_is_less': forward_min_continuous_abs_is_less,
-                                'forward_min_valid_abs_is_less': forward_min_valid_abs_is_less,
-                                'forward_max_continuous_abs_is_less': forward_max_continuous_abs_is_less,
-                                'forward_max_valid_abs_is_less': forward_max_valid_abs_is_less,
-                                'n_days_max_value': safe_formula_val(n_days_max_value),
-                                'prev_day_change': safe_formula_val(prev_day_change),
-                                'end_day_change': safe_formula_val(end_day_change),
-                                'diff_end_value': diff_data_view[stock_idx, end_date_idx],
-                                'increment_value': increment_value,
-                                'after_gt_end_value': after_gt_end_value,
-                                'after_gt_start_value': after_gt_start_value,
-                                'ops_value': ops_value,
-                                'hold_days': hold_days,
-                                'ops_change': ops_change,
-                                'adjust_days': adjust_days,
-                                'ops_incre_rate': ops_incre_rate,
-                                'increment_change': increment_change,
-                                'after_gt_end_change': after_gt_end_change,
-                                'after_gt_start_change': after_gt_start_change,
-                                'adjust_ops_change': take_profit_and_take_loss_change,
-                                'adjust_ops_incre_rate': adjust_ops_incre_rate,
-                                'take_and_stop_increment_change': take_and_stop_increment_change,
-                                'take_and_stop_after_gt_end_change': take_and_stop_after_gt_end_change,
-                                'take_and_stop_after_gt_start_change': take_and_stop_after_gt_start_change,
-                                'take_and_stop_change': take_profit_and_stop_loss_change,
-                                'take_and_stop_incre_rate': take_and_stop_incre_rate,
-                                'stop_and_take_increment_change': stop_and_take_increment_change,
-                                'stop_and_take_after_gt_end_change': stop_and_take_after_gt_end_change,
-                                'stop_and_take_after_gt_start_change': stop_and_take_after_gt_start_change,
-                                'stop_and_take_change': stop_profit_and_take_loss_change,
-                                'stop_and_take_incre_rate': stop_and_take_incre_rate,
-                                'score': score,
-                                'forward_max_result_len': forward_max_result_len,
-                                'forward_min_result_len': forward_min_result_len,
-                                'cont_sum_pos_sum': cont_sum_pos_sum,
-                                'cont_sum_neg_sum': cont_sum_neg_sum,
-                                'cont_sum_pos_sum_first_half': safe_formula_val(cont_sum_pos_sum_first_half),
-                                'cont_sum_pos_sum_second_half': safe_formula_val(cont_sum_pos_sum_second_half),
-                                'cont_sum_neg_sum_first_half': safe_formula_val(cont_sum_neg_sum_first_half),
-                                'cont_sum_neg_sum_second_half': safe_formula_val(cont_sum_neg_sum_second_half),
-                                'forward_max_cont_sum_pos_sum': forward_max_cont_sum_pos_sum,
-                                'forward_max_cont_sum_neg_sum': forward_max_cont_sum_neg_sum,
-                                'forward_min_cont_sum_pos_sum': forward_min_cont_sum_pos_sum,
-                                'forward_min_cont_sum_neg_sum': forward_min_cont_sum_neg_sum,
-                                'start_with_new_before_high': start_with_new_before_high_py,
-                                'start_with_new_before_high2': start_with_new_before_high2_py,
-                                'start_with_new_after_high': start_with_new_after_high_py,
-                                'start_with_new_after_high2': start_with_new_after_high2_py,
-                                'start_with_new_before_low': start_with_new_before_low_py,
-                                'start_with_new_before_low2': start_with_new_before_low2_py,
-                                'start_with_new_after_low': start_with_new_after_low_py,
-                                'start_with_new_after_low2': start_with_new_after_low2_py,
-                                'end_state': end_state,
-                                'stop_loss': stop_loss,
-                                'take_profit': take_profit,
-                                'op_day_change': op_day_change,
-                                'has_three_consecutive_zeros': has_three_consecutive_zeros_py
-                            }
-                            current_stocks = all_results.get(date_columns[end_date_idx], [])
-                            current_stocks.append(row_result)
-                            # 按score排序
-                            if sort_mode == "最大值排序":
-                                current_stocks.sort(key=lambda x: x['score'], reverse=True)
-                            else:  # 最小值排序
-                                current_stocks.sort(key=lambda x: x['score'])
-                            # 只保留指定数量的结果
-                            all_results[date_columns[end_date_idx]] = current_stocks[:select_count]
-                else:
-                    #if stock_idx == 0:
-                        #print(f"only_show_selected = {only_show_selected}， cont_sum_pos_sum_first_half = {cont_sum_pos_sum_first_half}")
-                    row_result = {
-                            'stock_idx': stock_idx,
-                            'max_value': max_price,
+                            forward_max_result = []
+                            forward_min_result = []
+                            forward_max_valid_sum_arr = []
+                            forward_min_valid_sum_arr = []
+                        py_valid_sum_arr = [valid_sum_vec[j] for j in range(valid_sum_vec.size())]
+                        # 公式无法编译时回退到exec，预先计算所有需要的变量
+                        formula_vars = {
+                            'max_value': safe_formula_val(max_price),
                             'max_value_date': max_value_date,
-                            'min_value': min_price,
+                            'min_value': safe_formula_val(min_price),
                             'min_value_date': min_value_date,
-                            'end_value': end_value,
+                            'end_value': safe_formula_val(end_value),
                             'end_value_date': end_value_date,
-                            'start_value': start_value,
+                            'start_value': safe_formula_val(start_value),
                             'start_value_date': start_value_date,
-                            'actual_value': actual_value,
+                            'actual_value': safe_formula_val(actual_value),
                             'actual_value_date': actual_value_date,
-                            'closest_value': closest_value,
+                            'closest_value': safe_formula_val(closest_value),
                             'closest_value_date': closest_value_date,
                             'continuous_results': py_cont_sum,
-                            'continuous_len': continuous_len,
-                            'continuous_start_value': continuous_start_value,
-                            'continuous_start_next_value': continuous_start_next_value,
-                            'continuous_start_next_next_value': continuous_start_next_next_value,
-                            'continuous_end_value': continuous_end_value,
-                            'continuous_end_prev_value': continuous_end_prev_value,
-                            'continuous_end_prev_prev_value': continuous_end_prev_prev_value,
-                            'continuous_abs_sum_first_half': continuous_abs_sum_first_half,
-                            'continuous_abs_sum_second_half': continuous_abs_sum_second_half,
-                            'continuous_abs_sum_block1': continuous_abs_sum_block1,
-                            'continuous_abs_sum_block2': continuous_abs_sum_block2,
-                            'continuous_abs_sum_block3': continuous_abs_sum_block3,
-                            'continuous_abs_sum_block4': continuous_abs_sum_block4,
+                            'continuous_len': safe_formula_val(continuous_len),
+                            'continuous_start_value': safe_formula_val(continuous_start_value),
+                            'continuous_start_next_value': safe_formula_val(continuous_start_next_value),
+                            'continuous_start_next_next_value': safe_formula_val(continuous_start_next_next_value),
+                            'continuous_end_value': safe_formula_val(continuous_end_value),
+                            'continuous_end_prev_value': safe_formula_val(continuous_end_prev_value),
+                            'continuous_end_prev_prev_value': safe_formula_val(continuous_end_prev_prev_value),
+                            'continuous_abs_sum_first_half': safe_formula_val(continuous_abs_sum_first_half),
+                            'continuous_abs_sum_second_half': safe_formula_val(continuous_abs_sum_second_half),
+                            'continuous_abs_sum_block1': safe_formula_val(continuous_abs_sum_block1),
+                            'continuous_abs_sum_block2': safe_formula_val(continuous_abs_sum_block2),
+                            'continuous_abs_sum_block3': safe_formula_val(continuous_abs_sum_block3),
+                            'continuous_abs_sum_block4': safe_formula_val(continuous_abs_sum_block4),
                             'forward_max_result': forward_max_result,
-                            'forward_max_continuous_start_value': forward_max_continuous_start_value,
-                            'forward_max_continuous_start_next_value': forward_max_continuous_start_next_value,
-                            'forward_max_continuous_start_next_next_value': forward_max_continuous_start_next_next_value,
-                            'forward_max_continuous_end_value': forward_max_continuous_end_value,
-                            'forward_max_continuous_end_prev_value': forward_max_continuous_end_prev_value,
-                            'forward_max_continuous_end_prev_prev_value': forward_max_continuous_end_prev_prev_value,
-                            'forward_max_abs_sum_first_half': forward_max_abs_sum_first_half,
-                            'forward_max_abs_sum_second_half': forward_max_abs_sum_second_half,
-                            'forward_max_abs_sum_block1': forward_max_abs_sum_block1,
-                            'forward_max_abs_sum_block2': forward_max_abs_sum_block2,
-                            'forward_max_abs_sum_block3': forward_max_abs_sum_block3,
-                            'forward_max_abs_sum_block4': forward_max_abs_sum_block4,
+                            'forward_max_continuous_start_value': safe_formula_val(forward_max_continuous_start_value),
+                            'forward_max_continuous_start_next_value': safe_formula_val(forward_max_continuous_start_next_value),
+                            'forward_max_continuous_start_next_next_value': safe_formula_val(forward_max_continuous_start_next_next_value),
+                            'forward_max_continuous_end_value': safe_formula_val(forward_max_continuous_end_value),
+                            'forward_max_continuous_end_prev_value': safe_formula_val(forward_max_continuous_end_prev_value),
+                            'forward_max_continuous_end_prev_prev_value': safe_formula_val(forward_max_continuous_end_prev_prev_value),
+                            'forward_max_abs_sum_first_half': safe_formula_val(forward_max_abs_sum_first_half),
+                            'forward_max_abs_sum_second_half': safe_formula_val(forward_max_abs_sum_second_half),
+                            'forward_max_abs_sum_block1': safe_formula_val(forward_max_abs_sum_block1),
+                            'forward_max_abs_sum_block2': safe_formula_val(forward_max_abs_sum_block2),
+                            'forward_max_abs_sum_block3': safe_formula_val(forward_max_abs_sum_block3),
+                            'forward_max_abs_sum_block4': safe_formula_val(forward_max_abs_sum_block4),
                             'forward_min_result': forward_min_result,
-                            'forward_min_continuous_start_value': forward_min_continuous_start_value,
-                            'forward_min_continuous_start_next_value': forward_min_continuous_start_next_value,
-                            'forward_min_continuous_start_next_next_value': forward_min_continuous_start_next_next_value,
-                            'forward_min_continuous_end_value': forward_min_continuous_end_value,
-                            'forward_min_continuous_end_prev_value': forward_min_continuous_end_prev_value,
-                            'forward_min_continuous_end_prev_prev_value': forward_min_continuous_end_prev_prev_value,
-                            'forward_min_abs_sum_first_half': forward_min_abs_sum_first_half,
-                            'forward_min_abs_sum_second_half': forward_min_abs_sum_second_half,
-                            'forward_min_abs_sum_block1': forward_min_abs_sum_block1,
-                            'forward_min_abs_sum_block2': forward_min_abs_sum_block2,
-                            'forward_min_abs_sum_block3': forward_min_abs_sum_block3,
-                            'forward_min_abs_sum_block4': forward_min_abs_sum_block4,
+                            'forward_min_continuous_start_value': safe_formula_val(forward_min_continuous_start_value),
+                            'forward_min_continuous_start_next_value': safe_formula_val(forward_min_continuous_start_next_value),
+                            'forward_min_continuous_start_next_next_value': safe_formula_val(forward_min_continuous_start_next_next_value),
+                            'forward_min_continuous_end_value': safe_formula_val(forward_min_continuous_end_value),
+                            'forward_min_continuous_end_prev_value': safe_formula_val(forward_min_continuous_end_prev_value),
+                            'forward_min_continuous_end_prev_prev_value': safe_formula_val(forward_min_continuous_end_prev_prev_value),
+                            'forward_min_abs_sum_first_half': safe_formula_val(forward_min_abs_sum_first_half),
+                            'forward_min_abs_sum_second_half': safe_formula_val(forward_min_abs_sum_second_half),
+                            'forward_min_abs_sum_block1': safe_formula_val(forward_min_abs_sum_block1),
+                            'forward_min_abs_sum_block2': safe_formula_val(forward_min_abs_sum_block2),
+                            'forward_min_abs_sum_block3': safe_formula_val(forward_min_abs_sum_block3),
+                            'forward_min_abs_sum_block4': safe_formula_val(forward_min_abs_sum_block4),
                             'valid_sum_arr': py_valid_sum_arr,
-                            'valid_sum_len': valid_sum_len,
-                            'valid_pos_sum': valid_pos_sum,
-                            'valid_neg_sum': valid_neg_sum,
+                            'valid_sum_len': safe_formula_val(valid_sum_len),
+                            'valid_pos_sum': safe_formula_val(valid_pos_sum),
+                            'valid_neg_sum': safe_formula_val(valid_neg_sum),
                             'forward_max_valid_sum_arr': forward_max_valid_sum_arr,
-                            'forward_max_valid_sum_len': forward_max_valid_sum_len,
-                            'forward_max_valid_pos_sum': forward_max_valid_pos_sum,
-                            'forward_max_valid_neg_sum': forward_max_valid_neg_sum,
+                            'forward_max_valid_sum_len': safe_formula_val(forward_max_valid_sum_len),
+                            'forward_max_valid_pos_sum': safe_formula_val(forward_max_valid_pos_sum),
+                            'forward_max_valid_neg_sum': safe_formula_val(forward_max_valid_neg_sum),
                             'forward_min_valid_sum_arr': forward_min_valid_sum_arr,
-                            'forward_min_valid_sum_len': forward_min_valid_sum_len,
-                            'forward_min_valid_pos_sum': forward_min_valid_pos_sum,
-                            'forward_min_valid_neg_sum': forward_min_valid_neg_sum,
-                            'valid_abs_sum_first_half': valid_abs_sum_first_half,
-                            'valid_abs_sum_second_half': valid_abs_sum_second_half,
-                            'valid_abs_sum_block1': valid_abs_sum_block1,
-                            'valid_abs_sum_block2': valid_abs_sum_block2,
-                            'valid_abs_sum_block3': valid_abs_sum_block3,
-                            'valid_abs_sum_block4': valid_abs_sum_block4,
-                            'forward_max_valid_abs_sum_first_half': forward_max_valid_abs_sum_first_half,
-                            'forward_max_valid_abs_sum_second_half': forward_max_valid_abs_sum_second_half,
-                            'forward_max_valid_abs_sum_block1': forward_max_valid_abs_sum_block1,
-                            'forward_max_valid_abs_sum_block2': forward_max_valid_abs_sum_block2,
-                            'forward_max_valid_abs_sum_block3': forward_max_valid_abs_sum_block3,
-                            'forward_max_valid_abs_sum_block4': forward_max_valid_abs_sum_block4,
-                            'forward_min_valid_abs_sum_first_half': forward_min_valid_abs_sum_first_half,
-                            'forward_min_valid_abs_sum_second_half': forward_min_valid_abs_sum_second_half,
-                            'forward_min_valid_abs_sum_block1': forward_min_valid_abs_sum_block1,
-                            'forward_min_valid_abs_sum_block2': forward_min_valid_abs_sum_block2,
-                            'forward_min_valid_abs_sum_block3': forward_min_valid_abs_sum_block3,
-                            'forward_min_valid_abs_sum_block4': forward_min_valid_abs_sum_block4,
+                            'forward_min_valid_sum_len': safe_formula_val(forward_min_valid_sum_len),
+                            'forward_min_valid_pos_sum': safe_formula_val(forward_min_valid_pos_sum),
+                            'forward_min_valid_neg_sum': safe_formula_val(forward_min_valid_neg_sum),
+                            'valid_abs_sum_first_half': safe_formula_val(valid_abs_sum_first_half),
+                            'valid_abs_sum_second_half': safe_formula_val(valid_abs_sum_second_half),
+                            'valid_abs_sum_block1': safe_formula_val(valid_abs_sum_block1),
+                            'valid_abs_sum_block2': safe_formula_val(valid_abs_sum_block2),
+                            'valid_abs_sum_block3': safe_formula_val(valid_abs_sum_block3),
+                            'valid_abs_sum_block4': safe_formula_val(valid_abs_sum_block4),
+                            'forward_max_valid_abs_sum_first_half': safe_formula_val(forward_max_valid_abs_sum_first_half),
+                            'forward_max_valid_abs_sum_second_half': safe_formula_val(forward_max_valid_abs_sum_second_half),
+                            'forward_max_valid_abs_sum_block1': safe_formula_val(forward_max_valid_abs_sum_block1),
+                            'forward_max_valid_abs_sum_block2': safe_formula_val(forward_max_valid_abs_sum_block2),
+                            'forward_max_valid_abs_sum_block3': safe_formula_val(forward_max_valid_abs_sum_block3),
+                            'forward_max_valid_abs_sum_block4': safe_formula_val(forward_max_valid_abs_sum_block4),
+                            'forward_min_valid_abs_sum_first_half': safe_formula_val(forward_min_valid_abs_sum_first_half),
+                            'forward_min_valid_abs_sum_second_half': safe_formula_val(forward_min_valid_abs_sum_second_half),
+                            'forward_min_valid_abs_sum_block1': safe_formula_val(forward_min_valid_abs_sum_block1),
+                            'forward_min_valid_abs_sum_block2': safe_formula_val(forward_min_valid_abs_sum_block2),
+                            'forward_min_valid_abs_sum_block3': safe_formula_val(forward_min_valid_abs_sum_block3),
+                            'forward_min_valid_abs_sum_block4': safe_formula_val(forward_min_valid_abs_sum_block4),
                             'forward_max_date': forward_max_date_str,
                             'forward_min_date': forward_min_date_str,
                             'n_max_is_max': n_max_is_max_result,
@@ -2580,46 +4801,34 @@ def calculate_batch_cy(
                             'forward_min_valid_abs_is_less': forward_min_valid_abs_is_less,
                             'forward_max_continuous_abs_is_less': forward_max_continuous_abs_is_less,
                             'forward_max_valid_abs_is_less': forward_max_valid_abs_is_less,
-                            'n_days_max_value': n_days_max_value,
-                            'prev_day_change': prev_day_change,
-                            'end_day_change': end_day_change,
-                            'diff_end_value': diff_data_view[stock_idx, end_date_idx],
-                            'increment_value': increment_value,
-                            'after_gt_end_value': after_gt_end_value,
-                            'after_gt_start_value': after_gt_start_value,
-                            'ops_value': ops_value,
-                            'hold_days': hold_days,
-                            'ops_change': ops_change,
-                            'adjust_days': adjust_days,
-                            'ops_incre_rate': ops_incre_rate,
-                            'increment_change': increment_change,
-                            'after_gt_end_change': after_gt_end_change,
-                            'after_gt_start_change': after_gt_start_change,
-                            'adjust_ops_change': take_profit_and_take_loss_change,
-                            'adjust_ops_incre_rate': adjust_ops_incre_rate,
-                            'take_and_stop_increment_change': take_and_stop_increment_change,
-                            'take_and_stop_after_gt_end_change': take_and_stop_after_gt_end_change,
-                            'take_and_stop_after_gt_start_change': take_and_stop_after_gt_start_change,
-                            'take_and_stop_change': take_profit_and_stop_loss_change,
-                            'take_and_stop_incre_rate': take_and_stop_incre_rate,
-                            'stop_and_take_increment_change': stop_and_take_increment_change,
-                            'stop_and_take_after_gt_end_change': stop_and_take_after_gt_end_change,
-                            'stop_and_take_after_gt_start_change': stop_and_take_after_gt_start_change,
-                            'stop_and_take_change': stop_profit_and_take_loss_change,
-                            'stop_and_take_incre_rate': stop_and_take_incre_rate,
-                            'score': score,
-                            'forward_max_result_len': forward_max_result_len,
-                            'forward_min_result_len': forward_min_result_len,
-                            'cont_sum_pos_sum': cont_sum_pos_sum,
-                            'cont_sum_neg_sum': cont_sum_neg_sum,
+                            'n_days_max_value': safe_formula_val(n_days_max_value),
+                            'prev_day_change': safe_formula_val(prev_day_change),
+                            'end_day_change': safe_formula_val(end_day_change),
+                            'diff_end_value': (diff_data_view32[stock_idx, end_date_idx] if use_float32 else diff_data_view[stock_idx, end_date_idx]),
+                            'increment_value': safe_formula_val(increment_value),
+                            'after_gt_end_value': safe_formula_val(after_gt_end_value),
+                            'after_gt_start_value': safe_formula_val(after_gt_start_value),
+                            'increment_change': safe_formula_val(increment_change),
+                            'after_gt_end_change': safe_formula_val(after_gt_end_change),
+                            'after_gt_start_change': safe_formula_val(after_gt_start_change),
+                            'adjust_ops_change': safe_formula_val(take_profit_and_take_loss_change),
+                            'adjust_ops_incre_rate': safe_formula_val(adjust_ops_incre_rate),
+                            'hold_days': safe_formula_val(hold_days),
+                            'ops_change': safe_formula_val(ops_change),
+                            'adjust_days': safe_formula_val(adjust_days),
+                            'ops_incre_rate': safe_formula_val(ops_incre_rate),
+                            'forward_max_result_len': safe_formula_val(forward_max_result_len),
+                            'forward_min_result_len': safe_formula_val(forward_min_result_len),
+                            'cont_sum_pos_sum': safe_formula_val(cont_sum_pos_sum),
+                            'cont_sum_neg_sum': safe_formula_val(cont_sum_neg_sum),
                             'cont_sum_pos_sum_first_half': safe_formula_val(cont_sum_pos_sum_first_half),
                             'cont_sum_pos_sum_second_half': safe_formula_val(cont_sum_pos_sum_second_half),
                             'cont_sum_neg_sum_first_half': safe_formula_val(cont_sum_neg_sum_first_half),
                             'cont_sum_neg_sum_second_half': safe_formula_val(cont_sum_neg_sum_second_half),
-                            'forward_max_cont_sum_pos_sum': forward_max_cont_sum_pos_sum,
-                            'forward_max_cont_sum_neg_sum': forward_max_cont_sum_neg_sum,
-                            'forward_min_cont_sum_pos_sum': forward_min_cont_sum_pos_sum,
-                            'forward_min_cont_sum_neg_sum': forward_min_cont_sum_neg_sum,
+                            'forward_max_cont_sum_pos_sum': safe_formula_val(forward_max_cont_sum_pos_sum),
+                            'forward_max_cont_sum_neg_sum': safe_formula_val(forward_max_cont_sum_neg_sum),
+                            'forward_min_cont_sum_pos_sum': safe_formula_val(forward_min_cont_sum_pos_sum),
+                            'forward_min_cont_sum_neg_sum': safe_formula_val(forward_min_cont_sum_neg_sum),
                             'start_with_new_before_high': start_with_new_before_high_py,
                             'start_with_new_before_high2': start_with_new_before_high2_py,
                             'start_with_new_after_high': start_with_new_after_high_py,
@@ -2628,19 +4837,234 @@ def calculate_batch_cy(
                             'start_with_new_before_low2': start_with_new_before_low2_py,
                             'start_with_new_after_low': start_with_new_after_low_py,
                             'start_with_new_after_low2': start_with_new_after_low2_py,
-                            'end_state': end_state,
-                            'stop_loss': stop_loss,
-                            'take_profit': take_profit,
-                            'op_day_change': op_day_change,
                             'has_three_consecutive_zeros': has_three_consecutive_zeros_py
                         }
-                    all_results[date_columns[end_date_idx]].append(row_result)
-            except Exception as e:
-                import traceback
-                print(f"[calculate_batch_cy] stock_idx={stock_idx}, idx={idx} 发生异常: {e}")
-                print(traceback.format_exc())
-
-    # 在函数结束处打印进程信息
-    #print(f"进程 {current_pid}: calculate_batch_cy 执行完成，返回结果")
+
+                        # 在执行公式前检查每对比较变量
+                        should_exec_formula = True  # 添加flag控制是否执行公式
+                        if comparison_vars_list:
+                            for var_pair in comparison_vars_list:
+                                var1, var2 = var_pair  # 解包元组对
+                                var1_value = formula_vars.get(var1, 0)
+                                var2_value = formula_vars.get(var2, 0)
+                                # 如果一对变量都为0，设置flag为False
+                                if (var1_value == 0 or var1_value is None) and (var2_value == 0 or var2_value is None):
+                                    should_exec_formula = False
+                                    score_obj = 0
+                                    break
+
+                        try:
+                            # 根据flag决定是否执行选股公式
+                            if should_exec_formula:
+                                exec(formula_expr, {}, formula_vars)
+                                score_obj = formula_vars.get('result', None)
+                        except Exception as e:
+                            import traceback
+                            print(f"[calculate_batch_cy] 执行公式异常: {e}")
+                            print(f"公式内容: {formula_expr}")
+                            print(traceback.format_exc())
+                            score_obj = None
+
+                    if only_show_selected:
+                        if not (score_obj is not None and score_obj != 0 and not isnan(end_value) and hold_days != -1):
+                            continue
+                        # 根据排序模式过滤score
+                        if not ((sort_mode_code == 1 and score_obj > 0) or (sort_mode_code == 2 and score_obj < 0)):
+                            continue
+
+                    # 累加值序列直接追加到该日期的连续缓冲区，结果行中只记录序列行号
+                    seq_base = date_pos * N_RESULT_SEQUENCES
+                    seq_row = push_sequence(seq_values[seq_base], seq_offsets[seq_base], cont_sum)
+                    push_sequence(seq_values[seq_base + 1], seq_offsets[seq_base + 1], forward_max_result_c, True, is_forward)
+                    push_sequence(seq_values[seq_base + 2], seq_offsets[seq_base + 2], forward_min_result_c, True, is_forward)
+                    push_sequence(seq_values[seq_base + 3], seq_offsets[seq_base + 3], valid_sum_vec)
+                    push_sequence(seq_values[seq_base + 4], seq_offsets[seq_base + 4], forward_max_valid_sum_vec, True, is_forward)
+                    push_sequence(seq_values[seq_base + 5], seq_offsets[seq_base + 5], forward_min_valid_sum_vec, True, is_forward)
+
+                    row_result = (
+                        stock_idx,  # stock_idx
+                        max_price,  # max_value
+                        max_value_date,  # max_value_date
+                        min_price,  # min_value
+                        min_value_date,  # min_value_date
+                        end_value,  # end_value
+                        end_value_date,  # end_value_date
+                        start_value,  # start_value
+                        start_value_date,  # start_value_date
+                        actual_value,  # actual_value
+                        actual_value_date,  # actual_value_date
+                        closest_value,  # closest_value
+                        closest_value_date,  # closest_value_date
+                        seq_row,  # continuous_results
+                        continuous_len,  # continuous_len
+                        nan_to_none(continuous_start_value),  # continuous_start_value
+                        nan_to_none(continuous_start_next_value),  # continuous_start_next_value
+                        nan_to_none(continuous_start_next_next_value),  # continuous_start_next_next_value
+                        nan_to_none(continuous_end_value),  # continuous_end_value
+                        nan_to_none(continuous_end_prev_value),  # continuous_end_prev_value
+                        nan_to_none(continuous_end_prev_prev_value),  # continuous_end_prev_prev_value
+                        continuous_abs_sum_first_half,  # continuous_abs_sum_first_half
+                        continuous_abs_sum_second_half,  # continuous_abs_sum_second_half
+                        continuous_abs_sum_block1,  # continuous_abs_sum_block1
+                        continuous_abs_sum_block2,  # continuous_abs_sum_block2
+                        continuous_abs_sum_block3,  # continuous_abs_sum_block3
+                        continuous_abs_sum_block4,  # continuous_abs_sum_block4
+                        seq_row,  # forward_max_result
+                        nan_to_none(forward_max_continuous_start_value),  # forward_max_continuous_start_value
+                        nan_to_none(forward_max_continuous_start_next_value),  # forward_max_continuous_start_next_value
+                        nan_to_none(forward_max_continuous_start_next_next_value),  # forward_max_continuous_start_next_next_value
+                        nan_to_none(forward_max_continuous_end_value),  # forward_max_continuous_end_value
+                        nan_to_none(forward_max_continuous_end_prev_value),  # forward_max_continuous_end_prev_value
+                        nan_to_none(forward_max_continuous_end_prev_prev_value),  # forward_max_continuous_end_prev_prev_value
+                        forward_max_abs_sum_first_half,  # forward_max_abs_sum_first_half
+                        forward_max_abs_sum_second_half,  # forward_max_abs_sum_second_half
+                        forward_max_abs_sum_block1,  # forward_max_abs_sum_block1
+                        forward_max_abs_sum_block2,  # forward_max_abs_sum_block2
+                        forward_max_abs_sum_block3,  # forward_max_abs_sum_block3
+                        forward_max_abs_sum_block4,  # forward_max_abs_sum_block4
+                        seq_row,  # forward_min_result
+                        nan_to_none(forward_min_continuous_start_value),  # forward_min_continuous_start_value
+                        nan_to_none(forward_min_continuous_start_next_value),  # forward_min_continuous_start_next_value
+                        nan_to_none(forward_min_continuous_start_next_next_value),  # forward_min_continuous_start_next_next_value
+                        nan_to_none(forward_min_continuous_end_value),  # forward_min_continuous_end_value
+                        nan_to_none(forward_min_continuous_end_prev_value),  # forward_min_continuous_end_prev_value
+                        nan_to_none(forward_min_continuous_end_prev_prev_value),  # forward_min_continuous_end_prev_prev_value
+                        forward_min_abs_sum_first_half,  # forward_min_abs_sum_first_half
+                        forward_min_abs_sum_second_half,  # forward_min_abs_sum_second_half
+                        forward_min_abs_sum_block1,  # forward_min_abs_sum_block1
+                        forward_min_abs_sum_block2,  # forward_min_abs_sum_block2
+                        forward_min_abs_sum_block3,  # forward_min_abs_sum_block3
+                        forward_min_abs_sum_block4,  # forward_min_abs_sum_block4
+                        seq_row,  # valid_sum_arr
+                        valid_sum_len,  # valid_sum_len
+                        valid_pos_sum,  # valid_pos_sum
+                        valid_neg_sum,  # valid_neg_sum
+                        seq_row,  # forward_max_valid_sum_arr
+                        forward_max_valid_sum_len,  # forward_max_valid_sum_len
+                        forward_max_valid_pos_sum,  # forward_max_valid_pos_sum
+                        forward_max_valid_neg_sum,  # forward_max_valid_neg_sum
+                        seq_row,  # forward_min_valid_sum_arr
+                        forward_min_valid_sum_len,  # forward_min_valid_sum_len
+                        forward_min_valid_pos_sum,  # forward_min_valid_pos_sum
+                        forward_min_valid_neg_sum,  # forward_min_valid_neg_sum
+                        valid_abs_sum_first_half,  # valid_abs_sum_first_half
+                        valid_abs_sum_second_half,  # valid_abs_sum_second_half
+                        valid_abs_sum_block1,  # valid_abs_sum_block1
+                        valid_abs_sum_block2,  # valid_abs_sum_block2
+                        valid_abs_sum_block3,  # valid_abs_sum_block3
+                        valid_abs_sum_block4,  # valid_abs_sum_block4
+                        forward_max_valid_abs_sum_first_half,  # forward_max_valid_abs_sum_first_half
+                        forward_max_valid_abs_sum_second_half,  # forward_max_valid_abs_sum_second_half
+                        forward_max_valid_abs_sum_block1,  # forward_max_valid_abs_sum_block1
+                        forward_max_valid_abs_sum_block2,  # forward_max_valid_abs_sum_block2
+                        forward_max_valid_abs_sum_block3,  # forward_max_valid_abs_sum_block3
+                        forward_max_valid_abs_sum_block4,  # forward_max_valid_abs_sum_block4
+                        forward_min_valid_abs_sum_first_half,  # forward_min_valid_abs_sum_first_half
+                        forward_min_valid_abs_sum_second_half,  # forward_min_valid_abs_sum_second_half
+                        forward_min_valid_abs_sum_block1,  # forward_min_valid_abs_sum_block1
+                        forward_min_valid_abs_sum_block2,  # forward_min_valid_abs_sum_block2
+                        forward_min_valid_abs_sum_block3,  # forward_min_valid_abs_sum_block3
+                        forward_min_valid_abs_sum_block4,  # forward_min_valid_abs_sum_block4
+                        forward_max_date_str,  # forward_max_date
+                        forward_min_date_str,  # forward_min_date
+                        n_max_is_max_result,  # n_max_is_max
+                        range_ratio_is_less,  # range_ratio_is_less
+                        continuous_abs_is_less,  # continuous_abs_is_less
+                        valid_abs_is_less,  # valid_abs_is_less
+                        forward_min_continuous_abs_is_less,  # forward_min_continuous_abs_is_less
+                        forward_min_valid_abs_is_less,  # forward_min_valid_abs_is_less
+                        forward_max_continuous_abs_is_less,  # forward_max_continuous_abs_is_less
+                        forward_max_valid_abs_is_less,  # forward_max_valid_abs_is_less
+                        safe_formula_val(n_days_max_value) if only_show_selected else n_days_max_value,  # n_days_max_value
+                        safe_formula_val(prev_day_change) if only_show_selected else prev_day_change,  # prev_day_change
+                        safe_formula_val(end_day_change) if only_show_selected else end_day_change,  # end_day_change
+                        (diff_data_view32[stock_idx, end_date_idx] if use_float32 else diff_data_view[stock_idx, end_date_idx]),  # diff_end_value
+                        increment_value,  # increment_value
+                        after_gt_end_value,  # after_gt_end_value
+                        after_gt_start_value,  # after_gt_start_value
+                        nan_to_none(ops_value),  # ops_value
+                        hold_days,  # hold_days
+                        ops_change,  # ops_change
+                        adjust_days,  # adjust_days
+                        None if adjust_days == 0 else ops_incre_rate,  # ops_incre_rate
+                        increment_change,  # increment_change
+                        after_gt_end_change,  # after_gt_end_change
+                        after_gt_start_change,  # after_gt_start_change
+                        take_profit_and_take_loss_change,  # adjust_ops_change
+                        nan_to_none(adjust_ops_incre_rate),  # adjust_ops_incre_rate
+                        take_and_stop_increment_change,  # take_and_stop_increment_change
+                        take_and_stop_after_gt_end_change,  # take_and_stop_after_gt_end_change
+                        take_and_stop_after_gt_start_change,  # take_and_stop_after_gt_start_change
+                        take_profit_and_stop_loss_change,  # take_and_stop_change
+                        nan_to_none(take_and_stop_incre_rate),  # take_and_stop_incre_rate
+                        stop_and_take_increment_change,  # stop_and_take_increment_change
+                        stop_and_take_after_gt_end_change,  # stop_and_take_after_gt_end_change
+                        stop_and_take_after_gt_start_change,  # stop_and_take_after_gt_start_change
+                        stop_profit_and_take_loss_change,  # stop_and_take_change
+                        nan_to_none(stop_and_take_incre_rate),  # stop_and_take_incre_rate
+                        score_obj,  # score
+                        forward_max_result_len,  # forward_max_result_len
+                        forward_min_result_len,  # forward_min_result_len
+                        cont_sum_pos_sum,  # cont_sum_pos_sum
+                        cont_sum_neg_sum,  # cont_sum_neg_sum
+                        safe_formula_val(cont_sum_pos_sum_first_half),  # cont_sum_pos_sum_first_half
+                        safe_formula_val(cont_sum_pos_sum_second_half),  # cont_sum_pos_sum_second_half
+                        safe_formula_val(cont_sum_neg_sum_first_half),  # cont_sum_neg_sum_first_half
+                        safe_formula_val(cont_sum_neg_sum_second_half),  # cont_sum_neg_sum_second_half
+                        forward_max_cont_sum_pos_sum,  # forward_max_cont_sum_pos_sum
+                        forward_max_cont_sum_neg_sum,  # forward_max_cont_sum_neg_sum
+                        forward_min_cont_sum_pos_sum,  # forward_min_cont_sum_pos_sum
+                        forward_min_cont_sum_neg_sum,  # forward_min_cont_sum_neg_sum
+                        start_with_new_before_high_py,  # start_with_new_before_high
+                        start_with_new_before_high2_py,  # start_with_new_before_high2
+                        start_with_new_after_high_py,  # start_with_new_after_high
+                        start_with_new_after_high2_py,  # start_with_new_after_high2
+                        start_with_new_before_low_py,  # start_with_new_before_low
+                        start_with_new_before_low2_py,  # start_with_new_before_low2
+                        start_with_new_after_low_py,  # start_with_new_after_low
+                        start_with_new_after_low2_py,  # start_with_new_after_low2
+                        end_state,  # end_state
+                        stop_loss,  # stop_loss
+                        take_profit,  # take_profit
+                        op_day_change,  # op_day_change
+                        has_three_consecutive_zeros_py,  # has_three_consecutive_zeros
+                    )
+                    if only_show_selected:
+                        current_stocks = all_results.get(date_columns[end_date_idx], [])
+                        current_stocks.append(row_result)
+                        # 按score排序
+                        if sort_mode_code == 1:
+                            current_stocks.sort(key=lambda x: x[RESULT_SCORE_POS], reverse=True)
+                        else:  # 最小值排序
+                            current_stocks.sort(key=lambda x: x[RESULT_SCORE_POS])
+                        # 只保留指定数量的结果
+                        all_results[date_columns[end_date_idx]] = current_stocks[:select_count]
+                    else:
+                        all_results[date_columns[end_date_idx]].append(row_result)
+                except Exception as e:
+                    import traceback
+                    print(f"[calculate_batch_cy] stock_idx={stock_idx}, idx={idx} 发生异常: {e}")
+                    print(traceback.format_exc())
+
+        # 在函数结束处打印进程信息
+        #print(f"进程 {current_pid}: calculate_batch_cy 执行完成，返回结果")
     
-    return all_results
\ No newline at end of file
+    # 每个结束日期的结果行转换为列式存储后返回，累加值序列列换成对应日期缓冲区的变长列
+    result_tables = {}
+    for idx in range(end_date_start_idx, end_date_end_idx-1, -1):
+        date_pos = end_date_start_idx - idx
+        end_date = date_columns[idx]
+        table = ResultTable.from_rows(all_results[end_date])
+        for j, name in enumerate(RESULT_SEQUENCE_FIELDS):
+            seq_base = date_pos * N_RESULT_SEQUENCES + j
+            sequences = RaggedColumn(double_vector_to_array(seq_values[seq_base]),
+                                     np.asarray(<long long[:seq_offsets[seq_base].size()]> seq_offsets[seq_base].data()).copy())
+            rows = table.columns[name]
+            if len(rows) != len(sequences) or np.any(np.asarray(rows) != np.arange(len(rows))):
+                sequences = sequences.take(rows)
+            table.columns[name] = sequences
+            table.masks[name] = None
+        result_tables[end_date] = table
+    if collect_metrics:
+        return result_tables, formula_cols, row_ok, pending
+    return result_tables
\ No newline at end of file